@@ -14,6 +14,8 @@
 
 # system imports
 from functools import wraps
+from threading import RLock
+import importlib
 import logging
 logger = logging.getLogger(__name__)
 
@@ -23,6 +25,9 @@ class Action(object):
     State machine action.
     """
 
+    # sub-classes that do not declare __slots__ still get a __dict__ as usual
+    __slots__ = ('name', 'event')
+
     def __init__(self, name, event=None):
         """
         Construct a state machine action.
@@ -46,6 +51,59 @@ class Action(object):
         return self.event
 
 
+class LazyAction(object):
+    """
+    Proxy for an action referenced in fsm.yaml (eg. 'path.to.ActionClass') that
+    defers importing the action's module until the action is first executed.
+    Large fsm.yaml files reference many action modules, and importing them all
+    up-front adds directly to AWS Lambda cold-start time.
+    """
+
+    __slots__ = ('name', '_action', '_lock')
+
+    def __init__(self, name):
+        """
+        Construct a lazy state machine action.
+
+        :param name: a str like 'path.to.ActionClass'.
+        """
+        self.name = name
+        self._action = None
+        self._lock = RLock()
+
+    def load(self):
+        """
+        Imports the action module (once) and constructs the actual action.
+
+        :return: an instance of path.to.ActionClass.
+        """
+        if self._action is None:
+            with self._lock:
+                if self._action is None:
+                    parts = self.name.split('.')
+                    module_name = '.'.join(parts[0:-1])
+                    class_name = parts[-1]
+                    module = importlib.import_module(module_name)
+                    self._action = getattr(module, class_name)(self.name)
+        return self._action
+
+    def execute(self, context, obj):
+        """
+        Execute the underlying state machine action.
+
+        :param context: an aws_lambda_fsm.fsm.Context instance.
+        :param obj: a dict.
+        :return: a str event.
+        """
+        return self.load().execute(context, obj)
+
+    def __getattr__(self, attr):
+        # only called for attributes not found on the proxy itself
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        return getattr(self.load(), attr)
+
+
 def max_retry_event(event):
     """
     A decorator for `Action.execute` which catches an exception on the last
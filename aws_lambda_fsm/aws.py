@@ -23,20 +23,23 @@ import os
 import uuid
 import json
 from collections import namedtuple
+from collections import OrderedDict
+import sys
 
 # library imports
-import boto3
-from botocore.endpoint import DEFAULT_TIMEOUT
 from botocore.exceptions import ClientError
-from botocore.client import Config
 
 # application imports
 from aws_lambda_fsm.constants import ENVIRONMENT_DATA
 from aws_lambda_fsm.constants import RETRY_DATA
+from aws_lambda_fsm.constants import SCHEDULE_DATA
 from aws_lambda_fsm.constants import CHECKPOINT_DATA
 from aws_lambda_fsm.constants import CACHE_DATA
 from aws_lambda_fsm.constants import LEASE_DATA
+from aws_lambda_fsm.constants import JOIN_DATA
 from aws_lambda_fsm.constants import STREAM_DATA
+from aws_lambda_fsm.constants import STREAM_LANE
+from aws_lambda_fsm.constants import SOURCE
 from aws_lambda_fsm.constants import AWS_DYNAMODB
 from aws_lambda_fsm.constants import AWS_KINESIS
 from aws_lambda_fsm.constants import AWS_CLOUDWATCH
@@ -44,7 +47,16 @@ from aws_lambda_fsm.constants import AWS_ELASTICACHE
 from aws_lambda_fsm.constants import AWS_SQS
 from aws_lambda_fsm.constants import AWS
 from aws_lambda_fsm.constants import ENVIRONMENT
+from aws_lambda_fsm.constants import SPAN
+from aws_lambda_fsm.constants import THROTTLE_DATA
+from aws_lambda_fsm.constants import SHARD_DATA
 from aws_lambda_fsm.config import get_settings
+from aws_lambda_fsm.tracing import get_span_sink
+from aws_lambda_fsm.tracing import record_span
+from aws_lambda_fsm.throttle import get_token_bucket
+from aws_lambda_fsm.shards import get_shard_monitor
+from aws_lambda_fsm.shards import get_explicit_hash_key
+from aws_lambda_fsm.shards import drain_shard_monitors
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
@@ -59,6 +71,11 @@ _lock = RLock()
 
 TRACE = 5
 
+# mirrors botocore.endpoint.DEFAULT_TIMEOUT. boto3 and the botocore client/endpoint
+# modules are comparatively expensive to import, so they are only imported when
+# a connection to an actual AWS service is first requested (cold-start time).
+DEFAULT_TIMEOUT = 60
+
 
 class ChaosFunction(object):
     """
@@ -215,6 +232,7 @@ def _get_elasticache_engine_and_endpoint(cache_arn):
 
         logger.warning('Consider using settings.ELASTICACHE_ENDPOINTS for endpoints.')
 
+        import boto3
         elasticache_connection = boto3.client('elasticache', region_name=arn.region_name)
         return_value = _trace(
             elasticache_connection.describe_cache_clusters,
@@ -320,6 +338,9 @@ def _get_service_connection(resource_arn,
 
             # actual AWS services with boto3 APIs
             else:
+                import boto3
+                from botocore.client import Config
+
                 # set the timeouts via a config
                 config = Config(connect_timeout=connect_timeout,
                                 read_timeout=read_timeout)
@@ -370,19 +391,59 @@ def get_connection(resource_arn,
     return connection
 
 
+def _get_service_and_operation(func):
+    """
+    Returns the service and operation names of a (boto3 client) method.
+
+    :param func: the callable function.
+    :return: a tuple of (str service name, str operation name).
+    """
+    func = getattr(func, 'wrapped_function', func)  # ChaosFunction
+    operation = getattr(func, '__name__', None) or str(func)
+    try:
+        service = func.__self__.meta.service_model.service_name
+    except AttributeError:
+        service = None
+    return service, operation
+
+
 def _trace(func, *args, **kwargs):
     """
-    Logs a TRACE level message.
+    Calls a backend function. If settings.TRACE_SINK is set, records a span for
+    the call, and if the logger is enabled for TRACE, logs the arguments and
+    return value. Otherwise, this is simply a function call.
 
     :param func: the callable function to call
     :param args: the args for the function
     :param kwargs: the kwargs for the function
     :return: the return value of the function
     """
-    guid = uuid.uuid4().hex
-    logger.log(TRACE, '%s: function=%s, args=%s, kwargs=%s)', guid, func, args, kwargs)
-    return_value = func(*args, **kwargs)
-    logger.log(TRACE, '%s: return_value = %s', guid, return_value)
+    sink = get_span_sink()
+    log = logger.isEnabledFor(TRACE)
+    if sink is None and not log:
+        return func(*args, **kwargs)
+
+    if log:
+        guid = uuid.uuid4().hex
+        logger.log(TRACE, '%s: function=%s, args=%s, kwargs=%s)', guid, func, args, kwargs)
+
+    started_at = time.time()
+    outcome = SPAN.OK
+    try:
+        return_value = func(*args, **kwargs)
+    except ClientError, e:
+        outcome = e.response.get('Error', {}).get('Code') or SPAN.ERROR
+        raise
+    except Exception, e:
+        outcome = type(e).__name__
+        raise
+    finally:
+        if sink is not None:
+            service, operation = _get_service_and_operation(func)
+            record_span(sink, service, operation, started_at, time.time() - started_at, (args, kwargs), outcome)
+
+    if log:
+        logger.log(TRACE, '%s: return_value = %s', guid, return_value)
     return return_value
 
 
@@ -394,12 +455,22 @@ def get_secondary_cache_source():
     return settings.SECONDARY_CACHE_SOURCE
 
 
-def get_primary_stream_source():
+def get_stream_lanes():
+    return getattr(settings, 'STREAM_LANES', None) or {}
+
+
+def get_primary_stream_source(lane=None):
+    sources = get_stream_lanes().get(lane) if lane else None
+    if sources:
+        return sources.get(STREAM_LANE.PRIMARY)
     return os.environ.get(ENVIRONMENT.FSM_PRIMARY_STREAM_SOURCE) or \
         settings.PRIMARY_STREAM_SOURCE
 
 
-def get_secondary_stream_source():
+def get_secondary_stream_source(lane=None):
+    sources = get_stream_lanes().get(lane) if lane else None
+    if sources:
+        return sources.get(STREAM_LANE.SECONDARY)
     return os.environ.get(ENVIRONMENT.FSM_SECONDARY_STREAM_SOURCE) or \
         settings.SECONDARY_STREAM_SOURCE
 
@@ -428,6 +499,14 @@ def get_secondary_environment_source():
     return settings.SECONDARY_ENVIRONMENT_SOURCE
 
 
+def get_primary_schedule_source():
+    return getattr(settings, 'PRIMARY_SCHEDULE_SOURCE', None)
+
+
+def get_secondary_schedule_source():
+    return getattr(settings, 'SECONDARY_SCHEDULE_SOURCE', None)
+
+
 def get_primary_metrics_source():
     return settings.PRIMARY_METRICS_SOURCE
 
@@ -436,36 +515,292 @@ def get_secondary_metrics_source():
     return settings.SECONDARY_METRICS_SOURCE
 
 
-def increment_error_counters(data, dimensions):
+def get_source(kind, primary=True, sources=None):
     """
-    Increments an error counter in AWS CloudWatch.
+    Returns the ARN of a primary/secondary source, from the per-machine sources
+    if provided, otherwise from the settings.
 
-    :return: the response from boto3 put_metric_data call.
+    :param kind: a str like 'stream' (see aws_lambda_fsm.constants.SOURCE).
+    :param primary: if True, return the primary source, and if False the secondary source.
+    :param sources: an optional dict as returned by get_sources.
+    :return: a str ARN.
+    """
+    if sources and kind in sources:
+        return sources[kind][SOURCE.PRIMARY if primary else SOURCE.SECONDARY]
+    if kind == SOURCE.STREAM:
+        return get_primary_stream_source() if primary else get_secondary_stream_source()
+    elif kind == SOURCE.RETRY:
+        return get_primary_retry_source() if primary else get_secondary_retry_source()
+    elif kind == SOURCE.CHECKPOINT:
+        return get_primary_checkpoint_source() if primary else get_secondary_checkpoint_source()
+    elif kind == SOURCE.CACHE:
+        return get_primary_cache_source() if primary else get_secondary_cache_source()
+
+
+def get_sources(overrides):
+    """
+    Resolves the per-machine source overrides from fsm.yaml against the settings. A
+    primary or secondary that is not overridden falls back to the settings.
+
+    :param overrides: a dict like {'stream': {'primary': 'arn:...', 'secondary': 'arn:...'}}
+    :return: a dict like {'stream': {'primary': 'arn:...', 'secondary': 'arn:...'}, 'retry': {...}, ...}
+      with every kind of source, or None if there are no overrides.
+    """
+    if not overrides:
+        return None
+    sources = {}
+    for kind in SOURCE.ALL:
+        override = overrides.get(kind) or {}
+        sources[kind] = {
+            SOURCE.PRIMARY: override.get(SOURCE.PRIMARY) or get_source(kind, primary=True),
+            SOURCE.SECONDARY: override.get(SOURCE.SECONDARY) or get_source(kind, primary=False)
+        }
+    return sources
+
+
+def get_stream_source(primary=True, sources=None, lane=None):
+    """
+    Returns the ARN of the primary/secondary stream source for a lane, if the lane
+    is in settings.STREAM_LANES, otherwise the stream source for the machine.
+
+    :param primary: if True, return the primary source, and if False the secondary source.
+    :param sources: an optional dict as returned by get_sources.
+    :param lane: an optional str lane name.
+    :return: a str ARN.
+    """
+    if lane and lane in get_stream_lanes():
+        return get_primary_stream_source(lane) if primary else get_secondary_stream_source(lane)
+    return get_source(SOURCE.STREAM, primary, sources)
+
+
+class MetricsBuffer(object):
+    """
+    Aggregates counters and statistic sets across all the records handled in an
+    invocation, so they can be published together (see flush_metrics) rather than
+    with a put_metric_data call per record.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.statistics = {}
+        self._lock = RLock()
+
+    def add_counters(self, data, dimensions):
+        """
+        Adds counter values.
+
+        :param data: a dict of {str: number} metric names and values.
+        :param dimensions: a dict of {str: str} dimension names and values.
+        """
+        dimensions = tuple(sorted(dimensions.items()))
+        with self._lock:
+            for name, value in data.items():
+                key = (name, dimensions)
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_statistics(self, name, dimensions, statistics, unit):
+        """
+        Merges a statistic set.
+
+        :param name: a str metric name.
+        :param dimensions: a dict of {str: str} dimension names and values.
+        :param statistics: a dict like {'SampleCount': 2, 'Sum': 3.0, 'Minimum': 1.0, 'Maximum': 2.0}.
+        :param unit: a str CloudWatch unit.
+        """
+        key = (name, tuple(sorted(dimensions.items())), unit)
+        with self._lock:
+            current = self.statistics.get(key)
+            if current is None:
+                self.statistics[key] = dict(statistics)
+            else:
+                current[AWS_CLOUDWATCH.SampleCount] += statistics[AWS_CLOUDWATCH.SampleCount]
+                current[AWS_CLOUDWATCH.Sum] += statistics[AWS_CLOUDWATCH.Sum]
+                current[AWS_CLOUDWATCH.Minimum] = \
+                    min(current[AWS_CLOUDWATCH.Minimum], statistics[AWS_CLOUDWATCH.Minimum])
+                current[AWS_CLOUDWATCH.Maximum] = \
+                    max(current[AWS_CLOUDWATCH.Maximum], statistics[AWS_CLOUDWATCH.Maximum])
+
+    def drain(self):
+        """
+        Returns (and resets) the buffered metrics.
+
+        :return: a list of dicts of CloudWatch metric data.
+        """
+        with self._lock:
+            counters, self.counters = self.counters, {}
+            statistics, self.statistics = self.statistics, {}
+        metric_data = [
+            _get_metric_datum(name, dimensions, {AWS_CLOUDWATCH.Value: value})
+            for (name, dimensions), value in sorted(counters.items())
+        ]
+        metric_data.extend(
+            _get_metric_datum(name, dimensions, {AWS_CLOUDWATCH.StatisticValues: values, AWS_CLOUDWATCH.Unit: unit})
+            for (name, dimensions, unit), values in sorted(statistics.items())
+        )
+        return metric_data
+
+
+_local.metrics = MetricsBuffer()
+
+
+def _get_metric_datum(name, dimensions, values):
+    """
+    Returns a CloudWatch metric datum.
+
+    :param name: a str metric name.
+    :param dimensions: a list of (str, str) dimension names and values.
+    :param values: a dict like {'Value': 1}.
+    :return: a dict.
+    """
+    datum = {
+        AWS_CLOUDWATCH.MetricName: name,
+        AWS_CLOUDWATCH.Dimensions: [
+            {AWS_CLOUDWATCH.Name: key, AWS_CLOUDWATCH.Value: val} for key, val in dimensions
+        ]
+    }
+    datum.update(values)
+    return datum
+
+
+def _put_metric_data_emf(namespace, metric_data):
+    """
+    Writes metric data to stdout in the CloudWatch Embedded Metric Format, with
+    one log line per set of dimensions. CloudWatch Logs extracts the metrics
+    asynchronously, so no API calls are made. Statistic sets are written as
+    separate "<name>.<statistic>" metrics, since EMF has no statistic set type.
+
+    :param namespace: a str CloudWatch namespace.
+    :param metric_data: a list of dicts of CloudWatch metric data.
+    """
+    entries = OrderedDict()
+    for datum in metric_data:
+        dimensions = tuple((d[AWS_CLOUDWATCH.Name], d[AWS_CLOUDWATCH.Value])
+                           for d in datum[AWS_CLOUDWATCH.Dimensions])
+        entry, metrics = entries.setdefault(dimensions, (dict(dimensions), []))
+        name = datum[AWS_CLOUDWATCH.MetricName]
+        if AWS_CLOUDWATCH.StatisticValues in datum:
+            for statistic, value in sorted(datum[AWS_CLOUDWATCH.StatisticValues].items()):
+                unit = AWS_CLOUDWATCH.COUNT if statistic == AWS_CLOUDWATCH.SampleCount \
+                    else datum[AWS_CLOUDWATCH.Unit]
+                entry['%s.%s' % (name, statistic)] = value
+                metrics.append({AWS_CLOUDWATCH.Name: '%s.%s' % (name, statistic), AWS_CLOUDWATCH.Unit: unit})
+        else:
+            entry[name] = datum[AWS_CLOUDWATCH.Value]
+            metrics.append({AWS_CLOUDWATCH.Name: name})
+
+    timestamp = int(time.time() * 1000)
+    for dimensions, (entry, metrics) in entries.items():
+        entry[AWS_CLOUDWATCH.EMF.AWS] = {
+            AWS_CLOUDWATCH.EMF.Timestamp: timestamp,
+            AWS_CLOUDWATCH.EMF.CloudWatchMetrics: [
+                {
+                    AWS_CLOUDWATCH.EMF.Namespace: namespace,
+                    AWS_CLOUDWATCH.EMF.Dimensions: [[key for key, _ in dimensions]],
+                    AWS_CLOUDWATCH.EMF.Metrics: metrics
+                }
+            ]
+        }
+        sys.stdout.write(json.dumps(entry, sort_keys=True) + '\n')
+    sys.stdout.flush()
+
+
+def _put_metric_data(metric_data):
+    """
+    Puts metric data in AWS CloudWatch, in chunks of the maximum number of metric
+    data per put_metric_data call, or as Embedded Metric Format logs if
+    settings.METRICS_EMF is set.
+
+    :param metric_data: a list of dicts of CloudWatch metric data.
+    :return: the response from the last boto3 put_metric_data call.
     """
     source = get_primary_metrics_source()
+    if not source or not metric_data:
+        return
+
+    namespace = get_arn_from_arn_string(source).resource
+    if getattr(settings, 'METRICS_EMF', False):
+        return _put_metric_data_emf(namespace, metric_data)
+
     cloudwatch_conn = get_connection(source)
     if not cloudwatch_conn:
         return
 
-    namespace = get_arn_from_arn_string(source).resource
     utcnow = datetime.datetime.utcnow()
-    return_value = _trace(
-        cloudwatch_conn.put_metric_data,
-        Namespace=namespace,
-        MetricData=[
-            {
-                AWS_CLOUDWATCH.MetricName: name,
-                AWS_CLOUDWATCH.Dimensions: [
-                    {AWS_CLOUDWATCH.Name: key, AWS_CLOUDWATCH.Value: val} for key, val in dimensions.iteritems()
-                ],
-                AWS_CLOUDWATCH.Timestamp: utcnow,
-                AWS_CLOUDWATCH.Value: value
-            } for name, value in data.items()
-        ]
-    )
+    for datum in metric_data:
+        datum[AWS_CLOUDWATCH.Timestamp] = utcnow
+    return_value = None
+    for i in range(0, len(metric_data), AWS_CLOUDWATCH.MAX_METRIC_DATA):
+        return_value = _trace(
+            cloudwatch_conn.put_metric_data,
+            Namespace=namespace,
+            MetricData=metric_data[i:i + AWS_CLOUDWATCH.MAX_METRIC_DATA]
+        )
     return return_value
 
 
+def increment_error_counters(data, dimensions):
+    """
+    Increments error counters in the metrics buffer. They are published to
+    AWS CloudWatch by flush_metrics at the end of the invocation.
+
+    :param data: a dict of {str: number} metric names and values.
+    :param dimensions: a dict of {str: str} dimension names and values.
+    """
+    _local.metrics.add_counters(data, dimensions)
+
+
+def buffer_metric_statistics(data, unit=AWS_CLOUDWATCH.MILLISECONDS):
+    """
+    Merges pre-aggregated statistic sets into the metrics buffer. They are
+    published to AWS CloudWatch by flush_metrics at the end of the invocation.
+
+    :param data: a list of (name, dimensions, statistics) tuples, where dimensions
+      is a dict of {str: str} dimension names and values, and statistics is a dict
+      like {'SampleCount': 2, 'Sum': 3.0, 'Minimum': 1.0, 'Maximum': 2.0}.
+    :param unit: a str CloudWatch unit.
+    """
+    for name, dimensions, statistics in data:
+        _local.metrics.add_statistics(name, dimensions, statistics, unit)
+
+
+def _buffer_shard_puts():
+    """
+    Adds the number of puts onto each kinesis shard (see settings.KINESIS_SHARD_METRICS)
+    to the metrics buffer.
+    """
+    for stream_arn, counts in drain_shard_monitors():
+        stream_name = get_arn_from_arn_string(stream_arn).slash_resource()
+        for shard_id, count in counts.items():
+            dimensions = {SHARD_DATA.STREAM_DIMENSION: stream_name, SHARD_DATA.SHARD_DIMENSION: shard_id}
+            _local.metrics.add_counters({SHARD_DATA.METRIC_NAME: count}, dimensions)
+
+
+def flush_metrics():
+    """
+    Publishes (and resets) the metrics buffer. Called at the end of each handler
+    invocation, since AWS Lambda may freeze the process afterwards.
+    """
+    try:
+        _buffer_shard_puts()
+        _put_metric_data(_local.metrics.drain())
+    except Exception:
+        logger.exception('Error flushing metrics.')
+
+
+def put_metrics(data, dimensions):
+    """
+    Puts metric values in AWS CloudWatch immediately.
+
+    :param data: a dict of {str: number} metric names and values.
+    :param dimensions: a dict of {str: str} dimension names and values.
+    :return: the response from boto3 put_metric_data call.
+    """
+    dimensions = dimensions.items()
+    return _put_metric_data([
+        _get_metric_datum(name, dimensions, {AWS_CLOUDWATCH.Value: value}) for name, value in data.items()
+    ])
+
+
 def _set_message_dispatched_memcache(cache_arn, correlation_id, steps, retries,
                                      timeout=CACHE_DATA.CACHE_CLEANUP_TIMEOUT):
     """Sets a flag in memcache"""
@@ -533,7 +868,8 @@ def _set_message_dispatched_dynamodb(table_arn, correlation_id, steps, retries,
         return 0
 
 
-def set_message_dispatched(correlation_id, steps, retries, primary=True, timeout=CACHE_DATA.CACHE_CLEANUP_TIMEOUT):
+def set_message_dispatched(correlation_id, steps, retries, primary=True, timeout=CACHE_DATA.CACHE_CLEANUP_TIMEOUT,
+                           sources=None):
     """
     Sets a flag in cache to indicate that a message has been dispatched.
     This is used by the framework to ensure that actions are not executed
@@ -544,12 +880,10 @@ def set_message_dispatched(correlation_id, steps, retries, primary=True, timeout
     :param timeout: an integer representing the number of seconds-since-epoch a corresponding call
         to get_message_dispatched should return True. We allow these entries to timeout to avoid
         filling the cache with entries that will never be used again.
+    :param sources: an optional dict of per-machine sources (see get_sources).
     :return: True if cached and False otherwise
     """
-    if primary:
-        source_arn = get_primary_cache_source()
-    else:
-        source_arn = get_secondary_cache_source()
+    source_arn = get_source(SOURCE.CACHE, primary, sources)
 
     service = get_arn_from_arn_string(source_arn).service
 
@@ -641,18 +975,16 @@ def _get_message_dispatched_dynamodb(table_arn, correlation_id, steps):
         return None
 
 
-def get_message_dispatched(correlation_id, steps, primary=True):
+def get_message_dispatched(correlation_id, steps, primary=True, sources=None):
     """
     Sets a flag in cache to indicate that a message has been dispatched.
 
     :param correlation_id: a str guid for the fsm
     :param steps: an integer corresponding to the step in the fsm execution
+    :param sources: an optional dict of per-machine sources (see get_sources).
     :return: True if cached and False otherwise
     """
-    if primary:
-        source_arn = get_primary_cache_source()
-    else:
-        source_arn = get_secondary_cache_source()
+    source_arn = get_source(SOURCE.CACHE, primary, sources)
 
     service = get_arn_from_arn_string(source_arn).service
 
@@ -887,7 +1219,7 @@ def _acquire_lease_dynamodb(table_arn, correlation_id, steps, retries, timeout=L
         return 0
 
 
-def acquire_lease(correlation_id, steps, retries, primary=True, timeout=LEASE_DATA.LEASE_TIMEOUT):
+def acquire_lease(correlation_id, steps, retries, primary=True, timeout=LEASE_DATA.LEASE_TIMEOUT, sources=None):
     """
     Acquires a lease from cache.
 
@@ -897,13 +1229,11 @@ def acquire_lease(correlation_id, steps, retries, primary=True, timeout=LEASE_DA
     :param timeout: an integer representing the number of seconds-since-epoch the lease
         should remain active. in the event of system error, we want to ensure an unreleased
         lease should eventually be acquired by another process.
+    :param sources: an optional dict of per-machine sources (see get_sources).
     :return: True if the lease was acquired, False if the lease was not acquired and 0 if
         there was some sort of systems/communication error.
     """
-    if primary:
-        source_arn = get_primary_cache_source()
-    else:
-        source_arn = get_secondary_cache_source()
+    source_arn = get_source(SOURCE.CACHE, primary, sources)
 
     service = get_arn_from_arn_string(source_arn).service
 
@@ -923,6 +1253,175 @@ def acquire_lease(correlation_id, steps, retries, primary=True, timeout=LEASE_DA
         return _acquire_lease_dynamodb(source_arn, correlation_id, steps, retries, timeout=timeout)
 
 
+def _renew_lease_memcache(cache_arn, correlation_id, steps, retries, fence_token, timeout=LEASE_DATA.LEASE_TIMEOUT):
+    """
+    Extends a lease in memcache, keeping the fence token.
+    """
+    memcache_conn = get_connection(cache_arn)
+    if not memcache_conn:
+        return  # pragma: no cover
+
+    # get the current value of the lease
+    memcache_key = LEASE_DATA.LEASE_KEY_PREFIX + correlation_id
+    current_lease_value = memcache_conn.gets(memcache_key)
+
+    if current_lease_value:
+
+        # split the current lease apart
+        current_steps, current_retries, current_expires, current_fence_token = \
+            _deserialize_lease_value(current_lease_value)
+
+        # extend it only if it is still ours. an expired lease that nobody else has
+        # taken still has our fence token, so it can be safely extended.
+        if (current_steps, current_retries, current_fence_token) == (steps, retries, fence_token):
+            new_lease_value = _serialize_lease_value(steps, retries, int(time.time()) + timeout, fence_token)
+            return memcache_conn.cas(memcache_key, new_lease_value, time=LEASE_DATA.LEASE_CLEANUP_TIMEOUT)
+
+    # otherwise, something else owns the lease, or no one does
+    return False
+
+
+def _renew_lease_redis(cache_arn, correlation_id, steps, retries, fence_token, timeout=LEASE_DATA.LEASE_TIMEOUT):
+    """
+    Extends a lease in redis, keeping the fence token.
+    """
+    import redis
+
+    redis_conn = get_connection(cache_arn)
+    if not redis_conn:
+        return  # pragma: no cover
+
+    with redis_conn.pipeline() as pipe:
+
+        try:
+
+            # get the current value of the lease (within a watch)
+            redis_key = LEASE_DATA.LEASE_KEY_PREFIX + correlation_id
+            pipe.watch(redis_key)
+            current_lease_value = pipe.get(redis_key)
+            pipe.multi()
+
+            if not current_lease_value:
+                return False
+
+            # split the current lease apart
+            current_steps, current_retries, current_expires, current_fence_token = \
+                _deserialize_lease_value(current_lease_value)
+
+            # otherwise, something else owns the lease, so we can't extend it
+            if (current_steps, current_retries, current_fence_token) != (steps, retries, fence_token):
+                return False
+
+            new_lease_value = _serialize_lease_value(steps, retries, int(time.time()) + timeout, fence_token)
+            pipe.setex(redis_key, LEASE_DATA.LEASE_CLEANUP_TIMEOUT, new_lease_value)
+
+            # execute the transaction
+            pipe.execute()
+
+            # if we make it this far, we have extended the lease
+            return True
+
+        except redis.WatchError:
+            return False
+
+        except redis.exceptions.ConnectionError:
+            logger.exception('')
+            return 0
+
+
+def _renew_lease_dynamodb(table_arn, correlation_id, steps, retries, fence_token, timeout=LEASE_DATA.LEASE_TIMEOUT):
+    """
+    Extends a lease in DynamoDB, keeping the fence token.
+    """
+    dynamodb_conn = get_connection(table_arn)
+    if not dynamodb_conn:
+        return  # pragma: no cover
+
+    table_name = get_arn_from_arn_string(table_arn).slash_resource()
+    key = {
+        LEASE_DATA.KEY: {AWS_DYNAMODB.STRING: LEASE_DATA.LEASE_KEY_PREFIX + correlation_id}
+    }
+
+    try:
+        # the conditions are:
+        #
+        # 1. the lease is currently 'leased', and
+        # 2. steps matches, and
+        # 3. retries matches, and
+        # 4. fence token matches
+        cexp = 'lease_state = :l AND ' \
+               'steps = :s AND ' \
+               'retries = :r AND ' \
+               'fence = :f'
+
+        # the only update is the expiration
+        uexp = 'SET expires = :e'
+
+        expression_attribute_values = {
+            ':l': {AWS_DYNAMODB.STRING: LEASE_DATA.STATES.LEASED},
+            ':s': {AWS_DYNAMODB.NUMBER: str(steps)},
+            ':r': {AWS_DYNAMODB.NUMBER: str(retries)},
+            ':f': {AWS_DYNAMODB.NUMBER: str(fence_token)},
+            ':e': {AWS_DYNAMODB.NUMBER: str(int(time.time()) + timeout)}
+        }
+
+        _trace(
+            dynamodb_conn.update_item,
+            TableName=table_name,
+            Key=key,
+            ConditionExpression=cexp,
+            UpdateExpression=uexp,
+            ExpressionAttributeValues=expression_attribute_values
+        )
+
+        # the conditional update worked
+        return True
+
+    except ClientError, e:
+
+        # operating as expected for a lease owned by someone else
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+
+        logger.exception('')
+        return 0
+
+
+def renew_lease(correlation_id, steps, retries, fence_token, primary=True, timeout=LEASE_DATA.LEASE_TIMEOUT,
+                sources=None):
+    """
+    Extends a lease in cache, without releasing it, so that no other process can
+    acquire the lease in between. The fence token is unchanged.
+
+    :param correlation_id: a str guid for the fsm
+    :param steps: an integer corresponding to the step in the fsm execution
+    :param retries: an integer corresponding to the number of retries in the fsm execution
+    :param fence_token: the int fence token returned by acquire_lease
+    :param timeout: an integer number of seconds from now the lease should remain active.
+    :param sources: an optional dict of per-machine sources (see get_sources).
+    :return: True if the lease was extended, False if the lease is no longer owned and 0 if
+        there was some sort of systems/communication error.
+    """
+    source_arn = get_source(SOURCE.CACHE, primary, sources)
+
+    service = get_arn_from_arn_string(source_arn).service
+
+    if not service:  # pragma: no cover
+        logger.warning("No cache source for primary=%s" % primary)
+
+    elif service == AWS.ELASTICACHE:
+        engine, _ = _get_elasticache_engine_and_endpoint(source_arn)
+
+        if engine == AWS_ELASTICACHE.ENGINE.MEMCACHED:
+            return _renew_lease_memcache(source_arn, correlation_id, steps, retries, fence_token, timeout=timeout)
+
+        elif engine == AWS_ELASTICACHE.ENGINE.REDIS:
+            return _renew_lease_redis(source_arn, correlation_id, steps, retries, fence_token, timeout=timeout)
+
+    elif service == AWS.DYNAMODB:
+        return _renew_lease_dynamodb(source_arn, correlation_id, steps, retries, fence_token, timeout=timeout)
+
+
 def _release_lease_memcache(cache_arn, correlation_id, steps, retries, fence_token):
     """
     Releases a lease from memcache.
@@ -1099,20 +1598,18 @@ def _release_lease_dynamodb(table_arn, correlation_id, steps, retries, fence_tok
         return 0
 
 
-def release_lease(correlation_id, steps, retries, fence_token, primary=True):
+def release_lease(correlation_id, steps, retries, fence_token, primary=True, sources=None):
     """
     Releases a lease from cache.
 
     :param correlation_id: a str guid for the fsm
     :param steps: an integer corresponding to the step in the fsm execution
     :param retries: an integer corresponding to the number of retries in the fsm execution
+    :param sources: an optional dict of per-machine sources (see get_sources).
     :return: True if the lease was released, False if the lease was not released and 0 if
         there was some sort of systems/communication error.
     """
-    if primary:
-        source_arn = get_primary_cache_source()
-    else:
-        source_arn = get_secondary_cache_source()
+    source_arn = get_source(SOURCE.CACHE, primary, sources)
 
     service = get_arn_from_arn_string(source_arn).service
 
@@ -1132,29 +1629,330 @@ def release_lease(correlation_id, steps, retries, fence_token, primary=True):
         return _release_lease_dynamodb(source_arn, correlation_id, steps, retries, fence_token)
 
 
-def _send_next_event_for_dispatch_kinesis(stream_arn, data, correlation_id):
-    """
-    Sends an FSM event message onto Kinesis.
+def _start_join_redis(cache_arn, join_id, count, payload):
+    """Stores a join barrier in redis"""
+    import redis
 
-    :param stream_arn: a str ARN for a kinesis stream like
-      'arn:partition:kinesis:region:account:resource'
-    :param data: a str data for the kinesis message
-    :param correlation_id: the guid for the fsm
-    :return: the return value from boto3 put_record call
-    """
-    # write the event and fsm state to kinesis.
-    kinesis_conn = get_connection(stream_arn)
-    if not kinesis_conn:
+    redis_conn = get_connection(cache_arn)
+    if not redis_conn:
         return  # pragma: no cover
 
-    stream_name = get_arn_from_arn_string(stream_arn).slash_resource()
-    return_value = _trace(
-        kinesis_conn.put_record,
-        StreamName=stream_name,
-        Data=data,
-        PartitionKey=correlation_id
-    )
-    return return_value
+    try:
+        redis_key = JOIN_DATA.JOIN_KEY_PREFIX + join_id
+        with redis_conn.pipeline() as pipe:
+            pipe.hmset(redis_key, {JOIN_DATA.COUNT: count, JOIN_DATA.PAYLOAD: payload})
+            pipe.expire(redis_key, JOIN_DATA.JOIN_TIMEOUT)
+            pipe.execute()
+        return True
+
+    except redis.exceptions.ConnectionError:
+        logger.exception('')
+        return 0
+
+
+def _start_join_dynamodb(table_arn, join_id, count, payload):
+    """Stores a join barrier in dynamodb"""
+
+    dynamodb_conn = get_connection(table_arn)
+    if not dynamodb_conn:
+        return  # pragma: no cover
+
+    table_name = get_arn_from_arn_string(table_arn).slash_resource()
+    key = {
+        JOIN_DATA.KEY: {AWS_DYNAMODB.STRING: JOIN_DATA.JOIN_KEY_PREFIX + join_id}
+    }
+
+    try:
+        # an update, rather than a put, so that a retried fork does not clobber
+        # the results of the children that have already reported
+        _trace(
+            dynamodb_conn.update_item,
+            TableName=table_name,
+            Key=key,
+            UpdateExpression='SET #c = :c, #p = :p, #t = :t',
+            ExpressionAttributeNames={
+                '#c': JOIN_DATA.COUNT,
+                '#p': JOIN_DATA.PAYLOAD,
+                '#t': CACHE_DATA.TIMEOUT
+            },
+            ExpressionAttributeValues={
+                ':c': {AWS_DYNAMODB.NUMBER: str(count)},
+                ':p': {AWS_DYNAMODB.STRING: payload},
+                ':t': {AWS_DYNAMODB.NUMBER: str(int(time.time()) + JOIN_DATA.JOIN_TIMEOUT)}
+            }
+        )
+        return True
+
+    except ClientError:
+        logger.exception('')
+        return 0
+
+
+def start_join(join_id, count, payload, primary=True, sources=None):
+    """
+    Stores a join barrier, that waits for a number of children to report, in cache.
+
+    :param join_id: a str guid for the join (unique to the forking step).
+    :param count: an int number of children.
+    :param payload: a str serialized payload to send when all the children have reported.
+    :param sources: an optional dict of per-machine sources (see get_sources).
+    :return: True if the barrier was stored, and 0 if there was some sort of
+      systems/communication error.
+    """
+    source_arn = get_source(SOURCE.CACHE, primary, sources)
+
+    service = get_arn_from_arn_string(source_arn).service
+
+    if not service:  # pragma: no cover
+        logger.warning("No cache source for primary=%s" % primary)
+
+    elif service == AWS.ELASTICACHE:
+        engine, _ = _get_elasticache_engine_and_endpoint(source_arn)
+
+        if engine == AWS_ELASTICACHE.ENGINE.MEMCACHED:
+            logger.error('Joins are not supported by memcache.')
+            return 0
+
+        elif engine == AWS_ELASTICACHE.ENGINE.REDIS:
+            return _start_join_redis(source_arn, join_id, count, payload)
+
+    elif service == AWS.DYNAMODB:
+        return _start_join_dynamodb(source_arn, join_id, count, payload)
+
+
+def _get_join_results(count, results):
+    """
+    Returns the results of all the children, or None if not all of them have reported.
+
+    :param count: an int number of children.
+    :param results: a dict of {int index: str result}.
+    :return: a list of str results, ordered by child index, or None.
+    """
+    if len(results) < count:
+        return None
+    return [results[index] for index in sorted(results)]
+
+
+def _report_join_redis(cache_arn, join_id, index, result):
+    """Reports a child to a join barrier in redis"""
+    import redis
+
+    redis_conn = get_connection(cache_arn)
+    if not redis_conn:
+        return  # pragma: no cover
+
+    try:
+        redis_key = JOIN_DATA.JOIN_KEY_PREFIX + join_id
+        with redis_conn.pipeline() as pipe:
+            pipe.hset(redis_key, JOIN_DATA.RESULT_PREFIX + str(index), result)
+            pipe.hgetall(redis_key)
+            _, values = pipe.execute()
+
+        results = dict((int(name[len(JOIN_DATA.RESULT_PREFIX):]), value)
+                       for name, value in values.items() if name.startswith(JOIN_DATA.RESULT_PREFIX))
+        all_results = _get_join_results(int(values.get(JOIN_DATA.COUNT, len(results) + 1)), results)
+        if all_results is None:
+            return None
+
+        # exactly one child (the first to claim it, or a retry of that child) completes the join
+        with redis_conn.pipeline() as pipe:
+            pipe.hsetnx(redis_key, JOIN_DATA.JOINED, str(index))
+            pipe.hget(redis_key, JOIN_DATA.JOINED)
+            _, joined = pipe.execute()
+        if joined != str(index):
+            return None
+        return values[JOIN_DATA.PAYLOAD], all_results
+
+    except redis.exceptions.ConnectionError:
+        logger.exception('')
+        return 0
+
+
+def _report_join_dynamodb(table_arn, join_id, index, result):
+    """Reports a child to a join barrier in dynamodb"""
+
+    dynamodb_conn = get_connection(table_arn)
+    if not dynamodb_conn:
+        return  # pragma: no cover
+
+    table_name = get_arn_from_arn_string(table_arn).slash_resource()
+    key = {
+        JOIN_DATA.KEY: {AWS_DYNAMODB.STRING: JOIN_DATA.JOIN_KEY_PREFIX + join_id}
+    }
+
+    try:
+        return_value = _trace(
+            dynamodb_conn.update_item,
+            TableName=table_name,
+            Key=key,
+            UpdateExpression='SET #r = :r',
+            ExpressionAttributeNames={'#r': JOIN_DATA.RESULT_PREFIX + str(index)},
+            ExpressionAttributeValues={':r': {AWS_DYNAMODB.STRING: result}},
+            ReturnValues='ALL_NEW'
+        )
+        values = return_value[AWS_DYNAMODB.Attributes]
+        results = dict((int(name[len(JOIN_DATA.RESULT_PREFIX):]), value[AWS_DYNAMODB.STRING])
+                       for name, value in values.items() if name.startswith(JOIN_DATA.RESULT_PREFIX))
+        count = values.get(JOIN_DATA.COUNT, {}).get(AWS_DYNAMODB.NUMBER, len(results) + 1)
+        all_results = _get_join_results(int(count), results)
+        if all_results is None:
+            return None
+
+        # exactly one child (the first to claim it, or a retry of that child) completes the join
+        _trace(
+            dynamodb_conn.update_item,
+            TableName=table_name,
+            Key=key,
+            ConditionExpression='attribute_not_exists(#j) OR #j = :j',
+            UpdateExpression='SET #j = :j',
+            ExpressionAttributeNames={'#j': JOIN_DATA.JOINED},
+            ExpressionAttributeValues={':j': {AWS_DYNAMODB.NUMBER: str(index)}}
+        )
+        return values[JOIN_DATA.PAYLOAD][AWS_DYNAMODB.STRING], all_results
+
+    except ClientError, e:
+
+        # another child completed the join
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return None
+
+        logger.exception('')
+        return 0
+
+
+def report_join(join_id, index, result, primary=True, sources=None):
+    """
+    Reports a child to a join barrier in cache. Reporting is idempotent, so a
+    child may report more than once (eg. when its step is retried).
+
+    :param join_id: a str guid for the join (see start_join).
+    :param index: an int child index.
+    :param result: a str serialized result for the child.
+    :param sources: an optional dict of per-machine sources (see get_sources).
+    :return: a tuple of (str payload, list of str results ordered by child index)
+      for exactly one of the children once all the children have reported, None
+      for the other reports, and 0 if there was some sort of systems/communication error.
+    """
+    source_arn = get_source(SOURCE.CACHE, primary, sources)
+
+    service = get_arn_from_arn_string(source_arn).service
+
+    if not service:  # pragma: no cover
+        logger.warning("No cache source for primary=%s" % primary)
+
+    elif service == AWS.ELASTICACHE:
+        engine, _ = _get_elasticache_engine_and_endpoint(source_arn)
+
+        if engine == AWS_ELASTICACHE.ENGINE.MEMCACHED:
+            logger.error('Joins are not supported by memcache.')
+            return 0
+
+        elif engine == AWS_ELASTICACHE.ENGINE.REDIS:
+            return _report_join_redis(source_arn, join_id, index, result)
+
+    elif service == AWS.DYNAMODB:
+        return _report_join_dynamodb(source_arn, join_id, index, result)
+
+
+def _describe_shards(kinesis_conn, stream_name):
+    """
+    Returns all the shards of a kinesis stream.
+
+    :param kinesis_conn: a boto3 kinesis connection.
+    :param stream_name: a str stream name.
+    :return: a list of shard dicts from the boto3 describe_stream call.
+    """
+    shards = []
+    kwargs = {'StreamName': stream_name}
+    while True:
+        out = _trace(kinesis_conn.describe_stream, **kwargs)[AWS_KINESIS.StreamDescription]
+        shards.extend(out[AWS_KINESIS.STREAM.Shards])
+        if not out.get(AWS_KINESIS.STREAM.HasMoreShards) or not shards:
+            return shards
+        kwargs['ExclusiveStartShardId'] = shards[-1][AWS_KINESIS.SHARD.ShardId]
+
+
+def _get_explicit_hash_key(stream_arn, kinesis_conn, stream_name, correlation_id):
+    """
+    Returns an explicit hash key that spreads machines evenly over the open shards
+    of a kinesis stream, if settings.KINESIS_EXPLICIT_HASH_KEYS is set.
+
+    :param stream_arn: a str ARN for a kinesis stream like
+      'arn:partition:kinesis:region:account:resource'
+    :param kinesis_conn: a boto3 kinesis connection.
+    :param stream_name: a str stream name.
+    :param correlation_id: the guid for the fsm
+    :return: a str hash key, or None to use the partition key.
+    """
+    if not getattr(settings, 'KINESIS_EXPLICIT_HASH_KEYS', False):
+        return None
+    hash_ranges = get_shard_monitor(stream_arn).get_hash_ranges(lambda: _describe_shards(kinesis_conn, stream_name))
+    if hash_ranges:
+        return get_explicit_hash_key(correlation_id, hash_ranges)
+
+
+def _record_shard_puts(stream_arn, records):
+    """
+    Counts the puts onto each shard, if settings.KINESIS_SHARD_METRICS is set.
+
+    :param stream_arn: a str ARN for a kinesis stream like
+      'arn:partition:kinesis:region:account:resource'
+    :param records: a list of result dicts from the boto3 put_record(s) call.
+    """
+    if getattr(settings, 'KINESIS_SHARD_METRICS', False):
+        monitor = get_shard_monitor(stream_arn)
+        for record in records:
+            shard_id = record.get(AWS_KINESIS.SHARD.ShardId)
+            if shard_id:
+                monitor.record(shard_id)
+
+
+def _send_next_event_for_dispatch_kinesis(stream_arn, data, correlation_id):
+    """
+    Sends an FSM event message onto Kinesis.
+
+    Puts are rate limited by a per-stream TokenBucket, and throttled puts are
+    retried (settings.KINESIS_THROTTLE_RETRIES times) before the error is raised
+    and the caller fails over to the secondary stream.
+
+    :param stream_arn: a str ARN for a kinesis stream like
+      'arn:partition:kinesis:region:account:resource'
+    :param data: a str data for the kinesis message
+    :param correlation_id: the guid for the fsm
+    :return: the return value from boto3 put_record call
+    """
+    # write the event and fsm state to kinesis.
+    kinesis_conn = get_connection(stream_arn)
+    if not kinesis_conn:
+        return  # pragma: no cover
+
+    stream_name = get_arn_from_arn_string(stream_arn).slash_resource()
+    kwargs = {}
+    explicit_hash_key = _get_explicit_hash_key(stream_arn, kinesis_conn, stream_name, correlation_id)
+    if explicit_hash_key:
+        kwargs[AWS_KINESIS.RECORD.ExplicitHashKey] = explicit_hash_key
+    bucket = get_token_bucket(stream_arn)
+    retries = getattr(settings, 'KINESIS_THROTTLE_RETRIES', THROTTLE_DATA.RETRIES)
+    for attempt in xrange(retries + 1):
+        bucket.acquire()
+        try:
+            return_value = _trace(
+                kinesis_conn.put_record,
+                StreamName=stream_name,
+                Data=data,
+                PartitionKey=correlation_id,
+                **kwargs
+            )
+        except ClientError, e:
+            if e.response.get('Error', {}).get('Code') != AWS_KINESIS.ProvisionedThroughputExceededException:
+                raise
+            bucket.throttled()
+            if attempt == retries:
+                raise
+        else:
+            bucket.succeeded()
+            _record_shard_puts(stream_arn, [return_value])
+            return return_value
 
 
 def _send_next_event_for_dispatch_dynamodb(table_arn, data, correlation_id):
@@ -1280,7 +2078,8 @@ def _send_next_event_for_dispatch_sqs(queue_arn, data, correlation_id, delay):
     return return_value
 
 
-def send_next_event_for_dispatch(context, data, correlation_id, delay=0, primary=True, recovering=False):
+def send_next_event_for_dispatch(context, data, correlation_id, delay=0, primary=True, recovering=False,
+                                 lane=None, sources=None):
     """
     Sends an FSM event message onto Kinesis or DynamoDB or SNS.
 
@@ -1291,18 +2090,16 @@ def send_next_event_for_dispatch(context, data, correlation_id, delay=0, primary
       use the secondary stream source
     :param recovering: if True, use the primary retry source, and if False
       use the secondary retry source
-    :return: see above.
-    """
-    if primary:
-        if recovering:
-            source_arn = get_primary_retry_source()
-        else:
-            source_arn = get_primary_stream_source()
+    :param lane: an optional str lane name (see settings.STREAM_LANES), selecting
+      the stream sources for that lane instead of the default stream sources
+    :param sources: an optional dict of per-machine sources (see get_sources)
+    :return: the return value from the boto3 call, or None if nothing was sent
+      (no stream source or connection).
+    """
+    if recovering:
+        source_arn = get_source(SOURCE.RETRY, primary, sources)
     else:
-        if recovering:
-            source_arn = get_secondary_retry_source()
-        else:
-            source_arn = get_secondary_stream_source()
+        source_arn = get_stream_source(primary, sources, lane)
 
     service = get_arn_from_arn_string(source_arn).service
 
@@ -1338,17 +2135,22 @@ def _send_next_events_for_dispatch_kinesis(stream_arn, all_data, correlation_ids
         return  # pragma: no cover
 
     stream_name = get_arn_from_arn_string(stream_arn).slash_resource()
+    records = []
+    for data, correlation_id in zip(all_data, correlation_ids):
+        record = {
+            AWS_KINESIS.RECORD.Data: data,
+            AWS_KINESIS.RECORD.PartitionKey: correlation_id
+        }
+        explicit_hash_key = _get_explicit_hash_key(stream_arn, kinesis_conn, stream_name, correlation_id)
+        if explicit_hash_key:
+            record[AWS_KINESIS.RECORD.ExplicitHashKey] = explicit_hash_key
+        records.append(record)
     return_value = _trace(
         kinesis_conn.put_records,
         StreamName=stream_name,
-        Records=[
-            {
-                AWS_KINESIS.RECORD.Data: data,
-                AWS_KINESIS.RECORD.PartitionKey: correlation_id
-            }
-            for (data, correlation_id) in zip(all_data, correlation_ids)
-        ]
+        Records=records
     )
+    _record_shard_puts(stream_arn, return_value.get(AWS_KINESIS.Records, []))
     return return_value
 
 
@@ -1437,7 +2239,38 @@ def _send_next_events_for_dispatch_sqs(queue_arn, all_data, correlation_ids, del
     return return_value
 
 
-def send_next_events_for_dispatch(context, all_data, correlation_ids, delay=0, primary=True):
+def _get_unsent_correlation_ids(service, return_value, correlation_ids):
+    """
+    Returns the correlation ids of the events that a bulk send did not send
+    (eg. throttled kinesis records, or unprocessed dynamodb items).
+
+    :param service: a str service like "kinesis".
+    :param return_value: the return value from a _send_next_events_for_dispatch_* call.
+    :param correlation_ids: a list of guids for the fsms.
+    :return: a list of guids.
+    """
+    if return_value is None:
+        return list(correlation_ids)
+
+    if service == AWS.KINESIS:
+        records = return_value.get(AWS_KINESIS.Records, [])
+        return [correlation_id for correlation_id, record in zip(correlation_ids, records)
+                if record.get(AWS_KINESIS.RECORD.ErrorCode)]
+
+    elif service == AWS.DYNAMODB:
+        return [item[AWS_DYNAMODB.PutRequest][AWS_DYNAMODB.Item][STREAM_DATA.CORRELATION_ID][AWS_DYNAMODB.STRING]
+                for items in return_value.get(AWS_DYNAMODB.UnprocessedItems, {}).values()
+                for item in items]
+
+    elif service == AWS.SNS:
+        return [correlation_id for correlation_id, ret in zip(correlation_ids, return_value) if ret is None]
+
+    elif service == AWS.SQS:
+        return [failed[AWS_SQS.MESSAGE.Id] for failed in return_value.get(AWS_SQS.Failed, [])]
+
+
+def send_next_events_for_dispatch(context, all_data, correlation_ids, delay=0, primary=True, lane=None,
+                                  sources=None):
     """
     Sends multiple FSM event message onto Kinesis or DynamoDB or SNS.
 
@@ -1446,32 +2279,34 @@ def send_next_events_for_dispatch(context, all_data, correlation_ids, delay=0, p
     :param correlation_ids: a list of guids for the fsms
     :param primary: if True, use the primary stream source, and if False
       use the secondary stream source
-    :return: see above.
+    :param lane: an optional str lane name (see settings.STREAM_LANES)
+    :param sources: an optional dict of per-machine sources (see get_sources)
+    :return: a list of the guids of the events that were not sent.
     """
-    if primary:
-        source_arn = get_primary_stream_source()
-    else:
-        source_arn = get_secondary_stream_source()
+    source_arn = get_stream_source(primary, sources, lane)
 
     service = get_arn_from_arn_string(source_arn).service
 
+    return_value = None
     if not service:  # pragma: no cover
         logger.warning("No stream source for primary=%s" % primary)
 
-    if service == AWS.KINESIS:
-        return _send_next_events_for_dispatch_kinesis(source_arn, all_data, correlation_ids)
+    elif service == AWS.KINESIS:
+        return_value = _send_next_events_for_dispatch_kinesis(source_arn, all_data, correlation_ids)
 
     elif service == AWS.DYNAMODB:
-        return _send_next_events_for_dispatch_dynamodb(source_arn, all_data, correlation_ids)
+        return_value = _send_next_events_for_dispatch_dynamodb(source_arn, all_data, correlation_ids)
 
     elif service == AWS.SNS:
-        return _send_next_events_for_dispatch_sns(source_arn, all_data, correlation_ids)
+        return_value = _send_next_events_for_dispatch_sns(source_arn, all_data, correlation_ids)
 
     elif service == AWS.SQS:
-        return _send_next_events_for_dispatch_sqs(source_arn, all_data, correlation_ids, delay)
+        return_value = _send_next_events_for_dispatch_sqs(source_arn, all_data, correlation_ids, delay)
+
+    return _get_unsent_correlation_ids(service, return_value, correlation_ids)
 
 
-def _store_checkpoint_dynamodb(table_arn, correlation_id, sent):
+def _store_checkpoint_dynamodb(table_arn, correlation_id, sent, timeout=None):
     """
     Stores the return value from a prior call to send_next_event_for_dispatch to
     DyanamoDB.
@@ -1480,6 +2315,8 @@ def _store_checkpoint_dynamodb(table_arn, correlation_id, sent):
       'arn:partition:dynamodb:region:account:resource'
     :param correlation_id: the guid for the fsm
     :param sent: the data to checkpoint
+    :param timeout: an optional int number of seconds after which the item
+      expires (stored in the "timeout" attribute, for a DynamoDB TTL)
     :return: the return value from boto3 put_item call
     """
     dynamodb_conn = get_connection(table_arn)
@@ -1491,6 +2328,8 @@ def _store_checkpoint_dynamodb(table_arn, correlation_id, sent):
         CHECKPOINT_DATA.CORRELATION_ID: {AWS_DYNAMODB.STRING: correlation_id},
         CHECKPOINT_DATA.SENT: {AWS_DYNAMODB.STRING: sent}
     }
+    if timeout:
+        item[CHECKPOINT_DATA.TIMEOUT] = {AWS_DYNAMODB.NUMBER: str(int(time.time()) + timeout)}
 
     # write the kinesis offset to dynamodb. this allows us to recover hung/incomplete fsms.
     return_value = _trace(
@@ -1501,7 +2340,7 @@ def _store_checkpoint_dynamodb(table_arn, correlation_id, sent):
     return return_value
 
 
-def store_checkpoint(context, sent, primary=True):
+def store_checkpoint(context, sent, primary=True, sources=None):
     """
     Stores the return value from a prior call to send_next_event_for_dispatch to
     persistent storage so that a stalled FSM can be re-started from the last known
@@ -1511,7 +2350,111 @@ def store_checkpoint(context, sent, primary=True):
     :param sent: the data to checkpoint
     :param primary: if True, use the primary checkpoint source, and if False
       use the secondary checkpoint source
-    :return: see above.
+    :param sources: an optional dict of per-machine sources (see get_sources)
+    :return: the return value from boto3 put_item call, or None if nothing was stored.
+    """
+    source_arn = get_source(SOURCE.CHECKPOINT, primary, sources)
+
+    service = get_arn_from_arn_string(source_arn).service
+
+    if service == AWS.DYNAMODB:
+        return _store_checkpoint_dynamodb(source_arn, context.correlation_id, sent)
+
+
+def _load_checkpoint_dynamodb(table_arn, correlation_id):
+    """
+    Loads the data from a prior call to _store_checkpoint_dynamodb.
+
+    :param table_arn: a str ARN for a DynamoDB table like
+      'arn:partition:dynamodb:region:account:resource'
+    :param correlation_id: the guid for the fsm
+    :return: the checkpointed str data, or None
+    """
+    dynamodb_conn = get_connection(table_arn)
+    if not dynamodb_conn:
+        return  # pragma: no cover
+
+    table_name = get_arn_from_arn_string(table_arn).slash_resource()
+    key = {
+        CHECKPOINT_DATA.CORRELATION_ID: {AWS_DYNAMODB.STRING: correlation_id}
+    }
+
+    return_value = _trace(
+        dynamodb_conn.get_item,
+        ConsistentRead=True,
+        TableName=table_name,
+        Key=key
+    )
+    item = return_value.get(AWS_DYNAMODB.Item)
+    if item:
+        return item[CHECKPOINT_DATA.SENT][AWS_DYNAMODB.STRING]
+
+
+def _get_snapshot_key(correlation_id, snapshot_id):
+    return CHECKPOINT_DATA.SNAPSHOT_KEY_PREFIX + correlation_id + '-' + snapshot_id
+
+
+def store_snapshot(correlation_id, snapshot_id, serialized, primary=True, sources=None):
+    """
+    Stores a snapshot of a machine's user context, which the payloads for
+    subsequent steps send deltas against (see Context.to_delta_payload_dict).
+
+    :param correlation_id: the guid for the fsm
+    :param snapshot_id: a str snapshot id
+    :param serialized: a json str user context
+    :param primary: if True, use the primary checkpoint source, and if False
+      use the secondary checkpoint source
+    :param sources: an optional dict of per-machine sources (see get_sources)
+    :return: the return value from boto3 put_item call, or None if the snapshot
+      was not stored (only dynamodb checkpoint sources support snapshots)
+    """
+    source_arn = get_source(SOURCE.CHECKPOINT, primary, sources)
+
+    service = get_arn_from_arn_string(source_arn).service
+
+    if service == AWS.DYNAMODB:
+        # retries re-send events that refer to replaced snapshots, so snapshots
+        # are not deleted, but expire long after the retries have run
+        return _store_checkpoint_dynamodb(source_arn, _get_snapshot_key(correlation_id, snapshot_id), serialized,
+                                          timeout=CHECKPOINT_DATA.SNAPSHOT_TIMEOUT)
+
+    logger.warning("Snapshots require a dynamodb checkpoint source (primary=%s)." % primary)
+
+
+def load_snapshot(correlation_id, snapshot_id, primary=True, sources=None):
+    """
+    Loads a snapshot from a prior call to store_snapshot.
+
+    :param correlation_id: the guid for the fsm
+    :param snapshot_id: a str snapshot id
+    :param primary: if True, use the primary checkpoint source, and if False
+      use the secondary checkpoint source
+    :param sources: an optional dict of per-machine sources (see get_sources)
+    :return: a json str user context, or None
+    """
+    source_arn = get_source(SOURCE.CHECKPOINT, primary, sources)
+
+    service = get_arn_from_arn_string(source_arn).service
+
+    if service == AWS.DYNAMODB:
+        return _load_checkpoint_dynamodb(source_arn, _get_snapshot_key(correlation_id, snapshot_id))
+
+
+def _get_shard_checkpoint_key(stream_arn, shard_id):
+    return CHECKPOINT_DATA.SHARD_KEY_PREFIX + get_arn_from_arn_string(stream_arn).slash_resource() + '-' + shard_id
+
+
+def store_shard_checkpoint(stream_arn, shard_id, sequence_number, primary=True):
+    """
+    Stores the last processed sequence number for a stream shard, so that a
+    long-running worker can resume from where a prior owner of the shard stopped.
+
+    :param stream_arn: a str ARN for a Kinesis stream.
+    :param shard_id: a str shard id like 'shardId-000000000000'.
+    :param sequence_number: a str sequence number.
+    :param primary: if True, use the primary checkpoint source, and if False
+      use the secondary checkpoint source
+    :return: the return value from boto3 put_item call
     """
     if primary:
         source_arn = get_primary_checkpoint_source()
@@ -1521,7 +2464,30 @@ def store_checkpoint(context, sent, primary=True):
     service = get_arn_from_arn_string(source_arn).service
 
     if service == AWS.DYNAMODB:
-        return _store_checkpoint_dynamodb(source_arn, context.correlation_id, sent)
+        key = _get_shard_checkpoint_key(stream_arn, shard_id)
+        return _store_checkpoint_dynamodb(source_arn, key, sequence_number)
+
+
+def load_shard_checkpoint(stream_arn, shard_id, primary=True):
+    """
+    Loads the last processed sequence number for a stream shard.
+
+    :param stream_arn: a str ARN for a Kinesis stream.
+    :param shard_id: a str shard id like 'shardId-000000000000'.
+    :param primary: if True, use the primary checkpoint source, and if False
+      use the secondary checkpoint source
+    :return: a str sequence number, or None
+    """
+    if primary:
+        source_arn = get_primary_checkpoint_source()
+    else:
+        source_arn = get_secondary_checkpoint_source()
+
+    service = get_arn_from_arn_string(source_arn).service
+
+    if service == AWS.DYNAMODB:
+        key = _get_shard_checkpoint_key(stream_arn, shard_id)
+        return _load_checkpoint_dynamodb(source_arn, key)
 
 
 def _store_environment_dynamodb(table_arn, environment):
@@ -1737,7 +2703,7 @@ def _start_retries_sqs(queue_arn, correlation_id, run_at, payload):
     return return_value
 
 
-def start_retries(context, run_at, payload, primary=True, recovering=False):
+def start_retries(context, run_at, payload, primary=True, recovering=False, lane=None, sources=None):
     """
     Triggers retries for a state machine by sending a message to a "run_at"
     parameter designating when to run the retry.
@@ -1749,18 +2715,15 @@ def start_retries(context, run_at, payload, primary=True, recovering=False):
       use the retries environment source
     :param recovering: if True, use the primary stream source, and if False
       use the secondary stream source
-    :return: see above.
+    :param lane: an optional str lane name (see settings.STREAM_LANES), selecting
+      the stream sources used when recovering
+    :param sources: an optional dict of per-machine sources (see get_sources)
+    :return: the return value from the boto3 call, or None if nothing was sent.
     """
-    if primary:
-        if recovering:
-            source_arn = get_primary_stream_source()
-        else:
-            source_arn = get_primary_retry_source()
+    if recovering:
+        source_arn = get_stream_source(primary, sources, lane)
     else:
-        if recovering:
-            source_arn = get_secondary_stream_source()
-        else:
-            source_arn = get_secondary_retry_source()
+        source_arn = get_source(SOURCE.RETRY, primary, sources)
 
     service = get_arn_from_arn_string(source_arn).service
 
@@ -1812,7 +2775,7 @@ def _stop_retries_dynamodb(table_arn, correlation_id, steps):
     return return_value
 
 
-def stop_retries(context, primary=True):
+def stop_retries(context, primary=True, sources=None):
     """
     Stops retries for a state machine by deleting any persistent messages
     that trigger retires.
@@ -1820,12 +2783,10 @@ def stop_retries(context, primary=True):
     :param context: a aws_lambda_fsm.fsm.Context instance
     :param primary: if True, use the primary retries source, and if False
       use the retries environment source
-    :return: see above.
+    :param sources: an optional dict of per-machine sources (see get_sources)
+    :return: the return value from boto3 delete_item call, or None if nothing was deleted.
     """
-    if primary:
-        source_arn = get_primary_retry_source()
-    else:
-        source_arn = get_secondary_retry_source()
+    source_arn = get_source(SOURCE.RETRY, primary, sources)
 
     service = get_arn_from_arn_string(source_arn).service
 
@@ -1886,6 +2847,205 @@ def retriable_entities(table_arn, index, run_at, limit=100):
 
     return items
 
+
+def _get_schedule_bucket(run_at):
+    """
+    Returns the bucket for a time, which is the start of the settings.SCHEDULE_BUCKET_SECONDS
+    long interval containing it.
+
+    :param run_at: a float time since epoch
+    :return: an int time since epoch
+    """
+    seconds = getattr(settings, 'SCHEDULE_BUCKET_SECONDS', SCHEDULE_DATA.BUCKET_SECONDS)
+    return int(run_at) // seconds * seconds
+
+
+def _schedule_event_dynamodb(table_arn, key, run_at, payload):
+    """
+    Schedules an FSM event message in DynamoDB.
+
+    :param table_arn: a str ARN for a DynamoDB table like
+      'arn:partition:dynamodb:region:account:resource'
+    :param key: a str key like 'correlation_id-steps-retries'
+    :param run_at: a float time since epoch
+    :param payload: the serialized fsm context
+    :return: the return value from boto3 put_item call
+    """
+    dynamodb_conn = get_connection(table_arn)
+    if not dynamodb_conn:
+        return  # pragma: no cover
+
+    table_name = get_arn_from_arn_string(table_arn).slash_resource()
+    item = {
+        SCHEDULE_DATA.BUCKET: {AWS_DYNAMODB.NUMBER: str(_get_schedule_bucket(run_at))},
+        SCHEDULE_DATA.KEY: {AWS_DYNAMODB.STRING: key},
+        SCHEDULE_DATA.RUN_AT: {AWS_DYNAMODB.NUMBER: str(run_at)},
+        SCHEDULE_DATA.PAYLOAD: {AWS_DYNAMODB.STRING: payload}
+    }
+    return_value = _trace(
+        dynamodb_conn.put_item,
+        TableName=table_name,
+        Item=item
+    )
+    return return_value
+
+
+def schedule_event(correlation_id, steps, retries, run_at, payload, primary=True):
+    """
+    Schedules an FSM event message to be dispatched (by the timer handler) at a
+    future time. Messages are stored in buckets of settings.SCHEDULE_BUCKET_SECONDS,
+    so that the timer handler only reads the buckets that are due.
+
+    :param correlation_id: the guid for the fsm
+    :param steps: the steps of the scheduled message
+    :param retries: the retries of the scheduled message
+    :param run_at: a float time since epoch
+    :param payload: the serialized fsm context
+    :param primary: if True, use the primary schedule source, and if False
+      use the secondary schedule source
+    :return: the return value from boto3 put_item call, or None if nothing was scheduled.
+    """
+    if primary:
+        source_arn = get_primary_schedule_source()
+    else:
+        source_arn = get_secondary_schedule_source()
+
+    service = get_arn_from_arn_string(source_arn).service
+
+    if not service:  # pragma: no cover
+        logger.warning("No schedule source for primary=%s" % primary)
+
+    elif service == AWS.DYNAMODB:
+        key = '%s-%s-%s' % (correlation_id, steps, retries)
+        return _schedule_event_dynamodb(source_arn, key, run_at, payload)
+
+
+def scheduled_events(table_arn, now, limit=100):
+    """
+    Returns the scheduled event messages that are due, starting at the bucket
+    after the last one that was completely dispatched (the cursor), and reading
+    at most settings.SCHEDULE_MAX_BUCKETS buckets.
+
+    :param table_arn: a str ARN for a DynamoDB table like
+      'arn:partition:dynamodb:region:account:resource'
+    :param now: a float time since epoch
+    :param limit: an int max number of messages
+    :return: a tuple like ([{'bucket': ..., 'ckey': ..., 'payload': ...}, ...], cursor)
+      where cursor is the int bucket to start reading from next time.
+    """
+    dynamodb_conn = get_connection(table_arn, disable_chaos=True)
+    if not dynamodb_conn:
+        return [], None  # pragma: no cover
+
+    table_name = get_arn_from_arn_string(table_arn).slash_resource()
+    seconds = getattr(settings, 'SCHEDULE_BUCKET_SECONDS', SCHEDULE_DATA.BUCKET_SECONDS)
+    max_buckets = getattr(settings, 'SCHEDULE_MAX_BUCKETS', SCHEDULE_DATA.MAX_BUCKETS)
+    current = _get_schedule_bucket(now)
+
+    # read the cursor
+    return_value = _trace(
+        dynamodb_conn.get_item,
+        TableName=table_name,
+        ConsistentRead=True,
+        Key={
+            SCHEDULE_DATA.BUCKET: {AWS_DYNAMODB.NUMBER: str(SCHEDULE_DATA.CURSOR_BUCKET)},
+            SCHEDULE_DATA.KEY: {AWS_DYNAMODB.STRING: SCHEDULE_DATA.CURSOR_KEY}
+        }
+    )
+    if AWS_DYNAMODB.Item in return_value:
+        bucket = int(return_value[AWS_DYNAMODB.Item][SCHEDULE_DATA.RUN_AT][AWS_DYNAMODB.NUMBER])
+    else:
+        bucket = current - seconds * (max_buckets - 1)
+    last = min(current, bucket + seconds * (max_buckets - 1))
+
+    items = []
+    while True:
+
+        # query a single bucket, which may take several pages
+        kwargs = {}
+        while True:
+            results = _trace(
+                dynamodb_conn.query,
+                TableName=table_name,
+                ConsistentRead=True,
+                KeyConditions={
+                    SCHEDULE_DATA.BUCKET: {
+                        AWS_DYNAMODB.ComparisonOperator: AWS_DYNAMODB.EQUAL,
+                        AWS_DYNAMODB.AttributeValueList: [{AWS_DYNAMODB.NUMBER: str(bucket)}]
+                    }
+                },
+                Limit=limit - len(items),
+                **kwargs
+            )
+            for result in results[AWS_DYNAMODB.Items]:
+                if float(result[SCHEDULE_DATA.RUN_AT][AWS_DYNAMODB.NUMBER]) <= now:
+                    items.append(
+                        {
+                            SCHEDULE_DATA.BUCKET: bucket,
+                            SCHEDULE_DATA.KEY: result[SCHEDULE_DATA.KEY][AWS_DYNAMODB.STRING],
+                            SCHEDULE_DATA.PAYLOAD: result[SCHEDULE_DATA.PAYLOAD][AWS_DYNAMODB.STRING]
+                        }
+                    )
+
+            # the bucket is only partially read, so read it again next time
+            if len(items) >= limit:
+                return items, bucket
+
+            if AWS_DYNAMODB.LastEvaluatedKey not in results:
+                break
+            kwargs[AWS_DYNAMODB.ExclusiveStartKey] = results[AWS_DYNAMODB.LastEvaluatedKey]
+
+        # the current bucket may still get more messages, so read it again next time
+        if bucket >= last:
+            return items, bucket + seconds if bucket < current else bucket
+        bucket += seconds
+
+
+def finish_scheduled_events(table_arn, items, cursor):
+    """
+    Deletes dispatched event messages, and saves the cursor.
+
+    :param table_arn: a str ARN for a DynamoDB table like
+      'arn:partition:dynamodb:region:account:resource'
+    :param items: a list of items returned from scheduled_events
+    :param cursor: an int bucket returned from scheduled_events
+    """
+    dynamodb_conn = get_connection(table_arn, disable_chaos=True)
+    if not dynamodb_conn:
+        return  # pragma: no cover
+
+    table_name = get_arn_from_arn_string(table_arn).slash_resource()
+    for i in xrange(0, len(items), SCHEDULE_DATA.BATCH_SIZE):
+        return_value = _trace(
+            dynamodb_conn.batch_write_item,
+            RequestItems={
+                table_name: [
+                    {
+                        AWS_DYNAMODB.DeleteRequest: {
+                            AWS_DYNAMODB.Key: {
+                                SCHEDULE_DATA.BUCKET: {AWS_DYNAMODB.NUMBER: str(item[SCHEDULE_DATA.BUCKET])},
+                                SCHEDULE_DATA.KEY: {AWS_DYNAMODB.STRING: item[SCHEDULE_DATA.KEY]}
+                            }
+                        }
+                    } for item in items[i:i + SCHEDULE_DATA.BATCH_SIZE]
+                ]
+            }
+        )
+        # the idempotency code ignores messages that are dispatched again
+        unprocessed = return_value.get(AWS_DYNAMODB.UnprocessedItems, {}).get(table_name)
+        if unprocessed:
+            logger.warning('Unable to delete %d scheduled events.', len(unprocessed))
+
+    _trace(
+        dynamodb_conn.put_item,
+        TableName=table_name,
+        Item={
+            SCHEDULE_DATA.BUCKET: {AWS_DYNAMODB.NUMBER: str(SCHEDULE_DATA.CURSOR_BUCKET)},
+            SCHEDULE_DATA.KEY: {AWS_DYNAMODB.STRING: SCHEDULE_DATA.CURSOR_KEY},
+            SCHEDULE_DATA.RUN_AT: {AWS_DYNAMODB.NUMBER: str(cursor)}
+        }
+    )
+
 ################################################################################
 # Configuration Validation
 ################################################################################
@@ -1896,6 +3056,7 @@ ALLOWED_RETRY_SERVICES = [AWS.KINESIS, AWS.DYNAMODB, AWS.SNS, AWS.SQS]
 ALLOWED_CHECKPOINT_SERVICES = [AWS.DYNAMODB]
 ALLOWED_ENVIRONMENT_SERVICES = [AWS.DYNAMODB]
 ALLOWED_METRICS_SERVICES = [AWS.CLOUDWATCH]
+ALLOWED_SCHEDULE_SERVICES = [AWS.DYNAMODB]
 ALLOWED_CACHE_SERVICES = [AWS.ELASTICACHE, AWS.DYNAMODB]
 
 
@@ -1955,6 +3116,13 @@ ALLOWED_MAPPING = {
         PRIMARY: get_primary_metrics_source(),
         SECONDARY: get_secondary_metrics_source(),
     },
+    'SCHEDULE': {
+        ALLOWED: ALLOWED_SCHEDULE_SERVICES,
+        REQUIRED: False,
+        FAILOVER: False,
+        PRIMARY: get_primary_schedule_source(),
+        SECONDARY: get_secondary_schedule_source(),
+    },
 }
 
 
@@ -2052,6 +3220,30 @@ def _validate_elasticache_endpoints():
                     logger.warning("ELASTICACHE_ENDPOINTS has invalid entry for key '%s' (port)", cache_arn)
 
 
+def _validate_stream_lanes():
+    """
+    Validates settings.STREAM_LANES is correctly formed
+
+    STREAM_LANES = {
+      "realtime": {
+        "primary": "stream_arn1",
+        "secondary": "stream_arn2"
+      }
+    }
+    """
+    for lane, entry in sorted(get_stream_lanes().items()):
+        primary = entry.get(STREAM_LANE.PRIMARY)
+        secondary = entry.get(STREAM_LANE.SECONDARY)
+        if not primary:
+            logger.fatal("STREAM_LANES has invalid entry for lane '%s' (primary)", lane)
+        for source_arn in (primary, secondary):
+            service = get_arn_from_arn_string(source_arn).service
+            if service and service not in ALLOWED_STREAM_SERVICES:
+                logger.fatal("STREAM_LANES has invalid entry for lane '%s' ('%s' is not allowed)", lane, source_arn)
+        if not secondary:
+            logger.warning("STREAM_LANES has no secondary for lane '%s' (failover not configured).", lane)
+
+
 def _validate_cache():
     """
     Validates the cache settings
@@ -2079,6 +3271,7 @@ def validate_config():
             for key, data in sorted(ALLOWED_MAPPING.items()):
                 _validate_config(key, data)
             _validate_sqs_urls()
+            _validate_stream_lanes()
             _validate_elasticache_endpoints()
             _validate_cache()
         _local.validated_config = True
@@ -0,0 +1,143 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# system imports
+from threading import RLock
+import logging
+import time
+
+# library imports
+
+# application imports
+from aws_lambda_fsm.constants import CIRCUIT
+from aws_lambda_fsm.config import get_settings
+from aws_lambda_fsm.registry import Registry
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+class Object(object):
+    pass
+
+_local = Object()
+_local.breakers = Registry(lambda arn: CircuitBreaker(
+    arn,
+    failure_threshold=getattr(settings, 'CIRCUIT_BREAKER_FAILURE_THRESHOLD', CIRCUIT.FAILURE_THRESHOLD),
+    reset_timeout=getattr(settings, 'CIRCUIT_BREAKER_RESET_TIMEOUT', CIRCUIT.RESET_TIMEOUT)
+))
+
+
+class CircuitBreaker(object):
+    """
+    A circuit breaker for a primary source. After failure_threshold consecutive
+    failures, the circuit opens and callers go straight to the secondary source.
+    After reset_timeout seconds, a single caller is allowed to probe the primary
+    source (half-open), and the result of the probe closes or re-opens the circuit.
+    """
+
+    def __init__(self, name, failure_threshold=CIRCUIT.FAILURE_THRESHOLD, reset_timeout=CIRCUIT.RESET_TIMEOUT):
+        """
+        :param name: a str name (the primary source arn) used for logging.
+        :param failure_threshold: an int number of consecutive failures that opens
+          the circuit, or 0 to never open it.
+        :param reset_timeout: a float number of seconds before probing the primary.
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CIRCUIT.CLOSED
+        self.failures = 0
+        self.opened_at = 0.
+        self._lock = RLock()
+
+    def allow(self):
+        """
+        Returns True if the primary source should be attempted.
+
+        :return: a bool.
+        """
+        if self.state == CIRCUIT.CLOSED:
+            return True
+        with self._lock:
+            if time.time() < self.opened_at + self.reset_timeout:
+                return False
+            # let a single caller probe the primary, and give it reset_timeout
+            # seconds to report back before letting another caller probe
+            self.state = CIRCUIT.HALF_OPEN
+            self.opened_at = time.time()
+            logger.info('Probing %s.', self.name)
+            return True
+
+    def primaries(self):
+        """
+        Returns the values of the `primary` flag to attempt, in order.
+
+        :return: a list like [True, False].
+        """
+        return [True, False] if self.allow() else [False]
+
+    def succeeded(self):
+        """
+        Records a successful call to the primary source.
+        """
+        if self.state == CIRCUIT.CLOSED and not self.failures:
+            return
+        with self._lock:
+            if self.state != CIRCUIT.CLOSED:
+                logger.info('Closing circuit for %s.', self.name)
+            self.state = CIRCUIT.CLOSED
+            self.failures = 0
+
+    def failed(self):
+        """
+        Records a failed call to the primary source.
+        """
+        with self._lock:
+            self.failures += 1
+            if self.state == CIRCUIT.HALF_OPEN or \
+                    (self.failure_threshold and self.failures >= self.failure_threshold):
+                if self.state == CIRCUIT.CLOSED:
+                    logger.warning('Opening circuit for %s after %d failures.', self.name, self.failures)
+                self.state = CIRCUIT.OPEN
+                self.opened_at = time.time()
+
+
+class NullCircuitBreaker(CircuitBreaker):
+    """
+    A circuit breaker for an unconfigured primary source. It never opens, and
+    ignores the results of calls, so unconfigured sources do not share a circuit.
+    """
+
+    def __init__(self):
+        super(NullCircuitBreaker, self).__init__(None, failure_threshold=0)
+
+    def succeeded(self):
+        pass
+
+    def failed(self):
+        pass
+
+
+def get_circuit_breaker(arn):
+    """
+    Returns the (cached) CircuitBreaker for a primary source.
+
+    :param arn: a str ARN like 'arn:partition:kinesis:region:account:resource'
+    :return: a aws_lambda_fsm.circuit.CircuitBreaker instance, or a new
+      aws_lambda_fsm.circuit.NullCircuitBreaker instance if arn is None.
+    """
+    if not arn:
+        return NullCircuitBreaker()
+    return _local.breakers.get(arn)
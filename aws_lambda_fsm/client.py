@@ -34,7 +34,8 @@ def start_state_machine(machine_name,
                         initial_context,
                         correlation_id=None,
                         current_state=STATE.PSEUDO_INIT,
-                        current_event=STATE.PSEUDO_INIT):
+                        current_event=STATE.PSEUDO_INIT,
+                        lane=None):
     """
     Insert a AWS Kinesis message that will kick off a state machine.
 
@@ -44,7 +45,8 @@ def start_state_machine(machine_name,
       define it automatically.
     :param current_state: the state to start the machine in.
     :param current_event: the event to start the machine with.
-
+    :param lane: an optional str lane name (see settings.STREAM_LANES) to send
+      the first event to.
     """
     correlation_id = correlation_id or uuid.uuid4().hex
     system_context = {
@@ -63,14 +65,19 @@ def start_state_machine(machine_name,
     }
     send_next_event_for_dispatch(None,
                                  json.dumps(payload, sort_keys=True),
-                                 correlation_id)
+                                 correlation_id,
+                                 lane=lane)
 
 
 def start_state_machines(machine_name,
                          user_contexts,
                          correlation_ids=None,
                          current_state=STATE.PSEUDO_INIT,
-                         current_event=STATE.PSEUDO_INIT):
+                         current_event=STATE.PSEUDO_INIT,
+                         lane=None,
+                         system_contexts=None,
+                         primary=True,
+                         sources=None):
     """
     Insert a bulk AWS Kinesis message that will kick off several state machines.
 
@@ -80,6 +87,14 @@ def start_state_machines(machine_name,
       if the system should define then automatically.
     :param current_state: the state to start the machines in.
     :param current_event: the event to start the machines with.
+    :param lane: an optional str lane name (see settings.STREAM_LANES) to send
+      the first events to.
+    :param system_contexts: an optional list of dicts of additional system context
+      data for the state machines.
+    :param primary: if True, use the primary stream source, and if False
+      use the secondary stream source.
+    :param sources: an optional dict of the machine's sources (see aws_lambda_fsm.aws.get_sources).
+    :return: a list of the correlation_ids of the machines that were not started.
     """
     all_data = []
     correlation_ids = correlation_ids or [uuid.uuid4().hex for i in range(len(user_contexts))]
@@ -95,12 +110,17 @@ def start_state_machines(machine_name,
             SYSTEM_CONTEXT.RETRIES: 0,
             SYSTEM_CONTEXT.CORRELATION_ID: correlation_id,
         }
+        if system_contexts:
+            system_context.update(system_contexts[i])
         payload = {
             PAYLOAD.VERSION: PAYLOAD.DEFAULT_VERSION,
             PAYLOAD.SYSTEM_CONTEXT: system_context,
             PAYLOAD.USER_CONTEXT: user_context
         }
         all_data.append(json.dumps(payload, sort_keys=True))
-    send_next_events_for_dispatch(None,
-                                  all_data,
-                                  correlation_ids)
+    return send_next_events_for_dispatch(None,
+                                         all_data,
+                                         correlation_ids,
+                                         primary=primary,
+                                         lane=lane,
+                                         sources=sources)
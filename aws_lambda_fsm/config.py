@@ -14,15 +14,23 @@
 
 # system imports
 from threading import RLock
+import importlib
+import hashlib
 import logging
+import os
+import pprint
 
 # library imports
-import yaml
 
 # application imports
+from aws_lambda_fsm.constants import AWS
+from aws_lambda_fsm.constants import CONFIG
+from aws_lambda_fsm.constants import PRECOMPILED
+from aws_lambda_fsm.constants import SOURCE
 
 _config_lock = RLock()
 _config = {}
+_precompiled = None
 
 _settings_lock = RLock()
 _settings = None
@@ -58,28 +66,306 @@ def set_settings(settings):
         _settings = settings
 
 
+def import_class(name):
+    """
+    Imports and returns a class named in a setting.
+
+    :param name: a str like 'path.to.SomeClass'.
+    :return: the class.
+    """
+    parts = name.split('.')
+    module = importlib.import_module('.'.join(parts[0:-1]))
+    return getattr(module, parts[-1])
+
+
 def get_current_configuration(filename='fsm.yaml'):
     """
     Returns the current fsm configuration dictionary, taking care to cache for performance.
-
-    TODO: schema
-    TODO: validation utilities
+    A precompiled configuration (see tools/compile_fsm.py) is used in preference to parsing
+    the .yaml file, provided it is not stale.
 
     :return: a dict.
     """
     with _config_lock:
         global _config
         if filename not in _config:
-            _config[filename] = load_config_from_yaml(filename=filename)
+            config_dict = load_precompiled_config(filename=filename)
+            if config_dict is None:
+                config_dict = load_config_from_yaml(filename=filename)
+            _config[filename] = config_dict
         return _config[filename]
 
 
 def load_config_from_yaml(filename='fsm.yaml'):
     """
-    Returns the current fsm configuration dictionary, loaded from file.
+    Returns the current fsm configuration dictionary, loaded from file. The
+    libyaml based loader is used when available, since the pure-python loader
+    is very slow for large files.
 
     :return: a dict.
     """
-    yaml_file = open(filename, 'r')
-    yaml_dict = yaml.load(yaml_file.read())
+    import yaml  # deferred, since yaml is only needed when a file is actually loaded
+    with open(filename, 'r') as yaml_file:
+        yaml_dict = yaml.load(yaml_file.read(), Loader=getattr(yaml, 'CLoader', yaml.Loader))
     return yaml_dict
+
+
+def _get_checksum(filename):
+    """
+    Returns a checksum of a file's contents.
+
+    :param filename: a path to a file.
+    :return: a str hex digest.
+    """
+    with open(filename, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def _get_precompiled_configurations():
+    """
+    Returns the configurations from the precompiled module, or an empty dict if
+    there is no precompiled module. The module name is controlled by
+    settings.PRECOMPILED_CONFIG_MODULE.
+
+    :return: a dict of {filename: {'checksum': str, 'config': dict}}
+    """
+    with _config_lock:
+        global _precompiled
+        if _precompiled is None:
+            module_name = getattr(get_settings(), 'PRECOMPILED_CONFIG_MODULE', PRECOMPILED.DEFAULT_MODULE)
+            try:
+                module = importlib.import_module(module_name)
+                _precompiled = getattr(module, PRECOMPILED.CONFIGURATIONS, {})
+            except ImportError:
+                _precompiled = {}
+            except Exception:
+                # a broken module must never stop the machines from loading from yaml
+                logger.exception('Unable to load precompiled module "%s". Loading from yaml.', module_name)
+                _precompiled = {}
+        return _precompiled
+
+
+def load_precompiled_config(filename='fsm.yaml'):
+    """
+    Returns the precompiled fsm configuration dictionary for the given file, or
+    None if there is no precompiled configuration, or if it was compiled from an
+    older version of the file.
+
+    :return: a dict, or None.
+    """
+    entry = _get_precompiled_configurations().get(filename)
+    if entry is None:
+        return None
+
+    # the .yaml file isn't required in the deployment package, but if it is
+    # present, make sure it hasn't been changed since it was compiled.
+    if os.path.exists(filename) and _get_checksum(filename) != entry[PRECOMPILED.CHECKSUM]:
+        logger.warning('Precompiled configuration for "%s" is stale. Loading from yaml.', filename)
+        return None
+
+    return entry[PRECOMPILED.CONFIG]
+
+
+def get_configuration_errors(config_dict, filename='fsm.yaml'):
+    """
+    Validates a single fsm configuration dictionary (imports are not followed).
+
+    :param config_dict: a dict as returned by load_config_from_yaml.
+    :param filename: a str filename used in error messages.
+    :return: a list of str error messages (empty if the configuration is valid).
+    """
+    errors = []
+    if not isinstance(config_dict, dict) or not isinstance(config_dict.get(CONFIG.MACHINES), list):
+        return ['%s: "%s" must be a list.' % (filename, CONFIG.MACHINES)]
+
+    for i, machine_dict in enumerate(config_dict[CONFIG.MACHINES]):
+        if CONFIG.IMPORT in machine_dict:
+            continue
+
+        machine_name = machine_dict.get(CONFIG.NAME)
+        if not machine_name:
+            errors.append('%s: machine #%d has no name.' % (filename, i))
+            continue
+
+        prefix = '%s: machine "%s"' % (filename, machine_name)
+        for key in (CONFIG.MAX_RETRIES, CONFIG.SNAPSHOT_INTERVAL):
+            try:
+                int(machine_dict.get(key, 0))
+            except (TypeError, ValueError):
+                errors.append('%s has an invalid %s.' % (prefix, key))
+        if not isinstance(machine_dict.get(CONFIG.STREAM, ''), basestring):
+            errors.append('%s has an invalid %s.' % (prefix, CONFIG.STREAM))
+        sources = machine_dict.get(CONFIG.SOURCES) or {}
+        if not isinstance(sources, dict) or \
+                any(kind not in SOURCE.ALL or not isinstance(source, dict) for kind, source in sources.items()):
+            errors.append('%s has invalid %s.' % (prefix, CONFIG.SOURCES))
+        elif _get_int(machine_dict.get(CONFIG.SNAPSHOT_INTERVAL)) > 0 and \
+                not _is_dynamodb_arn((sources.get(SOURCE.CHECKPOINT) or {}).get(SOURCE.PRIMARY) or
+                                     getattr(get_settings(), 'PRIMARY_CHECKPOINT_SOURCE', None)):
+            errors.append('%s has a %s, which requires a dynamodb %s source.' %
+                          (prefix, CONFIG.SNAPSHOT_INTERVAL, SOURCE.CHECKPOINT))
+
+        state_dicts = machine_dict.get(CONFIG.STATES)
+        if not state_dicts:
+            errors.append('%s has no states.' % prefix)
+            continue
+
+        state_names = [state_dict.get(CONFIG.NAME) for state_dict in state_dicts]
+        if len(set(state_names)) != len(state_names):
+            errors.append('%s has duplicate state names.' % prefix)
+        if not any(state_dict.get(CONFIG.INITIAL) for state_dict in state_dicts):
+            errors.append('%s has no initial state.' % prefix)
+
+        for state_dict in state_dicts:
+            state_name = state_dict.get(CONFIG.NAME)
+            if not state_name:
+                errors.append('%s has a state with no name.' % prefix)
+                continue
+            if not isinstance(state_dict.get(CONFIG.STREAM, ''), basestring):
+                errors.append('%s state "%s" has an invalid %s.' % (prefix, state_name, CONFIG.STREAM))
+            for key in (CONFIG.MAX_RETRIES, CONFIG.RETRY_INTERVAL, CONFIG.RETRY_BACKOFF):
+                try:
+                    float(state_dict.get(key, 0))
+                except (TypeError, ValueError):
+                    errors.append('%s state "%s" has an invalid %s.' % (prefix, state_name, key))
+            map_dict = state_dict.get(CONFIG.MAP)
+            if map_dict is not None and \
+                    not (isinstance(map_dict, dict) and isinstance(map_dict.get(CONFIG.MACHINE), basestring)):
+                errors.append('%s state "%s" has an invalid %s.' % (prefix, state_name, CONFIG.MAP))
+            parallel = state_dict.get(CONFIG.PARALLEL)
+            if parallel is not None and \
+                    not (isinstance(parallel, list) and parallel and all(isinstance(n, basestring) for n in parallel)):
+                errors.append('%s state "%s" has an invalid %s.' % (prefix, state_name, CONFIG.PARALLEL))
+            for key in (CONFIG.ENTRY_ACTION, CONFIG.EXIT_ACTION):
+                if _is_do_action_only(state_dict.get(key)):
+                    errors.append('%s state "%s" uses %s as an %s (it must be a %s).' %
+                                  (prefix, state_name, state_dict[key], key, CONFIG.DO_ACTION))
+            for transition_dict in state_dict.get(CONFIG.TRANSITIONS, []):
+                if _is_do_action_only(transition_dict.get(CONFIG.ACTION)):
+                    errors.append('%s state "%s" uses %s as a transition %s (it must be a %s).' %
+                                  (prefix, state_name, transition_dict[CONFIG.ACTION], CONFIG.ACTION,
+                                   CONFIG.DO_ACTION))
+                if not transition_dict.get(CONFIG.EVENT):
+                    errors.append('%s state "%s" has a transition with no event.' % (prefix, state_name))
+                if transition_dict.get(CONFIG.TARGET) not in state_names:
+                    errors.append('%s state "%s" has a transition to unknown target "%s".' %
+                                  (prefix, state_name, transition_dict.get(CONFIG.TARGET)))
+
+    return errors
+
+
+def _get_int(value):
+    """
+    Returns a configuration value as an int.
+
+    :param value: a value.
+    :return: an int, or 0 if the value is not an int (reported separately).
+    """
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _is_dynamodb_arn(arn):
+    """
+    Checks if an ARN is for a DynamoDB resource.
+
+    :param arn: a str ARN like 'arn:partition:dynamodb:region:account:resource', or None.
+    :return: a bool.
+    """
+    return isinstance(arn, basestring) and arn.split(':')[2:3] == [AWS.DYNAMODB]
+
+
+def _is_do_action_only(action_string):
+    """
+    Checks if an action may only be used as a state's do_action (like
+    aws_lambda_fsm.parallel.ForkAction). Actions that cannot be imported
+    are not checked.
+
+    :param action_string: a str like 'path.to.ActionClass', or None.
+    :return: a bool.
+    """
+    if not isinstance(action_string, basestring):
+        return False
+    try:
+        return bool(getattr(import_class(action_string), 'do_action_only', False))
+    except Exception:
+        return False
+
+
+def _get_non_literal_path(value, path=''):
+    """
+    Returns the path to the first value that is not a plain (json-like) literal,
+    since the repr of other values (like the datetime.date yaml makes from an
+    unquoted date, or .nan) raises a NameError when the module is imported.
+
+    :param value: a value loaded from yaml.
+    :param path: a str path to the value, used in error messages.
+    :return: a str path, or None if every value is a plain literal.
+    """
+    if isinstance(value, dict):
+        for key, child in sorted(value.items()):
+            child_path = '%s.%s' % (path, key) if path else str(key)
+            if not isinstance(key, PRECOMPILED.LITERAL_TYPES):
+                return child_path
+            child_path = _get_non_literal_path(child, child_path)
+            if child_path is not None:
+                return child_path
+        return None
+    if isinstance(value, list):
+        for i, child in enumerate(value):
+            child_path = _get_non_literal_path(child, '%s[%d]' % (path, i))
+            if child_path is not None:
+                return child_path
+        return None
+    if isinstance(value, float) and (value != value or value in (float('inf'), float('-inf'))):
+        return path or '.'  # nan and inf have no literal repr
+    return None if isinstance(value, PRECOMPILED.LITERAL_TYPES) else (path or '.')
+
+
+def compile_config(filename='fsm.yaml'):
+    """
+    Loads and validates an fsm .yaml file, and all the files it imports.
+
+    :param filename: a path to a fsm.yaml file.
+    :return: a tuple of a dict of {filename: {'checksum': str, 'config': dict}}
+      and a list of str error messages.
+    """
+    configurations = {}
+    errors = []
+    filenames = [filename]
+    while filenames:
+        current = filenames.pop(0)
+        if current in configurations:
+            continue
+        config_dict = load_config_from_yaml(filename=current)
+        configurations[current] = {
+            PRECOMPILED.CHECKSUM: _get_checksum(current),
+            PRECOMPILED.CONFIG: config_dict
+        }
+        errors.extend(get_configuration_errors(config_dict, filename=current))
+        path = _get_non_literal_path(config_dict)
+        if path is not None:
+            errors.append('%s: value at "%s" is not a plain literal (quote it in the .yaml).' % (current, path))
+        for machine_dict in (config_dict or {}).get(CONFIG.MACHINES) or []:
+            if CONFIG.IMPORT in machine_dict:
+                filenames.append(machine_dict[CONFIG.IMPORT])
+    return configurations, errors
+
+
+def get_precompiled_source(configurations, filename='fsm.yaml'):
+    """
+    Returns the source for a python module containing the parsed configurations.
+    Importing the (byte-compiled) module is much faster than parsing the .yaml.
+
+    :param configurations: a dict as returned by compile_config.
+    :param filename: a str filename for the generated comment.
+    :return: a str python module source.
+    :raises ValueError: if the configurations contain values that are not plain literals.
+    """
+    path = _get_non_literal_path(configurations)
+    if path is not None:
+        raise ValueError('Value at "%s" is not a plain literal.' % path)
+    return '# Generated by tools/compile_fsm.py from %s. Do not edit.\n\n%s = %s\n' % \
+        (filename, PRECOMPILED.CONFIGURATIONS, pprint.pformat(configurations))
@@ -48,6 +48,12 @@ class SYSTEM_CONTEXT(object):
     TOPIC = 'topic'
     METRICS = 'metrics'
     LEASE_PRIMARY = 'lease_primary'
+    TRACE_ID = 'trace_id'
+    PARENT_SPAN_ID = 'parent_span_id'
+    JOIN = 'join'
+    SNAPSHOT = 'snapshot'
+    SNAPSHOT_STEPS = 'snapshot_steps'
+    DELETED = 'deleted'
 
 
 class OBJ(object):
@@ -66,6 +72,7 @@ class ERRORS(object):
     RETRY = 'retry'
     DUPLICATE = 'duplicate'
     DISPATCH = 'dispatch'
+    SNAPSHOT = 'snapshot'
 
 
 ################################################################################
@@ -97,6 +104,90 @@ class CONFIG(object):
     TOPIC = 'topic'
     MAX_RETRIES = 'max_retries'
     DEFAULT_MAX_RETRIES = 5
+    SOURCES = 'sources'
+    INLINE_STEPS = 'inline_steps'
+    DEFAULT_INLINE_STEPS = 0
+    INLINE_SECONDS = 'inline_seconds'
+    DEFAULT_INLINE_SECONDS = 1.0
+    SNAPSHOT_INTERVAL = 'snapshot_interval'
+    DEFAULT_SNAPSHOT_INTERVAL = 0
+    RETRY_INTERVAL = 'retry_interval'
+    DEFAULT_RETRY_INTERVAL = 1
+    RETRY_BACKOFF = 'retry_backoff'
+    DEFAULT_RETRY_BACKOFF = 2.0
+    MAP = 'map'
+    PARALLEL = 'parallel'
+    MACHINE = 'machine'
+    ITEMS = 'items'
+    MAX_CONCURRENCY = 'max_concurrency'
+
+
+class PHASE(object):
+    LEASE = 'lease'
+    IDEMPOTENCY = 'idempotency'
+    ACTION = 'action'
+    SERIALIZATION = 'serialization'
+    SEND = 'send'
+    CHECKPOINT = 'checkpoint'
+    RETRY = 'retry'
+    DIMENSION = 'phase'
+    METRIC_NAME = 'PhaseDuration'
+    BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]  # milliseconds
+
+
+class SPAN(object):
+    SERVICE = 'service'
+    OPERATION = 'operation'
+    STARTED_AT = 'started_at'
+    DURATION = 'duration'
+    PAYLOAD_SIZE = 'payload_size'
+    OUTCOME = 'outcome'
+    TRACE_ID = 'trace_id'
+    SPAN_ID = 'span_id'
+    PARENT_SPAN_ID = 'parent_span_id'
+    OK = 'ok'
+    ERROR = 'error'
+    FSM = 'fsm'
+    STEP = 'step'
+    ACTION = 'action'
+    DEFAULT_FILE = 'spans.jsonl'
+    DEFAULT_OTLP_ENDPOINT = 'http://localhost:4318/v1/traces'
+    OTLP_TIMEOUT = 5
+
+
+class OTLP(object):
+    RESOURCE_SPANS = 'resourceSpans'
+    RESOURCE = 'resource'
+    SCOPE_SPANS = 'scopeSpans'
+    SCOPE = 'scope'
+    SPANS = 'spans'
+    SERVICE_NAME = 'service.name'
+    SCOPE_NAME = 'aws_lambda_fsm'
+    TRACE_ID = 'traceId'
+    SPAN_ID = 'spanId'
+    PARENT_SPAN_ID = 'parentSpanId'
+    NAME = 'name'
+    KIND = 'kind'
+    KIND_INTERNAL = 1
+    KIND_CLIENT = 3
+    START_TIME = 'startTimeUnixNano'
+    END_TIME = 'endTimeUnixNano'
+    ATTRIBUTES = 'attributes'
+    KEY = 'key'
+    VALUE = 'value'
+    STRING_VALUE = 'stringValue'
+    STATUS = 'status'
+    CODE = 'code'
+    STATUS_OK = 1
+    STATUS_ERROR = 2
+
+
+class PRECOMPILED(object):
+    DEFAULT_MODULE = 'fsm_compiled'
+    CONFIGURATIONS = 'CONFIGURATIONS'
+    CHECKSUM = 'checksum'
+    CONFIG = 'config'
+    LITERAL_TYPES = (basestring, bool, int, long, float, type(None))
 
 
 class MACHINE(object):
@@ -108,6 +199,10 @@ class MACHINE(object):
     METRICS = 'metrics'
     TOPIC = 'topic'
     MAX_RETRIES = 'max_retries'
+    INLINE_STEPS = 'inline_steps'
+    INLINE_SECONDS = 'inline_seconds'
+    SNAPSHOT_INTERVAL = 'snapshot_interval'
+    SOURCES = 'sources'
 
 
 ################################################################################
@@ -120,6 +215,23 @@ class STREAM_DATA(object):
     TIMESTAMP = 'timestamp'
 
 
+class SOURCE(object):
+    STREAM = 'stream'
+    RETRY = 'retry'
+    CHECKPOINT = 'checkpoint'
+    CACHE = 'cache'
+    ALL = [STREAM, RETRY, CHECKPOINT, CACHE]
+    PRIMARY = 'primary'
+    SECONDARY = 'secondary'
+
+
+class STREAM_LANE(object):
+    DEFAULT = 'default'
+    PRIMARY = 'primary'
+    SECONDARY = 'secondary'
+    DEFAULT_WEIGHT = 1
+
+
 class RETRY_DATA(object):
     PARTITION = 'partition'
     CORRELATION_ID_STEPS = 'correlation_id_steps'
@@ -128,9 +240,53 @@ class RETRY_DATA(object):
     RETRIES = 'retries'
 
 
+class SCHEDULE_DATA(object):
+    BUCKET = 'bucket'
+    KEY = 'ckey'
+    RUN_AT = 'run_at'
+    PAYLOAD = 'payload'
+    CURSOR_BUCKET = -1
+    CURSOR_KEY = 'cursor'
+    BUCKET_SECONDS = 60
+    MAX_BUCKETS = 60
+    BATCH_SIZE = 25  # dynamodb batch_write_item allows 25 requests
+
+
 class CHECKPOINT_DATA(object):
     CORRELATION_ID = 'correlation_id'
     SENT = 'sent'
+    SHARD_KEY_PREFIX = 'shard-'
+    SHARD_END = 'SHARD_END'
+    TIMEOUT = 'timeout'
+    SNAPSHOT_KEY_PREFIX = 'snapshot-'
+    SNAPSHOT_CACHE_SIZE = 100
+    SNAPSHOT_TIMEOUT = 7 * 24 * 60 * 60  # weekly
+
+
+class THROTTLE_DATA(object):
+    RETRIES = 2
+    MAX_WAIT = 0.5  # seconds
+    MIN_RATE = 1.  # records/sec
+    DECREASE = 0.5  # multiplicative decrease on throttling
+    INCREASE = 0.1  # additive increase per successful put (~10% per second)
+    BURST = 1.  # seconds of tokens
+
+
+class SHARD_DATA(object):
+    METRIC_NAME = 'ShardPuts'
+    STREAM_DIMENSION = 'stream'
+    SHARD_DIMENSION = 'shard'
+    HOT_RATIO = 2.  # a shard receiving more than 2x the mean number of puts is hot
+    WINDOW = 1000  # number of puts between hot shard checks
+    MAP_TIMEOUT = 300  # seconds to cache the shard hash key ranges
+
+
+class CIRCUIT(object):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    FAILURE_THRESHOLD = 5
+    RESET_TIMEOUT = 30  # seconds
 
 
 class ENVIRONMENT_DATA(object):
@@ -159,6 +315,56 @@ class LEASE_DATA(object):
         OPEN = 'open'
 
 
+class JOIN_DATA(object):
+    JOIN_TIMEOUT = 24 * 60 * 60  # daily
+    KEY = 'ckey'
+    JOIN_KEY_PREFIX = 'join-'
+    COUNT = 'count'
+    PAYLOAD = 'payload'
+    JOINED = 'joined'
+    RESULT_PREFIX = 'r_'
+    ID = 'id'
+    INDEX = 'index'
+    PRIMARY = 'primary'
+    MACHINE_NAME = 'machine_name'
+    EVENT = 'joined'
+    RESULTS = 'join_results'
+    BATCH_SIZE = 10  # the smallest batch supported by all the stream sources (sqs)
+
+
+class MAP_DATA(object):
+    ITEMS = 'items'
+    ITEM = 'item'
+    RESULTS = 'map_results'
+    EVENT = 'mapped'
+    CHUNK_SIZE = 100
+
+
+class STEP_FUNCTION_DATA(object):
+    PAYLOAD = 'payload'
+    DELTA = 'delta'
+    DELETED = 'deleted'
+    INLINE = 'inline'
+    STOP_STATES = 'stop_states'
+
+
+class WORKER_DATA(object):
+    LEASE_KEY_PREFIX = 'shard-'
+    LEASE_TIMEOUT = 60
+    CHECKPOINT_INTERVAL = 10
+    REBALANCE_INTERVAL = 30
+    METRICS_INTERVAL = 60
+    MIN_GET_RECORDS_INTERVAL = 0.2  # kinesis allows 5 reads/sec/shard
+    MAX_BACKOFF = 10
+
+    class METRICS(object):
+        RECORDS = 'WorkerRecords'
+        BATCHES = 'WorkerBatches'
+        ERRORS = 'WorkerErrors'
+        SHARDS = 'WorkerShards'
+        MILLIS_BEHIND_LATEST = 'WorkerMillisBehindLatest'
+
+
 ################################################################################
 # AWS Related
 ################################################################################
@@ -168,7 +374,9 @@ class AWS(object):
     KINESIS = 'kinesis'
     DYNAMODB = 'dynamodb'
     DYNAMODB_STREAM = 'dynamodb_stream'
+    DYNAMODB_STREAMS = 'dynamodbstreams'
     DYNAMODB_RETRY = 'dynamodb_retry'
+    DYNAMODB_SCHEDULE = 'dynamodb_schedule'
     MEMCACHE = 'memcache'
     ELASTICACHE = 'elasticache'
     CLOUDWATCH = 'cloudwatch'
@@ -217,6 +425,23 @@ class AWS_CLOUDWATCH(object):
     Timestamp = 'Timestamp'
     Value = 'Value'
     Name = 'Name'
+    Unit = 'Unit'
+    StatisticValues = 'StatisticValues'
+    SampleCount = 'SampleCount'
+    Sum = 'Sum'
+    Minimum = 'Minimum'
+    Maximum = 'Maximum'
+    MILLISECONDS = 'Milliseconds'
+    COUNT = 'Count'
+    MAX_METRIC_DATA = 20
+
+    class EMF(object):
+        AWS = '_aws'
+        Timestamp = 'Timestamp'
+        CloudWatchMetrics = 'CloudWatchMetrics'
+        Namespace = 'Namespace'
+        Dimensions = 'Dimensions'
+        Metrics = 'Metrics'
 
 
 class AWS_KINESIS(object):
@@ -225,9 +450,14 @@ class AWS_KINESIS(object):
     class RECORD(object):
         Data = 'Data'
         PartitionKey = 'PartitionKey'
+        ExplicitHashKey = 'ExplicitHashKey'
         SequenceNumber = 'SequenceNumber'
+        ErrorCode = 'ErrorCode'
 
     AT_SEQUENCE_NUMBER = 'AT_SEQUENCE_NUMBER'
+    AFTER_SEQUENCE_NUMBER = 'AFTER_SEQUENCE_NUMBER'
+    TRIM_HORIZON = 'TRIM_HORIZON'
+    ProvisionedThroughputExceededException = 'ProvisionedThroughputExceededException'
     ShardIterator = 'ShardIterator'
     NextShardIterator = 'NextShardIterator'
     LATEST = 'LATEST'
@@ -237,6 +467,15 @@ class AWS_KINESIS(object):
 
     class STREAM(object):
         Shards = 'Shards'
+        HasMoreShards = 'HasMoreShards'
+
+    class SHARD(object):
+        ShardId = 'ShardId'
+        HashKeyRange = 'HashKeyRange'
+        StartingHashKey = 'StartingHashKey'
+        EndingHashKey = 'EndingHashKey'
+        SequenceNumberRange = 'SequenceNumberRange'
+        EndingSequenceNumber = 'EndingSequenceNumber'
 
 
 class AWS_SNS(object):
@@ -251,6 +490,7 @@ class AWS_SNS(object):
 class AWS_SQS(object):
     Messages = 'Messages'
     QueueUrl = 'QueueUrl'
+    Failed = 'Failed'
 
     class MESSAGE(object):
         MessageBody = 'MessageBody'
@@ -273,6 +513,7 @@ class AWS_DYNAMODB(object):
     EQUAL = 'EQ'
     LESS_THAN = 'LT'
     GREATER_THAN = 'GT'
+    GREATER_THAN_OR_EQUAL = 'GE'
     KeyType = 'KeyType'
     KeySchema = 'KeySchema'
     HASH = 'HASH'
@@ -287,7 +528,21 @@ class AWS_DYNAMODB(object):
     AttributeValueList = 'AttributeValueList'
     Items = 'Items'
     Item = 'Item'
+    LastEvaluatedKey = 'LastEvaluatedKey'
+    LastEvaluatedShardId = 'LastEvaluatedShardId'
+    Table = 'Table'
+    LatestStreamArn = 'LatestStreamArn'
+    StreamSpecification = 'StreamSpecification'
+    StreamEnabled = 'StreamEnabled'
+    StreamViewType = 'StreamViewType'
+    NEW_IMAGE = 'NEW_IMAGE'
     PutRequest = 'PutRequest'
+    DeleteRequest = 'DeleteRequest'
+    Key = 'Key'
+    ExclusiveStartKey = 'ExclusiveStartKey'
+    UnprocessedItems = 'UnprocessedItems'
+    TimeToLiveSpecification = 'TimeToLiveSpecification'
+    Enabled = 'Enabled'
 
 
 class AWS_LAMBDA(object):
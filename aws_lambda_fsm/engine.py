@@ -0,0 +1,142 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# system imports
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from threading import RLock
+import logging
+
+# library imports
+
+# application imports
+from aws_lambda_fsm.constants import PAYLOAD
+from aws_lambda_fsm.constants import SYSTEM_CONTEXT
+from aws_lambda_fsm.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+class Object(object):
+    pass
+
+_local = Object()
+_local.pool = None
+_local.pool_size = 0
+_local.map_pool = None
+_local.map_pool_size = 0
+_lock = RLock()
+
+
+def get_concurrency():
+    """
+    Returns the number of machines to dispatch concurrently in a single process.
+
+    :return: an int.
+    """
+    return max(1, int(getattr(settings, 'DISPATCH_CONCURRENCY', 1)))
+
+
+def get_correlation_id(payload):
+    """
+    Returns the correlation_id of a payload, which is used to keep the events
+    for a single machine in order.
+
+    :param payload: a dict like {"system_context": {...}, "user_context": {...}}, or None.
+    :return: a str correlation_id, or None.
+    """
+    try:
+        return payload[PAYLOAD.SYSTEM_CONTEXT][SYSTEM_CONTEXT.CORRELATION_ID]
+    except (KeyError, TypeError):
+        return None
+
+
+def get_map_concurrency():
+    """
+    Returns the number of chunks to process concurrently in a map action.
+
+    :return: an int.
+    """
+    return max(1, int(getattr(settings, 'MAP_CONCURRENCY', 1)))
+
+
+def _get_pool(size, name='pool'):
+    """
+    Returns a (cached) thread pool. The pool is kept around between invocations,
+    since AWS Lambda and long-running workers re-use the same process.
+
+    :param size: an int number of threads.
+    :param name: a str name for the pool.
+    :return: a multiprocessing.pool.ThreadPool instance.
+    """
+    with _lock:
+        if getattr(_local, name + '_size') < size:
+            if getattr(_local, name):
+                getattr(_local, name).close()
+            setattr(_local, name, ThreadPool(size))
+            setattr(_local, name + '_size', size)
+        return getattr(_local, name)
+
+
+def run_concurrently(items, process, key, concurrency=None):
+    """
+    Runs process(item) for every item, interleaving the lease/cache/stream I/O
+    of different machines on a pool of threads. Items with the same key are
+    processed serially, and in order, by a single thread, so the events for a
+    single machine are never dispatched out of order.
+
+    process is expected to handle its own errors (the handlers log and gobble
+    them, and rely on the fsm retry code).
+
+    :param items: a list of items.
+    :param process: a function accepting a single item.
+    :param key: a function accepting a single item, returning a hashable key.
+    :param concurrency: an int max number of concurrent threads.
+    """
+    concurrency = concurrency or get_concurrency()
+
+    # the default is identical to the original serial loop
+    if concurrency <= 1 or len(items) <= 1:
+        for item in items:
+            process(item)
+        return
+
+    lanes = OrderedDict()
+    for item in items:
+        lanes.setdefault(key(item), []).append(item)
+
+    def run_lane(lane):
+        for item in lane:
+            process(item)
+
+    logger.info('Processing %d items in %d lanes with concurrency %d...', len(items), len(lanes), concurrency)
+    _get_pool(concurrency).map(run_lane, lanes.values(), chunksize=1)
+
+
+def map_concurrently(items, process, concurrency=None):
+    """
+    Returns [process(item) for item in items], running on a pool of threads. The
+    pool is separate from the run_concurrently pool, so actions dispatched on
+    that pool can use it without waiting on their own threads.
+
+    :param items: a list of items.
+    :param process: a function accepting a single item.
+    :param concurrency: an int max number of concurrent threads.
+    :return: a list of results, in the same order as the items.
+    """
+    concurrency = concurrency or get_map_concurrency()
+    if concurrency <= 1 or len(items) <= 1:
+        return [process(item) for item in items]
+    return _get_pool(concurrency, name='map_pool').map(process, items, chunksize=1)
@@ -14,7 +14,6 @@
 
 # system imports
 import json
-import importlib
 from threading import RLock
 import uuid
 import logging
@@ -25,6 +24,7 @@ import random
 from botocore.exceptions import ClientError
 
 # application imports
+from aws_lambda_fsm.action import LazyAction
 from aws_lambda_fsm.state import State
 from aws_lambda_fsm.transition import Transition
 from aws_lambda_fsm.config import get_current_configuration
@@ -37,6 +37,19 @@ from aws_lambda_fsm.aws import get_message_dispatched
 from aws_lambda_fsm.aws import increment_error_counters
 from aws_lambda_fsm.aws import acquire_lease
 from aws_lambda_fsm.aws import release_lease
+from aws_lambda_fsm.aws import get_source
+from aws_lambda_fsm.aws import get_sources
+from aws_lambda_fsm.aws import get_stream_source
+from aws_lambda_fsm.aws import get_primary_schedule_source
+from aws_lambda_fsm.aws import schedule_event
+from aws_lambda_fsm.circuit import get_circuit_breaker
+from aws_lambda_fsm.snapshot import put_snapshot
+from aws_lambda_fsm.snapshot import get_user_context
+from aws_lambda_fsm.snapshot import get_user_context_delta
+from aws_lambda_fsm.instrumentation import timed
+from aws_lambda_fsm.tracing import start_span
+from aws_lambda_fsm.tracing import finish_span
+from aws_lambda_fsm.tracing import traced
 from aws_lambda_fsm.constants import MACHINE
 from aws_lambda_fsm.constants import CONFIG
 from aws_lambda_fsm.constants import STATE
@@ -45,6 +58,9 @@ from aws_lambda_fsm.constants import SYSTEM_CONTEXT
 from aws_lambda_fsm.constants import PAYLOAD
 from aws_lambda_fsm.constants import AWS
 from aws_lambda_fsm.constants import ERRORS
+from aws_lambda_fsm.constants import PHASE
+from aws_lambda_fsm.constants import SPAN
+from aws_lambda_fsm.constants import SOURCE
 
 
 class Object(object):
@@ -54,6 +70,7 @@ class Object(object):
 _local = Object()
 _lock = RLock()
 _local.machines = None
+_local.machine_dicts = None
 
 logger = logging.getLogger(__name__)
 
@@ -65,7 +82,9 @@ class FSM(object):
 
     def __init__(self, config_dict=None):
         """
-        Constructs the factory and initializes the State/Transition caches.
+        Constructs the factory and indexes the machine definitions by name. The
+        State/Transition caches for a machine are only built when the machine is
+        first used.
 
         :param config_dict: a dict as returned by aws_lambda_fsm.config.get_current_configuration
         """
@@ -73,20 +92,22 @@ class FSM(object):
         if not reload_machines:
             config_dict = get_current_configuration()
         with _lock:
-            if _local.machines is None or reload_machines:
-                self.machines = None
+            if _local.machine_dicts is None or reload_machines:
+                self.machines = {}
+                self.machine_dicts = {}
                 self._init_(config_dict=config_dict)
                 _local.machines = self.machines
+                _local.machine_dicts = self.machine_dicts
             else:
                 self.machines = _local.machines
+                self.machine_dicts = _local.machine_dicts
 
     def _init_(self, config_dict):
         """
-        Initializes the State/Transition caches.
+        Indexes the machine definitions by name, following imports.
 
         :param config_dict: a dict as returned by aws_lambda_fsm.config.get_current_configuration
         """
-        self.machines = {} if (self.machines is None) else self.machines
         for machine_dict in config_dict[CONFIG.MACHINES]:
 
             if 'import' in machine_dict:
@@ -94,22 +115,73 @@ class FSM(object):
                 self._init_(another_config_dict)
                 continue
 
-            try:
-                # initialize the machine dict
-                machine_name = machine_dict[CONFIG.NAME]
+            # a machine may be defined across several dicts, which are merged in order
+            self.machine_dicts.setdefault(machine_dict[CONFIG.NAME], []).append(machine_dict)
+
+    def get_primary_sources(self, kind):
+        """
+        Returns the primary sources of a kind for all the machines, including the
+        default from the settings, without building the machines.
+
+        :param kind: a str like 'retry' (see aws_lambda_fsm.constants.SOURCE).
+        :return: a sorted list of str ARNs.
+        """
+        arns = set([get_source(kind)])
+        for machine_dicts in self.machine_dicts.values():
+            for machine_dict in machine_dicts:
+                arns.add(((machine_dict.get(CONFIG.SOURCES) or {}).get(kind) or {}).get(SOURCE.PRIMARY))
+        return sorted(arn for arn in arns if arn)
+
+    def get_machine(self, machine_name):
+        """
+        Returns the State/Transition caches for the machine, building them on first use.
+
+        :param machine_name: a str machine name.
+        :return: a dict like {'states': {...}, 'transitions': {...}, 'max_retries': 5}
+        """
+        machine = self.machines.get(machine_name)
+        if machine is None:
+            with _lock:
                 if machine_name not in self.machines:
-                    self.machines[machine_name] = {MACHINE.STATES: {}, MACHINE.TRANSITIONS: {}}
-                    # pseudo-init, pseudo-final
-                    self.machines[machine_name][MACHINE.STATES][STATE.PSEUDO_INIT] = State(STATE.PSEUDO_INIT)
-                    self.machines[machine_name][MACHINE.STATES][STATE.PSEUDO_FINAL] = State(STATE.PSEUDO_FINAL)
+                    self._build_machine(machine_name)
+                machine = self.machines[machine_name]
+        return machine
+
+    def _build_machine(self, machine_name):
+        """
+        Builds the State/Transition caches for a single machine.
+
+        :param machine_name: a str machine name.
+        """
+        machine = {MACHINE.STATES: {}, MACHINE.TRANSITIONS: {}}
+
+        # pseudo-init, pseudo-final
+        pseudo_init = machine[MACHINE.STATES][STATE.PSEUDO_INIT] = State(STATE.PSEUDO_INIT)
+        pseudo_final = machine[MACHINE.STATES][STATE.PSEUDO_FINAL] = State(STATE.PSEUDO_FINAL)
+
+        overrides = {}
+        for machine_dict in self.machine_dicts[machine_name]:
 
+            try:
                 # set the max-retries
-                self.machines[machine_name][MACHINE.MAX_RETRIES] = \
+                machine[MACHINE.MAX_RETRIES] = \
                     int(machine_dict.get(CONFIG.MAX_RETRIES, CONFIG.DEFAULT_MAX_RETRIES))
 
-                # fetch these for use later
-                pseudo_init = self.machines[machine_name][MACHINE.STATES][STATE.PSEUDO_INIT]
-                pseudo_final = self.machines[machine_name][MACHINE.STATES][STATE.PSEUDO_FINAL]
+                # set the budget for running steps inline (without a round-trip through the stream)
+                machine[MACHINE.INLINE_STEPS] = \
+                    int(machine_dict.get(CONFIG.INLINE_STEPS, CONFIG.DEFAULT_INLINE_STEPS))
+                machine[MACHINE.INLINE_SECONDS] = \
+                    float(machine_dict.get(CONFIG.INLINE_SECONDS, CONFIG.DEFAULT_INLINE_SECONDS))
+
+                # set the number of steps between user context snapshots (0 to send the full context)
+                machine[MACHINE.SNAPSHOT_INTERVAL] = \
+                    int(machine_dict.get(CONFIG.SNAPSHOT_INTERVAL, CONFIG.DEFAULT_SNAPSHOT_INTERVAL))
+
+                # set the stream lane (see settings.STREAM_LANES) for the machine's events
+                machine[MACHINE.STREAM] = machine_dict.get(CONFIG.STREAM, machine.get(MACHINE.STREAM))
+
+                # collect the machine's own stream/retry/checkpoint/cache sources
+                overrides.update(machine_dict.get(CONFIG.SOURCES) or {})
 
                 # iterate over each state, creating a singleton
                 for state_dict in machine_dict[CONFIG.STATES]:
@@ -122,35 +194,47 @@ class FSM(object):
                                   do_action=do_action,
                                   exit_action=exit_action,
                                   initial=state_dict.get(CONFIG.INITIAL),
-                                  final=state_dict.get(CONFIG.FINAL))
-                    self.machines[machine_name][MACHINE.STATES][state_name] = state
+                                  final=state_dict.get(CONFIG.FINAL),
+                                  stream=state_dict.get(CONFIG.STREAM))
+                    machine[MACHINE.STATES][state_name] = state
 
                     # pseudo-transitions
                     if state_dict.get(CONFIG.INITIAL):
-                        self._add_transition(machine_name, pseudo_init, state, STATE.PSEUDO_INIT)
+                        self._add_transition(machine, pseudo_init, state, STATE.PSEUDO_INIT)
                     if state_dict.get(CONFIG.FINAL):
-                        self._add_transition(machine_name, state, pseudo_final, STATE.PSEUDO_FINAL)
+                        self._add_transition(machine, state, pseudo_final, STATE.PSEUDO_FINAL)
 
                 # iterate over each transition, creating a singleton
                 for state_dict in machine_dict[CONFIG.STATES]:
                     state_name = state_dict[CONFIG.NAME]
-                    state = self.machines[machine_name][MACHINE.STATES][state_name]
+                    state = machine[MACHINE.STATES][state_name]
                     for transition_dict in state_dict.get(CONFIG.TRANSITIONS, []):
                         action = self._get_action(transition_dict.get(CONFIG.ACTION))
                         event = transition_dict[CONFIG.EVENT]
                         target_name = transition_dict[CONFIG.TARGET]
-                        target = self.machines[machine_name][MACHINE.STATES][target_name]
-                        self._add_transition(machine_name, state, target, event, action=action)
+                        target = machine[MACHINE.STATES][target_name]
+                        self._add_transition(machine, state, target, event, action=action)
+
+            # actions are only imported when first executed (see LazyAction), so only
+            # invalid numeric settings can fail here
+            except ValueError, e:  # pragma: no cover
+                logger.warning('Problem building machine "%s": %s', machine_name, e)
+                raise KeyError(machine_name)
+
+        # resolve the sources once, rather than on every call to aws
+        machine[MACHINE.SOURCES] = get_sources(overrides)
 
-            except (ImportError, ValueError), e:  # pragma: no cover
-                logger.warning('Problem importing machine "%s": %s', machine_name, e)
-                self.machines.pop(machine_name, None)
+        # precompute the event -> (actions, target) lookups used by State.dispatch
+        for state in machine[MACHINE.STATES].values():
+            state.compile()
 
-    def _add_transition(self, machine_name, source, target, event, action=None):
+        self.machines[machine_name] = machine
+
+    def _add_transition(self, machine, source, target, event, action=None):
         """
         A helper function to and an aws_lambda_fsm.transition.Transition instance to the machine.
 
-        :param machine_name: a str name for the machine.
+        :param machine: a dict of State/Transition caches for the machine.
         :param source: an aws_lambda_fsm.state.State instance.
         :param target: an aws_lambda_fsm.state.State instance.
         :param event: a str event.
@@ -158,22 +242,19 @@ class FSM(object):
         """
         transition_name = source.name + '->' + target.name + ':' + event
         transition = Transition(transition_name, target, action=action)
-        self.machines[machine_name][MACHINE.TRANSITIONS][transition_name] = transition
+        machine[MACHINE.TRANSITIONS][transition_name] = transition
         source.add_transition(transition, event)
 
     def _get_action(self, action_string):
         """
-        A helper function to dynamically import and construct an aws_lambda_fsm.action.Action instance.
+        A helper function to construct an aws_lambda_fsm.action.Action instance. The
+        action's module is not imported until the action is first executed.
 
         :param action_string: a str like 'path.to.ActionClass'
-        :return: an instance of path.to.ActionClass.
+        :return: an aws_lambda_fsm.action.LazyAction proxy for path.to.ActionClass.
         """
         if action_string:
-            parts = action_string.split('.')
-            module_name = '.'.join(parts[0:-1])
-            class_name = parts[-1]
-            module = importlib.import_module(module_name)
-            return getattr(module, class_name)(action_string)
+            return LazyAction(action_string)
 
     def create_FSM_instance(self, machine_name,
                             initial_system_context=None,
@@ -186,13 +267,19 @@ class FSM(object):
         :param initial_state_name: a str state name.
         :return: an aws_lambda_fsm.fsm.Context instance.
         """
-        initial_state = self.machines[machine_name][MACHINE.STATES][initial_state_name]
-        max_retries = self.machines[machine_name][MACHINE.MAX_RETRIES]
+        machine = self.get_machine(machine_name)
+        initial_state = machine[MACHINE.STATES][initial_state_name]
+        max_retries = machine[MACHINE.MAX_RETRIES]
         return Context(machine_name,
                        initial_system_context=initial_system_context,
                        initial_user_context=initial_user_context,
                        initial_state=initial_state,
-                       max_retries=max_retries)
+                       max_retries=max_retries,
+                       inline_steps=machine[MACHINE.INLINE_STEPS],
+                       inline_seconds=machine[MACHINE.INLINE_SECONDS],
+                       snapshot_interval=machine[MACHINE.SNAPSHOT_INTERVAL],
+                       stream=machine[MACHINE.STREAM],
+                       sources=machine[MACHINE.SOURCES])
 
 
 def _run_once_sucessfully(f):
@@ -207,8 +294,11 @@ def _run_once_sucessfully(f):
 
         # abort if these message has already been processed and another event message
         # has already been emitted to drive the state machine forward
-        primary = get_message_dispatched(self.correlation_id, self.steps, primary=True)
-        secondary = get_message_dispatched(self.correlation_id, self.steps, primary=False)
+        with timed(self, PHASE.IDEMPOTENCY):
+            primary = get_message_dispatched(self.correlation_id, self.steps, primary=True,
+                                             sources=self.sources)
+            secondary = get_message_dispatched(self.correlation_id, self.steps, primary=False,
+                                               sources=self.sources)
         dispatched = primary or secondary
 
         if dispatched:
@@ -219,8 +309,11 @@ def _run_once_sucessfully(f):
 
         # once the message is emitted, we want to make sure the current event is never sent again.
         # the approach here is to simply use a cache to set a key like "correlation_id-steps"
-        primary = set_message_dispatched(self.correlation_id, self.steps, self.retries, primary=True)
-        secondary = set_message_dispatched(self.correlation_id, self.steps, self.retries, primary=False)
+        with timed(self, PHASE.IDEMPOTENCY):
+            primary = set_message_dispatched(self.correlation_id, self.steps, self.retries, primary=True,
+                                             sources=self.sources)
+            secondary = set_message_dispatched(self.correlation_id, self.steps, self.retries, primary=False,
+                                               sources=self.sources)
         dispatched = primary and secondary  # 'and' is correct here. it just triggers an alarm.
 
         if not dispatched:
@@ -238,7 +331,12 @@ class Context(dict):
                  initial_system_context=None,
                  initial_user_context=None,
                  initial_state=None,
-                 max_retries=None):
+                 max_retries=None,
+                 inline_steps=CONFIG.DEFAULT_INLINE_STEPS,
+                 inline_seconds=CONFIG.DEFAULT_INLINE_SECONDS,
+                 snapshot_interval=CONFIG.DEFAULT_SNAPSHOT_INTERVAL,
+                 stream=None,
+                 sources=None):
         """
         Construct a state machine instance.
 
@@ -246,6 +344,13 @@ class Context(dict):
         :param initial_system_context: a dict of initial data for the system context.
         :param initial_user_context: a dict of initial data for the context.
         :param initial_state: an aws_lambda_fsm.state.State instance.
+        :param inline_steps: the max number of subsequent steps to execute inline
+          before sending the next event to the stream.
+        :param inline_seconds: the max number of seconds to spend executing steps inline.
+        :param snapshot_interval: the number of steps between snapshots of the user context
+          (see Context.to_delta_payload_dict), or 0 to send the full user context every step.
+        :param stream: an optional str lane name (see settings.STREAM_LANES) for the machine's events.
+        :param sources: an optional dict of the machine's own sources (see aws_lambda_fsm.aws.get_sources).
         """
         # only the current state and transition are stored as attributes
         # every other property is store in the __system_context dictionary
@@ -253,6 +358,13 @@ class Context(dict):
         self.current_state = initial_state
         self.current_transition = None
 
+        # the inline execution budget is configuration, so is not serialized
+        self.inline_steps = inline_steps
+        self.inline_seconds = inline_seconds
+        self.snapshot_interval = snapshot_interval
+        self.stream = stream
+        self.sources = sources
+
         # init the user dict
         if initial_user_context:
             self.update(initial_user_context)
@@ -270,6 +382,9 @@ class Context(dict):
 
         self._errors = {}
 
+        # the id of the span for the step being dispatched (if tracing is enabled)
+        self._span_id = None
+
     # Immutable properties
 
     @property
@@ -286,6 +401,14 @@ class Context(dict):
     def max_retries(self):
         return self.__system_context[SYSTEM_CONTEXT.MAX_RETRIES]
 
+    @property
+    def lane(self):
+        """
+        The lane for the events dispatched to the current state: the state's
+        stream, if set, otherwise the machine's stream.
+        """
+        return getattr(self.current_state, 'stream', None) or self.stream
+
     # Mutable properties
 
     @property
@@ -331,6 +454,26 @@ class Context(dict):
     def lease_primary(self, lease_primary):
         self.__system_context[SYSTEM_CONTEXT.LEASE_PRIMARY] = lease_primary
 
+    # trace_id is shared by all the steps of a machine execution, and parent_span_id
+    # is the span of the step that sent the current event. they are only set if
+    # tracing is enabled.
+
+    @property
+    def trace_id(self):
+        return self.__system_context.get(SYSTEM_CONTEXT.TRACE_ID)
+
+    @trace_id.setter
+    def trace_id(self, trace_id):
+        self.__system_context[SYSTEM_CONTEXT.TRACE_ID] = trace_id
+
+    @property
+    def parent_span_id(self):
+        return self.__system_context.get(SYSTEM_CONTEXT.PARENT_SPAN_ID)
+
+    @parent_span_id.setter
+    def parent_span_id(self, parent_span_id):
+        self.__system_context[SYSTEM_CONTEXT.PARENT_SPAN_ID] = parent_span_id
+
     # Serialization helpers
 
     def system_context(self):
@@ -349,10 +492,59 @@ class Context(dict):
             PAYLOAD.USER_CONTEXT: user_context
         }
 
+    def to_delta_payload_dict(self):
+        """
+        Returns the payload to send to the stream. When the machine has a snapshot_interval,
+        the user context is replaced by the changes since a snapshot stored in the checkpoint
+        source, and a new snapshot is stored every snapshot_interval steps. If the snapshot
+        cannot be stored, the full payload is sent.
+
+        :return: a dict.
+        """
+        payload = self.to_payload_dict()
+        if self.snapshot_interval <= 0:
+            return payload
+
+        system_context = payload[PAYLOAD.SYSTEM_CONTEXT]
+        user_context = payload[PAYLOAD.USER_CONTEXT]
+        snapshot_id = system_context.get(SYSTEM_CONTEXT.SNAPSHOT)
+        try:
+            if snapshot_id is None or \
+                    self.steps - system_context.get(SYSTEM_CONTEXT.SNAPSHOT_STEPS, 0) >= self.snapshot_interval:
+                snapshot_id = uuid.uuid4().hex
+                if not put_snapshot(self.correlation_id, snapshot_id, user_context, sources=self.sources):
+                    raise KeyError(snapshot_id)
+                system_context[SYSTEM_CONTEXT.SNAPSHOT] = snapshot_id
+                system_context[SYSTEM_CONTEXT.SNAPSHOT_STEPS] = self.steps
+            delta, deleted = get_user_context_delta(self.correlation_id, snapshot_id, user_context,
+                                                    sources=self.sources)
+        except KeyError:
+            self._queue_error(ERRORS.SNAPSHOT, 'Unable to use a snapshot. Sending the full context.')
+            system_context.pop(SYSTEM_CONTEXT.SNAPSHOT, None)
+            system_context.pop(SYSTEM_CONTEXT.SNAPSHOT_STEPS, None)
+            return payload
+
+        # the "deleted" key marks the user context as a delta
+        system_context[SYSTEM_CONTEXT.DELETED] = deleted
+        payload[PAYLOAD.USER_CONTEXT] = delta
+        return payload
+
     @staticmethod
     def from_payload_dict(payload):
         user_context = payload[PAYLOAD.USER_CONTEXT]
         system_context = payload[PAYLOAD.SYSTEM_CONTEXT]
+
+        # rebuild the user context from the snapshot (see Context.to_delta_payload_dict)
+        if SYSTEM_CONTEXT.DELETED in system_context:
+            system_context = dict(system_context)
+            deleted = system_context.pop(SYSTEM_CONTEXT.DELETED)
+            machine = FSM().get_machine(system_context[SYSTEM_CONTEXT.MACHINE_NAME])
+            user_context = get_user_context(system_context[SYSTEM_CONTEXT.CORRELATION_ID],
+                                            system_context[SYSTEM_CONTEXT.SNAPSHOT],
+                                            user_context,
+                                            deleted,
+                                            sources=machine[MACHINE.SOURCES])
+
         return FSM().create_FSM_instance(
             system_context[SYSTEM_CONTEXT.MACHINE_NAME],
             initial_user_context=user_context,
@@ -362,6 +554,40 @@ class Context(dict):
 
     # Protected helper methods
 
+    def _call_with_failover(self, breaker, call, message, reraise=False, flag=False):
+        """
+        Calls call(primary=True), then call(primary=False) if the primary source
+        raised or failed. The primary source is skipped while its circuit is open.
+        A call that returns None sent or stored nothing (e.g. no connection), so it
+        fails, and a dead primary opens the circuit too.
+
+        :param breaker: the aws_lambda_fsm.circuit.CircuitBreaker for the primary source.
+        :param call: a function accepting a bool primary.
+        :param message: a str error message, with a %s for the primary flag.
+        :param reraise: if True, re-raise an error from the secondary source.
+        :param flag: if True, call returns a success flag (e.g. for leases and joins),
+          so any falsy return value fails.
+        :return: the first successful return value, or the last return value.
+        """
+        return_value = None
+        for primary in breaker.primaries():
+            try:
+                return_value = call(primary)
+            except ClientError:
+                if primary:
+                    breaker.failed()
+                self._queue_error(ERRORS.ERROR, message % primary, exc_info=True)
+                if not primary and reraise:
+                    raise
+            else:
+                if return_value if flag else return_value is not None:
+                    if primary:
+                        breaker.succeeded()
+                    return return_value
+                if primary:
+                    breaker.failed()
+        return return_value
+
     def _start_retries(self, retry_data, obj, recovering=False):
         """
         Saves the current payload, with modified retry information, to DynamoDB
@@ -374,26 +600,37 @@ class Context(dict):
         retry_system_context = retry_data[PAYLOAD.SYSTEM_CONTEXT]
         serialized = json.dumps(retry_data, sort_keys=True)
 
-        for primary in [True, False]:
-            try:
-                # save the retry entity
-                # https://www.awsarchitectureblog.com/2015/03/backoff.html
-                # "full jitter"
-                cap, base, attempt = 60., 1., retry_system_context[SYSTEM_CONTEXT.RETRIES]
-                sleep = random.uniform(0, min(cap, base * 2 ** attempt))
-                return start_retries(
-                    self,
-                    time.time() + sleep,
-                    serialized,
-                    primary=primary,
-                    recovering=recovering
-                )
-            except ClientError:
-                # log an error to at least expose the error
-                self._queue_error(
-                    ERRORS.ERROR,
-                    'Unable to save last payload for retry (primary=%s).' % primary,
-                    exc_info=True)
+        # https://www.awsarchitectureblog.com/2015/03/backoff.html
+        # "full jitter"
+        cap, base, attempt = 60., 1., retry_system_context[SYSTEM_CONTEXT.RETRIES]
+        sleep = random.uniform(0, min(cap, base * 2 ** attempt))
+
+        # schedule the retry, if a schedule source is configured
+        if not recovering:
+            return_value = self._schedule(retry_system_context.get(SYSTEM_CONTEXT.STEPS, 0), attempt,
+                                          sleep, serialized)
+            if return_value:
+                return return_value
+
+        lane = self.lane
+        if recovering:
+            breaker = get_circuit_breaker(get_stream_source(sources=self.sources, lane=lane))
+        else:
+            breaker = get_circuit_breaker(get_source(SOURCE.RETRY, sources=self.sources))
+        # save the retry entity
+        return self._call_with_failover(
+            breaker,
+            lambda primary: start_retries(
+                self,
+                time.time() + sleep,
+                serialized,
+                primary=primary,
+                recovering=recovering,
+                lane=lane,
+                sources=self.sources
+            ),
+            'Unable to save last payload for retry (primary=%s).'
+        )
 
     def _stop_retries(self, obj):
         """
@@ -407,20 +644,14 @@ class Context(dict):
         # which we want to preserve.
         if obj[OBJ.SOURCE] == AWS.DYNAMODB_RETRY:
 
-            for primary in [True, False]:
-                try:
-                    return stop_retries(
-                        self,
-                        primary=primary
-                    )
-                except ClientError:
-                    # if deleting the entity fails, the entity will be picked up again
-                    # and retried. however, the idempotency code will detect the message
-                    # has been already executed, and nothing terrible will happen.
-                    self._queue_error(
-                        ERRORS.ERROR,
-                        'Unable to terminate retries (primary=%s).' % primary,
-                        exc_info=True)
+            # if deleting the entity fails, the entity will be picked up again
+            # and retried. however, the idempotency code will detect the message
+            # has been already executed, and nothing terrible will happen.
+            return self._call_with_failover(
+                get_circuit_breaker(get_source(SOURCE.RETRY, sources=self.sources)),
+                lambda primary: stop_retries(self, primary=primary, sources=self.sources),
+                'Unable to terminate retries (primary=%s).'
+            )
 
     def _store_checkpoint(self, obj):
         """
@@ -435,49 +666,96 @@ class Context(dict):
         # restart the fsm using the saved state.
         if obj.get(OBJ.SENT):
 
-            for primary in [True, False]:
-                try:
-                    return store_checkpoint(
-                        self,
-                        json.dumps(obj[OBJ.SENT], sort_keys=True,
-                                   default=lambda x: '<skipped>'),
-                        primary=primary
-                    )
-                except ClientError:
-                    # if unable to save the last sent message, then recovery/checkpointing
-                    # will be missing the more recent executed state. recovering may be
-                    # complicated, especially since the last transition has been marked as
-                    # successfully dispatched
-                    self._queue_error(
-                        ERRORS.ERROR,
-                        'Unable to save last sent data (primary=%s).' % primary,
-                        exc_info=True)
-
-    def _send_next_event_for_dispatch(self, serialized, obj, recovering=False):
+            # if unable to save the last sent message, then recovery/checkpointing
+            # will be missing the more recent executed state. recovering may be
+            # complicated, especially since the last transition has been marked as
+            # successfully dispatched
+            sent = json.dumps(obj[OBJ.SENT], sort_keys=True, default=lambda x: '<skipped>')
+            return self._call_with_failover(
+                get_circuit_breaker(get_source(SOURCE.CHECKPOINT, sources=self.sources)),
+                lambda primary: store_checkpoint(self, sent, primary=primary, sources=self.sources),
+                'Unable to save last sent data (primary=%s).'
+            )
+
+    def _schedule(self, steps, retries, delay, serialized):
+        """
+        Schedules a message to be dispatched after a delay, in the primary (then
+        secondary) schedule source. Falls back to the stream/retry sources (by
+        returning None) when no schedule source is configured, or the message
+        could not be scheduled.
+
+        :param steps: the int steps of the message.
+        :param retries: the int retries of the message.
+        :param delay: a float number of seconds.
+        :param serialized: a str serialized message.
+        :return: the return value from aws_lambda_fsm.aws.schedule_event, or None.
+        """
+        source_arn = get_primary_schedule_source()
+        if not source_arn:
+            return
+        run_at = time.time() + delay
+        return self._call_with_failover(
+            get_circuit_breaker(source_arn),
+            lambda primary: schedule_event(self.correlation_id, steps, retries, run_at, serialized, primary=primary),
+            'Unable to schedule event (primary=%s).'
+        )
+
+    def _send_next_event_for_dispatch(self, serialized, obj, recovering=False, lane=None, steps=None):
         """
         Send the next event for dispatch to the primary/secondary stream systems.
 
         :param serialized: a str serialized message.
         :param obj: a dict.
         :param recovering: indicate this dispatch is in an error path
+        :param lane: an optional str lane name (see settings.STREAM_LANES).
+        :param steps: the int steps of the serialized message, which is ahead of
+          this context's steps + 1 after inline steps.
         """
-        for primary in [True, False]:
-            try:
-                return send_next_event_for_dispatch(
-                    self,
-                    serialized,
-                    self.correlation_id,
-                    delay=obj.get(OBJ.DELAY, 0),
-                    primary=primary,
-                    recovering=recovering
-                )
-            except ClientError:
-                self._queue_error(
-                    ERRORS.ERROR,
-                    'Unable to send next event (primary=%s).' % primary,
-                    exc_info=True)
-                if not primary and recovering:
-                    raise
+        # schedule delayed events, if a schedule source is configured
+        delay = obj.get(OBJ.DELAY, 0)
+        if delay and not recovering:
+            return_value = self._schedule(self.steps + 1 if steps is None else steps, 0, delay, serialized)
+            if return_value:
+                return return_value
+
+        if recovering:
+            breaker = get_circuit_breaker(get_source(SOURCE.RETRY, sources=self.sources))
+        else:
+            breaker = get_circuit_breaker(get_stream_source(sources=self.sources, lane=lane))
+        return self._call_with_failover(
+            breaker,
+            lambda primary: send_next_event_for_dispatch(
+                self,
+                serialized,
+                self.correlation_id,
+                delay=delay,
+                primary=primary,
+                recovering=recovering,
+                lane=lane,
+                sources=self.sources
+            ),
+            'Unable to send next event (primary=%s).',
+            reraise=recovering
+        )
+
+    def send_next_event(self, serialized, obj, lane=None, steps=None):
+        """
+        Sends a serialized message for this machine to the stream, failing over to
+        the retry source if the message cannot be sent.
+
+        :param serialized: a str serialized message.
+        :param obj: a dict.
+        :param lane: an optional str lane name (see settings.STREAM_LANES).
+        :param steps: the int steps of the serialized message (default self.steps + 1).
+        :return: the return value from aws_lambda_fsm.aws.send_next_event_for_dispatch.
+        """
+        sent = self._send_next_event_for_dispatch(serialized, obj, lane=lane, steps=steps)
+
+        # things are falling off the rails
+        if not sent:
+            self._queue_error(ERRORS.DISPATCH, 'System error during dispatch. Failover to retry stream.')
+            sent = self._send_next_event_for_dispatch(serialized, obj, recovering=True)
+        return sent
 
     def _queue_error(self, error_name, message, exc_info=None):
         """
@@ -521,35 +799,71 @@ class Context(dict):
         :param obj: a dict.
         """
         # dispatch the event using the user context only
-        next_event = self.current_state.dispatch(self, event, obj)
+        with timed(self, PHASE.ACTION), traced(SPAN.FSM, SPAN.ACTION, {SYSTEM_CONTEXT.CURRENT_EVENT: event}):
+            next_event = self.current_state.dispatch(self, event, obj)
 
         # if there are more events
         if next_event:
 
             # make a full copy
-            ctx = Context.from_payload_dict(self.to_payload_dict())
+            with timed(self, PHASE.SERIALIZATION):
+                ctx = Context.from_payload_dict(self.to_payload_dict())
             ctx.steps += 1
             ctx.retries = 0
             ctx.current_event = next_event
-            serialized = json.dumps(ctx.to_payload_dict(), sort_keys=True)
+            if self._span_id:
+                ctx.parent_span_id = self._span_id
 
-            # dispatch the next event to aws kinesis/dynamodb
-            sent = self._send_next_event_for_dispatch(
-                serialized,
-                obj
-            )
+            # run as many subsequent steps as the budget allows in this invocation
+            if self.inline_steps > 0:
+                ctx = self._dispatch_inline(ctx, obj)
+                if ctx is None:
+                    return
+
+            with timed(self, PHASE.SERIALIZATION):
+                serialized = json.dumps(ctx.to_delta_payload_dict(), sort_keys=True)
 
-            # things are falling off the rails
-            if not sent:
-                self._queue_error(ERRORS.DISPATCH, 'System error during dispatch. Failover to retry stream.')
-                sent = self._send_next_event_for_dispatch(
-                    serialized,
-                    obj,
-                    recovering=True
-                )
+            # dispatch the next event to aws kinesis/dynamodb
+            with timed(self, PHASE.SEND):
+                sent = self.send_next_event(serialized, obj, lane=ctx.lane, steps=ctx.steps)
 
             obj[OBJ.SENT] = sent
 
+    def _dispatch_inline(self, ctx, obj):
+        """
+        Executes subsequent steps of the machine inline, rather than sending each
+        event through the stream and back into another invocation, until the
+        machine finishes, an action requests a delay, or the step/time budget is
+        exhausted.
+
+        All the inline steps execute under the lease and idempotency token of the
+        step that started them. If any inline step raises, the framework retries
+        from that original step (so actions must be idempotent, as usual).
+
+        :param ctx: an aws_lambda_fsm.fsm.Context instance for the next step.
+        :param obj: a dict.
+        :return: an aws_lambda_fsm.fsm.Context instance for the next step to send
+          to the stream, or None if the machine finished.
+        """
+        started_at = time.time()
+        inline_steps = 0
+        while inline_steps < self.inline_steps and \
+                time.time() - started_at < self.inline_seconds and \
+                not obj.get(OBJ.DELAY):
+            with timed(ctx, PHASE.ACTION), \
+                    traced(SPAN.FSM, SPAN.ACTION, {SYSTEM_CONTEXT.CURRENT_EVENT: ctx.current_event,
+                                                   SYSTEM_CONTEXT.STEPS: ctx.steps}):
+                next_event = ctx.current_state.dispatch(ctx, ctx.current_event, obj)
+            inline_steps += 1
+            if not next_event:
+                logger.info('Machine finished after %d inline steps.', inline_steps)
+                return None
+            ctx.steps += 1
+            ctx.retries = 0
+            ctx.current_event = next_event
+        logger.info('Budget exhausted after %d inline steps.', inline_steps)
+        return ctx
+
     def _dispatch(self, event, obj):
         """
         Dispatch an event to the state machine, store checkpointing info, and
@@ -559,8 +873,9 @@ class Context(dict):
         :param obj: a dict.
         """
         self._dispatch_to_current_state(event, obj)
-        self._store_checkpoint(obj)
-        self._stop_retries(obj)
+        with timed(self, PHASE.CHECKPOINT):
+            self._store_checkpoint(obj)
+            self._stop_retries(obj)
 
     def _retry(self, obj):
         """
@@ -572,33 +887,34 @@ class Context(dict):
         """
         logger.exception('Error occurred during FSM.dispatch().')
 
-        # fetch the original payload from the obj in-memory data. we grab the original
-        # payload rather than the current context to avoid passing any vars that were
-        # potentially mutated up to this point.
-        payload = obj[OBJ.PAYLOAD]
-        retry_data = json.loads(payload)
-        retry_system_context = retry_data[PAYLOAD.SYSTEM_CONTEXT]
-        retry_system_context[SYSTEM_CONTEXT.RETRIES] += 1
-
-        # determine how many times this has been retried, and if it has been retried
-        # too many times, then stop it permanently
-        if retry_system_context[SYSTEM_CONTEXT.RETRIES] <= self.max_retries:
-            self._queue_error(ERRORS.RETRY, 'More retries allowed (retry=%d, max=%d). Retrying.' %
-                              (retry_system_context[SYSTEM_CONTEXT.RETRIES], self.max_retries))
-            retried = self._start_retries(retry_data, obj)
-
-            # things are falling off the rails
-            if not retried:
-                self._queue_error(ERRORS.RETRY, 'System error during retry. Failover to event stream.')
-                self._start_retries(retry_data, obj, recovering=True)
-
-        # if there are no more retries available, simply log an error, then delete
-        # the retry entity from dynamodb. it will take human intervention to recover things
-        # at this point.
-        else:
-            self._queue_error(ERRORS.FATAL, 'No more retries allowed (retry=%d, max=%d). Terminating.' %
-                              (retry_system_context[SYSTEM_CONTEXT.RETRIES], self.max_retries))
-            self._stop_retries(obj)
+        with timed(self, PHASE.RETRY):
+            # fetch the original payload from the obj in-memory data. we grab the original
+            # payload rather than the current context to avoid passing any vars that were
+            # potentially mutated up to this point.
+            payload = obj[OBJ.PAYLOAD]
+            retry_data = json.loads(payload)
+            retry_system_context = retry_data[PAYLOAD.SYSTEM_CONTEXT]
+            retry_system_context[SYSTEM_CONTEXT.RETRIES] += 1
+
+            # determine how many times this has been retried, and if it has been retried
+            # too many times, then stop it permanently
+            if retry_system_context[SYSTEM_CONTEXT.RETRIES] <= self.max_retries:
+                self._queue_error(ERRORS.RETRY, 'More retries allowed (retry=%d, max=%d). Retrying.' %
+                                  (retry_system_context[SYSTEM_CONTEXT.RETRIES], self.max_retries))
+                retried = self._start_retries(retry_data, obj)
+
+                # things are falling off the rails
+                if not retried:
+                    self._queue_error(ERRORS.RETRY, 'System error during retry. Failover to event stream.')
+                    self._start_retries(retry_data, obj, recovering=True)
+
+            # if there are no more retries available, simply log an error, then delete
+            # the retry entity from dynamodb. it will take human intervention to recover things
+            # at this point.
+            else:
+                self._queue_error(ERRORS.FATAL, 'No more retries allowed (retry=%d, max=%d). Terminating.' %
+                                  (retry_system_context[SYSTEM_CONTEXT.RETRIES], self.max_retries))
+                self._stop_retries(obj)
 
     def _dispatch_and_retry(self, event, obj):
         """
@@ -674,17 +990,43 @@ class Context(dict):
         """
         fence_token = None
 
+        # start the span for this step. the spans for the actions and backend calls on
+        # this thread are its children, and it is the parent of the next step's span.
+        span = start_span(SPAN.FSM, SPAN.STEP,
+                          attributes={SYSTEM_CONTEXT.MACHINE_NAME: self.name,
+                                      SYSTEM_CONTEXT.CORRELATION_ID: self.correlation_id,
+                                      SYSTEM_CONTEXT.STEPS: self.steps,
+                                      SYSTEM_CONTEXT.RETRIES: self.retries,
+                                      SYSTEM_CONTEXT.CURRENT_STATE: getattr(self.current_state, 'name', None),
+                                      SYSTEM_CONTEXT.CURRENT_EVENT: event},
+                          trace_id=self.trace_id,
+                          parent_span_id=self.parent_span_id)
+        if span:
+            self.trace_id = span.trace_id
+            self._span_id = span.span_id
+
         try:
             # attempt to acquire the lease and execute the state transition
-            fence_token = acquire_lease(self.correlation_id, self.steps, self.retries,
-                                        primary=self.lease_primary)
+            with timed(self, PHASE.LEASE):
+                # go straight to the secondary cache while the primary cache is down
+                breaker = get_circuit_breaker(get_source(SOURCE.CACHE, sources=self.sources))
+                if self.lease_primary and not breaker.allow():
+                    self.lease_primary = False
 
-            # 0 indicates system error, False indicates lease acquisition failure
-            if fence_token == 0:
-                self._queue_error(ERRORS.CACHE, 'System error acquiring primary=%s lease.' % self.lease_primary)
-                self.lease_primary = not self.lease_primary
                 fence_token = acquire_lease(self.correlation_id, self.steps, self.retries,
-                                            primary=self.lease_primary)
+                                            primary=self.lease_primary, sources=self.sources)
+                if self.lease_primary:
+                    if fence_token == 0:
+                        breaker.failed()
+                    else:
+                        breaker.succeeded()
+
+                # 0 indicates system error, False indicates lease acquisition failure
+                if fence_token == 0:
+                    self._queue_error(ERRORS.CACHE, 'System error acquiring primary=%s lease.' % self.lease_primary)
+                    self.lease_primary = not self.lease_primary
+                    fence_token = acquire_lease(self.correlation_id, self.steps, self.retries,
+                                                primary=self.lease_primary, sources=self.sources)
 
             if not fence_token:
                 # could not get the lease. something is going wrong
@@ -752,10 +1094,15 @@ class Context(dict):
                 self._dispatch_and_retry(event, obj)
 
         finally:
-            released = release_lease(self.correlation_id, self.steps, self.retries, fence_token,
-                                     primary=self.lease_primary)
+            with timed(self, PHASE.LEASE):
+                released = release_lease(self.correlation_id, self.steps, self.retries, fence_token,
+                                         primary=self.lease_primary, sources=self.sources)
             if not released:
                 self._queue_error(ERRORS.CACHE, 'Could not release lease.')
+            if span:
+                finish_span(span,
+                            outcome=','.join(sorted(self._errors)) or SPAN.OK,
+                            payload_size=len((obj or {}).get(OBJ.PAYLOAD) or ''))
 
     def initialize(self):
         """
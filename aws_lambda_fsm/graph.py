@@ -0,0 +1,138 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# system imports
+from collections import OrderedDict
+
+# library imports
+
+# application imports
+from aws_lambda_fsm.config import get_current_configuration
+from aws_lambda_fsm.constants import CONFIG
+from aws_lambda_fsm.constants import MAP_DATA
+
+
+class TransitionNode(object):
+    """
+    A transition between two states in a MachineGraph.
+    """
+
+    def __init__(self, transition_dict):
+        """
+        :param transition_dict: a dict with transition info from fsm.yaml.
+        """
+        self.event = transition_dict[CONFIG.EVENT]
+        self.target = transition_dict[CONFIG.TARGET]
+        self.action = transition_dict.get(CONFIG.ACTION)
+
+
+class StateNode(object):
+    """
+    A state in a MachineGraph. Unlike aws_lambda_fsm.state.State, no actions
+    are imported, so the graph can be built without the deployed code.
+    """
+
+    def __init__(self, state_dict, machine_dict):
+        """
+        :param state_dict: a dict with state info from fsm.yaml.
+        :param machine_dict: a dict with machine info from fsm.yaml.
+        """
+        self.name = state_dict[CONFIG.NAME]
+        self.initial = bool(state_dict.get(CONFIG.INITIAL))
+        self.final = bool(state_dict.get(CONFIG.FINAL))
+        self.entry_action = state_dict.get(CONFIG.ENTRY_ACTION)
+        self.do_action = state_dict.get(CONFIG.DO_ACTION)
+        self.exit_action = state_dict.get(CONFIG.EXIT_ACTION)
+        self.transitions = [TransitionNode(transition_dict)
+                            for transition_dict in state_dict.get(CONFIG.TRANSITIONS, [])]
+
+        # retries default to the machine settings
+        self.max_retries = int(state_dict.get(CONFIG.MAX_RETRIES,
+                                              machine_dict.get(CONFIG.MAX_RETRIES, CONFIG.DEFAULT_MAX_RETRIES)))
+        self.retry_interval = int(state_dict.get(CONFIG.RETRY_INTERVAL, CONFIG.DEFAULT_RETRY_INTERVAL))
+        self.retry_backoff = float(state_dict.get(CONFIG.RETRY_BACKOFF, CONFIG.DEFAULT_RETRY_BACKOFF))
+
+        # map/parallel states run other machines as a group
+        map_dict = state_dict.get(CONFIG.MAP) or {}
+        self.map_machine = map_dict.get(CONFIG.MACHINE)
+        self.map_items = map_dict.get(CONFIG.ITEMS, MAP_DATA.ITEMS)
+        self.map_concurrency = int(map_dict.get(CONFIG.MAX_CONCURRENCY, 0))
+        self.parallel_machines = list(state_dict.get(CONFIG.PARALLEL) or [])
+
+    @property
+    def next_transition(self):
+        """
+        Returns the only transition out of this state, when there is exactly one,
+        since the next state is then known without inspecting the event.
+
+        :return: a TransitionNode instance, or None.
+        """
+        return self.transitions[0] if len(self.transitions) == 1 else None
+
+    @property
+    def children(self):
+        """
+        Returns the names of the machines run by this state.
+
+        :return: a list of str machine names.
+        """
+        return ([self.map_machine] if self.map_machine else []) + self.parallel_machines
+
+
+class MachineGraph(object):
+    """
+    The states and transitions of a single machine from fsm.yaml. Used by
+    the tools that convert fsm.yaml into other formats.
+    """
+
+    def __init__(self, machine_dict):
+        """
+        :param machine_dict: a dict with machine info from fsm.yaml.
+        """
+        self.name = machine_dict[CONFIG.NAME]
+        self.inline_steps = int(machine_dict.get(CONFIG.INLINE_STEPS, CONFIG.DEFAULT_INLINE_STEPS))
+        self.states = OrderedDict()
+        self.initial_state = None
+        for state_dict in machine_dict.get(CONFIG.STATES, []):
+            state = StateNode(state_dict, machine_dict)
+            self.states[state.name] = state
+            if state.initial:
+                self.initial_state = state
+
+    @property
+    def children(self):
+        """
+        Returns the names of the machines run by map/parallel states.
+
+        :return: a list of str machine names.
+        """
+        return [name for state in self.states.values() for name in state.children]
+
+
+def get_machine_graphs(filename='fsm.yaml'):
+    """
+    Returns a MachineGraph for every machine in the .yaml hierarchy. When a
+    machine name appears more than once, the first one found is used.
+
+    :param filename: a path to a fsm.yaml file.
+    :return: an OrderedDict of {str machine name: MachineGraph}.
+    """
+    graphs = OrderedDict()
+    for machine_dict in get_current_configuration(filename=filename)[CONFIG.MACHINES]:
+        if CONFIG.IMPORT in machine_dict:
+            for name, graph in get_machine_graphs(filename=machine_dict[CONFIG.IMPORT]).items():
+                graphs.setdefault(name, graph)
+            continue
+        graphs.setdefault(machine_dict[CONFIG.NAME], MachineGraph(machine_dict))
+    return graphs
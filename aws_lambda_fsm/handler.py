@@ -13,6 +13,7 @@
 # limitations under the License.
 
 # system imports
+from copy import deepcopy
 import base64
 import json
 import logging
@@ -20,19 +21,34 @@ import time
 
 # application imports
 from aws_lambda_fsm.fsm import Context
-from aws_lambda_fsm.fsm import FSM  # noqa
+from aws_lambda_fsm.fsm import FSM
 from aws_lambda_fsm.aws import retriable_entities
-from aws_lambda_fsm.aws import get_primary_retry_source
+from aws_lambda_fsm.aws import get_primary_schedule_source
+from aws_lambda_fsm.aws import get_secondary_schedule_source
+from aws_lambda_fsm.aws import scheduled_events
+from aws_lambda_fsm.aws import finish_scheduled_events
 from aws_lambda_fsm.aws import validate_config
+from aws_lambda_fsm.aws import flush_metrics
 from aws_lambda_fsm.constants import OBJ
 from aws_lambda_fsm.constants import STATE
 from aws_lambda_fsm.constants import AWS_LAMBDA
 from aws_lambda_fsm.constants import SYSTEM_CONTEXT
 from aws_lambda_fsm.constants import RETRY_DATA
+from aws_lambda_fsm.constants import SCHEDULE_DATA
+from aws_lambda_fsm.constants import SOURCE
 from aws_lambda_fsm.constants import AWS
 from aws_lambda_fsm.constants import STREAM_DATA
 from aws_lambda_fsm.constants import AWS_DYNAMODB
+from aws_lambda_fsm.constants import PAYLOAD
+from aws_lambda_fsm.constants import STEP_FUNCTION_DATA
 from aws_lambda_fsm.config import get_settings
+from aws_lambda_fsm.engine import run_concurrently
+from aws_lambda_fsm.engine import get_correlation_id
+from aws_lambda_fsm.snapshot import SnapshotNotFound
+from aws_lambda_fsm.snapshot import apply_delta
+from aws_lambda_fsm.snapshot import get_delta
+from aws_lambda_fsm.instrumentation import flush_instrumentation
+from aws_lambda_fsm.tracing import flush_spans
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
@@ -40,15 +56,27 @@ logger = logging.getLogger(__name__)
 validate_config()
 
 
-def _process_payload(payload_str, obj):
+def _flush_telemetry():
+    """
+    Internal function to publish the timings, error counters and trace spans
+    buffered while handling an invocation, in as few calls as possible.
+    """
+    flush_instrumentation()
+    flush_metrics()
+    flush_spans()
+
+
+def _process_payload(payload_str, obj, payload=None):
     """
     Internal function to turn a json fsm payload (from an AWS Lambda event),
     into an fsm Context, and then dispatch the event and execute user code.
 
     :param payload_str: a json string like '{"serialized": "data"}'
     :param obj: a dict to pass to fsm Context.dispatch(...)
+    :param payload: an optional dict, payload_str already parsed.
     """
-    payload = json.loads(payload_str)
+    if payload is None:
+        payload = json.loads(payload_str)
     obj[OBJ.PAYLOAD] = payload_str
     fsm = Context.from_payload_dict(payload)
     logger.info('system_context=%s', fsm.system_context())
@@ -57,34 +85,164 @@ def _process_payload(payload_str, obj):
     fsm.dispatch(current_event, obj)
 
 
-def _process_payload_step(payload_str, obj):
+def _get_target_name(fsm, event):
     """
-    Internal function to turn a json fsm payload (from an AWS Lambda event),
+    Internal function to find the state an event moves the machine to.
+
+    :param fsm: an aws_lambda_fsm.fsm.Context instance.
+    :param event: a str event.
+    :return: a str state name, or None if the event is unknown (the next task
+      reports the unknown event).
+    """
+    try:
+        return fsm.current_state.get_transition(event).target.name
+    except KeyError:
+        return None
+
+
+def _dispatch_step(fsm, obj, inline=False, stop_states=()):
+    """
+    Internal function to dispatch the current event and, if inline, as many
+    subsequent events as the machine's inline_steps/inline_seconds budget
+    allows. Inline execution stops before entering any of the stop_states,
+    since those are run by AWS Step Functions itself (map/parallel states).
+
+    :param fsm: an aws_lambda_fsm.fsm.Context instance.
+    :param obj: a dict to pass to the actions.
+    :param inline: a bool, True to execute subsequent steps inline.
+    :param stop_states: a list of str state names.
+    :return: a str event, or None if the machine finished.
+    """
+    started_at = time.time()
+    current_event = fsm.system_context().get(SYSTEM_CONTEXT.CURRENT_EVENT, STATE.PSEUDO_INIT)
+    steps = 0
+    while True:
+        next_event = fsm.current_state.dispatch(fsm, current_event, obj)
+        steps += 1
+        if not next_event or not inline or steps > fsm.inline_steps or \
+                time.time() - started_at >= fsm.inline_seconds or obj.get(OBJ.DELAY):
+            return next_event
+        target_name = _get_target_name(fsm, next_event)
+        if target_name is None or target_name in stop_states:
+            return next_event
+        fsm.current_event = current_event = next_event
+
+
+def _process_payload_step(payload, obj, delta=False, inline=False, stop_states=()):
+    """
+    Internal function to turn a fsm payload (from an AWS Lambda event),
     into an fsm Context, and then dispatch the event and execute user code.
 
     This function is ONLY used in the AWS Step Function execution path.
 
-    :param payload_str: a json string like '{"serialized": "data"}'
+    If the payload has the delta returned by the previous task (see below),
+    it is applied to the user context first.
+
+    :param payload: a dict like {"system_context": {...}, "user_context": {...}}
     :param obj: a dict to pass to fsm Context.dispatch(...)
+    :param delta: a bool, True to return only the system context, the changed
+      user context keys and the deleted user context keys, which the task stores
+      under "delta" (via ResultPath), rather than the full payload.
+    :param inline: a bool, True to execute subsequent steps inline.
+    :param stop_states: a list of str (map/parallel) state names. Inline execution
+      stops before them, and the delta returned before them has the whole user
+      context, since they read the user context directly.
+    :return: a dict payload (or delta), or None if the machine finished.
     """
-    payload = json.loads(payload_str)
-    obj[OBJ.PAYLOAD] = payload_str
+    base = payload[PAYLOAD.USER_CONTEXT]
+    previous = payload.get(STEP_FUNCTION_DATA.DELTA)
+    if previous:
+        user_context = apply_delta(dict(base), previous[PAYLOAD.USER_CONTEXT],
+                                   previous.get(STEP_FUNCTION_DATA.DELETED, ()))
+        payload = {
+            PAYLOAD.SYSTEM_CONTEXT: previous[PAYLOAD.SYSTEM_CONTEXT],
+            PAYLOAD.USER_CONTEXT: user_context
+        }
+    obj[OBJ.PAYLOAD] = json.dumps(payload)
+    if delta:
+        base = deepcopy(base)  # actions may change nested values in place
+
     fsm = Context.from_payload_dict(payload)
     logger.info('system_context=%s', fsm.system_context())
     logger.info('user_context.keys()=%s', fsm.user_context().keys())
-    current_event = fsm.system_context().get(SYSTEM_CONTEXT.CURRENT_EVENT, STATE.PSEUDO_INIT)
 
     # all retries etc. are handled by AWS Step Function infrastructure
     # so this an entirely stripped down dispatch running ONLY the user
     # Actions, and NONE of the framework's retry etc. code.
-    next_event = fsm.current_state.dispatch(fsm, current_event, obj)
+    next_event = _dispatch_step(fsm, obj, inline=inline, stop_states=stop_states)
     if next_event:
         fsm.current_event = next_event
         data = fsm.to_payload_dict()
+        if delta:
+            changed, deleted = get_delta(base, data[PAYLOAD.USER_CONTEXT])
+            if _get_target_name(fsm, next_event) in stop_states:
+                changed = data[PAYLOAD.USER_CONTEXT]
+            return {
+                PAYLOAD.SYSTEM_CONTEXT: data[PAYLOAD.SYSTEM_CONTEXT],
+                PAYLOAD.USER_CONTEXT: changed,
+                STEP_FUNCTION_DATA.DELETED: deleted
+            }
         data[AWS.STEP_FUNCTION] = True
         return data
 
 
+def _parse_payload(payload_str):
+    """
+    Internal function to parse a json fsm payload.
+
+    :param payload_str: a json string like '{"serialized": "data"}'
+    :return: a dict, or None if payload_str is not a valid payload (the
+      error is then reported when the payload is processed).
+    """
+    try:
+        payload = json.loads(payload_str)
+    except (TypeError, ValueError):
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+def _process_payloads(items, description, redeliver=True):
+    """
+    Internal function to dispatch a batch of payloads, concurrently if
+    settings.DISPATCH_CONCURRENCY is greater than 1. Each payload is parsed
+    once, up front, since the correlation_id is needed to keep the events
+    for a single machine in order.
+
+    :param items: a list of (payload_str, obj, entity) tuples.
+    :param description: a str like "record" used in the error logging.
+    :param redeliver: a bool, True to raise an exception once the batch has been processed
+      if any payload refers to a snapshot that could not be loaded, so AWS Lambda redelivers
+      the batch. The payloads that were dispatched are ignored by the idempotency code.
+    :return: a list of the entities that refer to a snapshot that could not be loaded.
+    """
+    items = [(payload_str, _parse_payload(payload_str), obj, entity) for payload_str, obj, entity in items]
+    unavailable = []
+
+    def process(item):
+        payload_str, payload, obj, entity = item
+        try:
+            _process_payload(payload_str, obj, payload=payload)
+
+        # the user context can not be rebuilt without the snapshot, so acking the
+        # payload would lose the event. it is left to be delivered again instead.
+        except SnapshotNotFound:
+            logger.exception('Snapshot unavailable handling %s: %%s' % description, entity)
+            unavailable.append(entity)
+
+        # in batch mode, we don't want a single error to cause the the entire batch
+        # to retry. for that reason, we have opted to gobble all the errors here
+        # and handle retries withing the fsm dispatch code.
+        except Exception:
+            logger.exception('Critical error handling %s: %%s' % description, entity)
+
+    run_concurrently(items, process, key=lambda item: get_correlation_id(item[1]))
+    _flush_telemetry()
+
+    if unavailable and redeliver:
+        raise Exception('Unable to load %d snapshots.' % len(unavailable))
+    return unavailable
+
+
 def lambda_api_handler(lambda_event):
     """
     AWS Lambda handler for executing state machines.
@@ -96,12 +254,20 @@ def lambda_api_handler(lambda_event):
         payload = json.dumps(lambda_event)  # API Gateway just passes straight though
         _process_payload(payload, obj)
 
+    # the event is lost unless the caller sends it again
+    except SnapshotNotFound:
+        logger.exception('Snapshot unavailable handling lambda: %s', lambda_event)
+        _flush_telemetry()
+        raise
+
     # in batch mode, we don't want a single error to cause the the entire batch
     # to retry. for that reason, we have opted to gobble all the errors here
     # and handle retries withing the fsm dispatch code.
     except Exception:
         logger.exception('Critical error handling lambda: %s', lambda_event)
 
+    _flush_telemetry()
+
 
 def lambda_step_handler(lambda_event):
     """
@@ -111,8 +277,19 @@ def lambda_step_handler(lambda_event):
     :return: a dict event to pass along to AWS Step Functions orchestration
     """
     obj = {OBJ.SOURCE: AWS.STEP_FUNCTION}
-    payload = json.dumps(lambda_event)  # Step Function just passes straight though
-    return _process_payload_step(payload, obj)
+
+    # errors propagate to the AWS Step Functions Retry, but the telemetry is still published
+    try:
+        # tasks with options pass the payload in a "payload" key (see aws_lambda_fsm.step_function)
+        payload = lambda_event.get(STEP_FUNCTION_DATA.PAYLOAD)
+        if payload is None:
+            return _process_payload_step(lambda_event, obj)  # Step Function just passes straight though
+        return _process_payload_step(payload, obj,
+                                     delta=lambda_event.get(STEP_FUNCTION_DATA.DELTA, False),
+                                     inline=lambda_event.get(STEP_FUNCTION_DATA.INLINE, False),
+                                     stop_states=lambda_event.get(STEP_FUNCTION_DATA.STOP_STATES, ()))
+    finally:
+        _flush_telemetry()
 
 
 def lambda_kinesis_handler(lambda_event):
@@ -124,13 +301,14 @@ def lambda_kinesis_handler(lambda_event):
     if lambda_event[AWS_LAMBDA.Records]:
         logger.info('Processing %d records from kinesis...', len(lambda_event[AWS_LAMBDA.Records]))
 
+    items = []
     for record in lambda_event[AWS_LAMBDA.Records]:
 
         try:
             obj = {OBJ.SOURCE: AWS.KINESIS}
             encoded = record[AWS_LAMBDA.KINESIS_RECORD.KINESIS][AWS_LAMBDA.KINESIS_RECORD.DATA]
             payload = base64.b64decode(encoded)
-            _process_payload(payload, obj)
+            items.append((payload, obj, record))
 
         # in batch mode, we don't want a single error to cause the the entire batch
         # to retry. for that reason, we have opted to gobble all the errors here
@@ -138,6 +316,8 @@ def lambda_kinesis_handler(lambda_event):
         except Exception:
             logger.exception('Critical error handling record: %s', record)
 
+    _process_payloads(items, 'record')
+
 
 def lambda_dynamodb_handler(lambda_event):
     """
@@ -148,6 +328,7 @@ def lambda_dynamodb_handler(lambda_event):
     if lambda_event[AWS_LAMBDA.Records]:
         logger.info('Processing %d records from dynamodb updates...', len(lambda_event[AWS_LAMBDA.Records]))
 
+    items = []
     for record in lambda_event[AWS_LAMBDA.Records]:
 
         try:
@@ -155,7 +336,7 @@ def lambda_dynamodb_handler(lambda_event):
             dynamodb = record[AWS_LAMBDA.DYNAMODB_RECORD.DYNAMODB]
             new_image = dynamodb[AWS_LAMBDA.DYNAMODB_RECORD.NewImage]
             payload = new_image[STREAM_DATA.PAYLOAD][AWS_DYNAMODB.STRING]
-            _process_payload(payload, obj)
+            items.append((payload, obj, record))
 
         # in batch mode, we don't want a single error to cause the the entire batch
         # to retry. for that reason, we have opted to gobble all the errors here
@@ -163,6 +344,8 @@ def lambda_dynamodb_handler(lambda_event):
         except Exception:
             logger.exception('Critical error handling record: %s', record)
 
+    _process_payloads(items, 'record')
+
 
 def lambda_sns_handler(lambda_event):
     """
@@ -173,6 +356,7 @@ def lambda_sns_handler(lambda_event):
     if lambda_event[AWS_LAMBDA.Records]:
         logger.info('Processing %d records from sns updates...', len(lambda_event[AWS_LAMBDA.Records]))
 
+    items = []
     for record in lambda_event[AWS_LAMBDA.Records]:
 
         try:
@@ -180,7 +364,7 @@ def lambda_sns_handler(lambda_event):
             sns = record[AWS_LAMBDA.SNS_RECORD.SNS]
             message = sns[AWS_LAMBDA.SNS_RECORD.Message]
             payload = json.loads(message)[AWS_LAMBDA.SNS_RECORD.DEFAULT]
-            _process_payload(payload, obj)
+            items.append((payload, obj, record))
 
         # in batch mode, we don't want a single error to cause the the entire batch
         # to retry. for that reason, we have opted to gobble all the errors here
@@ -188,15 +372,33 @@ def lambda_sns_handler(lambda_event):
         except Exception:
             logger.exception('Critical error handling record: %s', record)
 
+    _process_payloads(items, 'record')
+
 
 def lambda_timer_handler():
     """
     AWS Lambda handler that runs periodically.
     """
+    # machines may have their own retry sources (see fsm.yaml)
+    for retries_table_arn in FSM().get_primary_sources(SOURCE.RETRY):
+        _process_retries(retries_table_arn)
+
+    # events are only scheduled in the secondary schedule source when the primary fails
+    for schedule_table_arn in sorted(set([get_primary_schedule_source(), get_secondary_schedule_source()])):
+        if schedule_table_arn:
+            _process_scheduled_events(schedule_table_arn)
+
+
+def _process_retries(retries_table_arn):
+    """
+    Internal function to dispatch the retries that are due.
+
+    :param retries_table_arn: a str ARN for a DynamoDB table like
+      'arn:partition:dynamodb:region:account:resource'
+    """
     try:
         # TODO: hide these details behind an interface
         # TODO: handle missing dynamodb tables
-        retries_table_arn = get_primary_retry_source()
         index = 'retries'
 
         # get this table name elsewhere...
@@ -214,17 +416,53 @@ def lambda_timer_handler():
     if entities:
         logger.info('Processing %d entities from dynamodb retries...', len(entities))
 
+    items = []
     for entity in entities:
 
         try:
             obj = {OBJ.SOURCE: AWS.DYNAMODB_RETRY}
             payload = entity[RETRY_DATA.PAYLOAD]
-            _process_payload(payload, obj)
+            items.append((payload, obj, entity))
 
         # see comment in lambda_kinesis_handler
         except Exception:
             logger.exception('Critical error handling entity: %s', entity)
 
+    # retry entities are only deleted once dispatched, so are retried by the next timer
+    _process_payloads(items, 'entity', redeliver=False)
+
+
+def _process_scheduled_events(table_arn):
+    """
+    Internal function to dispatch the scheduled events that are due, then
+    delete them and move the cursor past the buckets that were completely read.
+
+    :param table_arn: a str ARN for a DynamoDB table like
+      'arn:partition:dynamodb:region:account:resource'
+    """
+    try:
+        entities, cursor = scheduled_events(table_arn, time.time())
+    except Exception:
+        logger.exception('Error querying scheduled events.')
+        return
+
+    if entities:
+        logger.info('Processing %d entities from dynamodb schedule...', len(entities))
+
+    # the fsm dispatch code handles its own retries (by scheduling a new event)
+    # so every event is deleted once it has been dispatched, successfully or not.
+    # events whose snapshot could not be loaded are not dispatched, so nothing is
+    # deleted and the cursor is not moved, and the next timer reads them again.
+    items = [(entity[SCHEDULE_DATA.PAYLOAD], {OBJ.SOURCE: AWS.DYNAMODB_SCHEDULE}, entity) for entity in entities]
+    if _process_payloads(items, 'entity', redeliver=False):
+        logger.warning('Not finishing scheduled events, since some snapshots were unavailable.')
+        return
+
+    try:
+        finish_scheduled_events(table_arn, entities, cursor)
+    except Exception:
+        logger.exception('Error finishing scheduled events.')
+
 
 def lambda_handler(lambda_event, lambda_context):
     """
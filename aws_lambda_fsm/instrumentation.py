@@ -0,0 +1,232 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# system imports
+from bisect import bisect_left
+from threading import RLock
+import logging
+import time
+
+# library imports
+
+# application imports
+from aws_lambda_fsm.aws import buffer_metric_statistics
+from aws_lambda_fsm.constants import AWS_CLOUDWATCH
+from aws_lambda_fsm.constants import PHASE
+from aws_lambda_fsm.constants import SYSTEM_CONTEXT
+from aws_lambda_fsm.config import get_settings
+from aws_lambda_fsm.config import import_class
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+class Object(object):
+    pass
+
+_local = Object()
+_local.instrumentation = None
+_lock = RLock()
+
+
+class Instrumentation(object):
+    """
+    Receives the time spent in each phase of Context.dispatch. This base class
+    discards everything, and is used when settings.INSTRUMENTATION is not set.
+
+    Subclasses must be thread-safe, since machines may be dispatched concurrently.
+    """
+
+    enabled = False
+
+    def record(self, machine_name, state_name, phase, seconds):
+        """
+        Records the time spent in a single phase.
+
+        :param machine_name: a str machine name.
+        :param state_name: a str state name.
+        :param phase: a str like "lease" (see aws_lambda_fsm.constants.PHASE).
+        :param seconds: a float number of seconds.
+        """
+        pass  # pragma: no cover
+
+    def flush(self):
+        """
+        Publishes (and resets) everything recorded since the last flush.
+        """
+        pass
+
+
+class Histogram(object):
+    """
+    A histogram of durations, with fixed millisecond buckets.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.minimum = None
+        self.maximum = None
+        self.buckets = [0] * (len(PHASE.BUCKETS) + 1)
+
+    def add(self, milliseconds):
+        """
+        Adds a single duration.
+
+        :param milliseconds: a float number of milliseconds.
+        """
+        self.count += 1
+        self.total += milliseconds
+        self.minimum = milliseconds if self.minimum is None else min(self.minimum, milliseconds)
+        self.maximum = milliseconds if self.maximum is None else max(self.maximum, milliseconds)
+        self.buckets[bisect_left(PHASE.BUCKETS, milliseconds)] += 1
+
+    def statistics(self):
+        """
+        Returns the histogram as a CloudWatch statistic set.
+
+        :return: a dict.
+        """
+        return {
+            AWS_CLOUDWATCH.SampleCount: self.count,
+            AWS_CLOUDWATCH.Sum: self.total,
+            AWS_CLOUDWATCH.Minimum: self.minimum,
+            AWS_CLOUDWATCH.Maximum: self.maximum
+        }
+
+    def __repr__(self):
+        bounds = ['<=%d' % bound for bound in PHASE.BUCKETS] + ['>%d' % PHASE.BUCKETS[-1]]
+        buckets = ', '.join('%s: %d' % (bound, n) for bound, n in zip(bounds, self.buckets) if n)
+        return 'Histogram(count=%d, avg=%.1fms, min=%.1fms, max=%.1fms, {%s})' % \
+            (self.count, self.total / self.count, self.minimum, self.maximum, buckets)
+
+
+class HistogramInstrumentation(Instrumentation):
+    """
+    Aggregates a Histogram per (machine, state, phase), and adds them to the
+    metrics buffer as CloudWatch statistic sets when flushed.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.histograms = {}
+        self._lock = RLock()
+
+    def record(self, machine_name, state_name, phase, seconds):
+        key = (machine_name, state_name, phase)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.add(seconds * 1000.)
+
+    def flush(self):
+        with self._lock:
+            histograms, self.histograms = self.histograms, {}
+        if not histograms:
+            return
+        data = []
+        for (machine_name, state_name, phase), histogram in sorted(histograms.items()):
+            logger.info('%s/%s/%s: %s', machine_name, state_name, phase, histogram)
+            dimensions = {
+                SYSTEM_CONTEXT.MACHINE_NAME: machine_name,
+                SYSTEM_CONTEXT.CURRENT_STATE: state_name,
+                PHASE.DIMENSION: phase
+            }
+            data.append((PHASE.METRIC_NAME, dimensions, histogram.statistics()))
+        buffer_metric_statistics(data)
+
+
+def get_instrumentation():
+    """
+    Returns the (cached) instrumentation instance, constructed from the class
+    named in settings.INSTRUMENTATION like
+    'aws_lambda_fsm.instrumentation.HistogramInstrumentation'.
+
+    :return: an aws_lambda_fsm.instrumentation.Instrumentation instance.
+    """
+    if _local.instrumentation is None:
+        with _lock:
+            if _local.instrumentation is None:
+                name = getattr(settings, 'INSTRUMENTATION', None)
+                if name:
+                    _local.instrumentation = import_class(name)()
+                else:
+                    _local.instrumentation = Instrumentation()
+    return _local.instrumentation
+
+
+def flush_instrumentation():
+    """
+    Flushes the instrumentation. Called at the end of each handler invocation,
+    before the metrics buffer is flushed.
+    """
+    try:
+        get_instrumentation().flush()
+    except Exception:
+        logger.exception('Error flushing instrumentation.')
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+
+    __slots__ = ('instrumentation', 'context', 'phase', 'state_name', 'started_at')
+
+    def __init__(self, instrumentation, context, phase):
+        self.instrumentation = instrumentation
+        self.context = context
+        self.phase = phase
+
+    def __enter__(self):
+        # like the error counters, attribute the phase to the state of the incoming
+        # event, since actions change the current state part way through dispatch
+        self.state_name = self.context.system_context().get(SYSTEM_CONTEXT.CURRENT_STATE) or \
+            getattr(self.context.current_state, 'name', None)
+        self.started_at = time.time()
+
+    def __exit__(self, *args):
+        seconds = time.time() - self.started_at
+        try:
+            self.instrumentation.record(self.context.name, self.state_name, self.phase, seconds)
+        except Exception:
+            logger.exception('Error recording %s timing.', self.phase)
+
+
+def timed(context, phase):
+    """
+    Returns a context manager that records the time spent in a phase of dispatch.
+    When instrumentation is disabled, this is a shared no-op.
+
+        with timed(context, PHASE.LEASE):
+            acquire_lease(...)
+
+    :param context: an aws_lambda_fsm.fsm.Context instance.
+    :param phase: a str like "lease" (see aws_lambda_fsm.constants.PHASE).
+    :return: a context manager.
+    """
+    instrumentation = get_instrumentation()
+    if not instrumentation.enabled:
+        return _NULL_TIMER
+    return _Timer(instrumentation, context, phase)
@@ -0,0 +1,362 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# system imports
+import json
+import logging
+
+# library imports
+
+# application imports
+from aws_lambda_fsm.action import Action
+from aws_lambda_fsm.aws import get_source
+from aws_lambda_fsm.aws import get_stream_source
+from aws_lambda_fsm.aws import start_join
+from aws_lambda_fsm.aws import report_join
+from aws_lambda_fsm.circuit import get_circuit_breaker
+from aws_lambda_fsm.client import start_state_machines
+from aws_lambda_fsm.engine import map_concurrently
+from aws_lambda_fsm.constants import JOIN_DATA
+from aws_lambda_fsm.constants import MAP_DATA
+from aws_lambda_fsm.constants import MACHINE
+from aws_lambda_fsm.constants import PAYLOAD
+from aws_lambda_fsm.constants import SOURCE
+from aws_lambda_fsm.constants import SYSTEM_CONTEXT
+from aws_lambda_fsm.fsm import Context
+from aws_lambda_fsm.fsm import FSM
+
+logger = logging.getLogger(__name__)
+
+
+class ForkAction(Action):
+    """
+    Starts a child machine for each of a list of initial user contexts, then waits
+    (without sending an event) until every child has reported via a JoinAction.
+    The last child to report then sends a single event (default "joined") to this
+    machine, with the children's results in the user context under "join_results".
+
+    Subclasses implement get_children. Requires a redis or dynamodb cache source.
+    Must be the do_action of a state, so the machine resumes with the user context
+    as it is at the end of the step.
+
+        class ForkItems(ForkAction):
+            def get_children(self, context, obj):
+                return 'process_item', [{'item': item} for item in context['items']]
+    """
+
+    # the number of children started with a single put
+    batch_size = JOIN_DATA.BATCH_SIZE
+
+    # may only be used as a state's do_action (checked by config.get_configuration_errors)
+    do_action_only = True
+
+    def __init__(self, name, event=JOIN_DATA.EVENT):
+        """
+        Construct a fork action.
+
+        :param name: a str name for the action.
+        :param event: the str event sent to this machine when all the children have reported.
+        """
+        super(ForkAction, self).__init__(name, event=event)
+
+    def get_children(self, context, obj):
+        """
+        Returns the children to start.
+
+        :param context: an aws_lambda_fsm.fsm.Context instance.
+        :param obj: a dict.
+        :return: a tuple of (str machine name, list of dict initial user contexts).
+        """
+        raise NotImplementedError()  # pragma: no cover
+
+    def execute(self, context, obj):
+        """
+        Stores the join barrier and starts the children.
+
+        :param context: an aws_lambda_fsm.fsm.Context instance.
+        :param obj: a dict.
+        :return: None, or the str event if there are no children.
+        """
+        # entry/exit/transition actions run before the rest of the step, so the
+        # payload built below would miss the step's later changes
+        if context.current_action is not context.current_state.do_action:
+            raise Exception('%s must be the do_action of a state.' % self.name)
+
+        machine_name, user_contexts = self.get_children(context, obj)
+        if not user_contexts:
+            context[JOIN_DATA.RESULTS] = []
+            return self.event
+
+        # the payload this machine resumes with once all the children have reported
+        ctx = Context.from_payload_dict(context.to_payload_dict())
+        ctx.steps += 1
+        ctx.retries = 0
+        ctx.current_event = self.event
+        payload = json.dumps(ctx.to_payload_dict(), sort_keys=True)
+
+        # the join_id is unique to this step, so a retried fork re-uses the same
+        # barrier and re-starts the same children
+        join_id = '%s-%d' % (context.correlation_id, context.steps)
+        stored = []
+
+        def store(primary):
+            if start_join(join_id, len(user_contexts), payload, primary=primary, sources=context.sources):
+                stored.append(primary)
+                return True
+            return False
+        context._call_with_failover(get_circuit_breaker(get_source(SOURCE.CACHE, sources=context.sources)),
+                                    store,
+                                    'Unable to start join (primary=%s).',
+                                    flag=True)
+        if not stored:
+            raise Exception('Unable to start join %s.' % join_id)
+
+        correlation_ids = ['%s-%d' % (join_id, i) for i in range(len(user_contexts))]
+        system_contexts = [
+            {
+                SYSTEM_CONTEXT.JOIN: {
+                    JOIN_DATA.ID: join_id,
+                    JOIN_DATA.INDEX: i,
+                    JOIN_DATA.PRIMARY: stored[0],
+                    JOIN_DATA.MACHINE_NAME: context.name
+                }
+            }
+            for i in range(len(user_contexts))
+        ]
+        self._start_children(context, machine_name, user_contexts, correlation_ids, system_contexts)
+        logger.info('Forked %d %s machines for join %s.', len(user_contexts), machine_name, join_id)
+
+    def _start_children(self, context, machine_name, user_contexts, correlation_ids, system_contexts):
+        """
+        Starts the children, on the child machine's own stream sources and lane,
+        failing over to the secondary stream source for any children that were not
+        sent (eg. throttled). Raises if any children are still not sent, since the
+        barrier could never complete, so the step is retried (re-using the same
+        barrier and correlation_ids).
+
+        :param context: an aws_lambda_fsm.fsm.Context instance.
+        :param machine_name: a str child machine name.
+        :param user_contexts: a list of dict initial user contexts.
+        :param correlation_ids: a list of str child correlation_ids.
+        :param system_contexts: a list of dict additional child system contexts.
+        """
+        machine = FSM().get_machine(machine_name)
+        sources = machine[MACHINE.SOURCES]
+        lane = machine.get(MACHINE.STREAM)
+        pending = range(len(user_contexts))
+
+        def start(primary):
+            for batch in [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]:
+                unsent = set(start_state_machines(machine_name,
+                                                  [user_contexts[j] for j in batch],
+                                                  correlation_ids=[correlation_ids[j] for j in batch],
+                                                  system_contexts=[system_contexts[j] for j in batch],
+                                                  lane=lane,
+                                                  primary=primary,
+                                                  sources=sources))
+                sent = set(j for j in batch if correlation_ids[j] not in unsent)
+                pending[:] = [j for j in pending if j not in sent]
+            return not pending
+        context._call_with_failover(get_circuit_breaker(get_stream_source(sources=sources, lane=lane)),
+                                    start,
+                                    'Unable to start children (primary=%s).',
+                                    flag=True)
+        if pending:
+            raise Exception('Unable to start %d of %d children.' % (len(pending), len(user_contexts)))
+
+
+class JoinAction(Action):
+    """
+    Reports the result of a child machine started by a ForkAction, typically as
+    the do_action of the child's final state. The child that completes the join
+    sends the event to the forking machine. Does nothing for machines that were
+    not started by a ForkAction.
+
+    Subclasses may implement get_result.
+    """
+
+    def set_results(self, user_context, results):
+        """
+        Adds the results of all the children to the forking machine's user context.
+
+        :param user_context: a dict.
+        :param results: a list of results, ordered by child index.
+        """
+        user_context[JOIN_DATA.RESULTS] = results
+
+    def get_result(self, context, obj):
+        """
+        Returns the result of the child machine.
+
+        :param context: an aws_lambda_fsm.fsm.Context instance.
+        :param obj: a dict.
+        :return: a json serializable result.
+        """
+        return None
+
+    def execute(self, context, obj):
+        """
+        Reports to the join barrier, and resumes the forking machine if all the
+        children have reported.
+
+        :param context: an aws_lambda_fsm.fsm.Context instance.
+        :param obj: a dict.
+        :return: a str event.
+        """
+        join = context.system_context().get(SYSTEM_CONTEXT.JOIN)
+        if not join:
+            return self.event
+
+        # the barrier is in the forking machine's cache source
+        sources = FSM().get_machine(join[JOIN_DATA.MACHINE_NAME])[MACHINE.SOURCES]
+        result = json.dumps(self.get_result(context, obj), sort_keys=True)
+        returned = report_join(join[JOIN_DATA.ID], join[JOIN_DATA.INDEX], result,
+                               primary=join[JOIN_DATA.PRIMARY], sources=sources)
+        if returned == 0:
+            raise Exception('Unable to report to join %s.' % join[JOIN_DATA.ID])
+
+        if returned:
+            payload, results = returned
+            payload_dict = json.loads(payload)
+            self.set_results(payload_dict[PAYLOAD.USER_CONTEXT], [json.loads(r) for r in results])
+            parent = Context.from_payload_dict(payload_dict)
+            serialized = json.dumps(payload_dict, sort_keys=True)
+            if not parent.send_next_event(serialized, {}, lane=parent.lane):
+                raise Exception('Unable to complete join %s.' % join[JOIN_DATA.ID])
+            logger.info('Completed join %s.', join[JOIN_DATA.ID])
+
+        return self.event
+
+
+class MapAction(ForkAction):
+    """
+    Processes a (large) list of items from the user context in chunks, rather than
+    looping over the items one step at a time, and stores the results (in item
+    order) under "map_results" in the user context.
+
+    By default the chunks are processed in this step, on a pool of
+    settings.MAP_CONCURRENCY threads, so process_item must be thread-safe. If
+    child_machine is set, each chunk is instead processed by a child machine (whose
+    final state uses a MapChunkAction), and this machine waits for the "mapped"
+    event, as for a ForkAction.
+
+        class DoubleItems(MapAction):
+            chunk_size = 500
+
+            def process_item(self, context, item):
+                return item * 2
+    """
+
+    # the user context key of the list of items
+    items_key = MAP_DATA.ITEMS
+
+    # the max number of items in a chunk
+    chunk_size = MAP_DATA.CHUNK_SIZE
+
+    # the number of chunks processed concurrently (default settings.MAP_CONCURRENCY)
+    concurrency = None
+
+    # the name of the machine that processes each chunk (default in this step)
+    child_machine = None
+
+    def __init__(self, name, event=MAP_DATA.EVENT):
+        """
+        Construct a map action.
+
+        :param name: a str name for the action.
+        :param event: the str event returned (or sent) when all the chunks are processed.
+        """
+        super(MapAction, self).__init__(name, event=event)
+
+    def get_chunks(self, context, obj):
+        """
+        Returns the items partitioned into chunks.
+
+        :param context: an aws_lambda_fsm.fsm.Context instance.
+        :param obj: a dict.
+        :return: a list of lists of items.
+        """
+        items = context.get(self.items_key) or []
+        return [items[i:i + self.chunk_size] for i in range(0, len(items), self.chunk_size)]
+
+    def process_item(self, context, item):
+        """
+        Processes a single item.
+
+        :param context: an aws_lambda_fsm.fsm.Context instance.
+        :param item: an item.
+        :return: a json serializable result.
+        """
+        raise NotImplementedError()  # pragma: no cover
+
+    def process_chunk(self, context, chunk):
+        """
+        Processes a chunk of items. Sub-classes may override this to process a
+        chunk with a single (batch) call.
+
+        :param context: an aws_lambda_fsm.fsm.Context instance.
+        :param chunk: a list of items.
+        :return: a list of json serializable results, one per item.
+        """
+        return [self.process_item(context, item) for item in chunk]
+
+    def get_children(self, context, obj):
+        return self.child_machine, [{self.items_key: chunk} for chunk in self.get_chunks(context, obj)]
+
+    def execute(self, context, obj):
+        """
+        Processes the chunks, or starts a child machine for each chunk.
+
+        :param context: an aws_lambda_fsm.fsm.Context instance.
+        :param obj: a dict.
+        :return: a str event, or None if the chunks are processed by child machines.
+        """
+        chunks = self.get_chunks(context, obj)
+        if self.child_machine and chunks:
+            return super(MapAction, self).execute(context, obj)
+
+        results = map_concurrently(chunks, lambda chunk: self.process_chunk(context, chunk),
+                                   concurrency=self.concurrency)
+        context[MAP_DATA.RESULTS] = [result for chunk_results in results for result in chunk_results]
+        logger.info('Mapped %d items in %d chunks.', len(context[MAP_DATA.RESULTS]), len(chunks))
+        return self.event
+
+
+class MapChunkAction(JoinAction):
+    """
+    Processes a chunk of items in a child machine started by a MapAction (typically
+    as the do_action of the child's final state) and reports the results. The
+    forking machine gets the results of all the chunks, in item order, under
+    "map_results" in the user context.
+    """
+
+    # the user context key of the list of items
+    items_key = MAP_DATA.ITEMS
+
+    def process_item(self, context, item):
+        """
+        Processes a single item.
+
+        :param context: an aws_lambda_fsm.fsm.Context instance.
+        :param item: an item.
+        :return: a json serializable result.
+        """
+        raise NotImplementedError()  # pragma: no cover
+
+    def get_result(self, context, obj):
+        return [self.process_item(context, item) for item in context.get(self.items_key) or []]
+
+    def set_results(self, user_context, results):
+        user_context[MAP_DATA.RESULTS] = [result for chunk_results in results for result in chunk_results]
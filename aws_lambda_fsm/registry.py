@@ -0,0 +1,68 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# system imports
+from threading import RLock
+
+# library imports
+
+# application imports
+
+
+class Registry(object):
+    """
+    A thread-safe cache of objects keyed by a source ARN (token buckets, circuit
+    breakers, shard monitors, ...). The objects live as long as the process, so
+    what they learn carries across invocations, and is shared by every machine
+    dispatched by the process.
+    """
+
+    def __init__(self, factory):
+        """
+        :param factory: a function accepting a key, returning a new object.
+        """
+        self.factory = factory
+        self.objects = {}
+        self._lock = RLock()
+
+    def get(self, key):
+        """
+        Returns the object for a key, creating it on first use.
+
+        :param key: a str key, like an ARN.
+        :return: an object returned by the factory.
+        """
+        obj = self.objects.get(key)
+        if obj is None:
+            with self._lock:
+                obj = self.objects.get(key)
+                if obj is None:
+                    obj = self.objects[key] = self.factory(key)
+        return obj
+
+    def items(self):
+        """
+        Returns a snapshot of all the objects.
+
+        :return: a sorted list of (key, object) tuples.
+        """
+        with self._lock:
+            return sorted(self.objects.items())
+
+    def clear(self):
+        """
+        Forgets all the objects.
+        """
+        with self._lock:
+            self.objects = {}
@@ -0,0 +1,177 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# system imports
+from threading import RLock
+import hashlib
+import logging
+import time
+
+# library imports
+
+# application imports
+from aws_lambda_fsm.constants import AWS_KINESIS
+from aws_lambda_fsm.constants import SHARD_DATA
+from aws_lambda_fsm.config import get_settings
+from aws_lambda_fsm.registry import Registry
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+class Object(object):
+    pass
+
+_local = Object()
+_local.monitors = Registry(lambda arn: ShardMonitor(
+    arn,
+    hot_ratio=getattr(settings, 'KINESIS_HOT_SHARD_RATIO', SHARD_DATA.HOT_RATIO),
+    window=getattr(settings, 'KINESIS_HOT_SHARD_WINDOW', SHARD_DATA.WINDOW)
+))
+
+
+def get_hash_ranges(shards):
+    """
+    Returns the hash key ranges of the open shards of a stream.
+
+    :param shards: a list of shard dicts from the boto3 describe_stream call.
+    :return: a sorted list of (int, int) inclusive hash key ranges.
+    """
+    return sorted(
+        (int(shard[AWS_KINESIS.SHARD.HashKeyRange][AWS_KINESIS.SHARD.StartingHashKey]),
+         int(shard[AWS_KINESIS.SHARD.HashKeyRange][AWS_KINESIS.SHARD.EndingHashKey]))
+        for shard in shards
+        if AWS_KINESIS.SHARD.EndingSequenceNumber not in shard.get(AWS_KINESIS.SHARD.SequenceNumberRange, {})
+    )
+
+
+def get_explicit_hash_key(correlation_id, hash_ranges):
+    """
+    Returns an explicit hash key that places a correlation_id on one of the open
+    shards with equal probability, regardless of the size of the shard hash key
+    ranges (which are uneven after the stream has been split or merged). The key
+    only depends on the correlation_id, so all the events for a single machine
+    still go to the same shard.
+
+    :param correlation_id: the guid for the fsm.
+    :param hash_ranges: a sorted list of (int, int) inclusive hash key ranges.
+    :return: a str decimal hash key.
+    """
+    digest = int(hashlib.md5(correlation_id).hexdigest(), 16)
+    start, end = hash_ranges[digest % len(hash_ranges)]
+    return str(start + (digest // len(hash_ranges)) % (end - start + 1))
+
+
+class ShardMonitor(object):
+    """
+    Counts the records put onto each shard of a stream (from the ShardId in the
+    put responses), and warns when a shard receives a disproportionate share.
+    Also caches the hash key ranges of the stream for explicit hash keys.
+    """
+
+    def __init__(self, name, hot_ratio=SHARD_DATA.HOT_RATIO, window=SHARD_DATA.WINDOW):
+        """
+        :param name: a str name (the stream arn) used for logging.
+        :param hot_ratio: a float multiple of the mean number of puts that makes a shard hot.
+        :param window: an int number of puts between hot shard checks.
+        """
+        self.name = name
+        self.hot_ratio = hot_ratio
+        self.window = window
+        self.counts = {}
+        self.window_counts = {}
+        self.window_total = 0
+        self.hot_shard_ids = []
+        self.hash_ranges = None
+        self.hash_ranges_loaded_at = None
+        self._lock = RLock()
+
+    def record(self, shard_id, count=1):
+        """
+        Records puts onto a shard.
+
+        :param shard_id: a str shard id like 'shardId-000000000000'.
+        :param count: an int number of records.
+        """
+        with self._lock:
+            self.counts[shard_id] = self.counts.get(shard_id, 0) + count
+            self.window_counts[shard_id] = self.window_counts.get(shard_id, 0) + count
+            self.window_total += count
+            if self.window_total >= self.window:
+                self._check()
+
+    def _check(self):
+        # the number of open shards is only known if the hash key ranges are
+        # loaded, otherwise the mean is over the shards that received puts
+        shard_count = max(len(self.window_counts), len(self.hash_ranges or []))
+        limit = self.hot_ratio * self.window_total / shard_count
+        self.hot_shard_ids = sorted(shard_id for shard_id, count in self.window_counts.items() if count > limit)
+        for shard_id in self.hot_shard_ids:
+            logger.warning('Hot shard %s on %s received %d of the last %d puts.',
+                           shard_id, self.name, self.window_counts[shard_id], self.window_total)
+        self.window_counts = {}
+        self.window_total = 0
+
+    def drain(self):
+        """
+        Returns (and resets) the number of puts onto each shard since the last drain.
+
+        :return: a dict of {str: int} shard ids and counts.
+        """
+        with self._lock:
+            counts, self.counts = self.counts, {}
+        return counts
+
+    def get_hash_ranges(self, describe_shards):
+        """
+        Returns the (cached) hash key ranges of the open shards.
+
+        :param describe_shards: a function returning a list of shard dicts from the
+          boto3 describe_stream call.
+        :return: a sorted list of (int, int) inclusive hash key ranges, or None
+          if they could not be loaded.
+        """
+        now = time.time()
+        if self.hash_ranges_loaded_at is None or now - self.hash_ranges_loaded_at > SHARD_DATA.MAP_TIMEOUT:
+            with self._lock:
+                if self.hash_ranges_loaded_at is None or now - self.hash_ranges_loaded_at > SHARD_DATA.MAP_TIMEOUT:
+                    # on error, keep using the stale ranges until the next timeout
+                    self.hash_ranges_loaded_at = now
+                    try:
+                        self.hash_ranges = get_hash_ranges(describe_shards()) or None
+                    except Exception:
+                        logger.exception('Error loading the shards for %s.', self.name)
+        return self.hash_ranges
+
+
+def get_shard_monitor(arn):
+    """
+    Returns the (cached) ShardMonitor for a stream, so hot shards are detected
+    across invocations.
+
+    :param arn: a str ARN like 'arn:partition:kinesis:region:account:resource'
+    :return: a aws_lambda_fsm.shards.ShardMonitor instance.
+    """
+    return _local.monitors.get(arn)
+
+
+def drain_shard_monitors():
+    """
+    Returns (and resets) the number of puts onto each shard of every stream.
+
+    :return: a list of (str, dict) stream arns and {shard_id: count} dicts.
+    """
+    return [(arn, counts) for arn, counts in ((arn, monitor.drain()) for arn, monitor in _local.monitors.items())
+            if counts]
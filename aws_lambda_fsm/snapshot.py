@@ -0,0 +1,182 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# system imports
+from collections import OrderedDict
+from threading import RLock
+import json
+import logging
+
+# library imports
+from botocore.exceptions import ClientError
+
+# application imports
+from aws_lambda_fsm.aws import get_source
+from aws_lambda_fsm.aws import load_snapshot
+from aws_lambda_fsm.aws import store_snapshot
+from aws_lambda_fsm.circuit import get_circuit_breaker
+from aws_lambda_fsm.constants import CHECKPOINT_DATA
+from aws_lambda_fsm.constants import SOURCE
+
+logger = logging.getLogger(__name__)
+
+
+class Object(object):
+    pass
+
+_local = Object()
+_local.snapshots = OrderedDict()
+_lock = RLock()
+
+
+def _cache_snapshot(correlation_id, snapshot_id, serialized):
+    """
+    Caches a snapshot in-process, since the steps of a machine are usually
+    handled by the same process, evicting the least recently used snapshots.
+
+    :param correlation_id: the guid for the fsm.
+    :param snapshot_id: a str snapshot id.
+    :param serialized: a json str user context.
+    :return: a tuple of (json str, dict) user context.
+    """
+    entry = (serialized, json.loads(serialized))
+    with _lock:
+        _local.snapshots[(correlation_id, snapshot_id)] = entry
+        while len(_local.snapshots) > CHECKPOINT_DATA.SNAPSHOT_CACHE_SIZE:
+            _local.snapshots.popitem(last=False)
+    return entry
+
+
+def get_delta(base, user_context):
+    """
+    Returns the changes to a user context.
+
+    :param base: a dict user context.
+    :param user_context: a dict user context.
+    :return: a tuple of (dict of the changed keys, sorted list of the deleted keys).
+    """
+    delta = dict((key, value) for key, value in user_context.iteritems()
+                 if key not in base or base[key] != value)
+    deleted = sorted(key for key in base if key not in user_context)
+    return delta, deleted
+
+
+def apply_delta(user_context, delta, deleted):
+    """
+    Applies the changes returned by get_delta to a user context, in place.
+
+    :param user_context: a dict user context.
+    :param delta: a dict of the changed keys.
+    :param deleted: a list of the deleted keys.
+    :return: the dict user context.
+    """
+    user_context.update(delta)
+    for key in deleted:
+        user_context.pop(key, None)
+    return user_context
+
+
+class SnapshotNotFound(KeyError):
+    """
+    Raised when a snapshot is in neither checkpoint source, because it was not
+    yet readable, or has expired. The payload referring to it can not be dispatched,
+    so it has to be redelivered (see aws_lambda_fsm.handler).
+    """
+
+
+def put_snapshot(correlation_id, snapshot_id, user_context, sources=None):
+    """
+    Stores a snapshot of a user context in the checkpoint source.
+
+    :param correlation_id: the guid for the fsm.
+    :param snapshot_id: a str snapshot id.
+    :param user_context: a dict user context.
+    :param sources: an optional dict of the machine's sources (see aws_lambda_fsm.aws.get_sources).
+    :return: True if the snapshot was stored.
+    """
+    serialized = json.dumps(user_context, sort_keys=True)
+    breaker = get_circuit_breaker(get_source(SOURCE.CHECKPOINT, sources=sources))
+    for primary in breaker.primaries():
+        try:
+            stored = store_snapshot(correlation_id, snapshot_id, serialized, primary=primary, sources=sources)
+        except ClientError:
+            logger.exception('Unable to store snapshot (primary=%s).', primary)
+            stored = None
+        if stored:
+            if primary:
+                breaker.succeeded()
+            _cache_snapshot(correlation_id, snapshot_id, serialized)
+            return True
+        if primary:
+            breaker.failed()
+    return False
+
+
+def _get_snapshot(correlation_id, snapshot_id, sources=None):
+    """
+    Returns a snapshot, from the in-process cache, or the primary (then
+    secondary) checkpoint source.
+
+    :param correlation_id: the guid for the fsm.
+    :param snapshot_id: a str snapshot id.
+    :param sources: an optional dict of the machine's sources (see aws_lambda_fsm.aws.get_sources).
+    :return: a tuple of (json str, dict) user context. The dict is shared, so
+      must not be modified.
+    """
+    with _lock:
+        entry = _local.snapshots.pop((correlation_id, snapshot_id), None)
+        if entry:
+            _local.snapshots[(correlation_id, snapshot_id)] = entry
+            return entry
+
+    for primary in (True, False):
+        try:
+            serialized = load_snapshot(correlation_id, snapshot_id, primary=primary, sources=sources)
+        except ClientError:
+            logger.exception('Unable to load snapshot (primary=%s).', primary)
+            continue
+        if serialized:
+            return _cache_snapshot(correlation_id, snapshot_id, serialized)
+    raise SnapshotNotFound('Snapshot "%s" not found for "%s".' % (snapshot_id, correlation_id))
+
+
+def get_user_context(correlation_id, snapshot_id, delta, deleted, sources=None):
+    """
+    Rebuilds a user context from a snapshot and a delta.
+
+    :param correlation_id: the guid for the fsm.
+    :param snapshot_id: a str snapshot id.
+    :param delta: a dict of the keys changed since the snapshot.
+    :param deleted: a list of the keys deleted since the snapshot.
+    :param sources: an optional dict of the machine's sources (see aws_lambda_fsm.aws.get_sources).
+    :return: a dict user context.
+    :raises SnapshotNotFound: if the snapshot can not be loaded.
+    """
+    serialized, _ = _get_snapshot(correlation_id, snapshot_id, sources=sources)
+    # a fresh copy, since actions can modify nested values in place
+    return apply_delta(json.loads(serialized), delta, deleted)
+
+
+def get_user_context_delta(correlation_id, snapshot_id, user_context, sources=None):
+    """
+    Returns the changes to a user context since a snapshot.
+
+    :param correlation_id: the guid for the fsm.
+    :param snapshot_id: a str snapshot id.
+    :param user_context: a dict user context.
+    :param sources: an optional dict of the machine's sources (see aws_lambda_fsm.aws.get_sources).
+    :return: a tuple of (dict of changed keys, sorted list of deleted keys).
+    """
+    _, base = _get_snapshot(correlation_id, snapshot_id, sources=sources)
+    return get_delta(base, user_context)
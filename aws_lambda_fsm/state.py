@@ -27,8 +27,11 @@ class State(object):
     State machine state.
     """
 
+    __slots__ = ('name', 'entry_action', 'do_action', 'exit_action', 'initial', 'final', 'stream',
+                 '_event_2_transition', '_event_2_dispatch')
+
     def __init__(self, name, entry_action=None, do_action=None, exit_action=None,
-                 initial=None, final=None):
+                 initial=None, final=None, stream=None):
         """
         Construct a state machine state.
 
@@ -36,6 +39,7 @@ class State(object):
         :param entry_action: an optional aws_lambda_fsm.action.Action instance to execute on entry to the state.
         :param do_action: an optional aws_lambda_fsm.action.Action instance to execute once in the state.
         :param exit_action: an optional aws_lambda_fsm.action.Action instance to execute on exit from the state.
+        :param stream: an optional str lane name (see settings.STREAM_LANES) for events dispatched to the state.
         """
         self.name = name
         self.entry_action = entry_action
@@ -43,7 +47,9 @@ class State(object):
         self.exit_action = exit_action
         self.initial = initial
         self.final = final
+        self.stream = stream
         self._event_2_transition = {}
+        self._event_2_dispatch = {}
 
     def add_transition(self, transition, event):
         """
@@ -53,6 +59,7 @@ class State(object):
         :param event: a str event which triggers the transition.
         """
         self._event_2_transition[event] = transition
+        self._event_2_dispatch.pop(event, None)
 
     def get_transition(self, event):
         """
@@ -63,10 +70,65 @@ class State(object):
         """
         return self._event_2_transition[event]
 
+    def compile(self):
+        """
+        Precomputes, for every event, the tuple of
+        (transition, exit action, transition action, entry action, do action, target, final)
+        so that State.dispatch does not have to look each of them up on every event. This
+        must be called once all the states and transitions of the machine are complete.
+
+        :return: a dict of {str event: tuple}
+        """
+        self._event_2_dispatch = dict(
+            (event, (transition,
+                     self.exit_action,
+                     transition.action,
+                     transition.target.entry_action,
+                     transition.target.do_action,
+                     transition.target,
+                     transition.target.final))
+            for event, transition in self._event_2_transition.items()
+        )
+        return self._event_2_dispatch
+
     def dispatch(self, context, event, obj):
         """
         Dispatch an event to the state machine state.
 
+        :param context: an aws_lambda_fsm.fsm.Context instance
+        :param event: a str event.
+        :param obj: a dict.
+        :return: a str event.
+        """
+        compiled = self._event_2_dispatch.get(event)
+        if compiled is None:
+            return self._dispatch(context, event, obj)
+
+        transition, exit_action, transition_action, entry_action, do_action, target, final = compiled
+        context.current_transition = transition
+        if exit_action:
+            context.current_action = exit_action
+            exit_action.execute(context, obj)
+        if transition_action:
+            context.current_action = transition_action
+            transition_action.execute(context, obj)
+        context.current_state = target
+        if entry_action:
+            context.current_action = entry_action
+            entry_action.execute(context, obj)
+        next_event = None
+        if do_action:
+            context.current_action = do_action
+            next_event = do_action.execute(context, obj)
+        if final:
+            return None
+        return next_event
+
+    def _dispatch(self, context, event, obj):
+        """
+        Dispatch an event to the state machine state, looking up the transition and
+        actions as the event is processed (used when the state is not compiled).
+
         :param context: an aws_lambda_fsm.fsm.Context instance
         :param event: a str event.
         :param obj: a dict.
@@ -77,6 +139,8 @@ class State(object):
         if context.current_state.exit_action:
             context.current_action = context.current_state.exit_action
             context.current_state.exit_action.execute(context, obj)
+        if transition.action:
+            context.current_action = transition.action
         transition.execute(context, obj)
         if context.current_state.entry_action:
             context.current_action = context.current_state.entry_action
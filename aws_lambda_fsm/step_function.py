@@ -0,0 +1,388 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# system imports
+import json
+
+# library imports
+
+# application imports
+from aws_lambda_fsm.constants import AWS
+from aws_lambda_fsm.constants import JOIN_DATA
+from aws_lambda_fsm.constants import MAP_DATA
+from aws_lambda_fsm.constants import PAYLOAD
+from aws_lambda_fsm.constants import STATE
+from aws_lambda_fsm.constants import STEP_FUNCTION_DATA
+from aws_lambda_fsm.constants import SYSTEM_CONTEXT
+
+CHOICES_SUFFIX = '-choices'
+RESUME_SUFFIX = '-resume'
+START_SUFFIX = '-start'
+MERGE_SUFFIX = '-merge'
+DISPATCH_SUFFIX = '-dispatch'
+DONE_SUFFIX = '-done'
+
+
+def _path(*keys):
+    """
+    Returns a JsonPath into the payload.
+
+    :param keys: a list of str keys.
+    :return: a str like "$.system_context.current_event".
+    """
+    return '.'.join(('$',) + keys)
+
+
+def _quote(value):
+    """
+    Returns a str literal for use as an intrinsic function argument.
+
+    :param value: a str.
+    :return: a str like "'value'".
+    """
+    for char in '\\\'{}':
+        value = value.replace(char, '\\' + char)
+    return "'%s'" % value
+
+
+def get_retry(state):
+    """
+    Returns the Retry field for a Task state.
+
+    :param state: an aws_lambda_fsm.graph.StateNode instance.
+    :return: a list of dicts.
+    """
+    return [
+        {
+            'ErrorEquals': ['States.ALL'],
+            'IntervalSeconds': state.retry_interval,
+            'MaxAttempts': state.max_retries,
+            'BackoffRate': state.retry_backoff
+        }
+    ]
+
+
+def get_start_parameters(machine_name, user_context):
+    """
+    Returns the Parameters that build the payload for starting a machine.
+
+    :param machine_name: a str machine name.
+    :param user_context: a dict of Parameters for the user context, or a str
+      JsonPath to copy it from.
+    :return: a dict.
+    """
+    user_context_key = PAYLOAD.USER_CONTEXT + ('.$' if isinstance(user_context, basestring) else '')
+    return {
+        PAYLOAD.VERSION: PAYLOAD.DEFAULT_VERSION,
+        PAYLOAD.SYSTEM_CONTEXT: {
+            SYSTEM_CONTEXT.MACHINE_NAME: machine_name,
+            SYSTEM_CONTEXT.CURRENT_STATE: STATE.PSEUDO_INIT,
+            SYSTEM_CONTEXT.CURRENT_EVENT: STATE.PSEUDO_INIT,
+            SYSTEM_CONTEXT.STEPS: 0,
+            SYSTEM_CONTEXT.RETRIES: 0
+        },
+        user_context_key: user_context,
+        AWS.STEP_FUNCTION: True
+    }
+
+
+def get_resume_parameters(state_name, event, delta=False):
+    """
+    Returns the Parameters that move the payload on to a state and event,
+    once the machines run by a map/parallel state have all finished.
+
+    :param state_name: a str state name.
+    :param event: a str event.
+    :param delta: a bool, True if the Tasks return user context deltas.
+    :return: a dict.
+    """
+    system_context = json.dumps({SYSTEM_CONTEXT.CURRENT_STATE: state_name,
+                                 SYSTEM_CONTEXT.CURRENT_EVENT: event},
+                                sort_keys=True, separators=(',', ':'))
+    system_context = 'States.JsonMerge(%s, States.StringToJson(%s), false)' % \
+        (_path(PAYLOAD.SYSTEM_CONTEXT), _quote(system_context))
+    parameters = {
+        PAYLOAD.VERSION + '.$': _path(PAYLOAD.VERSION),
+        PAYLOAD.SYSTEM_CONTEXT + '.$': system_context,
+        PAYLOAD.USER_CONTEXT + '.$': _path(PAYLOAD.USER_CONTEXT),
+        AWS.STEP_FUNCTION: True
+    }
+    # the Choice states read the event from the (empty) delta
+    if delta:
+        parameters[STEP_FUNCTION_DATA.DELTA] = {
+            PAYLOAD.SYSTEM_CONTEXT + '.$': system_context,
+            PAYLOAD.USER_CONTEXT: {}
+        }
+    return parameters
+
+
+def get_merge_parameters():
+    """
+    Returns the Parameters that move the user context returned by the last Task
+    into the payload. Tasks return the whole user context (rather than just the
+    changes) before a map/parallel state, since the deleted keys cannot be
+    removed with the intrinsic functions.
+
+    :return: a dict.
+    """
+    return {
+        PAYLOAD.VERSION + '.$': _path(PAYLOAD.VERSION),
+        PAYLOAD.SYSTEM_CONTEXT + '.$': _path(STEP_FUNCTION_DATA.DELTA, PAYLOAD.SYSTEM_CONTEXT),
+        PAYLOAD.USER_CONTEXT + '.$': _path(STEP_FUNCTION_DATA.DELTA, PAYLOAD.USER_CONTEXT),
+        AWS.STEP_FUNCTION: True
+    }
+
+
+class _Converter(object):
+    """
+    Builds the States for a single machine.
+    """
+
+    def __init__(self, graph, graphs, lambda_arn, parents, delta):
+        """
+        :param graph: an aws_lambda_fsm.graph.MachineGraph instance.
+        :param graphs: a dict of {str machine name: MachineGraph}.
+        :param lambda_arn: a str AWS Lambda function ARN.
+        :param parents: a tuple of str machine names already being converted.
+        :param delta: a bool, True if the Tasks return user context deltas.
+        """
+        if graph.name in parents:
+            raise ValueError('Machine "%s" runs itself.' % graph.name)
+        self.graph = graph
+        self.graphs = graphs
+        self.lambda_arn = lambda_arn
+        self.parents = parents + (graph.name,)
+        self.delta = delta
+        self.inline = graph.inline_steps > 0
+        self.stop_states = [state.name for state in graph.states.values() if state.children]
+        self.result_path = _path(STEP_FUNCTION_DATA.DELTA) if delta else '$'
+
+    def get_entry_name(self, state_name):
+        """
+        Returns the name of the state that transitions to a fsm state enter. In
+        delta mode, map/parallel states are entered via a Pass state that
+        merges the delta, since they read the user context directly.
+
+        :param state_name: a str fsm state name.
+        :return: a str state name.
+        """
+        if self.delta and state_name in self.stop_states:
+            return state_name + MERGE_SUFFIX
+        return state_name
+
+    def get_variable(self, key):
+        """
+        Returns the Choice Variable for a system context key of the last Task's result.
+
+        :param key: a str system context key.
+        :return: a str JsonPath.
+        """
+        return _path(*((STEP_FUNCTION_DATA.DELTA,) if self.delta else ()) + (PAYLOAD.SYSTEM_CONTEXT, key))
+
+    def get_states(self):
+        """
+        :return: a dict of {str state name: dict}.
+        """
+        states = {}
+        for state in self.graph.states.values():
+            if state.children:
+                states.update(self.get_group_states(state))
+            else:
+                states.update(self.get_task_states(state))
+        if self.inline:
+            states.update(self.get_dispatch_states())
+        return states
+
+    def get_group_states(self, state):
+        """
+        Returns the Map or Parallel state (and the Pass states that merge the
+        delta beforehand, and resume the machine afterwards) for a state that
+        runs other machines.
+
+        :param state: an aws_lambda_fsm.graph.StateNode instance.
+        :return: a dict of {str state name: dict}.
+        """
+        if state.map_machine:
+            data = {
+                'Type': 'Map',
+                'ItemsPath': _path(PAYLOAD.USER_CONTEXT, state.map_items),
+                'Parameters': get_start_parameters(state.map_machine, {MAP_DATA.ITEM + '.$': '$$.Map.Item.Value'}),
+                'Iterator': get_definition(self.graphs[state.map_machine], self.graphs, self.lambda_arn,
+                                           parents=self.parents, delta=self.delta),
+                'ResultPath': _path(PAYLOAD.USER_CONTEXT, MAP_DATA.RESULTS)
+            }
+            if state.map_concurrency:
+                data['MaxConcurrency'] = state.map_concurrency
+        else:
+            data = {
+                'Type': 'Parallel',
+                'Branches': [get_definition(self.graphs[name], self.graphs, self.lambda_arn,
+                                            parents=self.parents, start=True, delta=self.delta)
+                             for name in state.parallel_machines],
+                'ResultPath': _path(PAYLOAD.USER_CONTEXT, JOIN_DATA.RESULTS)
+            }
+        states = {state.name: data}
+
+        merge_name = self.get_entry_name(state.name)
+        if merge_name != state.name:
+            states[merge_name] = {
+                'Type': 'Pass',
+                'Parameters': get_merge_parameters(),
+                'Next': state.name
+            }
+
+        # once the results are in, continue with the (first) transition
+        if state.final or not state.transitions:
+            data['End'] = True
+        else:
+            transition = state.transitions[0]
+            resume_name = state.name + RESUME_SUFFIX
+            data['Next'] = resume_name
+            states[resume_name] = {
+                'Type': 'Pass',
+                'Parameters': get_resume_parameters(state.name, transition.event, delta=self.delta),
+                'Next': transition.target  # the user context is already merged
+            }
+        return states
+
+    def get_task_states(self, state):
+        """
+        Returns the Task state (and the Choice state, if needed) for a state.
+
+        :param state: an aws_lambda_fsm.graph.StateNode instance.
+        :return: a dict of {str state name: dict}.
+        """
+        data = {
+            'Type': 'Task',
+            'Resource': self.lambda_arn,
+            'Retry': get_retry(state)
+        }
+        states = {state.name: data}
+
+        # pass the options along with the payload
+        if self.delta or self.inline:
+            parameters = {AWS.STEP_FUNCTION: True, STEP_FUNCTION_DATA.PAYLOAD + '.$': '$'}
+            if self.delta:
+                parameters[STEP_FUNCTION_DATA.DELTA] = True
+                data['ResultPath'] = self.result_path
+            if self.inline:
+                parameters[STEP_FUNCTION_DATA.INLINE] = True
+            if self.stop_states:
+                parameters[STEP_FUNCTION_DATA.STOP_STATES] = self.stop_states
+            data['Parameters'] = parameters
+
+        # inline steps can finish in any state, so all the Tasks share a Choice state
+        if self.inline:
+            data['Next'] = self.graph.name + DISPATCH_SUFFIX
+        elif state.final or not state.transitions:
+            data['End'] = True
+        elif state.next_transition:
+            data['Next'] = self.get_entry_name(state.next_transition.target)
+        else:
+            choices_name = state.name + CHOICES_SUFFIX
+            data['Next'] = choices_name
+            states[choices_name] = {
+                'Type': 'Choice',
+                'Choices': [
+                    {
+                        'Variable': self.get_variable(SYSTEM_CONTEXT.CURRENT_EVENT),
+                        'StringEquals': transition.event,
+                        'Next': self.get_entry_name(transition.target)
+                    }
+                    for transition in state.transitions
+                ]
+            }
+        return states
+
+    def get_dispatch_states(self):
+        """
+        Returns the Choice state that follows every Task when steps run inline,
+        which routes on the state and event the Task finished with, and the
+        Succeed state for when the machine finishes.
+
+        :return: a dict of {str state name: dict}.
+        """
+        done_name = self.graph.name + DONE_SUFFIX
+        choices = [{'Variable': self.result_path, 'IsNull': True, 'Next': done_name}]
+        for state in self.graph.states.values():
+            if state.children:
+                continue
+            for transition in state.transitions:
+                choices.append({
+                    'And': [
+                        {'Variable': self.get_variable(SYSTEM_CONTEXT.CURRENT_STATE), 'StringEquals': state.name},
+                        {'Variable': self.get_variable(SYSTEM_CONTEXT.CURRENT_EVENT), 'StringEquals': transition.event}
+                    ],
+                    'Next': self.get_entry_name(transition.target)
+                })
+        return {
+            self.graph.name + DISPATCH_SUFFIX: {'Type': 'Choice', 'Choices': choices},
+            done_name: {'Type': 'Succeed'}
+        }
+
+
+def get_states(graph, graphs, lambda_arn, parents=(), delta=False):
+    """
+    Returns the States for a single machine. Each fsm state becomes a Task
+    that runs the transition into the state. A Choice state is only added
+    for states with more than one transition, since the Task can go straight
+    to the next state otherwise.
+
+    When the machine has inline_steps, each Task runs as many steps as the
+    budget allows, and is followed by a single Choice state on the state and
+    event it finished with.
+
+    :param graph: an aws_lambda_fsm.graph.MachineGraph instance.
+    :param graphs: a dict of {str machine name: MachineGraph}.
+    :param lambda_arn: a str AWS Lambda function ARN.
+    :param parents: a tuple of str machine names already being converted.
+    :param delta: a bool, True to have the Tasks return only the changes to the
+      user context, which are kept under "delta" (see aws_lambda_fsm.handler).
+    :return: a dict of {str state name: dict}.
+    """
+    return _Converter(graph, graphs, lambda_arn, parents, delta).get_states()
+
+
+def get_definition(graph, graphs, lambda_arn, parents=(), start=False, comment=None, delta=False):
+    """
+    Returns a https://states-language.net/spec.html compliant definition
+    representing a machine.
+
+    :param graph: an aws_lambda_fsm.graph.MachineGraph instance.
+    :param graphs: a dict of {str machine name: MachineGraph}.
+    :param lambda_arn: a str AWS Lambda function ARN.
+    :param parents: a tuple of str machine names already being converted.
+    :param start: a bool, True to add a Pass state that builds the payload
+      for starting the machine from the input user context.
+    :param comment: an optional str Comment.
+    :param delta: a bool, True to have the Tasks return only the changes to the
+      user context.
+    :return: a dict.
+    """
+    states = get_states(graph, graphs, lambda_arn, parents=parents, delta=delta)
+    data = {
+        'StartAt': graph.initial_state.name,
+        'States': states
+    }
+    if start:
+        start_name = graph.name + START_SUFFIX
+        states[start_name] = {
+            'Type': 'Pass',
+            'Parameters': get_start_parameters(graph.name, _path(PAYLOAD.USER_CONTEXT)),
+            'Next': data['StartAt']
+        }
+        data['StartAt'] = start_name
+    if comment:
+        data['Comment'] = comment
+    return data
@@ -0,0 +1,130 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# system imports
+from threading import RLock
+import logging
+import time
+
+# library imports
+
+# application imports
+from aws_lambda_fsm.constants import THROTTLE_DATA
+from aws_lambda_fsm.config import get_settings
+from aws_lambda_fsm.registry import Registry
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+class Object(object):
+    pass
+
+_local = Object()
+_local.buckets = Registry(lambda arn: TokenBucket(
+    arn,
+    max_rate=getattr(settings, 'KINESIS_MAX_RATE', None),
+    max_wait=getattr(settings, 'KINESIS_THROTTLE_MAX_WAIT', THROTTLE_DATA.MAX_WAIT)
+))
+
+
+class TokenBucket(object):
+    """
+    A token bucket that learns the sustainable rate of a stream from throttling
+    responses (additive increase, multiplicative decrease).
+
+    The bucket starts unlimited. The first throttle sets the rate to a fraction of
+    the rate observed over the previous second, each subsequent throttle halves it,
+    and each successful put raises it a little, so the rate converges just below
+    what the stream will accept.
+    """
+
+    def __init__(self, name, max_rate=None, max_wait=THROTTLE_DATA.MAX_WAIT):
+        """
+        :param name: a str name (the stream arn) used for logging.
+        :param max_rate: a float max number of records/sec, or None for unlimited.
+        :param max_wait: a float max number of seconds to wait for a token.
+        """
+        self.name = name
+        self.max_rate = max_rate
+        self.max_wait = max_wait
+        self.rate = max_rate
+        self.tokens = 0.
+        self.updated_at = time.time()
+        self.window_started_at = self.updated_at
+        self.window_count = 0
+        self.last_window_rate = 0.
+        self._lock = RLock()
+
+    def acquire(self):
+        """
+        Takes a token, sleeping until one is available (or max_wait has elapsed).
+        Tokens are reserved before sleeping, so concurrent threads queue up fairly.
+
+        :return: a float number of seconds slept.
+        """
+        with self._lock:
+            if self.rate is None:
+                return 0.
+            now = time.time()
+            capacity = max(1., self.rate * THROTTLE_DATA.BURST)
+            self.tokens = min(capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens = max(-self.rate * self.max_wait, self.tokens - 1.)
+            wait = min(self.max_wait, -self.tokens / self.rate) if self.tokens < 0 else 0.
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def succeeded(self):
+        """
+        Records a successful put.
+        """
+        with self._lock:
+            now = time.time()
+            elapsed = now - self.window_started_at
+            if elapsed >= 1.:
+                self.last_window_rate = self.window_count / elapsed
+                self.window_started_at = now
+                self.window_count = 0
+            self.window_count += 1
+            if self.rate is not None:
+                self.rate += THROTTLE_DATA.INCREASE
+                if self.max_rate is not None:
+                    self.rate = min(self.max_rate, self.rate)
+
+    def throttled(self):
+        """
+        Records a throttled put.
+        """
+        with self._lock:
+            now = time.time()
+            if self.rate is None:
+                elapsed = max(1., now - self.window_started_at)
+                self.rate = max(self.last_window_rate, self.window_count / elapsed)
+            self.rate = max(THROTTLE_DATA.MIN_RATE, self.rate * THROTTLE_DATA.DECREASE)
+            self.tokens = min(0., self.tokens)
+            self.updated_at = now
+            logger.warning('Throttled by %s, limiting to %.1f records/sec.', self.name, self.rate)
+
+
+def get_token_bucket(arn):
+    """
+    Returns the (cached) TokenBucket for a stream, so the learned rate carries
+    across invocations.
+
+    :param arn: a str ARN like 'arn:partition:kinesis:region:account:resource'
+    :return: a aws_lambda_fsm.throttle.TokenBucket instance.
+    """
+    return _local.buckets.get(arn)
@@ -0,0 +1,439 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# system imports
+from threading import RLock
+import binascii
+import json
+import logging
+import os
+import threading
+import time
+import urllib2
+
+# library imports
+
+# application imports
+from aws_lambda_fsm.constants import SPAN
+from aws_lambda_fsm.constants import OTLP
+from aws_lambda_fsm.config import get_settings
+from aws_lambda_fsm.config import import_class
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+class Object(object):
+    pass
+
+_local = Object()
+_local.sink = None
+_local.sink_loaded = False
+_lock = RLock()
+
+# the attributes (correlation_id, steps, etc.), trace_id and span_id of the step
+# (or action) being executed on the current thread. spans recorded on the thread
+# are children of that span.
+_trace_context = threading.local()
+
+
+def new_trace_id():
+    """
+    :return: a random 32 character hex str.
+    """
+    return binascii.hexlify(os.urandom(16))
+
+
+def new_span_id():
+    """
+    :return: a random 16 character hex str.
+    """
+    return binascii.hexlify(os.urandom(8))
+
+
+class Span(object):
+    """
+    A single step, action, or call to a backend service.
+    """
+
+    __slots__ = ('service', 'operation', 'started_at', 'duration', 'payload_size', 'outcome', 'attributes',
+                 'trace_id', 'span_id', 'parent_span_id')
+
+    def __init__(self, service, operation, started_at, duration, payload_size, outcome, attributes,
+                 trace_id=None, span_id=None, parent_span_id=None):
+        """
+        :param service: a str service name like "kinesis" or "fsm".
+        :param operation: a str operation name like "put_record" or "step".
+        :param started_at: a float timestamp.
+        :param duration: a float number of seconds.
+        :param payload_size: an int (approximate) number of bytes sent.
+        :param outcome: a str like "ok", or an error code/exception name.
+        :param attributes: a dict of trace context like {'correlation_id': 'abc', 'steps': 1}.
+        :param trace_id: a str trace id, shared by all the spans of a machine execution.
+        :param span_id: a str span id.
+        :param parent_span_id: a str span id.
+        """
+        self.service = service
+        self.operation = operation
+        self.started_at = started_at
+        self.duration = duration
+        self.payload_size = payload_size
+        self.outcome = outcome
+        self.attributes = attributes
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_span_id = parent_span_id
+
+    def to_dict(self):
+        data = dict(self.attributes)
+        data.update({
+            SPAN.SERVICE: self.service,
+            SPAN.OPERATION: self.operation,
+            SPAN.STARTED_AT: self.started_at,
+            SPAN.DURATION: self.duration,
+            SPAN.PAYLOAD_SIZE: self.payload_size,
+            SPAN.OUTCOME: self.outcome,
+            SPAN.TRACE_ID: self.trace_id,
+            SPAN.SPAN_ID: self.span_id,
+            SPAN.PARENT_SPAN_ID: self.parent_span_id
+        })
+        return data
+
+    def to_otlp(self):
+        """
+        Returns the span in the OpenTelemetry protocol (OTLP) json encoding.
+
+        :return: a dict.
+        """
+        attributes = dict(self.attributes)
+        attributes.update({
+            SPAN.SERVICE: self.service,
+            SPAN.PAYLOAD_SIZE: self.payload_size,
+            SPAN.OUTCOME: self.outcome
+        })
+        start = int(self.started_at * 1e9)
+        span = {
+            OTLP.TRACE_ID: self.trace_id,
+            OTLP.SPAN_ID: self.span_id,
+            OTLP.NAME: '%s.%s' % (self.service, self.operation),
+            OTLP.KIND: OTLP.KIND_INTERNAL if self.service == SPAN.FSM else OTLP.KIND_CLIENT,
+            OTLP.START_TIME: str(start),
+            OTLP.END_TIME: str(start + int(self.duration * 1e9)),
+            OTLP.ATTRIBUTES: [
+                {OTLP.KEY: key, OTLP.VALUE: {OTLP.STRING_VALUE: unicode(value)}}
+                for key, value in sorted(attributes.items())
+            ],
+            OTLP.STATUS: {OTLP.CODE: OTLP.STATUS_OK if self.outcome == SPAN.OK else OTLP.STATUS_ERROR}
+        }
+        if self.parent_span_id:
+            span[OTLP.PARENT_SPAN_ID] = self.parent_span_id
+        return span
+
+
+class SpanSink(object):
+    """
+    Receives spans. Subclasses must be thread-safe, since machines may be
+    dispatched concurrently.
+    """
+
+    def record(self, span):
+        """
+        :param span: an aws_lambda_fsm.tracing.Span instance.
+        """
+        pass
+
+    def flush(self):
+        """
+        Exports any buffered spans. Called at the end of each handler invocation.
+        """
+        pass
+
+
+class LoggingSpanSink(SpanSink):
+    """
+    Logs each span as a json line.
+    """
+
+    def record(self, span):
+        logger.info('span=%s', json.dumps(span.to_dict(), sort_keys=True))
+
+
+class BufferingSpanSink(SpanSink):
+    """
+    Buffers spans, and exports them in a single OTLP json request when flushed.
+    Subclasses implement export.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._lock = RLock()
+
+    def record(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def flush(self):
+        with self._lock:
+            spans, self.spans = self.spans, []
+        if spans:
+            self.export(json.dumps(get_otlp_request(spans), sort_keys=True))
+
+    def export(self, data):
+        """
+        Sends the request. Called by flush, outside the lock, when spans are
+        buffered. Errors are logged by flush_spans.
+
+        :param data: a json str OTLP ExportTraceServiceRequest.
+        """
+        raise NotImplementedError()  # pragma: no cover
+
+
+class FileSpanSink(BufferingSpanSink):
+    """
+    Appends a line of OTLP json to settings.TRACE_FILE per flush (the format of
+    the OpenTelemetry collector's file exporter/receiver).
+    """
+
+    def export(self, data):
+        with open(getattr(settings, 'TRACE_FILE', SPAN.DEFAULT_FILE), 'a') as f:
+            f.write(data + '\n')
+
+
+class OtlpHttpSpanSink(BufferingSpanSink):
+    """
+    Posts OTLP json to settings.TRACE_OTLP_ENDPOINT, like a local OpenTelemetry
+    collector's "http://localhost:4318/v1/traces".
+    """
+
+    def export(self, data):
+        request = urllib2.Request(getattr(settings, 'TRACE_OTLP_ENDPOINT', SPAN.DEFAULT_OTLP_ENDPOINT),
+                                  data, {'Content-Type': 'application/json'})
+        urllib2.urlopen(request, timeout=SPAN.OTLP_TIMEOUT).close()
+
+
+def get_otlp_request(spans):
+    """
+    Returns an OTLP json ExportTraceServiceRequest.
+
+    :param spans: a list of aws_lambda_fsm.tracing.Span instances.
+    :return: a dict.
+    """
+    return {
+        OTLP.RESOURCE_SPANS: [
+            {
+                OTLP.RESOURCE: {
+                    OTLP.ATTRIBUTES: [
+                        {OTLP.KEY: OTLP.SERVICE_NAME, OTLP.VALUE: {OTLP.STRING_VALUE: OTLP.SCOPE_NAME}}
+                    ]
+                },
+                OTLP.SCOPE_SPANS: [
+                    {
+                        OTLP.SCOPE: {OTLP.NAME: OTLP.SCOPE_NAME},
+                        OTLP.SPANS: [span.to_otlp() for span in spans]
+                    }
+                ]
+            }
+        ]
+    }
+
+
+def get_span_sink():
+    """
+    Returns the (cached) span sink, constructed from the class named in
+    settings.TRACE_SINK like 'aws_lambda_fsm.tracing.LoggingSpanSink', or
+    None if tracing is disabled.
+
+    :return: an aws_lambda_fsm.tracing.SpanSink instance, or None.
+    """
+    if not _local.sink_loaded:
+        with _lock:
+            if not _local.sink_loaded:
+                name = getattr(settings, 'TRACE_SINK', None)
+                _local.sink = import_class(name)() if name else None
+                _local.sink_loaded = True
+    return _local.sink
+
+
+def get_trace_context():
+    """
+    :return: a dict of the attributes attached to spans on the current thread.
+    """
+    return getattr(_trace_context, 'attributes', None) or {}
+
+
+class ActiveSpan(object):
+    """
+    A span that has been started (see start_span) but not yet finished.
+    """
+
+    __slots__ = ('sink', 'service', 'operation', 'started_at', 'attributes',
+                 'trace_id', 'span_id', 'parent_span_id', 'previous')
+
+    def __init__(self, sink, service, operation, attributes, trace_id, parent_span_id, previous):
+        self.sink = sink
+        self.service = service
+        self.operation = operation
+        self.attributes = attributes
+        self.trace_id = trace_id
+        self.span_id = new_span_id()
+        self.parent_span_id = parent_span_id
+        self.previous = previous
+        self.started_at = time.time()
+
+
+def start_span(service, operation, attributes=None, trace_id=None, parent_span_id=None):
+    """
+    Starts a span, and makes it the parent of the spans started/recorded on the
+    current thread until it is finished. The trace_id and parent default to the
+    span already active on the thread (if any), and the attributes are added to
+    the active attributes.
+
+    :param service: a str service name like "fsm".
+    :param operation: a str operation name like "step".
+    :param attributes: a dict like {'correlation_id': 'abc', 'steps': 1}.
+    :param trace_id: a str trace id (a new trace is started if there is none).
+    :param parent_span_id: a str span id.
+    :return: an aws_lambda_fsm.tracing.ActiveSpan instance, or None if tracing is disabled.
+    """
+    sink = get_span_sink()
+    if sink is None:
+        return None
+    previous = (getattr(_trace_context, 'attributes', None),
+                getattr(_trace_context, 'trace_id', None),
+                getattr(_trace_context, 'span_id', None))
+    merged = dict(previous[0] or {})
+    merged.update(attributes or {})
+    span = ActiveSpan(sink, service, operation, merged,
+                      trace_id or previous[1] or new_trace_id(),
+                      parent_span_id or previous[2],
+                      previous)
+    _trace_context.attributes, _trace_context.trace_id, _trace_context.span_id = \
+        span.attributes, span.trace_id, span.span_id
+    return span
+
+
+def finish_span(span, outcome=SPAN.OK, payload_size=0):
+    """
+    Finishes a span, records it to the sink, and restores the span that was active
+    on the current thread when it was started.
+
+    :param span: an aws_lambda_fsm.tracing.ActiveSpan instance.
+    :param outcome: a str like "ok", or an error name.
+    :param payload_size: an int (approximate) number of bytes.
+    """
+    _trace_context.attributes, _trace_context.trace_id, _trace_context.span_id = span.previous
+    try:
+        span.sink.record(Span(span.service, span.operation, span.started_at, time.time() - span.started_at,
+                              payload_size, outcome, span.attributes,
+                              trace_id=span.trace_id, span_id=span.span_id, parent_span_id=span.parent_span_id))
+    except Exception:
+        logger.exception('Error recording span.')
+
+
+class _NullSpan(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Traced(object):
+
+    __slots__ = ('service', 'operation', 'attributes', 'span')
+
+    def __init__(self, service, operation, attributes):
+        self.service = service
+        self.operation = operation
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.span = start_span(self.service, self.operation, attributes=self.attributes)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        finish_span(self.span, outcome=exc_type.__name__ if exc_type else SPAN.OK)
+
+
+def traced(service, operation, attributes=None):
+    """
+    Returns a context manager that records a span for a block of code. When
+    tracing is disabled, this is a shared no-op.
+
+        with traced(SPAN.FSM, SPAN.ACTION, {'current_state': 'a'}):
+            ...
+
+    :param service: a str service name like "fsm".
+    :param operation: a str operation name like "action".
+    :param attributes: a dict of additional attributes.
+    :return: a context manager.
+    """
+    if get_span_sink() is None:
+        return _NULL_SPAN
+    return _Traced(service, operation, attributes)
+
+
+def flush_spans():
+    """
+    Flushes the span sink. Called at the end of each handler invocation, since
+    AWS Lambda may freeze the process afterwards.
+    """
+    try:
+        sink = get_span_sink()
+        if sink is not None:
+            sink.flush()
+    except Exception:
+        logger.exception('Error flushing spans.')
+
+
+def get_payload_size(value):
+    """
+    Returns the approximate size of a request, as the total length of its strings.
+
+    :param value: a str, dict, list, etc.
+    :return: an int.
+    """
+    if isinstance(value, basestring):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(get_payload_size(v) for v in value.itervalues())
+    if isinstance(value, (list, tuple)):
+        return sum(get_payload_size(v) for v in value)
+    return 0
+
+
+def record_span(sink, service, operation, started_at, duration, payload, outcome):
+    """
+    Records a span for a backend call to the sink, as a child of the span active on
+    the current thread (or in a trace of its own if there is none). Errors are logged,
+    and never affect the traced call.
+
+    :param sink: an aws_lambda_fsm.tracing.SpanSink instance.
+    :param service: a str service name like "kinesis".
+    :param operation: a str operation name like "put_record".
+    :param started_at: a float timestamp.
+    :param duration: a float number of seconds.
+    :param payload: the request arguments, used to compute the payload size.
+    :param outcome: a str like "ok", or an error code/exception name.
+    """
+    try:
+        sink.record(Span(service, operation, started_at, duration,
+                         get_payload_size(payload), outcome, get_trace_context(),
+                         trace_id=getattr(_trace_context, 'trace_id', None) or new_trace_id(),
+                         span_id=new_span_id(),
+                         parent_span_id=getattr(_trace_context, 'span_id', None)))
+    except Exception:
+        logger.exception('Error recording span.')
@@ -27,6 +27,8 @@ class Transition(object):
     State machine transition.
     """
 
+    __slots__ = ('name', 'target', 'action')
+
     def __init__(self, name, target, action=None):
         """
         Construct a state machine transition.
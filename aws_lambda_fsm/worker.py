@@ -0,0 +1,496 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# system imports
+import base64
+import logging
+import threading
+import time
+
+# library imports
+from botocore.exceptions import ClientError
+
+# application imports
+from aws_lambda_fsm.aws import get_connection
+from aws_lambda_fsm.aws import get_arn_from_arn_string
+from aws_lambda_fsm.aws import acquire_lease
+from aws_lambda_fsm.aws import release_lease
+from aws_lambda_fsm.aws import renew_lease
+from aws_lambda_fsm.aws import store_shard_checkpoint
+from aws_lambda_fsm.aws import load_shard_checkpoint
+from aws_lambda_fsm.aws import put_metrics
+from aws_lambda_fsm.handler import lambda_kinesis_handler
+from aws_lambda_fsm.constants import AWS_KINESIS
+from aws_lambda_fsm.constants import AWS_LAMBDA
+from aws_lambda_fsm.constants import CHECKPOINT_DATA
+from aws_lambda_fsm.constants import WORKER_DATA
+
+logger = logging.getLogger(__name__)
+
+
+class WeightedSemaphore(object):
+    """
+    A semaphore shared between the workers for several lanes (see settings.STREAM_LANES)
+    in a single process. When batches from more than one lane are waiting, permits are
+    granted in proportion to the weights of the lanes (stride scheduling), so a flood
+    of events on a low priority lane can not starve a high priority lane, and a lane
+    with nothing to do leaves its share to the others.
+    """
+
+    def __init__(self, value, weights):
+        """
+        Construct a weighted semaphore.
+
+        :param value: an int max number of permits held at once.
+        :param weights: a dict of {str lane: int weight}.
+        """
+        self.value = value
+        self.weights = weights
+        self.passes = dict.fromkeys(weights, 0.)
+        self.waiting = dict.fromkeys(weights, 0)
+        self.current_pass = 0.
+        self.condition = threading.Condition()
+
+    def _next_lane(self):
+        waiting = [lane for lane, count in self.waiting.items() if count]
+        return min(waiting, key=lambda lane: (self.passes[lane], lane))
+
+    def acquire(self, lane):
+        """
+        Blocks until a permit is granted to the lane.
+
+        :param lane: a str lane name.
+        """
+        with self.condition:
+            if not self.waiting[lane]:
+                # an idle lane does not get to catch up on the permits it did not use
+                self.passes[lane] = max(self.passes[lane], self.current_pass)
+            self.waiting[lane] += 1
+            while not self.value or self._next_lane() != lane:
+                self.condition.wait()
+            self.waiting[lane] -= 1
+            self.value -= 1
+            self.current_pass = self.passes[lane]
+            self.passes[lane] += 1. / self.weights[lane]
+            self.condition.notify_all()
+
+    def release(self):
+        """
+        Returns a permit.
+        """
+        with self.condition:
+            self.value += 1
+            self.condition.notify_all()
+
+    def lane(self, lane):
+        """
+        Returns a context manager that holds a permit for the lane, suitable for
+        passing to an aws_lambda_fsm.worker.Worker.
+
+        :param lane: a str lane name.
+        :return: a context manager.
+        """
+        return _Lane(self, lane)
+
+
+class _Lane(object):
+
+    def __init__(self, semaphore, lane):
+        self.semaphore = semaphore
+        self.lane = lane
+
+    def __enter__(self):
+        self.semaphore.acquire(self.lane)
+
+    def __exit__(self, *args):
+        self.semaphore.release()
+
+
+class ShardConsumer(threading.Thread):
+    """
+    Consumes a single Kinesis shard, passing batches of records to the worker's
+    lambda handler.
+
+    The consumer only runs while it owns the lease for the shard, and checkpoints
+    the sequence number of the last processed record, so that a consumer in another
+    worker process can resume from where this one stopped. Processing is at-least-once,
+    so records processed after the last checkpoint may be processed again, and are
+    de-duplicated by the usual fsm idempotency checks.
+    """
+
+    def __init__(self, worker, shard_id):
+        """
+        Construct a shard consumer.
+
+        :param worker: an aws_lambda_fsm.worker.Worker instance.
+        :param shard_id: a str shard id like 'shardId-000000000000'.
+        """
+        super(ShardConsumer, self).__init__(name=shard_id)
+        self.daemon = True
+        self.worker = worker
+        self.shard_id = shard_id
+        self.lease_key = WORKER_DATA.LEASE_KEY_PREFIX + worker.stream_name + '-' + shard_id
+        self.fence_token = None
+        self.lease_acquired_at = 0
+        self.shard_iterator = None
+        self.sequence_number = None
+        self.checkpointed = None
+        self.checkpointed_at = 0
+        self.millis_behind_latest = 0
+        self.backoff = 0
+        self.finished = False
+
+    def acquire(self):
+        """
+        Acquires the lease for this shard.
+
+        :return: True if the lease was acquired.
+        """
+        fence_token = acquire_lease(self.lease_key, 0, 0, timeout=self.worker.lease_timeout)
+        if fence_token:
+            self.fence_token = fence_token
+            self.lease_acquired_at = time.time()
+        return bool(fence_token)
+
+    def release(self):
+        """
+        Releases the lease for this shard, if it is held.
+        """
+        if self.fence_token:
+            release_lease(self.lease_key, 0, 0, self.fence_token)
+            self.fence_token = None
+
+    def renew(self):
+        """
+        Renews the lease for this shard once half of the lease timeout has elapsed.
+        The lease is extended in place, with the same fence token, so no other
+        worker can take the shard in between.
+
+        :return: True if this consumer still owns the shard.
+        """
+        if not self.fence_token:
+            return False
+        if time.time() - self.lease_acquired_at < self.worker.lease_timeout / 2.0:
+            return True
+        if not renew_lease(self.lease_key, 0, 0, self.fence_token, timeout=self.worker.lease_timeout):
+            logger.warning('Lost the lease for shard %s.', self.shard_id)
+            self.fence_token = None  # the lease expires on its own, if it is still ours at all
+            return False
+        self.lease_acquired_at = time.time()
+        return True
+
+    def get_shard_iterator(self):
+        """
+        Returns a shard iterator positioned after the last processed (or checkpointed)
+        sequence number.
+
+        :return: a str shard iterator, or None if the shard has been fully processed.
+        """
+        if self.sequence_number is None:
+            self.sequence_number = self.checkpointed = \
+                load_shard_checkpoint(self.worker.stream_arn, self.shard_id)
+
+        if self.sequence_number == CHECKPOINT_DATA.SHARD_END:
+            self.finished = True
+            return None
+
+        kwargs = {'StreamName': self.worker.stream_name, 'ShardId': self.shard_id}
+        if self.sequence_number:
+            kwargs['ShardIteratorType'] = AWS_KINESIS.AFTER_SEQUENCE_NUMBER
+            kwargs['StartingSequenceNumber'] = self.sequence_number
+        else:
+            kwargs['ShardIteratorType'] = self.worker.initial_position
+        return self.worker.kinesis_conn.get_shard_iterator(**kwargs)[AWS_KINESIS.ShardIterator]
+
+    def process_batch(self):
+        """
+        Gets a single batch of records from the shard and passes them to the
+        lambda handler.
+
+        :return: the int number of records processed.
+        """
+        try:
+            out = self.worker.kinesis_conn.get_records(
+                ShardIterator=self.shard_iterator,
+                Limit=self.worker.batch_size
+            )
+        except ClientError, e:
+            if e.response['Error']['Code'] == AWS_KINESIS.ProvisionedThroughputExceededException:
+                self.backoff = min(max(self.backoff * 2, WORKER_DATA.MIN_GET_RECORDS_INTERVAL),
+                                   WORKER_DATA.MAX_BACKOFF)
+                return 0
+            raise
+
+        self.backoff = 0
+        self.shard_iterator = out.get(AWS_KINESIS.NextShardIterator)
+        self.millis_behind_latest = out.get(AWS_KINESIS.MillisBehindLatest, 0)
+        records = out[AWS_KINESIS.Records]
+
+        if records:
+            lambda_event = {
+                AWS_LAMBDA.Records: [
+                    {
+                        AWS_LAMBDA.KINESIS_RECORD.KINESIS: {
+                            AWS_LAMBDA.KINESIS_RECORD.DATA: base64.b64encode(record[AWS_KINESIS.RECORD.Data])
+                        }
+                    } for record in records
+                ]
+            }
+
+            # the semaphore limits the number of batches in-flight across all shards
+            with self.worker.semaphore:
+                self.worker.handler(lambda_event)
+            self.sequence_number = records[-1][AWS_KINESIS.RECORD.SequenceNumber]
+            self.worker.record_batch(len(records))
+
+        # a closed (split/merged) shard has no next iterator
+        if not self.shard_iterator:
+            self.finished = True
+            self.sequence_number = CHECKPOINT_DATA.SHARD_END
+
+        return len(records)
+
+    def checkpoint(self, force=False):
+        """
+        Stores the last processed sequence number, at most once per checkpoint interval.
+
+        :param force: if True, ignore the checkpoint interval.
+        """
+        now = time.time()
+        if self.sequence_number and self.sequence_number != self.checkpointed and \
+                (force or now - self.checkpointed_at >= self.worker.checkpoint_interval):
+            store_shard_checkpoint(self.worker.stream_arn, self.shard_id, self.sequence_number)
+            self.checkpointed = self.sequence_number
+            self.checkpointed_at = now
+
+    def run(self):
+        """
+        Consumes the shard until the worker is stopped, the shard is closed, or
+        the lease is lost.
+        """
+        logger.info('Starting consumer for shard %s.', self.shard_id)
+        try:
+            while not self.worker.stopped.is_set() and not self.finished and self.renew():
+
+                count = 0
+                started_at = time.time()
+                try:
+                    if not self.shard_iterator:
+                        self.shard_iterator = self.get_shard_iterator()
+                    if self.shard_iterator:
+                        count = self.process_batch()
+                    self.checkpoint()
+                except Exception:
+                    logger.exception('Error consuming shard %s.', self.shard_id)
+                    self.worker.record_error()
+                    self.shard_iterator = None
+                    self.backoff = min(max(self.backoff * 2, self.worker.sleep_time), WORKER_DATA.MAX_BACKOFF)
+
+                # kinesis only allows 5 reads/sec/shard, and there is no point spinning
+                # on a shard that has been fully consumed.
+                if self.backoff:
+                    delay = self.backoff
+                elif count:
+                    delay = WORKER_DATA.MIN_GET_RECORDS_INTERVAL - (time.time() - started_at)
+                else:
+                    delay = self.worker.sleep_time
+                if delay > 0:
+                    self.worker.stopped.wait(delay)
+
+        finally:
+            # a consumer that lost the lease must not checkpoint, since that could
+            # move the new owner's checkpoint backwards
+            try:
+                if self.renew():
+                    self.checkpoint(force=True)
+            except Exception:
+                logger.exception('Error checkpointing shard %s.', self.shard_id)
+            self.release()
+            logger.info('Stopped consumer for shard %s.', self.shard_id)
+
+
+class Worker(object):
+    """
+    A long-running (non-Lambda) runtime that consumes a Kinesis stream directly
+    with a thread per shard. Shard ownership is coordinated between worker
+    processes with leases in the cache source, so a fleet of workers can share
+    a stream.
+    """
+
+    def __init__(self,
+                 stream_arn,
+                 handler=None,
+                 batch_size=100,
+                 sleep_time=1.0,
+                 max_shards=0,
+                 max_concurrent_batches=0,
+                 semaphore=None,
+                 initial_position=AWS_KINESIS.TRIM_HORIZON,
+                 lease_timeout=WORKER_DATA.LEASE_TIMEOUT,
+                 checkpoint_interval=WORKER_DATA.CHECKPOINT_INTERVAL,
+                 rebalance_interval=WORKER_DATA.REBALANCE_INTERVAL,
+                 metrics_interval=WORKER_DATA.METRICS_INTERVAL):
+        """
+        Construct a worker.
+
+        :param stream_arn: a str ARN for a Kinesis stream.
+        :param handler: a function accepting a lambda event (defaults to lambda_kinesis_handler).
+        :param batch_size: an int max number of records per handler call.
+        :param sleep_time: a float number of seconds to wait when a shard has no new records.
+        :param max_shards: an int max number of shards owned by this worker (0 is unlimited).
+        :param max_concurrent_batches: an int max number of batches processed at once
+          across all shards (0 is unlimited).
+        :param semaphore: an optional context manager limiting the batches processed at once,
+          shared with the workers for other lanes (see aws_lambda_fsm.worker.WeightedSemaphore).
+        :param initial_position: the str shard iterator type used when a shard has no checkpoint.
+        :param lease_timeout: an int number of seconds a shard lease is held for.
+        :param checkpoint_interval: an int number of seconds between checkpoints.
+        :param rebalance_interval: an int number of seconds between attempts to acquire more shards.
+        :param metrics_interval: an int number of seconds between metrics flushes.
+        """
+        self.stream_arn = stream_arn
+        self.stream_name = get_arn_from_arn_string(stream_arn).slash_resource()
+        self.kinesis_conn = get_connection(stream_arn)
+        self.handler = handler or lambda_kinesis_handler
+        self.batch_size = batch_size
+        self.sleep_time = sleep_time
+        self.max_shards = max_shards
+        self.semaphore = semaphore or threading.BoundedSemaphore(max_concurrent_batches or 2 ** 16)
+        self.initial_position = initial_position
+        self.lease_timeout = lease_timeout
+        self.checkpoint_interval = checkpoint_interval
+        self.rebalance_interval = rebalance_interval
+        self.metrics_interval = metrics_interval
+        self.stopped = threading.Event()
+        self.consumers = {}
+        self.finished_shard_ids = set()
+        self.rebalanced_at = 0
+        self.metrics_flushed_at = time.time()
+        self._lock = threading.Lock()
+        self.records = 0
+        self.batches = 0
+        self.errors = 0
+
+    def record_batch(self, count):
+        with self._lock:
+            self.batches += 1
+            self.records += count
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def get_shard_ids(self):
+        """
+        Returns all the shard ids for the stream.
+
+        :return: a list of str shard ids.
+        """
+        shard_ids = []
+        kwargs = {'StreamName': self.stream_name}
+        while True:
+            out = self.kinesis_conn.describe_stream(**kwargs)[AWS_KINESIS.StreamDescription]
+            shard_ids.extend(shard[AWS_KINESIS.SHARD.ShardId] for shard in out[AWS_KINESIS.STREAM.Shards])
+            if not out.get(AWS_KINESIS.STREAM.HasMoreShards) or not shard_ids:
+                return shard_ids
+            kwargs['ExclusiveStartShardId'] = shard_ids[-1]
+
+    def rebalance(self):
+        """
+        Reaps stopped consumers, and starts consumers for any shards this worker
+        can acquire a lease for.
+        """
+        for shard_id, consumer in self.consumers.items():
+            if not consumer.is_alive():
+                if consumer.finished:
+                    self.finished_shard_ids.add(shard_id)
+                del self.consumers[shard_id]
+
+        for shard_id in self.get_shard_ids():
+            if self.max_shards and len(self.consumers) >= self.max_shards:
+                break
+            if shard_id in self.consumers or shard_id in self.finished_shard_ids:
+                continue
+            consumer = ShardConsumer(self, shard_id)
+            if consumer.acquire():
+                self.consumers[shard_id] = consumer
+                consumer.start()
+
+        self.rebalanced_at = time.time()
+
+    def flush_metrics(self):
+        """
+        Logs and publishes the worker metrics (via the metrics source) accumulated
+        since the last flush.
+        """
+        with self._lock:
+            data = {
+                WORKER_DATA.METRICS.RECORDS: self.records,
+                WORKER_DATA.METRICS.BATCHES: self.batches,
+                WORKER_DATA.METRICS.ERRORS: self.errors
+            }
+            self.records = self.batches = self.errors = 0
+        consumers = self.consumers.values()
+        data[WORKER_DATA.METRICS.SHARDS] = len(consumers)
+        data[WORKER_DATA.METRICS.MILLIS_BEHIND_LATEST] = \
+            max([consumer.millis_behind_latest for consumer in consumers] or [0])
+        logger.info('Worker metrics for %s: %s', self.stream_name, data)
+        try:
+            put_metrics(data, {'stream': self.stream_name})
+        except Exception:
+            logger.exception('Error publishing worker metrics.')
+        self.metrics_flushed_at = time.time()
+
+    def tick(self):
+        """
+        Runs the periodic rebalance and metrics tasks, when they are due.
+        """
+        now = time.time()
+        if now - self.rebalanced_at >= self.rebalance_interval:
+            try:
+                self.rebalance()
+            except Exception:
+                logger.exception('Error rebalancing shards.')
+        if now - self.metrics_flushed_at >= self.metrics_interval:
+            self.flush_metrics()
+
+    def run(self):
+        """
+        Runs the worker until stop() is called, then shuts down gracefully.
+        """
+        logger.info('Starting worker for %s.', self.stream_name)
+        while not self.stopped.is_set():
+            self.tick()
+            self.stopped.wait(self.sleep_time)
+        self.shutdown()
+
+    def stop(self, *args):
+        """
+        Signals the worker and its consumers to stop. Suitable for use as a signal handler.
+        """
+        logger.info('Stopping worker for %s.', self.stream_name)
+        self.stopped.set()
+
+    def shutdown(self, timeout=None):
+        """
+        Waits for all consumers to finish their current batch, checkpoint and
+        release their leases.
+
+        :param timeout: a float number of seconds to wait for each consumer.
+        """
+        self.stopped.set()
+        for consumer in self.consumers.values():
+            consumer.join(timeout)
+        self.flush_metrics()
+        logger.info('Stopped worker for %s.', self.stream_name)
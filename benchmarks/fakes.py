@@ -0,0 +1,181 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# fakes.py
+#
+# In-memory stand-ins for the stream/cache/checkpoint/retry backends used by
+# aws_lambda_fsm.fsm, with injectable latency, and per-phase timing.
+
+# system imports
+import json
+import time
+
+# library imports
+
+# application imports
+from aws_lambda_fsm import fsm
+from aws_lambda_fsm import handler
+
+
+class Phases(object):
+    """
+    Accumulates the wall-clock time spent in each phase of dispatch.
+    """
+
+    LEASE = 'lease'
+    IDEMPOTENCY = 'idempotency'
+    ACTION = 'action'
+    SERIALIZATION = 'serialization'
+    SEND = 'send'
+    CHECKPOINT = 'checkpoint'
+    RETRY = 'retry'
+    ALL = [LEASE, IDEMPOTENCY, ACTION, SERIALIZATION, SEND, CHECKPOINT, RETRY]
+
+    def __init__(self):
+        self.seconds = dict((phase, 0.0) for phase in self.ALL)
+        self.calls = dict((phase, 0) for phase in self.ALL)
+
+    def timed(self, phase, func):
+        """
+        Returns a wrapper around func that adds its run time to phase.
+        """
+        def wrapper(*args, **kwargs):
+            started_at = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.seconds[phase] += time.time() - started_at
+                self.calls[phase] += 1
+        return wrapper
+
+    def reset(self):
+        self.__init__()
+
+
+PHASES = Phases()
+
+
+class TimedJson(object):
+    """
+    A stand-in for the json module that times dumps/loads as serialization.
+    """
+
+    def __init__(self, phases):
+        self.dumps = phases.timed(Phases.SERIALIZATION, json.dumps)
+        self.loads = phases.timed(Phases.SERIALIZATION, json.loads)
+
+
+class InMemoryBackends(object):
+    """
+    In-memory implementations of the aws_lambda_fsm.aws functions used by the
+    dispatch path. Each call sleeps for the configured latency, to approximate
+    the round-trip to a real service.
+    """
+
+    def __init__(self, latency=0.0, phases=PHASES):
+        """
+        :param latency: a float number of seconds added to each backend call.
+        :param phases: an instance of Phases.
+        """
+        self.latency = latency
+        self.phases = phases
+        self.leases = {}
+        self.dispatched = {}
+        self.stream = []
+        self.checkpoints = {}
+        self.retries = {}
+        self.errors = {}
+        self._originals = {}
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def acquire_lease(self, correlation_id, steps, retries, primary=True, timeout=None, sources=None):
+        self._wait()
+        fence_token = self.leases.get(correlation_id, (None, 0))[1] + 1
+        self.leases[correlation_id] = ((steps, retries), fence_token)
+        return fence_token
+
+    def release_lease(self, correlation_id, steps, retries, fence_token, primary=True, sources=None):
+        self._wait()
+        if self.leases.get(correlation_id) == ((steps, retries), fence_token):
+            self.leases[correlation_id] = (None, fence_token)
+            return True
+        return False
+
+    def get_message_dispatched(self, correlation_id, steps, primary=True, sources=None):
+        self._wait()
+        return self.dispatched.get((correlation_id, steps), False)
+
+    def set_message_dispatched(self, correlation_id, steps, retries, primary=True, sources=None):
+        self._wait()
+        self.dispatched[(correlation_id, steps)] = '%d-%d' % (steps, retries)
+        return True
+
+    def send_next_event_for_dispatch(self, context, data, correlation_id, delay=0, primary=True, recovering=False,
+                                     lane=None, sources=None):
+        self._wait()
+        self.stream.append(data)
+        return {'ShardId': 'shardId-000000000000', 'SequenceNumber': str(len(self.stream))}
+
+    def store_checkpoint(self, context, sent, primary=True, sources=None):
+        self._wait()
+        self.checkpoints[context.correlation_id] = sent
+        return True
+
+    def start_retries(self, context, run_at, payload, primary=True, recovering=False, lane=None, sources=None):
+        self._wait()
+        self.retries[context.correlation_id] = payload
+        return True
+
+    def stop_retries(self, context, primary=True, sources=None):
+        self._wait()
+        self.retries.pop(context.correlation_id, None)
+        return True
+
+    def increment_error_counters(self, data, dimensions):
+        for name, value in data.items():
+            self.errors[name] = self.errors.get(name, 0) + value
+
+    def install(self):
+        """
+        Replaces the backend functions (and json) used by aws_lambda_fsm.fsm and
+        aws_lambda_fsm.handler with the in-memory, timed, versions.
+        """
+        patches = [
+            (fsm, 'acquire_lease', self.phases.timed(Phases.LEASE, self.acquire_lease)),
+            (fsm, 'release_lease', self.phases.timed(Phases.LEASE, self.release_lease)),
+            (fsm, 'get_message_dispatched', self.phases.timed(Phases.IDEMPOTENCY, self.get_message_dispatched)),
+            (fsm, 'set_message_dispatched', self.phases.timed(Phases.IDEMPOTENCY, self.set_message_dispatched)),
+            (fsm, 'send_next_event_for_dispatch', self.phases.timed(Phases.SEND, self.send_next_event_for_dispatch)),
+            (fsm, 'store_checkpoint', self.phases.timed(Phases.CHECKPOINT, self.store_checkpoint)),
+            (fsm, 'stop_retries', self.phases.timed(Phases.CHECKPOINT, self.stop_retries)),
+            (fsm, 'start_retries', self.phases.timed(Phases.RETRY, self.start_retries)),
+            (fsm, 'increment_error_counters', self.increment_error_counters),
+            (fsm, 'json', TimedJson(self.phases)),
+            (handler, 'json', TimedJson(self.phases)),
+        ]
+        for module, name, value in patches:
+            self._originals[(module, name)] = getattr(module, name)
+            setattr(module, name, value)
+
+    def uninstall(self):
+        """
+        Restores the original backend functions.
+        """
+        for (module, name), value in self._originals.items():
+            setattr(module, name, value)
+        self._originals.clear()
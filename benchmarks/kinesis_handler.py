@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# kinesis_handler.py
+#
+# Throughput benchmark for handler.lambda_kinesis_handler. Drives synthetic
+# batches of kinesis records through a machine with a ring of states, against
+# the in-memory backends in benchmarks/fakes.py, and reports records/sec,
+# per-phase time and allocations. Results can be saved as a baseline, and
+# later runs compared against it.
+
+# system imports
+import argparse
+import base64
+import gc
+import json
+import logging
+import os
+import resource
+import sys
+import time
+import uuid
+
+# library imports
+
+# application imports
+from aws_lambda_fsm.action import Action
+from aws_lambda_fsm.fsm import FSM
+from aws_lambda_fsm import handler
+from benchmarks.fakes import InMemoryBackends
+from benchmarks.fakes import PHASES
+from benchmarks.fakes import Phases
+
+# setup the command line args
+parser = argparse.ArgumentParser(description='Benchmarks handler.lambda_kinesis_handler.')
+parser.add_argument('--records', type=int, default=10000)
+parser.add_argument('--batch_size', type=int, default=100)
+parser.add_argument('--num_states', type=int, default=10)
+parser.add_argument('--payload_size', type=int, default=100)
+parser.add_argument('--latency', type=float, default=0.0,
+                    help='Seconds of latency added to every in-memory backend call.')
+parser.add_argument('--baseline', default=os.path.join(os.path.dirname(__file__), 'baseline.json'))
+parser.add_argument('--save_baseline', action='store_true')
+parser.add_argument('--tolerance', type=float, default=10.0,
+                    help='Percent slowdown (vs. the baseline) considered a regression.')
+parser.add_argument('--log_level', default='CRITICAL')
+args = parser.parse_args()
+
+logging.basicConfig(
+    format='[%(levelname)s] %(asctime)-15s %(message)s',
+    level=int(args.log_level) if args.log_level.isdigit() else args.log_level,
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+
+class NextAction(Action):
+    def execute(self, context, obj):
+        started_at = time.time()
+        try:
+            return 'next'
+        finally:
+            PHASES.seconds[Phases.ACTION] += time.time() - started_at
+            PHASES.calls[Phases.ACTION] += 1
+
+
+def get_config_dict(num_states):
+    """
+    Returns a configuration for a machine with a ring of num_states states.
+    """
+    action = __name__ + '.NextAction'
+    states = []
+    for i in range(num_states):
+        states.append({
+            'name': 's%d' % i,
+            'initial': i == 0,
+            'do_action': action,
+            'transitions': [{'event': 'next', 'target': 's%d' % ((i + 1) % num_states)}]
+        })
+    return {'machines': [{'name': 'benchmark', 'states': states}]}
+
+
+def get_lambda_events(fsm):
+    """
+    Returns a list of kinesis lambda events, each containing up to batch_size
+    records, for distinct machine instances.
+    """
+    records = []
+    for i in range(args.records):
+        context = fsm.create_FSM_instance(
+            'benchmark',
+            initial_system_context={'correlation_id': uuid.uuid4().hex},
+            initial_user_context={'data': 'x' * args.payload_size},
+            initial_state_name='s%d' % (i % args.num_states)
+        )
+        context.current_event = 'next'
+        data = json.dumps(context.to_payload_dict(), sort_keys=True)
+        records.append({'kinesis': {'data': base64.b64encode(data)}})
+    return [{'Records': records[i:i + args.batch_size]} for i in range(0, len(records), args.batch_size)]
+
+
+def run():
+    """
+    Runs the benchmark and returns a dict of results.
+    """
+    fsm = FSM(config_dict=get_config_dict(args.num_states))
+    lambda_events = get_lambda_events(fsm)
+    backends = InMemoryBackends(latency=args.latency)
+    backends.install()
+    PHASES.reset()
+    gc.collect()
+    gc.disable()
+    try:
+        objects = len(gc.get_objects())
+        started_at = time.time()
+        for lambda_event in lambda_events:
+            handler.lambda_kinesis_handler(lambda_event)
+        elapsed = time.time() - started_at
+        objects = len(gc.get_objects()) - objects
+    finally:
+        gc.enable()
+        backends.uninstall()
+
+    if len(backends.stream) != args.records or backends.errors:
+        sys.exit('Benchmark failed: sent %d of %d records, errors %s' %
+                 (len(backends.stream), args.records, backends.errors))
+
+    return {
+        'records_per_second': args.records / elapsed,
+        'phase_usec_per_record': dict((phase, PHASES.seconds[phase] / args.records * 1e6)
+                                      for phase in Phases.ALL),
+        'objects_per_record': float(objects) / args.records,
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
+
+def report(results, baseline):
+    """
+    Prints the results (and the change vs. the baseline) and returns True if
+    throughput regressed by more than the tolerance.
+    """
+    def change(value, key, phase=None):
+        old = baseline.get(key) if baseline else None
+        if phase and old:
+            old = old.get(phase)
+        if not old:
+            return ''
+        return ' (%+.1f%%)' % (100.0 * (value - old) / old)
+
+    print('records:            %d (batch_size=%d, num_states=%d, payload_size=%d, latency=%s)' %
+          (args.records, args.batch_size, args.num_states, args.payload_size, args.latency))
+    value = results['records_per_second']
+    print('records/sec:        %10.1f%s' % (value, change(value, 'records_per_second')))
+    for phase in Phases.ALL:
+        value = results['phase_usec_per_record'][phase]
+        print('  %-16s  %10.1f usec/record%s' % (phase, value, change(value, 'phase_usec_per_record', phase)))
+    value = results['objects_per_record']
+    print('objects/record:     %10.1f%s' % (value, change(value, 'objects_per_record')))
+    print('max rss:            %10d kb' % results['max_rss_kb'])
+
+    if not baseline:
+        return False
+    slowdown = 100.0 * (baseline['records_per_second'] - results['records_per_second']) / \
+        baseline['records_per_second']
+    if slowdown > args.tolerance:
+        print('REGRESSION: throughput is %.1f%% lower than the baseline (tolerance %.1f%%)' %
+              (slowdown, args.tolerance))
+        return True
+    return False
+
+
+results = run()
+
+baseline = None
+if not args.save_baseline and os.path.exists(args.baseline):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+regressed = report(results, baseline)
+
+if args.save_baseline:
+    with open(args.baseline, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print('Saved baseline to %s' % args.baseline)
+
+sys.exit(1 if regressed else 0)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# state_dispatch.py
+#
+# Micro-benchmark for the State.dispatch hot loop. Builds a machine with a ring
+# of states (no AWS services are used) and repeatedly dispatches events through
+# it, comparing each state's compiled lookups (State.compile) with the uncompiled
+# lookups. Run it from the repository root:
+#
+#   $ PYTHONPATH=. python benchmarks/state_dispatch.py --num_states=10 --number=100000
+
+# system imports
+import argparse
+import timeit
+
+# library imports
+
+# application imports
+from aws_lambda_fsm.action import Action
+from aws_lambda_fsm.fsm import FSM
+
+# setup the command line args
+parser = argparse.ArgumentParser(description='Benchmarks State.dispatch.')
+parser.add_argument('--num_states', type=int, default=10)
+parser.add_argument('--number', type=int, default=100000)
+parser.add_argument('--repeat', type=int, default=5)
+args = parser.parse_args()
+
+
+class NextAction(Action):
+    def execute(self, context, obj):
+        return 'next'
+
+
+def get_config_dict(num_states):
+    """
+    Returns a configuration for a machine with a ring of num_states states.
+    """
+    action = __name__ + '.NextAction'
+    states = []
+    for i in range(num_states):
+        states.append({
+            'name': 's%d' % i,
+            'initial': i == 0,
+            'entry_action': action,
+            'do_action': action,
+            'exit_action': action,
+            'transitions': [{'event': 'next', 'target': 's%d' % ((i + 1) % num_states), 'action': action}]
+        })
+    return {'machines': [{'name': 'benchmark', 'states': states}]}
+
+
+def run(compiled):
+    """
+    Returns the best time (in nanoseconds) per State.dispatch call.
+    """
+    fsm = FSM(config_dict=get_config_dict(args.num_states))
+    context = fsm.create_FSM_instance('benchmark', initial_state_name='s0')
+    obj = {}
+    method = 'dispatch' if compiled else '_dispatch'
+
+    def loop():
+        current_state = context.current_state
+        getattr(current_state, method)(context, 'next', obj)
+
+    best = min(timeit.repeat(loop, number=args.number, repeat=args.repeat))
+    return best / args.number * 1e9
+
+
+uncompiled = run(False)
+compiled = run(True)
+print('State.dispatch (uncompiled): %8.1f ns/event' % uncompiled)
+print('State.dispatch (compiled):   %8.1f ns/event (%.1f%% faster)' %
+      (compiled, 100.0 * (uncompiled - compiled) / uncompiled))
@@ -0,0 +1 @@
+settings.py.example
\ No newline at end of file
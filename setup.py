@@ -38,7 +38,7 @@ def get_requirements(filename):
 
 
 def get_packages():
-    return find_packages(exclude=["tests.*", "tests", "examples", "examples.*"])
+    return find_packages(exclude=["tests.*", "tests", "examples", "examples.*", "benchmarks", "benchmarks.*"])
 
 
 def read_file(filename, mode='rb'):
@@ -55,6 +55,7 @@ setup_args = dict(
              "tools/fsm_sqs_to_arn.py",
              "tools/dev_lambda.py",
              "tools/dev_ecs.py",
+             "tools/fsm_worker.py",
              "tools/create_resources.py",
              "tools/create_kinesis_stream.py",
              "tools/create_dynamodb_table.py",
@@ -18,7 +18,7 @@ import unittest
 # library imports
 
 # application imports
-from aws_lambda_fsm.action import Action, max_retry_event
+from aws_lambda_fsm.action import Action, LazyAction, max_retry_event
 from aws_lambda_fsm.fsm import Context
 
 
@@ -30,6 +30,35 @@ class TestAction(unittest.TestCase):
         self.assertEqual('foo', event)
 
 
+class EventAction(Action):
+    def execute(self, context, obj):
+        return 'event'
+
+
+class TestLazyAction(unittest.TestCase):
+
+    def test_load_is_deferred(self):
+        action = LazyAction('tests.aws_lambda_fsm.test_action.EventAction')
+        self.assertIsNone(action._action)
+        loaded = action.load()
+        self.assertTrue(isinstance(loaded, EventAction))
+        self.assertEqual('tests.aws_lambda_fsm.test_action.EventAction', loaded.name)
+        self.assertTrue(loaded is action.load())
+
+    def test_execute(self):
+        action = LazyAction('tests.aws_lambda_fsm.test_action.EventAction')
+        self.assertEqual('event', action.execute(None, None))
+
+    def test_getattr_delegates(self):
+        action = LazyAction('tests.aws_lambda_fsm.test_action.EventAction')
+        self.assertEqual(None, action.event)
+        self.assertRaises(AttributeError, getattr, action, '__foo__')
+
+    def test_missing_module_raises_on_execute(self):
+        action = LazyAction('tests.does_not_exist.EventAction')
+        self.assertRaises(ImportError, action.execute, None, None)
+
+
 class TestMaxRetryEvent(unittest.TestCase):
     class MyAction(Action):
         @max_retry_event('fail')
@@ -27,7 +27,14 @@ from aws_lambda_fsm.constants import AWS_SQS
 from aws_lambda_fsm.constants import AWS_ELASTICACHE
 from aws_lambda_fsm.aws import get_connection
 from aws_lambda_fsm.aws import retriable_entities
+from aws_lambda_fsm.aws import schedule_event
+from aws_lambda_fsm.aws import scheduled_events
+from aws_lambda_fsm.aws import finish_scheduled_events
 from aws_lambda_fsm.aws import store_checkpoint
+from aws_lambda_fsm.aws import store_shard_checkpoint
+from aws_lambda_fsm.aws import load_shard_checkpoint
+from aws_lambda_fsm.aws import store_snapshot
+from aws_lambda_fsm.aws import load_snapshot
 from aws_lambda_fsm.aws import store_environment
 from aws_lambda_fsm.aws import load_environment
 from aws_lambda_fsm.aws import start_retries
@@ -37,6 +44,10 @@ from aws_lambda_fsm.aws import send_next_events_for_dispatch
 from aws_lambda_fsm.aws import set_message_dispatched
 from aws_lambda_fsm.aws import get_message_dispatched
 from aws_lambda_fsm.aws import increment_error_counters
+from aws_lambda_fsm.aws import buffer_metric_statistics
+from aws_lambda_fsm.aws import flush_metrics
+from aws_lambda_fsm.aws import put_metrics
+from aws_lambda_fsm.aws import MetricsBuffer
 from aws_lambda_fsm.aws import get_primary_stream_source
 from aws_lambda_fsm.aws import get_secondary_stream_source
 from aws_lambda_fsm.aws import get_primary_environment_source
@@ -49,14 +60,25 @@ from aws_lambda_fsm.aws import _get_connection_info
 from aws_lambda_fsm.aws import _get_sqs_queue_url
 from aws_lambda_fsm.aws import _get_elasticache_engine_and_endpoint
 from aws_lambda_fsm.aws import ChaosConnection
+from aws_lambda_fsm.aws import ChaosFunction
+from aws_lambda_fsm.aws import _trace
 from aws_lambda_fsm.aws import get_arn_from_arn_string
 from aws_lambda_fsm.aws import _validate_config
 from aws_lambda_fsm.aws import _validate_cache
 from aws_lambda_fsm.aws import _validate_sqs_urls
+from aws_lambda_fsm.aws import _validate_stream_lanes
+from aws_lambda_fsm.aws import get_source
+from aws_lambda_fsm.aws import get_sources
 from aws_lambda_fsm.aws import _validate_elasticache_endpoints
 from aws_lambda_fsm.aws import validate_config
 from aws_lambda_fsm.aws import acquire_lease
 from aws_lambda_fsm.aws import release_lease
+from aws_lambda_fsm.aws import renew_lease
+from aws_lambda_fsm.aws import start_join
+from aws_lambda_fsm.aws import report_join
+from aws_lambda_fsm import shards
+from aws_lambda_fsm.shards import get_explicit_hash_key
+from aws_lambda_fsm.shards import get_shard_monitor
 
 
 class Connection(object):
@@ -131,8 +153,82 @@ class TestArn(unittest.TestCase):
         self.assertEqual('bar', arn.colon_resource())
 
 
+class Client(object):
+    meta = mock.Mock()
+    meta.service_model.service_name = 'kinesis'
+
+    def put_record(self, **kwargs):
+        return 'ok'
+
+    def fail(self, **kwargs):
+        raise ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'test')
+
+
+class TestTrace(unittest.TestCase):
+
+    @mock.patch('aws_lambda_fsm.aws.uuid')
+    @mock.patch('aws_lambda_fsm.aws.record_span')
+    @mock.patch('aws_lambda_fsm.aws.get_span_sink')
+    def test_trace_disabled(self,
+                            mock_get_span_sink,
+                            mock_record_span,
+                            mock_uuid):
+        mock_get_span_sink.return_value = None
+        self.assertEqual('ok', _trace(Client().put_record, Data='abc'))
+        self.assertFalse(mock_uuid.called)
+        self.assertFalse(mock_record_span.called)
+
+    @mock.patch('aws_lambda_fsm.aws.logger')
+    @mock.patch('aws_lambda_fsm.aws.uuid')
+    @mock.patch('aws_lambda_fsm.aws.get_span_sink')
+    def test_trace_logging(self,
+                           mock_get_span_sink,
+                           mock_uuid,
+                           mock_logger):
+        mock_get_span_sink.return_value = None
+        mock_logger.isEnabledFor.return_value = True
+        mock_uuid.uuid4.return_value.hex = 'guid'
+        self.assertEqual('ok', _trace(Client().put_record, Data='abc'))
+        mock_logger.log.assert_called_with(5, '%s: return_value = %s', 'guid', 'ok')
+
+    @mock.patch('aws_lambda_fsm.aws.time')
+    @mock.patch('aws_lambda_fsm.aws.record_span')
+    @mock.patch('aws_lambda_fsm.aws.get_span_sink')
+    def test_trace_span(self,
+                        mock_get_span_sink,
+                        mock_record_span,
+                        mock_time):
+        mock_time.time.side_effect = [1.0, 1.5]
+        self.assertEqual('ok', _trace(Client().put_record, Data='abc'))
+        mock_record_span.assert_called_with(mock_get_span_sink.return_value, 'kinesis', 'put_record',
+                                            1.0, 0.5, ((), {'Data': 'abc'}), 'ok')
+
+    @mock.patch('aws_lambda_fsm.aws.record_span')
+    @mock.patch('aws_lambda_fsm.aws.get_span_sink')
+    def test_trace_span_client_error(self,
+                                     mock_get_span_sink,
+                                     mock_record_span):
+        self.assertRaises(ClientError, _trace, Client().fail)
+        self.assertEqual(('kinesis', 'fail'), mock_record_span.call_args[0][1:3])
+        self.assertEqual('ProvisionedThroughputExceededException', mock_record_span.call_args[0][6])
+
+    @mock.patch('aws_lambda_fsm.aws.record_span')
+    @mock.patch('aws_lambda_fsm.aws.get_span_sink')
+    def test_trace_span_exception(self,
+                                  mock_get_span_sink,
+                                  mock_record_span):
+        def find_things():
+            pass
+        self.assertRaises(ValueError, _trace, ChaosFunction(ValueError(), find_things))
+        self.assertEqual((None, 'find_things'), mock_record_span.call_args[0][1:3])
+        self.assertEqual('ValueError', mock_record_span.call_args[0][6])
+
+
 class TestAws(unittest.TestCase):
 
+    def setUp(self):
+        shards._local.monitors.clear()
+
     def test_chaos_0(self):
         connection = Connection()
         connection = ChaosConnection('kinesis', connection, chaos={'dynamodb': {Exception(): 1.0}})
@@ -242,12 +338,12 @@ class TestAws(unittest.TestCase):
         self.assertEqual(expected, actual)
 
     @mock.patch('aws_lambda_fsm.aws.settings')
-    @mock.patch('aws_lambda_fsm.aws.boto3')
+    @mock.patch('boto3.client')
     def test_get_elasticache_engine_and_endpoint_not_found(self,
-                                                           mock_boto3,
+                                                           mock_client,
                                                            mock_settings):
         setattr(_local, 'cache_details_for_' + _get_test_arn(AWS.ELASTICACHE), None)
-        mock_boto3.client.return_value.describe_cache_clusters.return_value = {
+        mock_client.return_value.describe_cache_clusters.return_value = {
             'CacheClusters': []
         }
         mock_settings.ENDPOINTS = {}
@@ -256,12 +352,12 @@ class TestAws(unittest.TestCase):
         self.assertIsNone(actual)
 
     @mock.patch('aws_lambda_fsm.aws.settings')
-    @mock.patch('aws_lambda_fsm.aws.boto3')
+    @mock.patch('boto3.client')
     def test_get_elasticache_engine_and_endpoint_invalid(self,
-                                                         mock_boto3,
+                                                         mock_client,
                                                          mock_settings):
         setattr(_local, 'cache_details_for_' + _get_test_arn(AWS.ELASTICACHE), None)
-        mock_boto3.client.return_value.describe_cache_clusters.return_value = {
+        mock_client.return_value.describe_cache_clusters.return_value = {
             'CacheClusters': [{
                 'Engine': 'memcached',
                 'foobar': {
@@ -276,12 +372,12 @@ class TestAws(unittest.TestCase):
         self.assertIsNone(actual)
 
     @mock.patch('aws_lambda_fsm.aws.settings')
-    @mock.patch('aws_lambda_fsm.aws.boto3')
+    @mock.patch('boto3.client')
     def test_get_elasticache_engine_and_endpoint_on_wire(self,
-                                                         mock_boto3,
+                                                         mock_client,
                                                          mock_settings):
         setattr(_local, 'cache_details_for_' + _get_test_arn(AWS.ELASTICACHE), None)
-        mock_boto3.client.return_value.describe_cache_clusters.return_value = {
+        mock_client.return_value.describe_cache_clusters.return_value = {
             'CacheClusters': [{
                 'Engine': 'memcached',
                 'ConfigurationEndpoint': {
@@ -508,8 +604,13 @@ class TestAws(unittest.TestCase):
                                      mock_datetime,
                                      mock_get_connection):
         mock_settings.PRIMARY_METRICS_SOURCE = _get_test_arn(AWS.CLOUDWATCH)
+        mock_settings.METRICS_EMF = False
         mock_datetime.datetime.utcnow.return_value = 'now'
+        _local.metrics = MetricsBuffer()
         increment_error_counters({'a': 98, 'b': 99}, {'d': 'e'})
+        increment_error_counters({'a': 2}, {'d': 'e'})
+        self.assertFalse(mock_get_connection.return_value.put_metric_data.called)
+        flush_metrics()
         mock_get_connection.return_value.put_metric_data.assert_called_with(
             Namespace='resourcetype/resourcename',
             MetricData=[
@@ -518,7 +619,7 @@ class TestAws(unittest.TestCase):
                     'Dimensions': [
                         {'Name': 'd', 'Value': 'e'}
                     ],
-                    'Value': 98,
+                    'Value': 100,
                     'MetricName': 'a'
                 },
                 {
@@ -531,13 +632,144 @@ class TestAws(unittest.TestCase):
                 }
             ]
         )
+        mock_get_connection.return_value.put_metric_data.reset_mock()
+        flush_metrics()
+        self.assertFalse(mock_get_connection.return_value.put_metric_data.called)
 
     @mock.patch('aws_lambda_fsm.aws.get_connection')
     def test_increment_error_counter_no_connection(self,
                                                    mock_get_connection):
         mock_get_connection.return_value = None
-        ret = increment_error_counters([('b', 99)], {'d': 'e'})
-        self.assertIsNone(ret)
+        _local.metrics = MetricsBuffer()
+        increment_error_counters({'b': 99}, {'d': 'e'})
+        flush_metrics()
+        self.assertEqual({}, _local.metrics.counters)
+
+    @mock.patch('aws_lambda_fsm.aws._put_metric_data')
+    def test_flush_metrics_shard_puts(self,
+                                      mock_put_metric_data):
+        _local.metrics = MetricsBuffer()
+        get_shard_monitor(_get_test_arn(AWS.KINESIS)).record('s0', count=3)
+        flush_metrics()
+        self.assertEqual(
+            [{'MetricName': 'ShardPuts',
+              'Dimensions': [{'Name': 'shard', 'Value': 's0'}, {'Name': 'stream', 'Value': 'resourcename'}],
+              'Value': 3}],
+            mock_put_metric_data.call_args[0][0]
+        )
+
+    @mock.patch('aws_lambda_fsm.aws.logger')
+    @mock.patch('aws_lambda_fsm.aws._put_metric_data')
+    def test_flush_metrics_error(self,
+                                 mock_put_metric_data,
+                                 mock_logger):
+        mock_put_metric_data.side_effect = Exception()
+        flush_metrics()
+        mock_logger.exception.assert_called_with('Error flushing metrics.')
+
+    # buffer_metric_statistics
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.datetime')
+    @mock.patch('aws_lambda_fsm.aws.settings')
+    def test_buffer_metric_statistics(self,
+                                      mock_settings,
+                                      mock_datetime,
+                                      mock_get_connection):
+        mock_settings.PRIMARY_METRICS_SOURCE = _get_test_arn(AWS.CLOUDWATCH)
+        mock_settings.METRICS_EMF = False
+        mock_datetime.datetime.utcnow.return_value = 'now'
+        _local.metrics = MetricsBuffer()
+        buffer_metric_statistics([('a', {'d': str(i)}, {'SampleCount': 1, 'Sum': 1.0, 'Minimum': 1.0, 'Maximum': 1.0})
+                                  for i in range(21)])
+        buffer_metric_statistics([('a', {'d': '9'}, {'SampleCount': 2, 'Sum': 5.0, 'Minimum': 2.0, 'Maximum': 3.0})])
+        buffer_metric_statistics([('a', {'d': '9'}, {'SampleCount': 1, 'Sum': 0.5, 'Minimum': 0.5, 'Maximum': 0.5})])
+        flush_metrics()
+        self.assertEqual(2, mock_get_connection.return_value.put_metric_data.call_count)
+        metric_data = mock_get_connection.return_value.put_metric_data.call_args_list[0][1]['MetricData']
+        self.assertEqual(20, len(metric_data))
+        metric_data = mock_get_connection.return_value.put_metric_data.call_args_list[1][1]['MetricData']
+        self.assertEqual(
+            [{
+                'Timestamp': 'now',
+                'Dimensions': [
+                    {'Name': 'd', 'Value': '9'}
+                ],
+                'StatisticValues': {'SampleCount': 4, 'Sum': 6.5, 'Minimum': 0.5, 'Maximum': 3.0},
+                'Unit': 'Milliseconds',
+                'MetricName': 'a'
+            }],
+            metric_data
+        )
+
+    @mock.patch('aws_lambda_fsm.aws.time')
+    @mock.patch('aws_lambda_fsm.aws.sys')
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.settings')
+    def test_flush_metrics_emf(self,
+                               mock_settings,
+                               mock_get_connection,
+                               mock_sys,
+                               mock_time):
+        mock_settings.PRIMARY_METRICS_SOURCE = _get_test_arn(AWS.CLOUDWATCH)
+        mock_settings.METRICS_EMF = True
+        mock_time.time.return_value = 1.5
+        _local.metrics = MetricsBuffer()
+        increment_error_counters({'error': 1}, {'d': 'e'})
+        buffer_metric_statistics([('a', {'d': 'e'}, {'SampleCount': 1, 'Sum': 1.0, 'Minimum': 1.0, 'Maximum': 1.0})])
+        increment_error_counters({'error': 1}, {'d': 'f'})
+        flush_metrics()
+        self.assertFalse(mock_get_connection.called)
+        self.assertEqual(
+            [
+                mock.call('{"_aws": {"CloudWatchMetrics": [{"Dimensions": [["d"]], "Metrics": [{"Name": "error"}, '
+                          '{"Name": "a.Maximum", "Unit": "Milliseconds"}, '
+                          '{"Name": "a.Minimum", "Unit": "Milliseconds"}, '
+                          '{"Name": "a.SampleCount", "Unit": "Count"}, {"Name": "a.Sum", "Unit": "Milliseconds"}], '
+                          '"Namespace": "resourcetype/resourcename"}], "Timestamp": 1500}, '
+                          '"a.Maximum": 1.0, "a.Minimum": 1.0, "a.SampleCount": 1, "a.Sum": 1.0, '
+                          '"d": "e", "error": 1}\n'),
+                mock.call('{"_aws": {"CloudWatchMetrics": [{"Dimensions": [["d"]], "Metrics": [{"Name": "error"}], '
+                          '"Namespace": "resourcetype/resourcename"}], "Timestamp": 1500}, "d": "f", "error": 1}\n')
+            ],
+            mock_sys.stdout.write.mock_calls
+        )
+
+    # put_metrics
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.datetime')
+    @mock.patch('aws_lambda_fsm.aws.settings')
+    def test_put_metrics(self,
+                         mock_settings,
+                         mock_datetime,
+                         mock_get_connection):
+        mock_settings.PRIMARY_METRICS_SOURCE = _get_test_arn(AWS.CLOUDWATCH)
+        mock_settings.METRICS_EMF = False
+        mock_datetime.datetime.utcnow.return_value = 'now'
+        put_metrics({'a': 98}, {'d': 'e'})
+        mock_get_connection.return_value.put_metric_data.assert_called_with(
+            Namespace='resourcetype/resourcename',
+            MetricData=[
+                {
+                    'Timestamp': 'now',
+                    'Dimensions': [
+                        {'Name': 'd', 'Value': 'e'}
+                    ],
+                    'Value': 98,
+                    'MetricName': 'a'
+                }
+            ]
+        )
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.settings')
+    def test_put_metrics_no_source(self,
+                                   mock_settings,
+                                   mock_get_connection):
+        mock_settings.PRIMARY_METRICS_SOURCE = None
+        self.assertIsNone(put_metrics({'a': 98}, {'d': 'e'}))
+        self.assertFalse(mock_get_connection.called)
 
     # get_primary_stream_source
     # get_secondary_stream_source
@@ -554,6 +786,44 @@ class TestAws(unittest.TestCase):
         mock_settings.SECONDARY_STREAM_SOURCE = 'bar'
         self.assertEqual('bar', get_secondary_stream_source())
 
+    @mock.patch('aws_lambda_fsm.aws.settings')
+    def test_get_stream_source_lane(self,
+                                    mock_settings):
+        mock_settings.PRIMARY_STREAM_SOURCE = 'foo'
+        mock_settings.SECONDARY_STREAM_SOURCE = 'bar'
+        mock_settings.STREAM_LANES = {'fast': {'primary': 'foo-fast', 'secondary': 'bar-fast'}}
+        self.assertEqual('foo-fast', get_primary_stream_source('fast'))
+        self.assertEqual('bar-fast', get_secondary_stream_source('fast'))
+        self.assertEqual('foo', get_primary_stream_source('default'))
+        self.assertEqual('bar', get_secondary_stream_source('default'))
+
+    # get_source
+    # get_sources
+
+    @mock.patch('aws_lambda_fsm.aws.settings')
+    def test_get_source(self,
+                        mock_settings):
+        mock_settings.PRIMARY_STREAM_SOURCE = 'ps'
+        mock_settings.SECONDARY_STREAM_SOURCE = 'ss'
+        mock_settings.PRIMARY_RETRY_SOURCE = 'pr'
+        mock_settings.SECONDARY_RETRY_SOURCE = 'sr'
+        mock_settings.PRIMARY_CHECKPOINT_SOURCE = 'pc'
+        mock_settings.SECONDARY_CHECKPOINT_SOURCE = 'sc'
+        mock_settings.PRIMARY_CACHE_SOURCE = 'pa'
+        mock_settings.SECONDARY_CACHE_SOURCE = 'sa'
+        self.assertEqual(None, get_sources({}))
+        sources = get_sources({'stream': {'primary': 'ps2'}, 'cache': {'secondary': 'sa2'}})
+        self.assertEqual({
+            'stream': {'primary': 'ps2', 'secondary': 'ss'},
+            'retry': {'primary': 'pr', 'secondary': 'sr'},
+            'checkpoint': {'primary': 'pc', 'secondary': 'sc'},
+            'cache': {'primary': 'pa', 'secondary': 'sa2'}
+        }, sources)
+        self.assertEqual('ps2', get_source('stream', sources=sources))
+        self.assertEqual('sa2', get_source('cache', primary=False, sources=sources))
+        self.assertEqual('ps', get_source('stream'))
+        self.assertEqual('sc', get_source('checkpoint', primary=False))
+
     # get_primary_environment_source
     # get_secondary_environment_source
 
@@ -675,6 +945,27 @@ class TestAws(unittest.TestCase):
 
     # send_next_event_for_dispatch
 
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_stream_lanes')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_stream_source')
+    def test_send_next_event_for_dispatch_lane(self,
+                                               mock_get_primary_stream_source,
+                                               mock_get_stream_lanes,
+                                               mock_get_connection):
+        mock_get_stream_lanes.return_value = {'fast': {}}
+        mock_get_primary_stream_source.return_value = _get_test_arn(AWS.SNS)
+        send_next_event_for_dispatch(mock.Mock(), 'c', 'd', lane='fast')
+        mock_get_primary_stream_source.assert_called_with('fast')
+        self.assertTrue(mock_get_connection.return_value.publish.called)
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    def test_send_next_event_for_dispatch_sources(self,
+                                                  mock_get_connection):
+        sources = get_sources({'stream': {'primary': _get_test_arn(AWS.SNS)}})
+        send_next_event_for_dispatch(mock.Mock(), 'c', 'd', lane='unknown', sources=sources)
+        self.assertTrue(mock_get_connection.return_value.publish.called)
+        mock_get_connection.assert_called_with(_get_test_arn(AWS.SNS))
+
     @mock.patch('aws_lambda_fsm.aws.get_connection')
     @mock.patch('aws_lambda_fsm.aws.get_primary_stream_source')
     def test_send_next_event_for_dispatch_kinesis(self,
@@ -689,6 +980,103 @@ class TestAws(unittest.TestCase):
             StreamName='resourcename'
         )
 
+    @mock.patch('aws_lambda_fsm.aws.settings')
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_stream_source')
+    def test_send_next_event_for_dispatch_kinesis_explicit_hash_key(self,
+                                                                    mock_get_primary_stream_source,
+                                                                    mock_get_connection,
+                                                                    mock_settings):
+        mock_settings.KINESIS_EXPLICIT_HASH_KEYS = True
+        mock_settings.KINESIS_SHARD_METRICS = True
+        mock_settings.KINESIS_THROTTLE_RETRIES = 0
+        mock_get_primary_stream_source.return_value = _get_test_arn(AWS.KINESIS)
+        mock_get_connection.return_value.describe_stream.side_effect = [
+            {'StreamDescription': {'HasMoreShards': True, 'Shards': [
+                {'ShardId': 's0', 'HashKeyRange': {'StartingHashKey': '0', 'EndingHashKey': '9'}}]}},
+            {'StreamDescription': {'HasMoreShards': False, 'Shards': [
+                {'ShardId': 's1', 'HashKeyRange': {'StartingHashKey': '10', 'EndingHashKey': '99'}}]}}
+        ]
+        mock_get_connection.return_value.put_record.return_value = {'ShardId': 's1'}
+        send_next_event_for_dispatch(mock.Mock(), 'c', 'd')
+        mock_get_connection.return_value.describe_stream.assert_called_with(
+            StreamName='resourcename', ExclusiveStartShardId='s0')
+        mock_get_connection.return_value.put_record.assert_called_with(
+            PartitionKey='d',
+            ExplicitHashKey=get_explicit_hash_key('d', [(0, 9), (10, 99)]),
+            Data='c',
+            StreamName='resourcename'
+        )
+        self.assertEqual({'s1': 1}, get_shard_monitor(_get_test_arn(AWS.KINESIS)).drain())
+
+    @mock.patch('aws_lambda_fsm.aws.settings')
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_stream_source')
+    def test_send_next_event_for_dispatch_kinesis_no_shards(self,
+                                                            mock_get_primary_stream_source,
+                                                            mock_get_connection,
+                                                            mock_settings):
+        mock_settings.KINESIS_EXPLICIT_HASH_KEYS = True
+        mock_settings.KINESIS_SHARD_METRICS = False
+        mock_settings.KINESIS_THROTTLE_RETRIES = 0
+        mock_get_primary_stream_source.return_value = _get_test_arn(AWS.KINESIS)
+        mock_get_connection.return_value.describe_stream.return_value = \
+            {'StreamDescription': {'HasMoreShards': True, 'Shards': []}}
+        send_next_event_for_dispatch(mock.Mock(), 'c', 'd')
+        mock_get_connection.return_value.put_record.assert_called_with(
+            PartitionKey='d',
+            Data='c',
+            StreamName='resourcename'
+        )
+
+    @mock.patch('aws_lambda_fsm.aws.get_token_bucket')
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_stream_source')
+    def test_send_next_event_for_dispatch_kinesis_throttled(self,
+                                                            mock_get_primary_stream_source,
+                                                            mock_get_connection,
+                                                            mock_get_token_bucket):
+        mock_context = mock.Mock()
+        mock_get_primary_stream_source.return_value = _get_test_arn(AWS.KINESIS)
+        throttled = ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'test')
+        mock_get_connection.return_value.put_record.side_effect = [throttled, throttled, 'ok']
+        self.assertEqual('ok', send_next_event_for_dispatch(mock_context, 'c', 'd'))
+        mock_get_token_bucket.assert_called_with(_get_test_arn(AWS.KINESIS))
+        bucket = mock_get_token_bucket.return_value
+        self.assertEqual(3, bucket.acquire.call_count)
+        self.assertEqual(2, bucket.throttled.call_count)
+        self.assertEqual(1, bucket.succeeded.call_count)
+
+    @mock.patch('aws_lambda_fsm.aws.get_token_bucket')
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_stream_source')
+    def test_send_next_event_for_dispatch_kinesis_throttled_fails(self,
+                                                                  mock_get_primary_stream_source,
+                                                                  mock_get_connection,
+                                                                  mock_get_token_bucket):
+        mock_context = mock.Mock()
+        mock_get_primary_stream_source.return_value = _get_test_arn(AWS.KINESIS)
+        throttled = ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'test')
+        mock_get_connection.return_value.put_record.side_effect = throttled
+        self.assertRaises(ClientError, send_next_event_for_dispatch, mock_context, 'c', 'd')
+        self.assertEqual(3, mock_get_connection.return_value.put_record.call_count)
+        self.assertEqual(3, mock_get_token_bucket.return_value.throttled.call_count)
+
+    @mock.patch('aws_lambda_fsm.aws.get_token_bucket')
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_stream_source')
+    def test_send_next_event_for_dispatch_kinesis_error(self,
+                                                        mock_get_primary_stream_source,
+                                                        mock_get_connection,
+                                                        mock_get_token_bucket):
+        mock_context = mock.Mock()
+        mock_get_primary_stream_source.return_value = _get_test_arn(AWS.KINESIS)
+        mock_get_connection.return_value.put_record.side_effect = \
+            ClientError({'Error': {'Code': 'ResourceNotFoundException'}}, 'test')
+        self.assertRaises(ClientError, send_next_event_for_dispatch, mock_context, 'c', 'd')
+        self.assertEqual(1, mock_get_connection.return_value.put_record.call_count)
+        self.assertFalse(mock_get_token_bucket.return_value.throttled.called)
+
     @mock.patch('aws_lambda_fsm.aws.get_connection')
     @mock.patch('aws_lambda_fsm.aws.get_primary_retry_source')
     def test_send_next_event_for_dispatch_kinesis_recovering(self,
@@ -784,12 +1172,54 @@ class TestAws(unittest.TestCase):
                                                    mock_get_connection):
         mock_context = mock.Mock()
         mock_get_primary_stream_source.return_value = _get_test_arn(AWS.KINESIS)
-        send_next_events_for_dispatch(mock_context, ['c', 'cc'], ['d', 'dd'])
+        mock_get_connection.return_value.put_records.return_value = \
+            {'Records': [{'ShardId': 's0'}, {'ErrorCode': 'ProvisionedThroughputExceededException'}]}
+        self.assertEqual(['dd'], send_next_events_for_dispatch(mock_context, ['c', 'cc'], ['d', 'dd']))
         mock_get_connection.return_value.put_records.assert_called_with(
             Records=[{'PartitionKey': 'd', 'Data': 'c'}, {'PartitionKey': 'dd', 'Data': 'cc'}],
             StreamName='resourcename'
         )
 
+    @mock.patch('aws_lambda_fsm.aws._send_next_events_for_dispatch_kinesis')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_stream_source')
+    def test_send_next_events_for_dispatch_no_connection(self,
+                                                         mock_get_primary_stream_source,
+                                                         mock_send_next_events_for_dispatch_kinesis):
+        mock_get_primary_stream_source.return_value = _get_test_arn(AWS.KINESIS)
+        mock_send_next_events_for_dispatch_kinesis.return_value = None
+        self.assertEqual(['d', 'dd'], send_next_events_for_dispatch(mock.Mock(), ['c', 'cc'], ['d', 'dd']))
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    def test_send_next_events_for_dispatch_sources(self,
+                                                   mock_get_connection):
+        sources = {'stream': {'primary': _get_test_arn(AWS.KINESIS), 'secondary': _get_test_arn(AWS.SQS)}}
+        mock_get_connection.return_value.put_records.return_value = {'Records': [{'ShardId': 's0'}]}
+        self.assertEqual([], send_next_events_for_dispatch(mock.Mock(), ['c'], ['d'], sources=sources))
+        self.assertTrue(mock_get_connection.return_value.put_records.called)
+
+    @mock.patch('aws_lambda_fsm.aws.settings')
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_stream_source')
+    def test_send_next_events_for_dispatch_kinesis_explicit_hash_key(self,
+                                                                     mock_get_primary_stream_source,
+                                                                     mock_get_connection,
+                                                                     mock_settings):
+        mock_settings.KINESIS_EXPLICIT_HASH_KEYS = True
+        mock_settings.KINESIS_SHARD_METRICS = True
+        mock_get_primary_stream_source.return_value = _get_test_arn(AWS.KINESIS)
+        mock_get_connection.return_value.describe_stream.return_value = \
+            {'StreamDescription': {'Shards': [
+                {'ShardId': 's0', 'HashKeyRange': {'StartingHashKey': '0', 'EndingHashKey': '99'}}]}}
+        mock_get_connection.return_value.put_records.return_value = \
+            {'Records': [{'ShardId': 's0'}, {'ErrorCode': 'ProvisionedThroughputExceededException'}]}
+        send_next_events_for_dispatch(mock.Mock(), ['c', 'cc'], ['d', 'dd'])
+        mock_get_connection.return_value.put_records.assert_called_with(
+            Records=[{'PartitionKey': 'd', 'Data': 'c', 'ExplicitHashKey': get_explicit_hash_key('d', [(0, 99)])},
+                     {'PartitionKey': 'dd', 'Data': 'cc', 'ExplicitHashKey': get_explicit_hash_key('dd', [(0, 99)])}],
+            StreamName='resourcename'
+        )
+        self.assertEqual({'s0': 1}, get_shard_monitor(_get_test_arn(AWS.KINESIS)).drain())
+
     @mock.patch('aws_lambda_fsm.aws.get_connection')
     @mock.patch('aws_lambda_fsm.aws.get_secondary_stream_source')
     def test_send_next_events_for_dispatch_kinesis_secondary(self,
@@ -813,7 +1243,10 @@ class TestAws(unittest.TestCase):
         mock_context = mock.Mock()
         mock_time.time.return_value = 1234.0
         mock_get_primary_stream_source.return_value = _get_test_arn(AWS.DYNAMODB)
-        send_next_events_for_dispatch(mock_context, ['c', 'cc'], ['d', 'dd'])
+        mock_get_connection.return_value.batch_write_item.return_value = {'UnprocessedItems': {'resourcename': [
+            {'PutRequest': {'Item': {'correlation_id': {'S': 'dd'}, 'payload': {'S': 'cc'}}}}
+        ]}}
+        self.assertEqual(['dd'], send_next_events_for_dispatch(mock_context, ['c', 'cc'], ['d', 'dd']))
         mock_get_connection.return_value.batch_write_item.assert_called_with(
             RequestItems={
                 'resourcename': [
@@ -832,7 +1265,7 @@ class TestAws(unittest.TestCase):
                                                mock_get_connection):
         mock_context = mock.Mock()
         mock_get_primary_stream_source.return_value = _get_test_arn(AWS.SNS)
-        send_next_events_for_dispatch(mock_context, ['c', 'cc'], ['d', 'dd'])
+        self.assertEqual([], send_next_events_for_dispatch(mock_context, ['c', 'cc'], ['d', 'dd']))
         mock_get_connection.return_value.publish.assert_has_calls(
             [
                 mock.call(Message='{"default": "c"}', TopicArn=_get_test_arn(AWS.SNS)),
@@ -850,13 +1283,125 @@ class TestAws(unittest.TestCase):
         mock_context = mock.Mock()
         mock_get_primary_stream_source.return_value = _get_test_arn(AWS.SQS)
         mock_get_sqs_queue_url.return_value = 'https://sqs.testing.amazonaws.com/1234567890/queuename'
-        send_next_events_for_dispatch(mock_context, ['c', 'cc'], ['d', 'dd'])
+        mock_get_connection.return_value.send_message_batch.return_value = \
+            {'Successful': [{'Id': 'd'}], 'Failed': [{'Id': 'dd'}]}
+        self.assertEqual(['dd'], send_next_events_for_dispatch(mock_context, ['c', 'cc'], ['d', 'dd']))
         mock_get_connection.return_value.send_message_batch.assert_called_with(
             QueueUrl='https://sqs.testing.amazonaws.com/1234567890/queuename',
             Entries=[{'DelaySeconds': 0, 'Id': 'd', 'MessageBody': 'c'},
                      {'DelaySeconds': 0, 'Id': 'dd', 'MessageBody': 'cc'}]
         )
 
+    # schedule_event
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_schedule_source')
+    def test_schedule_event(self,
+                            mock_get_primary_schedule_source,
+                            mock_get_connection):
+        mock_get_primary_schedule_source.return_value = _get_test_arn(AWS.DYNAMODB)
+        schedule_event('a', 1, 2, 1234.5, 'c')
+        mock_get_connection.return_value.put_item.assert_called_with(
+            TableName='resourcename',
+            Item={'bucket': {'N': '1200'}, 'ckey': {'S': 'a-1-2'}, 'run_at': {'N': '1234.5'}, 'payload': {'S': 'c'}}
+        )
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_secondary_schedule_source')
+    def test_schedule_event_secondary(self,
+                                      mock_get_secondary_schedule_source,
+                                      mock_get_connection):
+        mock_get_secondary_schedule_source.return_value = _get_test_arn(AWS.DYNAMODB)
+        schedule_event('a', 1, 2, 1234.5, 'c', primary=False)
+        self.assertTrue(mock_get_connection.return_value.put_item.called)
+
+    # scheduled_events
+
+    def _query(self, buckets):
+        def query(**kwargs):
+            bucket = kwargs['KeyConditions']['bucket']['AttributeValueList'][0]['N']
+            pages = buckets.get(int(bucket), [[]])
+            page = kwargs.get('ExclusiveStartKey', 0)
+            results = {'Items': [{'ckey': {'S': key}, 'run_at': {'N': str(run_at)}, 'payload': {'S': key}}
+                                 for key, run_at in pages[page]]}
+            if page + 1 < len(pages):
+                results['LastEvaluatedKey'] = page + 1
+            return results
+        return query
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    def test_scheduled_events_no_cursor(self,
+                                        mock_get_connection):
+        conn = mock_get_connection.return_value
+        conn.get_item.return_value = {}
+        conn.query.side_effect = self._query({
+            3600 - 60: [[('a', 3590.)], [('b', 3595.)]],
+            3600: [[('c', 3601.), ('d', 3650.)]]
+        })
+        items, cursor = scheduled_events(_get_test_arn(AWS.DYNAMODB), 3630.)
+        self.assertEqual(
+            [{'bucket': 3540, 'ckey': 'a', 'payload': 'a'},
+             {'bucket': 3540, 'ckey': 'b', 'payload': 'b'},
+             {'bucket': 3600, 'ckey': 'c', 'payload': 'c'}],
+            items
+        )
+        self.assertEqual(3600, cursor)
+        self.assertEqual(61, conn.query.call_count)
+        conn.get_item.assert_called_with(
+            TableName='resourcename',
+            ConsistentRead=True,
+            Key={'bucket': {'N': '-1'}, 'ckey': {'S': 'cursor'}}
+        )
+        conn.query.assert_called_with(
+            TableName='resourcename',
+            ConsistentRead=True,
+            KeyConditions={'bucket': {'ComparisonOperator': 'EQ', 'AttributeValueList': [{'N': '3600'}]}},
+            Limit=98
+        )
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    def test_scheduled_events_max_buckets(self,
+                                          mock_get_connection):
+        conn = mock_get_connection.return_value
+        conn.get_item.return_value = {'Item': {'run_at': {'N': '0'}}}
+        conn.query.side_effect = self._query({0: [[('a', 1.)]]})
+        items, cursor = scheduled_events(_get_test_arn(AWS.DYNAMODB), 36000.)
+        self.assertEqual([{'bucket': 0, 'ckey': 'a', 'payload': 'a'}], items)
+        self.assertEqual(3600, cursor)
+        self.assertEqual(60, conn.query.call_count)
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    def test_scheduled_events_limit(self,
+                                    mock_get_connection):
+        conn = mock_get_connection.return_value
+        conn.get_item.return_value = {'Item': {'run_at': {'N': '0'}}}
+        conn.query.side_effect = self._query({0: [[('a', 1.)]], 60: [[('b', 61.), ('c', 62.)]]})
+        items, cursor = scheduled_events(_get_test_arn(AWS.DYNAMODB), 36000., limit=3)
+        self.assertEqual(['a', 'b', 'c'], [item['ckey'] for item in items])
+        self.assertEqual(60, cursor)
+
+    # finish_scheduled_events
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.logger')
+    def test_finish_scheduled_events(self,
+                                     mock_logger,
+                                     mock_get_connection):
+        conn = mock_get_connection.return_value
+        conn.batch_write_item.side_effect = [{}, {'UnprocessedItems': {'resourcename': [{}, {}]}}]
+        items = [{'bucket': 60, 'ckey': str(i), 'payload': 'p'} for i in range(30)]
+        finish_scheduled_events(_get_test_arn(AWS.DYNAMODB), items, 120)
+        self.assertEqual(2, conn.batch_write_item.call_count)
+        self.assertEqual(
+            {'DeleteRequest': {'Key': {'bucket': {'N': '60'}, 'ckey': {'S': '25'}}}},
+            conn.batch_write_item.call_args[1]['RequestItems']['resourcename'][0]
+        )
+        mock_logger.warning.assert_called_with('Unable to delete %d scheduled events.', 2)
+        conn.put_item.assert_called_with(
+            TableName='resourcename',
+            Item={'bucket': {'N': '-1'}, 'ckey': {'S': 'cursor'}, 'run_at': {'N': '120'}}
+        )
+
     # retriable_entities
 
     @mock.patch('aws_lambda_fsm.aws.get_connection')
@@ -1059,6 +1604,90 @@ class TestAws(unittest.TestCase):
         ret = store_checkpoint(mock_context, 'c', 'd')
         self.assertIsNone(ret)
 
+    # store_shard_checkpoint
+    # load_shard_checkpoint
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_checkpoint_source')
+    def test_store_shard_checkpoint_dynamodb(self,
+                                             mock_get_primary_checkpoint_source,
+                                             mock_get_connection):
+        mock_get_primary_checkpoint_source.return_value = _get_test_arn(AWS.DYNAMODB)
+        store_shard_checkpoint(_get_test_arn(AWS.KINESIS, resource='stream/s'), 'shardId-000000000000', '123')
+        mock_get_connection.return_value.put_item.assert_called_with(
+            Item={'sent': {'S': '123'},
+                  'correlation_id': {'S': 'shard-s-shardId-000000000000'}},
+            TableName='resourcename'
+        )
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_secondary_checkpoint_source')
+    def test_store_shard_checkpoint_secondary(self,
+                                              mock_get_secondary_checkpoint_source,
+                                              mock_get_connection):
+        mock_get_secondary_checkpoint_source.return_value = _get_test_arn(AWS.KINESIS)
+        store_shard_checkpoint(_get_test_arn(AWS.KINESIS), 'shardId-000000000000', '123', primary=False)
+        self.assertFalse(mock_get_connection.return_value.put_item.called)
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_checkpoint_source')
+    def test_load_shard_checkpoint_dynamodb(self,
+                                            mock_get_primary_checkpoint_source,
+                                            mock_get_connection):
+        mock_get_primary_checkpoint_source.return_value = _get_test_arn(AWS.DYNAMODB)
+        mock_get_connection.return_value.get_item.return_value = {'Item': {'sent': {'S': '123'}}}
+        ret = load_shard_checkpoint(_get_test_arn(AWS.KINESIS, resource='stream/s'), 'shardId-000000000000')
+        self.assertEqual('123', ret)
+        mock_get_connection.return_value.get_item.assert_called_with(
+            ConsistentRead=True,
+            Key={'correlation_id': {'S': 'shard-s-shardId-000000000000'}},
+            TableName='resourcename'
+        )
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_secondary_checkpoint_source')
+    def test_load_shard_checkpoint_missing(self,
+                                           mock_get_secondary_checkpoint_source,
+                                           mock_get_connection):
+        mock_get_secondary_checkpoint_source.return_value = _get_test_arn(AWS.DYNAMODB)
+        mock_get_connection.return_value.get_item.return_value = {}
+        ret = load_shard_checkpoint(_get_test_arn(AWS.KINESIS), 'shardId-000000000000', primary=False)
+        self.assertIsNone(ret)
+
+    # store_snapshot
+    # load_snapshot
+
+    @mock.patch('aws_lambda_fsm.aws.time')
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    def test_store_snapshot_dynamodb(self,
+                                     mock_get_connection,
+                                     mock_time):
+        mock_time.time.return_value = 1000.5
+        sources = {'checkpoint': {'primary': _get_test_arn(AWS.DYNAMODB), 'secondary': _get_test_arn(AWS.KINESIS)}}
+        self.assertTrue(store_snapshot('c', 's', '{}', sources=sources))
+        mock_get_connection.return_value.put_item.assert_called_with(
+            Item={'sent': {'S': '{}'},
+                  'correlation_id': {'S': 'snapshot-c-s'},
+                  'timeout': {'N': '605800'}},
+            TableName='resourcename'
+        )
+        mock_get_connection.return_value.put_item.reset_mock()
+        self.assertIsNone(store_snapshot('c', 's', '{}', primary=False, sources=sources))
+        self.assertFalse(mock_get_connection.return_value.put_item.called)
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    def test_load_snapshot_dynamodb(self,
+                                    mock_get_connection):
+        sources = {'checkpoint': {'primary': _get_test_arn(AWS.DYNAMODB), 'secondary': _get_test_arn(AWS.KINESIS)}}
+        mock_get_connection.return_value.get_item.return_value = {'Item': {'sent': {'S': '{}'}}}
+        self.assertEqual('{}', load_snapshot('c', 's', sources=sources))
+        mock_get_connection.return_value.get_item.assert_called_with(
+            ConsistentRead=True,
+            Key={'correlation_id': {'S': 'snapshot-c-s'}},
+            TableName='resourcename'
+        )
+        self.assertIsNone(load_snapshot('c', 's', primary=False, sources=sources))
+
     # set_message_dispatched
 
     @mock.patch('aws_lambda_fsm.aws.get_connection')
@@ -1551,6 +2180,41 @@ class LeaseMemcacheTest(unittest.TestCase):
         mock_get_connection.return_value.gets.assert_called_with('lease-a')
         self.assertFalse(mock_get_connection.return_value.cas.called)
 
+    # RENEW
+
+    @mock.patch('aws_lambda_fsm.aws.time')
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_cache_source')
+    @mock.patch('aws_lambda_fsm.aws.settings')
+    def test_renew_lease_memcache_owned(self,
+                                        mock_settings,
+                                        mock_get_primary_cache_source,
+                                        mock_get_connection,
+                                        mock_time):
+        mock_time.time.return_value = 999.
+        mock_settings.ENDPOINTS = ENDPOINTS_MEMCACHE
+        mock_get_primary_cache_source.return_value = _get_test_arn(AWS.ELASTICACHE)
+        mock_get_connection.return_value.gets.return_value = '0:0:99:3'
+        mock_get_connection.return_value.cas.return_value = True
+        ret = renew_lease('a', 0, 0, 3, timeout=60)
+        self.assertTrue(ret)
+        mock_get_connection.return_value.cas.assert_called_with('lease-a', '0:0:1059:3', time=86400)
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_cache_source')
+    @mock.patch('aws_lambda_fsm.aws.settings')
+    def test_renew_lease_memcache_not_owned(self,
+                                            mock_settings,
+                                            mock_get_primary_cache_source,
+                                            mock_get_connection):
+        mock_settings.ENDPOINTS = ENDPOINTS_MEMCACHE
+        mock_get_primary_cache_source.return_value = _get_test_arn(AWS.ELASTICACHE)
+        mock_get_connection.return_value.gets.return_value = '0:0:99:4'
+        self.assertFalse(renew_lease('a', 0, 0, 3))
+        mock_get_connection.return_value.gets.return_value = None
+        self.assertFalse(renew_lease('a', 0, 0, 3))
+        self.assertFalse(mock_get_connection.return_value.cas.called)
+
 
 class LeaseRedisTest(unittest.TestCase):
 
@@ -1845,6 +2509,64 @@ class LeaseRedisTest(unittest.TestCase):
         self.assertFalse(mock_pipe.setex.called)
         self.assertFalse(mock_pipe.execute.called)
 
+    # RENEW
+
+    @mock.patch('aws_lambda_fsm.aws.time')
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_cache_source')
+    @mock.patch('aws_lambda_fsm.aws.settings')
+    def test_renew_lease_redis_owned(self,
+                                     mock_settings,
+                                     mock_get_primary_cache_source,
+                                     mock_get_connection,
+                                     mock_time):
+        mock_time.time.return_value = 999.
+        mock_settings.ENDPOINTS = {}
+        mock_settings.ELASTICACHE_ENDPOINTS = ELASTICACHE_ENDPOINTS_REDIS
+        mock_get_primary_cache_source.return_value = _get_test_arn(AWS.ELASTICACHE)
+        mock_pipe = mock_get_connection.return_value.pipeline.return_value.__enter__.return_value
+        mock_pipe.get.return_value = '0:0:99:3'
+        ret = renew_lease('a', 0, 0, 3, timeout=60)
+        self.assertTrue(ret)
+        mock_pipe.watch.assert_called_with('lease-a')
+        mock_pipe.setex.assert_called_with('lease-a', 86400, '0:0:1059:3')
+        mock_pipe.execute.assert_called_with()
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_cache_source')
+    @mock.patch('aws_lambda_fsm.aws.settings')
+    def test_renew_lease_redis_not_owned(self,
+                                         mock_settings,
+                                         mock_get_primary_cache_source,
+                                         mock_get_connection):
+        mock_settings.ENDPOINTS = {}
+        mock_settings.ELASTICACHE_ENDPOINTS = ELASTICACHE_ENDPOINTS_REDIS
+        mock_get_primary_cache_source.return_value = _get_test_arn(AWS.ELASTICACHE)
+        mock_pipe = mock_get_connection.return_value.pipeline.return_value.__enter__.return_value
+        mock_pipe.get.return_value = '0:0:99:4'
+        self.assertFalse(renew_lease('a', 0, 0, 3))
+        mock_pipe.get.return_value = None
+        self.assertFalse(renew_lease('a', 0, 0, 3))
+        self.assertFalse(mock_pipe.setex.called)
+        self.assertFalse(mock_pipe.execute.called)
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_cache_source')
+    @mock.patch('aws_lambda_fsm.aws.settings')
+    def test_renew_lease_redis_errors(self,
+                                      mock_settings,
+                                      mock_get_primary_cache_source,
+                                      mock_get_connection):
+        mock_settings.ENDPOINTS = {}
+        mock_settings.ELASTICACHE_ENDPOINTS = ELASTICACHE_ENDPOINTS_REDIS
+        mock_get_primary_cache_source.return_value = _get_test_arn(AWS.ELASTICACHE)
+        mock_pipe = mock_get_connection.return_value.pipeline.return_value.__enter__.return_value
+        mock_pipe.get.return_value = '0:0:99:3'
+        mock_pipe.execute.side_effect = redis.WatchError
+        self.assertTrue(False is renew_lease('a', 0, 0, 3))
+        mock_pipe.execute.side_effect = redis.exceptions.ConnectionError
+        self.assertTrue(0 is renew_lease('a', 0, 0, 3))
+
 
 class LeaseDynamodbTest(unittest.TestCase):
 
@@ -2025,6 +2747,44 @@ class LeaseDynamodbTest(unittest.TestCase):
             Key={'ckey': {'S': 'lease-a'}}
         )
 
+    # RENEW
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_cache_source')
+    @mock.patch('aws_lambda_fsm.aws.time')
+    def test_renew_lease_dynamodb(self,
+                                  mock_time,
+                                  mock_get_primary_cache_source,
+                                  mock_get_connection):
+        mock_time.time.return_value = 999.
+        mock_get_primary_cache_source.return_value = _get_test_arn(AWS.DYNAMODB)
+        ret = renew_lease('a', 0, 0, 3, timeout=60)
+        self.assertTrue(ret)
+        mock_get_connection.return_value.update_item.assert_called_with(
+            ConditionExpression='lease_state = :l AND steps = :s AND retries = :r AND fence = :f',
+            TableName='resourcename',
+            UpdateExpression='SET expires = :e',
+            ExpressionAttributeValues={':l': {'S': 'leased'},
+                                       ':f': {'N': '3'},
+                                       ':e': {'N': '1059'},
+                                       ':r': {'N': '0'},
+                                       ':s': {'N': '0'}},
+            Key={'ckey': {'S': 'lease-a'}}
+        )
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_cache_source')
+    def test_renew_lease_dynamodb_not_owned(self,
+                                            mock_get_primary_cache_source,
+                                            mock_get_connection):
+        mock_get_primary_cache_source.return_value = _get_test_arn(AWS.DYNAMODB)
+        mock_get_connection.return_value.update_item.side_effect = \
+            ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'Operation')
+        self.assertTrue(False is renew_lease('a', 0, 0, 3))
+        mock_get_connection.return_value.update_item.side_effect = \
+            ClientError({'Error': {'Code': 'FatalErrorOfSomeSort'}}, 'Operation')
+        self.assertTrue(0 is renew_lease('a', 0, 0, 3))
+
 
 class ValidateConfigTest(unittest.TestCase):
 
@@ -2047,6 +2807,42 @@ class ValidateConfigTest(unittest.TestCase):
             mock_logger.mock_calls
         )
 
+    # _validate_stream_lanes
+
+    @mock.patch('aws_lambda_fsm.aws.logger')
+    @mock.patch('aws_lambda_fsm.aws.settings')
+    def test_validate_stream_lanes_valid(self,
+                                         mock_settings,
+                                         mock_logger):
+        mock_settings.STREAM_LANES = {
+            'fast': {'primary': _get_test_arn(AWS.KINESIS), 'secondary': _get_test_arn(AWS.SQS)}
+        }
+        _validate_stream_lanes()
+        self.assertEqual(
+            [],
+            mock_logger.mock_calls
+        )
+
+    @mock.patch('aws_lambda_fsm.aws.logger')
+    @mock.patch('aws_lambda_fsm.aws.settings')
+    def test_validate_stream_lanes_invalid(self,
+                                           mock_settings,
+                                           mock_logger):
+        mock_settings.STREAM_LANES = {
+            'fast': {'primary': _get_test_arn(AWS.ELASTICACHE)},
+            'slow': {'secondary': _get_test_arn(AWS.KINESIS)}
+        }
+        _validate_stream_lanes()
+        self.assertEqual(
+            [
+                mock.call.fatal("STREAM_LANES has invalid entry for lane '%s' ('%s' is not allowed)",
+                                'fast', _get_test_arn(AWS.ELASTICACHE)),
+                mock.call.warning("STREAM_LANES has no secondary for lane '%s' (failover not configured).", 'fast'),
+                mock.call.fatal("STREAM_LANES has invalid entry for lane '%s' (primary)", 'slow')
+            ],
+            mock_logger.mock_calls
+        )
+
     # _validate_sqs_urls
 
     @mock.patch('aws_lambda_fsm.aws.logger')
@@ -2259,10 +3055,10 @@ class ValidateConfigTest(unittest.TestCase):
         _local.validated_config = False
         self.assertEqual(0, len(mock_validate_config.mock_calls))
         validate_config()
-        self.assertEqual(6, len(mock_validate_config.mock_calls))
+        self.assertEqual(7, len(mock_validate_config.mock_calls))
         _local.validated_config = True
         validate_config()
-        self.assertEqual(6, len(mock_validate_config.mock_calls))
+        self.assertEqual(7, len(mock_validate_config.mock_calls))
 
     @mock.patch('aws_lambda_fsm.aws._validate_config')
     def test_validate_config(self, mock_validate_config):
@@ -2314,3 +3110,164 @@ class ValidateConfigTest(unittest.TestCase):
             ],
             mock_logger.mock_calls
         )
+
+
+class JoinTest(unittest.TestCase):
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_cache_source')
+    @mock.patch('aws_lambda_fsm.aws.settings')
+    def test_start_join_memcache(self,
+                                 mock_settings,
+                                 mock_get_primary_cache_source,
+                                 mock_get_connection):
+        mock_settings.ELASTICACHE_ENDPOINTS = ELASTICACHE_ENDPOINTS_MEMCACHE
+        mock_get_primary_cache_source.return_value = _get_test_arn(AWS.ELASTICACHE)
+        self.assertEqual(0, start_join('j', 2, 'p'))
+        self.assertEqual(0, report_join('j', 0, 'r'))
+        self.assertFalse(mock_get_connection.called)
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_cache_source')
+    @mock.patch('aws_lambda_fsm.aws.settings')
+    def test_start_join_redis(self,
+                              mock_settings,
+                              mock_get_primary_cache_source,
+                              mock_get_connection):
+        mock_settings.ELASTICACHE_ENDPOINTS = ELASTICACHE_ENDPOINTS_REDIS
+        mock_get_primary_cache_source.return_value = _get_test_arn(AWS.ELASTICACHE)
+        mock_pipe = mock_get_connection.return_value.pipeline.return_value.__enter__.return_value
+        self.assertTrue(start_join('j', 2, 'p'))
+        mock_pipe.hmset.assert_called_with('join-j', {'count': 2, 'payload': 'p'})
+        mock_pipe.expire.assert_called_with('join-j', 86400)
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_cache_source')
+    @mock.patch('aws_lambda_fsm.aws.settings')
+    def test_start_join_redis_error(self,
+                                    mock_settings,
+                                    mock_get_primary_cache_source,
+                                    mock_get_connection):
+        mock_settings.ELASTICACHE_ENDPOINTS = ELASTICACHE_ENDPOINTS_REDIS
+        mock_get_primary_cache_source.return_value = _get_test_arn(AWS.ELASTICACHE)
+        mock_pipe = mock_get_connection.return_value.pipeline.return_value.__enter__.return_value
+        mock_pipe.execute.side_effect = redis.exceptions.ConnectionError
+        self.assertEqual(0, start_join('j', 2, 'p'))
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_cache_source')
+    @mock.patch('aws_lambda_fsm.aws.settings')
+    def test_report_join_redis(self,
+                               mock_settings,
+                               mock_get_primary_cache_source,
+                               mock_get_connection):
+        mock_settings.ELASTICACHE_ENDPOINTS = ELASTICACHE_ENDPOINTS_REDIS
+        mock_get_primary_cache_source.return_value = _get_test_arn(AWS.ELASTICACHE)
+        mock_pipe = mock_get_connection.return_value.pipeline.return_value.__enter__.return_value
+
+        # not all the children have reported
+        mock_pipe.execute.return_value = (1, {'count': '2', 'payload': 'p', 'r_1': 'r1'})
+        self.assertIsNone(report_join('j', 1, 'r1'))
+        mock_pipe.hset.assert_called_with('join-j', 'r_1', 'r1')
+        mock_pipe.hgetall.assert_called_with('join-j')
+        self.assertFalse(mock_pipe.hsetnx.called)
+
+        # the last child completes the join
+        mock_pipe.execute.side_effect = [(1, {'count': '2', 'payload': 'p', 'r_0': 'r0', 'r_1': 'r1'}), (1, '0')]
+        self.assertEqual(('p', ['r0', 'r1']), report_join('j', 0, 'r0'))
+        mock_pipe.hsetnx.assert_called_with('join-j', 'joined', '0')
+
+        # but only once
+        mock_pipe.execute.side_effect = [(0, {'count': '2', 'payload': 'p', 'r_0': 'r0', 'r_1': 'r1'}), (0, '0')]
+        self.assertIsNone(report_join('j', 1, 'r1'))
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_cache_source')
+    @mock.patch('aws_lambda_fsm.aws.settings')
+    def test_report_join_redis_error(self,
+                                     mock_settings,
+                                     mock_get_primary_cache_source,
+                                     mock_get_connection):
+        mock_settings.ELASTICACHE_ENDPOINTS = ELASTICACHE_ENDPOINTS_REDIS
+        mock_get_primary_cache_source.return_value = _get_test_arn(AWS.ELASTICACHE)
+        mock_pipe = mock_get_connection.return_value.pipeline.return_value.__enter__.return_value
+        mock_pipe.execute.side_effect = redis.exceptions.ConnectionError
+        self.assertEqual(0, report_join('j', 1, 'r1'))
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_cache_source')
+    @mock.patch('aws_lambda_fsm.aws.time')
+    def test_start_join_dynamodb(self,
+                                 mock_time,
+                                 mock_get_primary_cache_source,
+                                 mock_get_connection):
+        mock_time.time.return_value = 999.
+        mock_get_primary_cache_source.return_value = _get_test_arn(AWS.DYNAMODB)
+        self.assertTrue(start_join('j', 2, 'p'))
+        mock_get_connection.return_value.update_item.assert_called_with(
+            TableName='resourcename',
+            Key={'ckey': {'S': 'join-j'}},
+            UpdateExpression='SET #c = :c, #p = :p, #t = :t',
+            ExpressionAttributeNames={'#c': 'count', '#p': 'payload', '#t': 'timeout'},
+            ExpressionAttributeValues={':c': {'N': '2'}, ':p': {'S': 'p'}, ':t': {'N': '87399'}}
+        )
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_cache_source')
+    def test_start_join_dynamodb_error(self,
+                                       mock_get_primary_cache_source,
+                                       mock_get_connection):
+        mock_get_primary_cache_source.return_value = _get_test_arn(AWS.DYNAMODB)
+        mock_get_connection.return_value.update_item.side_effect = \
+            ClientError({'Error': {'Code': 'FatalErrorOfSomeSort'}}, 'Operation')
+        self.assertEqual(0, start_join('j', 2, 'p'))
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_cache_source')
+    def test_report_join_dynamodb(self,
+                                  mock_get_primary_cache_source,
+                                  mock_get_connection):
+        mock_get_primary_cache_source.return_value = _get_test_arn(AWS.DYNAMODB)
+        update_item = mock_get_connection.return_value.update_item
+
+        # not all the children have reported
+        update_item.return_value = {'Attributes': {'count': {'N': '2'}, 'payload': {'S': 'p'}, 'r_1': {'S': 'r1'}}}
+        self.assertIsNone(report_join('j', 1, 'r1'))
+        update_item.assert_called_with(
+            TableName='resourcename',
+            Key={'ckey': {'S': 'join-j'}},
+            UpdateExpression='SET #r = :r',
+            ExpressionAttributeNames={'#r': 'r_1'},
+            ExpressionAttributeValues={':r': {'S': 'r1'}},
+            ReturnValues='ALL_NEW'
+        )
+
+        # the last child completes the join
+        update_item.return_value = {'Attributes': {'count': {'N': '2'}, 'payload': {'S': 'p'},
+                                                   'r_0': {'S': 'r0'}, 'r_1': {'S': 'r1'}}}
+        self.assertEqual(('p', ['r0', 'r1']), report_join('j', 0, 'r0'))
+        update_item.assert_called_with(
+            TableName='resourcename',
+            Key={'ckey': {'S': 'join-j'}},
+            ConditionExpression='attribute_not_exists(#j) OR #j = :j',
+            UpdateExpression='SET #j = :j',
+            ExpressionAttributeNames={'#j': 'joined'},
+            ExpressionAttributeValues={':j': {'N': '0'}}
+        )
+
+        # but only once
+        update_item.side_effect = [
+            update_item.return_value,
+            ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'Operation')
+        ]
+        self.assertIsNone(report_join('j', 1, 'r1'))
+
+    @mock.patch('aws_lambda_fsm.aws.get_connection')
+    @mock.patch('aws_lambda_fsm.aws.get_primary_cache_source')
+    def test_report_join_dynamodb_error(self,
+                                        mock_get_primary_cache_source,
+                                        mock_get_connection):
+        mock_get_primary_cache_source.return_value = _get_test_arn(AWS.DYNAMODB)
+        mock_get_connection.return_value.update_item.side_effect = \
+            ClientError({'Error': {'Code': 'FatalErrorOfSomeSort'}}, 'Operation')
+        self.assertEqual(0, report_join('j', 1, 'r1'))
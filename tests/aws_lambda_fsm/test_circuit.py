@@ -0,0 +1,112 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# system imports
+import unittest
+
+# library imports
+import mock
+
+# application imports
+from aws_lambda_fsm import circuit
+from aws_lambda_fsm.circuit import CircuitBreaker
+from aws_lambda_fsm.circuit import get_circuit_breaker
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    @mock.patch('aws_lambda_fsm.circuit.time')
+    def test_opens_after_consecutive_failures(self,
+                                              mock_time):
+        mock_time.time.return_value = 100.
+        breaker = CircuitBreaker('arn', failure_threshold=3, reset_timeout=10.)
+        breaker.failed()
+        breaker.failed()
+        breaker.succeeded()
+        breaker.failed()
+        breaker.failed()
+        self.assertEqual(('closed', [True, False]), (breaker.state, breaker.primaries()))
+        breaker.failed()
+        self.assertEqual(('open', [False]), (breaker.state, breaker.primaries()))
+
+    @mock.patch('aws_lambda_fsm.circuit.time')
+    def test_half_open_probe_succeeds(self,
+                                      mock_time):
+        mock_time.time.return_value = 100.
+        breaker = CircuitBreaker('arn', failure_threshold=1, reset_timeout=10.)
+        breaker.failed()
+        mock_time.time.return_value = 110.
+
+        # a single caller probes the primary
+        self.assertEqual([True, False], breaker.primaries())
+        self.assertEqual(('half_open', [False]), (breaker.state, breaker.primaries()))
+        breaker.succeeded()
+        self.assertEqual(('closed', 0, [True, False]), (breaker.state, breaker.failures, breaker.primaries()))
+
+    @mock.patch('aws_lambda_fsm.circuit.time')
+    def test_half_open_probe_fails(self,
+                                   mock_time):
+        mock_time.time.return_value = 100.
+        breaker = CircuitBreaker('arn', failure_threshold=5, reset_timeout=10.)
+        for i in range(5):
+            breaker.failed()
+        mock_time.time.return_value = 110.
+        self.assertTrue(breaker.allow())
+        mock_time.time.return_value = 115.
+        breaker.failed()
+        self.assertEqual(('open', 115.), (breaker.state, breaker.opened_at))
+        mock_time.time.return_value = 124.
+        self.assertFalse(breaker.allow())
+
+    @mock.patch('aws_lambda_fsm.circuit.time')
+    def test_half_open_probe_lost(self,
+                                  mock_time):
+        mock_time.time.return_value = 100.
+        breaker = CircuitBreaker('arn', failure_threshold=1, reset_timeout=10.)
+        breaker.failed()
+        mock_time.time.return_value = 110.
+        self.assertTrue(breaker.allow())
+        mock_time.time.return_value = 120.
+        self.assertTrue(breaker.allow())
+
+    def test_disabled(self):
+        breaker = CircuitBreaker('arn', failure_threshold=0)
+        for i in range(100):
+            breaker.failed()
+        self.assertEqual(('closed', [True, False]), (breaker.state, breaker.primaries()))
+
+
+class TestGetCircuitBreaker(unittest.TestCase):
+
+    def tearDown(self):
+        circuit._local.breakers.clear()
+
+    @mock.patch('aws_lambda_fsm.circuit.settings')
+    def test_get_circuit_breaker(self,
+                                 mock_settings):
+        mock_settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD = 2
+        mock_settings.CIRCUIT_BREAKER_RESET_TIMEOUT = 5
+        breaker = get_circuit_breaker('arn')
+        self.assertEqual(('arn', 2, 5), (breaker.name, breaker.failure_threshold, breaker.reset_timeout))
+        self.assertTrue(breaker is get_circuit_breaker('arn'))
+        self.assertFalse(breaker is get_circuit_breaker('arn2'))
+
+    def test_get_circuit_breaker_no_arn(self):
+        breaker = get_circuit_breaker(None)
+        for i in range(100):
+            breaker.failed()
+        self.assertEqual(('closed', [True, False]), (breaker.state, breaker.primaries()))
+        breaker.succeeded()
+        self.assertFalse(breaker is get_circuit_breaker(None))
+        self.assertEqual([], circuit._local.breakers.items())
@@ -37,7 +37,8 @@ class TestClient(unittest.TestCase):
             '{"system_context": {"correlation_id": "correlation_id", "current_event": '
             '"pseudo_init", "current_state": "pseudo_init", "machine_name": "name", "retries": 0, '
             '"started_at": 12345, "steps": 0}, "user_context": {"aaa": "bbb"}, "version": "0.1"}',
-            'correlation_id'
+            'correlation_id',
+            lane=None
         )
 
     @mock.patch('aws_lambda_fsm.client.send_next_events_for_dispatch')
@@ -55,5 +56,29 @@ class TestClient(unittest.TestCase):
              '{"system_context": {"correlation_id": "b", "current_event": "pseudo_init", '
              '"current_state": "pseudo_init", "machine_name": "name", "retries": 0, "started_at": '
              '12345, "steps": 0}, "user_context": {"ccc": "ddd"}, "version": "0.1"}'],
-            ['a', 'b']
+            ['a', 'b'],
+            primary=True,
+            lane=None,
+            sources=None
+        )
+
+    @mock.patch('aws_lambda_fsm.client.send_next_events_for_dispatch')
+    @mock.patch('aws_lambda_fsm.client.time')
+    def test_start_state_machines_system_contexts(self,
+                                                  mock_time,
+                                                  mock_send_next_event_for_dispatch):
+        mock_time.time.return_value = 12345.
+        mock_send_next_event_for_dispatch.return_value = ['a']
+        self.assertEqual(['a'], start_state_machines('name', [{'aaa': 'bbb'}], correlation_ids=['a'],
+                                                     system_contexts=[{'join': 'j'}], lane='l', primary=False,
+                                                     sources={'x': 'y'}))
+        mock_send_next_event_for_dispatch.assert_called_with(
+            None,
+            ['{"system_context": {"correlation_id": "a", "current_event": "pseudo_init", '
+             '"current_state": "pseudo_init", "join": "j", "machine_name": "name", "retries": 0, '
+             '"started_at": 12345, "steps": 0}, "user_context": {"aaa": "bbb"}, "version": "0.1"}'],
+            ['a'],
+            primary=False,
+            lane='l',
+            sources={'x': 'y'}
         )
@@ -13,15 +13,25 @@
 # limitations under the License.
 
 # system imports
+from threading import RLock
+import datetime
 import unittest
 
 # library imports
+import mock
 
 # application imports
 from aws_lambda_fsm.config import load_config_from_yaml
+from aws_lambda_fsm.config import load_precompiled_config
+from aws_lambda_fsm.config import compile_config
+from aws_lambda_fsm.config import get_precompiled_source
+from aws_lambda_fsm.config import get_configuration_errors
+from aws_lambda_fsm.config import _get_precompiled_configurations
+from aws_lambda_fsm.config import _get_non_literal_path
 from aws_lambda_fsm.config import get_current_configuration
 from aws_lambda_fsm.config import get_settings
 from aws_lambda_fsm.config import set_settings
+from aws_lambda_fsm.config import import_class
 import aws_lambda_fsm.config
 from tests.aws_lambda_fsm import TestSettings
 
@@ -47,3 +57,190 @@ class TestAction(unittest.TestCase):
         set_settings('foo')
         s = get_settings()
         self.assertEqual('foo', s)
+
+
+class TestImportClass(unittest.TestCase):
+
+    def test_import_class(self):
+        self.assertEqual(RLock, import_class('threading.RLock'))
+
+
+class TestPrecompiled(unittest.TestCase):
+
+    def setUp(self):
+        aws_lambda_fsm.config._config = {}
+        aws_lambda_fsm.config._precompiled = None
+
+    def tearDown(self):
+        aws_lambda_fsm.config._config = {}
+        aws_lambda_fsm.config._precompiled = None
+
+    def test_no_precompiled_module(self):
+        self.assertEqual({}, _get_precompiled_configurations())
+        self.assertIsNone(load_precompiled_config())
+
+    @mock.patch('aws_lambda_fsm.config.importlib')
+    def test_precompiled_module(self, mock_importlib):
+        mock_importlib.import_module.return_value.CONFIGURATIONS = {'a.yaml': {}}
+        self.assertEqual({'a.yaml': {}}, _get_precompiled_configurations())
+        mock_importlib.import_module.assert_called_with('fsm_compiled')
+
+    @mock.patch('aws_lambda_fsm.config.importlib')
+    def test_broken_precompiled_module(self, mock_importlib):
+        mock_importlib.import_module.side_effect = NameError('datetime')
+        self.assertEqual({}, _get_precompiled_configurations())
+
+    def test_get_non_literal_path(self):
+        self.assertIsNone(_get_non_literal_path({'a': [1, 2.0, u'b', None, True, {1: 'c'}]}))
+        self.assertEqual('a[1].b', _get_non_literal_path({'a': [{}, {'b': datetime.date(2017, 1, 1)}]}))
+        self.assertEqual('a', _get_non_literal_path({'a': float('nan')}))
+        self.assertEqual('(1, 2)', _get_non_literal_path({(1, 2): 'a'}))
+        self.assertEqual('.', _get_non_literal_path(float('inf')))
+
+    def test_get_precompiled_source_non_literal(self):
+        self.assertRaises(ValueError, get_precompiled_source, {'fsm.yaml': {'config': datetime.date(2017, 1, 1)}})
+
+    @mock.patch('aws_lambda_fsm.config._get_checksum')
+    @mock.patch('aws_lambda_fsm.config.load_config_from_yaml')
+    def test_compile_config_non_literal(self, mock_load_config_from_yaml, mock_get_checksum):
+        mock_get_checksum.return_value = 'checksum'
+        mock_load_config_from_yaml.return_value = \
+            {'machines': [{'import': 'a.yaml', 'date': datetime.date(2017, 1, 1)}]}
+        configurations, errors = compile_config(filename='a.yaml')
+        self.assertEqual(['a.yaml: value at "machines[0].date" is not a plain literal (quote it in the .yaml).'],
+                         errors)
+
+    def test_get_current_configuration_prefers_precompiled(self):
+        checksum = aws_lambda_fsm.config._get_checksum('fsm.yaml')
+        aws_lambda_fsm.config._precompiled = {'fsm.yaml': {'checksum': checksum, 'config': {'machines': []}}}
+        self.assertEqual({'machines': []}, get_current_configuration())
+
+    def test_get_current_configuration_stale_precompiled(self):
+        aws_lambda_fsm.config._precompiled = {'fsm.yaml': {'checksum': 'stale', 'config': {'machines': []}}}
+        self.assertEqual(load_config_from_yaml(), get_current_configuration())
+
+    def test_precompiled_without_yaml_file(self):
+        aws_lambda_fsm.config._precompiled = {'missing.yaml': {'checksum': 'x', 'config': {'machines': []}}}
+        self.assertEqual({'machines': []}, load_precompiled_config(filename='missing.yaml'))
+
+    def test_compile_config(self):
+        configurations, errors = compile_config()
+        self.assertEqual([], errors)
+        self.assertTrue('fsm.yaml' in configurations)
+        self.assertTrue('examples/tracer/fsm.yaml' in configurations)
+        source = get_precompiled_source(configurations)
+        namespace = {}
+        exec(source, namespace)
+        self.assertEqual(configurations, namespace['CONFIGURATIONS'])
+
+    @mock.patch('aws_lambda_fsm.config._get_checksum')
+    @mock.patch('aws_lambda_fsm.config.load_config_from_yaml')
+    def test_compile_config_duplicate_import(self, mock_load_config_from_yaml, mock_get_checksum):
+        mock_get_checksum.return_value = 'checksum'
+        mock_load_config_from_yaml.side_effect = [
+            {'machines': [{'import': 'a.yaml'}, {'import': 'a.yaml'}]},
+            {'machines': []}
+        ]
+        configurations, errors = compile_config()
+        self.assertEqual(['a.yaml', 'fsm.yaml'], sorted(configurations.keys()))
+        self.assertEqual(2, mock_load_config_from_yaml.call_count)
+
+
+class TestGetConfigurationErrors(unittest.TestCase):
+
+    def test_valid(self):
+        config_dict = {
+            'machines': [
+                {'import': 'foo.yaml'},
+                {'name': 'm', 'states': [{'name': 'a', 'initial': True, 'max_retries': 3, 'map': {'machine': 'n'},
+                                          'transitions': [{'event': 'e', 'target': 'a'}]}]}
+            ]
+        }
+        self.assertEqual([], get_configuration_errors(config_dict))
+
+    @mock.patch('aws_lambda_fsm.config.get_settings')
+    def test_snapshot_interval(self,
+                               mock_get_settings):
+        mock_get_settings.return_value.PRIMARY_CHECKPOINT_SOURCE = 'arn:partition:dynamodb:testing:account:table/t'
+
+        def machine(name, snapshot_interval=5, **kwargs):
+            kwargs.update(name=name, snapshot_interval=snapshot_interval, states=[{'name': 'a', 'initial': True}])
+            return kwargs
+        config_dict = {
+            'machines': [
+                machine('m1'),
+                machine('m2', sources={'checkpoint': {'primary': 'arn:partition:kinesis:testing:account:stream/s'}}),
+                machine('m3', sources={'checkpoint': {'secondary': 'arn:partition:kinesis:testing:account:stream/s'}}),
+                machine('m4', snapshot_interval='x', sources={'checkpoint': {'primary': 'x'}})
+            ]
+        }
+        self.assertEqual([
+            'fsm.yaml: machine "m2" has a snapshot_interval, which requires a dynamodb checkpoint source.',
+            'fsm.yaml: machine "m4" has an invalid snapshot_interval.'
+        ], get_configuration_errors(config_dict))
+
+    @mock.patch('aws_lambda_fsm.config.get_settings')
+    def test_snapshot_interval_settings(self,
+                                        mock_get_settings):
+        mock_get_settings.return_value.PRIMARY_CHECKPOINT_SOURCE = None
+        config_dict = {
+            'machines': [
+                {'name': 'm1', 'snapshot_interval': 5, 'states': [{'name': 'a', 'initial': True}]},
+                {'name': 'm2', 'snapshot_interval': 0, 'states': [{'name': 'a', 'initial': True}]}
+            ]
+        }
+        self.assertEqual([
+            'fsm.yaml: machine "m1" has a snapshot_interval, which requires a dynamodb checkpoint source.'
+        ], get_configuration_errors(config_dict))
+
+    def test_do_action_only(self):
+        config_dict = {
+            'machines': [
+                {'name': 'm', 'states': [{'name': 'a', 'initial': True,
+                                          'entry_action': 'aws_lambda_fsm.parallel.ForkAction',
+                                          'exit_action': 'aws_lambda_fsm.action.Action',
+                                          'do_action': 'aws_lambda_fsm.parallel.MapAction',
+                                          'transitions': [{'event': 'e', 'target': 'a',
+                                                           'action': 'aws_lambda_fsm.parallel.MapAction'},
+                                                          {'event': 'f', 'target': 'a',
+                                                           'action': 'not_a_module.Action'}]}]}
+            ]
+        }
+        self.assertEqual([
+            'fsm.yaml: machine "m" state "a" uses aws_lambda_fsm.parallel.ForkAction as an entry_action '
+            '(it must be a do_action).',
+            'fsm.yaml: machine "m" state "a" uses aws_lambda_fsm.parallel.MapAction as a transition action '
+            '(it must be a do_action).'
+        ], get_configuration_errors(config_dict))
+
+    def test_no_machines(self):
+        self.assertEqual(['fsm.yaml: "machines" must be a list.'], get_configuration_errors(None))
+
+    def test_invalid(self):
+        config_dict = {
+            'machines': [
+                {'states': []},
+                {'name': 'm1', 'max_retries': 'x', 'snapshot_interval': [], 'stream': 1, 'sources': {'metrics': {}}},
+                {'name': 'm2', 'states': [{'name': 'a'}, {'name': 'a'}, {}]},
+                {'name': 'm3', 'states': [{'name': 'a', 'initial': True, 'stream': ['x'],
+                                           'retry_backoff': 'x', 'map': {'items': 'i'}, 'parallel': [],
+                                           'transitions': [{'target': 'b'}]}]}
+            ]
+        }
+        self.assertEqual([
+            'fsm.yaml: machine #0 has no name.',
+            'fsm.yaml: machine "m1" has an invalid max_retries.',
+            'fsm.yaml: machine "m1" has an invalid snapshot_interval.',
+            'fsm.yaml: machine "m1" has an invalid stream.',
+            'fsm.yaml: machine "m1" has invalid sources.',
+            'fsm.yaml: machine "m1" has no states.',
+            'fsm.yaml: machine "m2" has duplicate state names.',
+            'fsm.yaml: machine "m2" has no initial state.',
+            'fsm.yaml: machine "m2" has a state with no name.',
+            'fsm.yaml: machine "m3" state "a" has an invalid stream.',
+            'fsm.yaml: machine "m3" state "a" has an invalid retry_backoff.',
+            'fsm.yaml: machine "m3" state "a" has an invalid map.',
+            'fsm.yaml: machine "m3" state "a" has an invalid parallel.',
+            'fsm.yaml: machine "m3" state "a" has a transition with no event.',
+            'fsm.yaml: machine "m3" state "a" has a transition to unknown target "b".'
+        ], get_configuration_errors(config_dict))
@@ -0,0 +1,99 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# system imports
+import unittest
+import threading
+import time
+
+# library imports
+import mock
+
+# application imports
+from aws_lambda_fsm import engine
+from aws_lambda_fsm.engine import get_concurrency
+from aws_lambda_fsm.engine import get_map_concurrency
+from aws_lambda_fsm.engine import map_concurrently
+from aws_lambda_fsm.engine import get_correlation_id
+from aws_lambda_fsm.engine import run_concurrently
+
+
+class TestEngine(unittest.TestCase):
+
+    def setUp(self):
+        engine._local.pool = None
+        engine._local.pool_size = 0
+        engine._local.map_pool = None
+        engine._local.map_pool_size = 0
+
+    @mock.patch('aws_lambda_fsm.engine.settings')
+    def test_get_concurrency(self,
+                             mock_settings):
+        mock_settings.DISPATCH_CONCURRENCY = 0
+        self.assertEqual(1, get_concurrency())
+        mock_settings.DISPATCH_CONCURRENCY = 8
+        self.assertEqual(8, get_concurrency())
+
+    def test_get_correlation_id(self):
+        self.assertEqual('abc', get_correlation_id({'system_context': {'correlation_id': 'abc'}}))
+        self.assertEqual(None, get_correlation_id({'system_context': None}))
+        self.assertEqual(None, get_correlation_id(None))
+
+    def test_run_concurrently_serial(self):
+        processed = []
+        run_concurrently([1, 2, 3], processed.append, key=None, concurrency=1)
+        self.assertEqual([1, 2, 3], processed)
+        self.assertEqual(None, engine._local.pool)
+
+    def test_run_concurrently_preserves_order_per_key(self):
+        processed = []
+        threads = set()
+
+        def process(item):
+            threads.add(threading.current_thread().name)
+            time.sleep(0.001)
+            processed.append(item)
+
+        items = [('a', i) for i in range(5)] + [('b', i) for i in range(5)]
+        run_concurrently(items, process, key=lambda item: item[0], concurrency=2)
+        self.assertEqual(sorted(items), sorted(processed))
+        self.assertEqual(range(5), [i for k, i in processed if k == 'a'])
+        self.assertEqual(range(5), [i for k, i in processed if k == 'b'])
+        self.assertEqual(2, engine._local.pool_size)
+
+    def test_run_concurrently_grows_pool(self):
+        run_concurrently([1, 2], lambda item: None, key=lambda item: item, concurrency=2)
+        pool = engine._local.pool
+        run_concurrently([1, 2], lambda item: None, key=lambda item: item, concurrency=2)
+        self.assertTrue(pool is engine._local.pool)
+        run_concurrently([1, 2], lambda item: None, key=lambda item: item, concurrency=4)
+        self.assertFalse(pool is engine._local.pool)
+        self.assertEqual(4, engine._local.pool_size)
+
+    @mock.patch('aws_lambda_fsm.engine.settings')
+    def test_get_map_concurrency(self,
+                                 mock_settings):
+        mock_settings.MAP_CONCURRENCY = 0
+        self.assertEqual(1, get_map_concurrency())
+        mock_settings.MAP_CONCURRENCY = 8
+        self.assertEqual(8, get_map_concurrency())
+
+    def test_map_concurrently_serial(self):
+        self.assertEqual([2, 4, 6], map_concurrently([1, 2, 3], lambda item: item * 2, concurrency=1))
+        self.assertEqual(None, engine._local.map_pool)
+
+    def test_map_concurrently(self):
+        self.assertEqual([2, 4, 6], map_concurrently([1, 2, 3], lambda item: item * 2, concurrency=2))
+        self.assertEqual(2, engine._local.map_pool_size)
+        self.assertEqual(None, engine._local.pool)
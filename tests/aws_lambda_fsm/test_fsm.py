@@ -13,6 +13,7 @@
 # limitations under the License.
 
 # system imports
+from collections import OrderedDict
 import unittest
 import copy
 import json
@@ -25,7 +26,18 @@ from botocore.exceptions import ClientError
 from aws_lambda_fsm.action import Action
 from aws_lambda_fsm.fsm import FSM
 from aws_lambda_fsm import config
+from aws_lambda_fsm import instrumentation
+from aws_lambda_fsm import tracing
+from aws_lambda_fsm import circuit
+from aws_lambda_fsm.circuit import get_circuit_breaker
+from aws_lambda_fsm import snapshot
+from aws_lambda_fsm.instrumentation import HistogramInstrumentation
 from aws_lambda_fsm.fsm import Context
+from aws_lambda_fsm.aws import get_primary_cache_source
+from aws_lambda_fsm.aws import get_primary_retry_source
+from aws_lambda_fsm.aws import get_primary_stream_source
+from aws_lambda_fsm.aws import get_secondary_retry_source
+from aws_lambda_fsm.aws import get_secondary_stream_source
 
 
 class TestAction(Action):
@@ -38,9 +50,18 @@ class ErrorAction(Action):
         raise Exception()
 
 
+class DelayAction(Action):
+    def execute(self, context, obj):
+        obj['delay'] = 10
+        return 'ok'
+
+
 class TestFsmBase(unittest.TestCase):
     maxDiff = 99999
 
+    def tearDown(self):
+        circuit._local.breakers.clear()
+
     CONFIG_DICT = {
         'machines': [
             {
@@ -89,9 +110,17 @@ class TestFSM(TestFsmBase):
         # test the factory
         config._config = {'some/fsm.yaml': {'machines': []}}
         fsm = FSM(config_dict=self.CONFIG_DICT)
+        self.assertEqual({}, fsm.machines)
+        self.assertEqual(['foo'], fsm.machine_dicts.keys())
+        fsm.get_machine('foo')
         self.assertEqual({
             'foo': {
                 'max_retries': 5,
+                'inline_steps': 0,
+                'inline_seconds': 1.0,
+                'snapshot_interval': 0,
+                'stream': 's',
+                'sources': None,
                 'states': {
                     'a': fsm.machines['foo']['states']['a'],
                     'b': fsm.machines['foo']['states']['b'],
@@ -117,6 +146,70 @@ class TestFSM(TestFsmBase):
         instance = self._instance()
         self.assertEqual({}, instance)
 
+    def test_FSM_builds_machines_lazily(self):
+        config._config = {'some/fsm.yaml': {'machines': [{'name': 'bar', 'states': []}]}}
+        fsm = FSM(config_dict=self.CONFIG_DICT)
+        self.assertEqual(['bar', 'foo'], sorted(fsm.machine_dicts.keys()))
+        self.assertEqual({}, fsm.machines)
+        fsm.create_FSM_instance('foo')
+        self.assertEqual(['foo'], fsm.machines.keys())
+        self.assertTrue(fsm.get_machine('foo') is fsm.get_machine('foo'))
+        self.assertTrue(FSM().get_machine('foo') is fsm.get_machine('foo'))
+
+    def test_FSM_merges_machine_dicts(self):
+        config._config = {'some/fsm.yaml': {'machines': [{'name': 'foo', 'max_retries': 2,
+                                                          'states': [{'name': 'c'}]}]}}
+        fsm = FSM(config_dict=self.CONFIG_DICT)
+        machine = fsm.get_machine('foo')
+        self.assertEqual(['a', 'b', 'c', 'pseudo_final', 'pseudo_init'], sorted(machine['states'].keys()))
+        self.assertEqual(5, machine['max_retries'])
+
+    def test_FSM_lane(self):
+        config._config = {'some/fsm.yaml': {'machines': [{'name': 'foo',
+                                                          'states': [{'name': 'c', 'stream': 'fast'}]}]}}
+        fsm = FSM(config_dict=self.CONFIG_DICT)
+        self.assertEqual('s', fsm.get_machine('foo')['stream'])
+        instance = fsm.create_FSM_instance('foo', initial_state_name='a')
+        self.assertEqual('s', instance.lane)
+        instance = fsm.create_FSM_instance('foo', initial_state_name='c')
+        self.assertEqual('fast', instance.lane)
+
+    def test_FSM_sources(self):
+        config._config = {'some/fsm.yaml': {'machines': [{'name': 'foo',
+                                                          'sources': {'retry': {'primary': 'r1'},
+                                                                      'cache': {'secondary': 'c2'}},
+                                                          'states': [{'name': 'c'}]}]}}
+        fsm = FSM(config_dict=self.CONFIG_DICT)
+        self.assertEqual(sorted(['r1', get_primary_retry_source()]), fsm.get_primary_sources('retry'))
+        self.assertEqual([get_primary_stream_source()], fsm.get_primary_sources('stream'))
+        sources = fsm.get_machine('foo')['sources']
+        self.assertEqual({'primary': 'r1', 'secondary': get_secondary_retry_source()}, sources['retry'])
+        self.assertEqual({'primary': get_primary_cache_source(), 'secondary': 'c2'}, sources['cache'])
+        self.assertEqual({'primary': get_primary_stream_source(), 'secondary': get_secondary_stream_source()},
+                         sources['stream'])
+        instance = fsm.create_FSM_instance('foo', initial_state_name='a')
+        self.assertTrue(instance.sources is sources)
+
+    def test_FSM_compiles_states(self):
+        config._config = {'some/fsm.yaml': {'machines': []}}
+        fsm = FSM(config_dict=self.CONFIG_DICT)
+        machine = fsm.get_machine('foo')
+        states = machine['states']
+        self.assertEqual(
+            {'c': (machine['transitions']['a->b:c'], None, None, None, None, states['b'], 'true')},
+            states['a']._event_2_dispatch
+        )
+        self.assertEqual(
+            {'pseudo_init': (machine['transitions']['pseudo_init->a:pseudo_init'], None, None, None,
+                             states['a'].do_action, states['a'], None)},
+            states['pseudo_init']._event_2_dispatch
+        )
+
+    def test_FSM_unknown_machine(self):
+        config._config = {'some/fsm.yaml': {'machines': []}}
+        fsm = FSM(config_dict=self.CONFIG_DICT)
+        self.assertRaises(KeyError, fsm.create_FSM_instance, 'unknown')
+
     def test_FSM_system_context(self):
         instance = self._instance()
         instance.system_context()
@@ -222,7 +315,8 @@ class TestDispatchAndRetry(TestFsmBase):
         )
         mock_stop_retries.assert_called_with(
             instance,
-            primary=True
+            primary=True,
+            sources=None
         )
 
     @mock.patch('aws_lambda_fsm.fsm.stop_retries')
@@ -276,24 +370,57 @@ class TestDispatchAndRetry(TestFsmBase):
             'b',
             delay=0,
             primary=True,
-            recovering=False
+            recovering=False,
+            lane='s',
+            sources=None
         )
         mock_store_checkpoint.assert_called_with(
             instance,
             '{"put": "record"}',
-            primary=True
+            primary=True,
+            sources=None
         )
         mock_stop_retries.assert_called_with(
             instance,
-            primary=True
+            primary=True,
+            sources=None
         )
         mock_set_message_dispatched.assert_called_with(
             'b',
             999,
             0,
-            primary=False
+            primary=False,
+            sources=None
         )
 
+    @mock.patch('aws_lambda_fsm.fsm.stop_retries')
+    @mock.patch('aws_lambda_fsm.fsm.send_next_event_for_dispatch')
+    @mock.patch('aws_lambda_fsm.fsm.store_checkpoint')
+    @mock.patch('aws_lambda_fsm.fsm.set_message_dispatched')
+    def test_dispatch_instrumented(self,
+                                   mock_set_message_dispatched,
+                                   mock_store_checkpoint,
+                                   mock_send_next_event_for_dispatch,
+                                   mock_stop_retries):
+        instrumentation._local.instrumentation = HistogramInstrumentation()
+        try:
+            self._dispatch(mock_send_next_event_for_dispatch)
+            histograms = instrumentation._local.instrumentation.histograms
+        finally:
+            instrumentation._local.instrumentation = None
+        self.assertEqual(
+            [
+                ('foo', 's', 'action'),
+                ('foo', 's', 'checkpoint'),
+                ('foo', 's', 'idempotency'),
+                ('foo', 's', 'send'),
+                ('foo', 's', 'serialization')
+            ],
+            sorted(histograms.keys())
+        )
+        self.assertEqual(2, histograms[('foo', 's', 'idempotency')].count)
+        self.assertEqual(2, histograms[('foo', 's', 'serialization')].count)
+
     @mock.patch('aws_lambda_fsm.fsm.Context._queue_error')
     @mock.patch('aws_lambda_fsm.fsm.stop_retries')
     @mock.patch('aws_lambda_fsm.fsm.send_next_event_for_dispatch')
@@ -315,22 +442,26 @@ class TestDispatchAndRetry(TestFsmBase):
             'b',
             delay=0,
             primary=True,
-            recovering=False
+            recovering=False,
+            lane='s',
+            sources=None
         )
         mock_store_checkpoint.assert_called_with(
             instance,
             '{"put": "record"}',
-            primary=True
+            primary=True,
+            sources=None
         )
         mock_stop_retries.assert_called_with(
             instance,
-            primary=True
+            primary=True,
+            sources=None
         )
 
         mock_set_message_dispatched.assert_has_calls(
             [
-                mock.call('b', 999, 0, primary=True),
-                mock.call('b', 999, 0, primary=False)
+                mock.call('b', 999, 0, primary=True, sources=None),
+                mock.call('b', 999, 0, primary=False, sources=None)
             ]
         )
         mock_queue_error.assert_called_with(
@@ -363,7 +494,9 @@ class TestDispatchAndRetry(TestFsmBase):
             'b',
             delay=0,
             primary=True,
-            recovering=False
+            recovering=False,
+            lane='s',
+            sources=None
         )
         mock_start_retries.assert_called_with(
             instance,
@@ -372,7 +505,9 @@ class TestDispatchAndRetry(TestFsmBase):
             '"s", "machine_name": "foo", "metrics": "m", "retries": 1, "steps": 999, "stream": '
             '"s", "table": "t", "topic": "z"}, "user_context": {}, "version": "0.1"}',
             primary=True,
-            recovering=False
+            recovering=False,
+            lane='s',
+            sources=None
         )
         mock_queue_error.assert_called_with(
             'retry',
@@ -399,7 +534,8 @@ class TestDispatchAndRetry(TestFsmBase):
             'b',
             999,
             0,
-            primary=False
+            primary=False,
+            sources=None
         )
         mock_send_next_event_for_dispatch.assert_called_with(
             instance,
@@ -409,12 +545,15 @@ class TestDispatchAndRetry(TestFsmBase):
             'b',
             delay=0,
             primary=True,
-            recovering=False
+            recovering=False,
+            lane='s',
+            sources=None
         )
         mock_store_checkpoint.assert_called_with(
             instance,
             '{"put": "record"}',
-            primary=False
+            primary=False,
+            sources=None
         )
         mock_queue_error.assert_called_with(
             'error',
@@ -423,7 +562,8 @@ class TestDispatchAndRetry(TestFsmBase):
         )
         mock_stop_retries.assert_called_with(
             instance,
-            primary=True
+            primary=True,
+            sources=None
         )
 
     @mock.patch('aws_lambda_fsm.fsm.Context._queue_error')
@@ -446,7 +586,8 @@ class TestDispatchAndRetry(TestFsmBase):
             'b',
             999,
             0,
-            primary=False
+            primary=False,
+            sources=None
         )
         mock_send_next_event_for_dispatch.assert_called_with(
             instance,
@@ -456,12 +597,15 @@ class TestDispatchAndRetry(TestFsmBase):
             'b',
             delay=0,
             primary=True,
-            recovering=False
+            recovering=False,
+            lane='s',
+            sources=None
         )
         mock_store_checkpoint.assert_called_with(
             instance,
             '{"put": "record"}',
-            primary=True
+            primary=True,
+            sources=None
         )
         mock_queue_error.assert_called_with(
             'error',
@@ -470,10 +614,256 @@ class TestDispatchAndRetry(TestFsmBase):
         )
         mock_stop_retries.assert_called_with(
             instance,
-            primary=False
+            primary=False,
+            sources=None
         )
 
 
+class TestDispatchInline(TestFsmBase):
+
+    def _config_dict(self, inline_steps, inline_seconds, final):
+        action = 'tests.aws_lambda_fsm.test_fsm.TestAction'
+        return {
+            'machines': [
+                {
+                    'name': 'inline',
+                    'inline_steps': inline_steps,
+                    'inline_seconds': inline_seconds,
+                    'states': [
+                        {'name': 'a', 'initial': True, 'do_action': action,
+                         'transitions': [{'target': 'b', 'event': 'ok'}]},
+                        {'name': 'b', 'do_action': action,
+                         'transitions': [{'target': 'c', 'event': 'ok'}]},
+                        {'name': 'c', 'do_action': None if final else action, 'final': final,
+                         'transitions': [] if final else [{'target': 'a', 'event': 'ok'}]}
+                    ]
+                }
+            ]
+        }
+
+    @mock.patch('aws_lambda_fsm.fsm.stop_retries')
+    @mock.patch('aws_lambda_fsm.fsm.send_next_event_for_dispatch')
+    @mock.patch('aws_lambda_fsm.fsm.store_checkpoint')
+    @mock.patch('aws_lambda_fsm.fsm.set_message_dispatched')
+    def _dispatch(self,
+                  config_dict,
+                  obj,
+                  mock_set_message_dispatched,
+                  mock_store_checkpoint,
+                  mock_send_next_event_for_dispatch,
+                  mock_stop_retries):
+        fsm = FSM(config_dict=config_dict)
+        instance = fsm.create_FSM_instance(
+            'inline',
+            initial_state_name='pseudo_init',
+            initial_system_context={'correlation_id': 'b', 'steps': 999}
+        )
+        obj['payload'] = json.dumps(instance.to_payload_dict())
+        obj['source'] = 'dynamodb_retry'
+        mock_send_next_event_for_dispatch.return_value = {'put': 'record'}
+        instance._dispatch_and_retry('pseudo_init', obj)
+        mock_set_message_dispatched.assert_called_with('b', 999, 0, primary=False, sources=None)
+        if not mock_send_next_event_for_dispatch.called:
+            return None
+        return json.loads(mock_send_next_event_for_dispatch.call_args[0][1])['system_context']
+
+    def test_inline_disabled(self):
+        system_context = self._dispatch(self._config_dict(0, 1.0, False), {})
+        self.assertEqual(('a', 'ok', 1000), (system_context['current_state'],
+                                             system_context['current_event'],
+                                             system_context['steps']))
+
+    def test_inline_steps_budget(self):
+        system_context = self._dispatch(self._config_dict(4, 60.0, False), {})
+        self.assertEqual(('b', 'ok', 1004), (system_context['current_state'],
+                                             system_context['current_event'],
+                                             system_context['steps']))
+
+    def test_inline_seconds_budget(self):
+        system_context = self._dispatch(self._config_dict(4, 0.0, False), {})
+        self.assertEqual(('a', 1000), (system_context['current_state'], system_context['steps']))
+
+    def test_inline_delay_stops_inline_execution(self):
+        system_context = self._dispatch(self._config_dict(4, 60.0, False), {'delay': 10})
+        self.assertEqual(('a', 1000), (system_context['current_state'], system_context['steps']))
+
+    def test_inline_machine_finishes(self):
+        self.assertIsNone(self._dispatch(self._config_dict(4, 60.0, True), {}))
+
+    @mock.patch('aws_lambda_fsm.fsm.get_primary_schedule_source')
+    @mock.patch('aws_lambda_fsm.fsm.schedule_event')
+    @mock.patch('aws_lambda_fsm.fsm.stop_retries')
+    @mock.patch('aws_lambda_fsm.fsm.store_checkpoint')
+    @mock.patch('aws_lambda_fsm.fsm.set_message_dispatched')
+    def test_inline_delay_scheduled_with_message_steps(self,
+                                                       mock_set_message_dispatched,
+                                                       mock_store_checkpoint,
+                                                       mock_stop_retries,
+                                                       mock_schedule_event,
+                                                       mock_get_primary_schedule_source):
+        config_dict = self._config_dict(4, 60.0, False)
+        config_dict['machines'][0]['states'][1]['do_action'] = 'tests.aws_lambda_fsm.test_fsm.DelayAction'
+        instance = FSM(config_dict=config_dict).create_FSM_instance(
+            'inline',
+            initial_state_name='pseudo_init',
+            initial_system_context={'correlation_id': 'b', 'steps': 999}
+        )
+        obj = {'payload': json.dumps(instance.to_payload_dict()), 'source': 'dynamodb_retry'}
+        instance._dispatch_and_retry('pseudo_init', obj)
+        args = mock_schedule_event.call_args[0]
+        self.assertEqual(('b', 1001, 0), args[:3])
+        self.assertEqual(1001, json.loads(args[4])['system_context']['steps'])
+
+    @mock.patch('aws_lambda_fsm.fsm.acquire_lease')
+    @mock.patch('aws_lambda_fsm.fsm.release_lease')
+    @mock.patch('aws_lambda_fsm.fsm.stop_retries')
+    @mock.patch('aws_lambda_fsm.fsm.send_next_event_for_dispatch')
+    @mock.patch('aws_lambda_fsm.fsm.store_checkpoint')
+    @mock.patch('aws_lambda_fsm.fsm.set_message_dispatched')
+    def test_inline_traced(self,
+                           mock_set_message_dispatched,
+                           mock_store_checkpoint,
+                           mock_send_next_event_for_dispatch,
+                           mock_stop_retries,
+                           mock_release_lease,
+                           mock_acquire_lease):
+        mock_acquire_lease.return_value = 'token'
+        mock_release_lease.return_value = True
+        mock_send_next_event_for_dispatch.return_value = {'put': 'record'}
+        sink = tracing._local.sink = mock.Mock()
+        tracing._local.sink_loaded = True
+        try:
+            fsm = FSM(config_dict=self._config_dict(1, 60.0, False))
+            instance = fsm.create_FSM_instance(
+                'inline',
+                initial_state_name='pseudo_init',
+                initial_system_context={'correlation_id': 'b', 'steps': 999,
+                                        'trace_id': 't', 'parent_span_id': 'p'}
+            )
+            obj = {'payload': json.dumps(instance.to_payload_dict()), 'source': 'dynamodb_retry'}
+            instance.dispatch('pseudo_init', obj)
+        finally:
+            tracing._local.sink = None
+            tracing._local.sink_loaded = False
+
+        action1, action2, step = [c[0][0] for c in sink.record.call_args_list]
+        self.assertEqual(('step', 't', 'p', 'ok', len(obj['payload'])),
+                         (step.operation, step.trace_id, step.parent_span_id, step.outcome, step.payload_size))
+        self.assertEqual({'machine_name': 'inline', 'correlation_id': 'b', 'steps': 999, 'retries': 0,
+                          'current_state': 'pseudo_init', 'current_event': 'pseudo_init'}, step.attributes)
+        self.assertEqual([('action', 't', step.span_id)] * 2,
+                         [(a.operation, a.trace_id, a.parent_span_id) for a in (action1, action2)])
+        system_context = json.loads(mock_send_next_event_for_dispatch.call_args[0][1])['system_context']
+        self.assertEqual(('t', step.span_id), (system_context['trace_id'], system_context['parent_span_id']))
+
+
+class TestDeltaPayload(TestFsmBase):
+
+    CONFIG_DICT = {
+        'machines': [
+            {
+                'name': 'delta',
+                'snapshot_interval': 2,
+                'states': [
+                    {'name': 'a', 'initial': True, 'do_action': 'tests.aws_lambda_fsm.test_fsm.TestAction',
+                     'transitions': [{'target': 'a', 'event': 'ok'}]}
+                ]
+            }
+        ]
+    }
+
+    def setUp(self):
+        snapshot._local.snapshots = OrderedDict()
+
+    def _instance(self, config_dict=CONFIG_DICT):
+        return FSM(config_dict=config_dict).create_FSM_instance(
+            config_dict['machines'][0]['name'],
+            initial_state_name='a',
+            initial_system_context={'correlation_id': 'c', 'steps': 10},
+            initial_user_context={'big': 'x' * 100, 'gone': 1}
+        )
+
+    def test_disabled(self):
+        config_dict = copy.deepcopy(self.CONFIG_DICT)
+        config_dict['machines'][0]['snapshot_interval'] = 0
+        instance = self._instance(config_dict=config_dict)
+        self.assertEqual(instance.to_payload_dict(), instance.to_delta_payload_dict())
+
+    @mock.patch('aws_lambda_fsm.snapshot.load_snapshot')
+    @mock.patch('aws_lambda_fsm.snapshot.store_snapshot')
+    def test_round_trip(self,
+                        mock_store_snapshot,
+                        mock_load_snapshot):
+        instance = self._instance()
+        payload = instance.to_delta_payload_dict()
+        snapshot_id = payload['system_context']['snapshot']
+        mock_store_snapshot.assert_called_with('c', snapshot_id, json.dumps(instance.user_context(), sort_keys=True),
+                                               primary=True, sources=None)
+        self.assertEqual(({}, [], 10), (payload['user_context'],
+                                        payload['system_context']['deleted'],
+                                        payload['system_context']['snapshot_steps']))
+
+        # the next step sends only the changes against the same snapshot
+        instance = Context.from_payload_dict(payload)
+        self.assertEqual({'big': 'x' * 100, 'gone': 1}, instance.user_context())
+        self.assertFalse('deleted' in instance.system_context())
+        del instance['gone']
+        instance['new'] = 2
+        instance.steps = 11
+        payload = instance.to_delta_payload_dict()
+        self.assertEqual(({'new': 2}, ['gone'], snapshot_id), (payload['user_context'],
+                                                               payload['system_context']['deleted'],
+                                                               payload['system_context']['snapshot']))
+
+        # rebuilt from the checkpoint source in another process
+        snapshot._local.snapshots = OrderedDict()
+        mock_load_snapshot.return_value = json.dumps({'big': 'x' * 100, 'gone': 1})
+        instance = Context.from_payload_dict(payload)
+        self.assertEqual({'big': 'x' * 100, 'new': 2}, instance.user_context())
+        mock_load_snapshot.assert_called_with('c', snapshot_id, primary=True, sources=None)
+
+        # and a new snapshot is taken every snapshot_interval steps
+        instance.steps = 12
+        payload = instance.to_delta_payload_dict()
+        self.assertNotEqual(snapshot_id, payload['system_context']['snapshot'])
+        self.assertEqual(({}, [], 12), (payload['user_context'],
+                                        payload['system_context']['deleted'],
+                                        payload['system_context']['snapshot_steps']))
+
+    @mock.patch('aws_lambda_fsm.fsm.Context._queue_error')
+    @mock.patch('aws_lambda_fsm.snapshot.store_snapshot')
+    def test_snapshot_fails(self,
+                            mock_store_snapshot,
+                            mock_queue_error):
+        mock_store_snapshot.side_effect = ClientError({'Error': {'Code': 'x', 'Message': 'y'}}, 'PutItem')
+        instance = self._instance()
+        instance._Context__system_context.update({'snapshot': 'old', 'snapshot_steps': 0})
+        payload = instance.to_delta_payload_dict()
+        self.assertEqual({'big': 'x' * 100, 'gone': 1}, payload['user_context'])
+        self.assertFalse(set(['snapshot', 'snapshot_steps', 'deleted']) & set(payload['system_context']))
+        mock_queue_error.assert_called_with('snapshot', 'Unable to use a snapshot. Sending the full context.')
+
+    @mock.patch('aws_lambda_fsm.fsm.stop_retries')
+    @mock.patch('aws_lambda_fsm.fsm.send_next_event_for_dispatch')
+    @mock.patch('aws_lambda_fsm.fsm.store_checkpoint')
+    @mock.patch('aws_lambda_fsm.fsm.set_message_dispatched')
+    @mock.patch('aws_lambda_fsm.snapshot.store_snapshot')
+    def test_dispatch_sends_delta(self,
+                                  mock_store_snapshot,
+                                  mock_set_message_dispatched,
+                                  mock_store_checkpoint,
+                                  mock_send_next_event_for_dispatch,
+                                  mock_stop_retries):
+        instance = self._instance()
+        obj = {'payload': json.dumps(instance.to_payload_dict()), 'source': 'dynamodb_retry'}
+        mock_send_next_event_for_dispatch.return_value = {'put': 'record'}
+        instance._dispatch_and_retry('ok', obj)
+        payload = json.loads(mock_send_next_event_for_dispatch.call_args[0][1])
+        self.assertEqual(({}, [], 11), (payload['user_context'],
+                                        payload['system_context']['deleted'],
+                                        payload['system_context']['steps']))
+
+
 class TestDispatchExclusiveLock(TestFsmBase):
 
     @mock.patch('aws_lambda_fsm.fsm.uuid')
@@ -496,14 +886,16 @@ class TestDispatchExclusiveLock(TestFsmBase):
             'bobloblaw',
             0,
             0,
-            primary=True
+            primary=True,
+            sources=None
         )
         mock_release_lease.assert_called_with(
             'bobloblaw',
             0,
             0,
             'foobar',
-            primary=True
+            primary=True,
+            sources=None
         )
         self.assertFalse(mock_queue_error.called)
         mock_dispatch_and_retry.assert_called_with(
@@ -531,14 +923,16 @@ class TestDispatchExclusiveLock(TestFsmBase):
             'bobloblaw',
             0,
             0,
-            primary=False
+            primary=False,
+            sources=None
         )
         mock_release_lease.assert_called_with(
             'bobloblaw',
             0,
             0,
             False,
-            primary=False
+            primary=False,
+            sources=None
         )
         self.assertEqual(
             [
@@ -552,6 +946,37 @@ class TestDispatchExclusiveLock(TestFsmBase):
             {'foo': 'bar'}
         )
 
+    @mock.patch('aws_lambda_fsm.fsm.uuid')
+    @mock.patch('aws_lambda_fsm.fsm.acquire_lease')
+    @mock.patch('aws_lambda_fsm.fsm.release_lease')
+    @mock.patch('aws_lambda_fsm.fsm.Context._queue_error')
+    @mock.patch('aws_lambda_fsm.fsm.Context._retry')
+    @mock.patch('aws_lambda_fsm.fsm.Context._dispatch_and_retry')
+    def test_lease_circuit_open(self,
+                                mock_dispatch_and_retry,
+                                mock_retry,
+                                mock_queue_error,
+                                mock_release_lease,
+                                mock_acquire_lease,
+                                mock_uuid):
+        mock_uuid.uuid4.return_value.hex = 'bobloblaw'
+        mock_acquire_lease.return_value = 0
+        mock_release_lease.return_value = True
+        for i in range(5):
+            Context('name').dispatch('event', {'foo': 'bar'})
+        self.assertEqual(10, mock_acquire_lease.call_count)
+
+        # the primary cache is skipped while the circuit is open
+        mock_acquire_lease.reset_mock()
+        mock_queue_error.reset_mock()
+        mock_acquire_lease.return_value = 'foobar'
+        instance = Context('name')
+        instance.dispatch('event', {'foo': 'bar'})
+        mock_acquire_lease.assert_called_once_with('bobloblaw', 0, 0, primary=False, sources=None)
+        mock_release_lease.assert_called_with('bobloblaw', 0, 0, 'foobar', primary=False, sources=None)
+        self.assertFalse(instance.lease_primary)
+        self.assertFalse(mock_queue_error.called)
+
 
 class TestContextPrimarySecondary(TestFsmBase):
 
@@ -573,7 +998,8 @@ class TestContextPrimarySecondary(TestFsmBase):
         mock_store_checkpoint.assert_called_with(
             {},
             '{"yep": "sent"}',
-            primary=True
+            primary=True,
+            sources=None
         )
 
     @mock.patch('aws_lambda_fsm.fsm.store_checkpoint')
@@ -585,7 +1011,8 @@ class TestContextPrimarySecondary(TestFsmBase):
         mock_store_checkpoint.assert_called_with(
             {},
             '{"yep": "sent"}',
-            primary=False
+            primary=False,
+            sources=None
         )
 
     @mock.patch('aws_lambda_fsm.fsm.start_retries')
@@ -605,7 +1032,9 @@ class TestContextPrimarySecondary(TestFsmBase):
             2.0,
             '{"system_context": {"retries": 1}, "user_context": {}}',
             primary=False,
-            recovering=False
+            recovering=False,
+            lane='s',
+            sources=None
         )
 
     @mock.patch('aws_lambda_fsm.fsm.start_retries')
@@ -624,7 +1053,9 @@ class TestContextPrimarySecondary(TestFsmBase):
             2.0,
             '{"system_context": {"retries": 1}, "user_context": {}}',
             primary=True,
-            recovering=False
+            recovering=False,
+            lane='s',
+            sources=None
         )
 
     @mock.patch('aws_lambda_fsm.fsm.stop_retries')
@@ -637,7 +1068,8 @@ class TestContextPrimarySecondary(TestFsmBase):
         instance._stop_retries({'source': 'dynamodb_retry'})
         mock_stop_retries.assert_called_with(
             {},
-            primary=True
+            primary=True,
+            sources=None
         )
 
     @mock.patch('aws_lambda_fsm.fsm.stop_retries')
@@ -651,7 +1083,8 @@ class TestContextPrimarySecondary(TestFsmBase):
         instance._stop_retries({'source': 'dynamodb_retry'})
         mock_stop_retries.assert_called_with(
             {},
-            primary=False
+            primary=False,
+            sources=None
         )
 
     @mock.patch('aws_lambda_fsm.fsm.send_next_event_for_dispatch')
@@ -665,7 +1098,9 @@ class TestContextPrimarySecondary(TestFsmBase):
             'foobar',
             delay=0,
             primary=True,
-            recovering=False
+            recovering=False,
+            lane=None,
+            sources=None
         )
 
     @mock.patch('aws_lambda_fsm.fsm.send_next_event_for_dispatch')
@@ -681,9 +1116,152 @@ class TestContextPrimarySecondary(TestFsmBase):
             'foobar',
             delay=0,
             primary=False,
-            recovering=True
+            recovering=True,
+            lane=None,
+            sources=None
         )
 
+    @mock.patch('aws_lambda_fsm.fsm.get_primary_schedule_source')
+    @mock.patch('aws_lambda_fsm.fsm.schedule_event')
+    @mock.patch('aws_lambda_fsm.fsm.send_next_event_for_dispatch')
+    @mock.patch('aws_lambda_fsm.fsm.time')
+    def test_send_next_event_for_dispatch_scheduled(self,
+                                                    mock_time,
+                                                    mock_send_next_event_for_dispatch,
+                                                    mock_schedule_event,
+                                                    mock_get_primary_schedule_source):
+        mock_time.time.return_value = 1.0
+        instance = self._instance()
+
+        # not delayed
+        instance._send_next_event_for_dispatch('a', {})
+        self.assertFalse(mock_schedule_event.called)
+        self.assertTrue(mock_send_next_event_for_dispatch.called)
+
+        # delayed
+        mock_send_next_event_for_dispatch.reset_mock()
+        self.assertEqual(mock_schedule_event.return_value,
+                         instance._send_next_event_for_dispatch('a', {'delay': 3600}))
+        mock_schedule_event.assert_called_with('foobar', 1, 0, 3601.0, 'a', primary=True)
+        self.assertFalse(mock_send_next_event_for_dispatch.called)
+
+        # the steps of a message sent after inline steps
+        instance._send_next_event_for_dispatch('a', {'delay': 3600}, steps=5)
+        mock_schedule_event.assert_called_with('foobar', 5, 0, 3601.0, 'a', primary=True)
+
+        # no schedule source
+        mock_schedule_event.reset_mock()
+        mock_get_primary_schedule_source.return_value = None
+        instance._send_next_event_for_dispatch('a', {'delay': 3600})
+        self.assertFalse(mock_schedule_event.called)
+        self.assertEqual(3600, mock_send_next_event_for_dispatch.call_args[1]['delay'])
+
+    @mock.patch('aws_lambda_fsm.fsm.get_primary_schedule_source')
+    @mock.patch('aws_lambda_fsm.fsm.schedule_event')
+    @mock.patch('aws_lambda_fsm.fsm.send_next_event_for_dispatch')
+    def test_send_next_event_for_dispatch_scheduled_error(self,
+                                                          mock_send_next_event_for_dispatch,
+                                                          mock_schedule_event,
+                                                          mock_get_primary_schedule_source):
+        mock_schedule_event.side_effect = ClientError({'Error': {'Code': 404}}, 'test')
+        instance = self._instance()
+        instance._send_next_event_for_dispatch('a', {'delay': 3600})
+        self.assertEqual({'error': 2}, instance._errors)
+        self.assertEqual([True, False], [c[1]['primary'] for c in mock_schedule_event.call_args_list])
+        self.assertEqual(3600, mock_send_next_event_for_dispatch.call_args[1]['delay'])
+
+    @mock.patch('aws_lambda_fsm.fsm.get_primary_schedule_source')
+    @mock.patch('aws_lambda_fsm.fsm.schedule_event')
+    @mock.patch('aws_lambda_fsm.fsm.start_retries')
+    @mock.patch('aws_lambda_fsm.fsm.time')
+    @mock.patch('aws_lambda_fsm.fsm.random')
+    def test_start_retries_scheduled(self,
+                                     mock_random,
+                                     mock_time,
+                                     mock_start_retries,
+                                     mock_schedule_event,
+                                     mock_get_primary_schedule_source):
+        mock_random.uniform.return_value = 1.0
+        mock_time.time.return_value = 1.0
+        instance = self._instance()
+        retry_data = {'system_context': {'steps': 3, 'retries': 1}, 'user_context': {}}
+        self.assertEqual(mock_schedule_event.return_value, instance._start_retries(retry_data, {}))
+        mock_schedule_event.assert_called_with(
+            'foobar', 3, 1, 2.0, '{"system_context": {"retries": 1, "steps": 3}, "user_context": {}}', primary=True
+        )
+        self.assertFalse(mock_start_retries.called)
+
+        # recovering always uses the stream
+        instance._start_retries(retry_data, {}, recovering=True)
+        self.assertEqual(1, mock_schedule_event.call_count)
+        self.assertTrue(mock_start_retries.called)
+
+    @mock.patch('aws_lambda_fsm.fsm.send_next_event_for_dispatch')
+    def test_send_next_event_for_dispatch_primary_returns_nothing(self,
+                                                                  mock_send_next_event_for_dispatch):
+        mock_send_next_event_for_dispatch.side_effect = lambda *args, **kwargs: None if kwargs['primary'] else 'sent'
+        instance = self._instance()
+        for i in range(5):
+            self.assertEqual('sent', instance._send_next_event_for_dispatch('a', {}))
+        self.assertEqual(10, mock_send_next_event_for_dispatch.call_count)
+
+        # a primary that sends nothing opens the circuit too
+        mock_send_next_event_for_dispatch.reset_mock()
+        self.assertEqual('sent', instance._send_next_event_for_dispatch('a', {}))
+        self.assertEqual(1, mock_send_next_event_for_dispatch.call_count)
+        self.assertEqual({}, instance._errors)
+
+        # nothing sent at all
+        mock_send_next_event_for_dispatch.side_effect = None
+        mock_send_next_event_for_dispatch.return_value = None
+        self.assertIsNone(instance._send_next_event_for_dispatch('a', {}))
+
+    def test_call_with_failover_falsy(self):
+        instance = self._instance()
+        breaker = get_circuit_breaker('arn')
+        call = mock.Mock(return_value=0)
+        self.assertEqual(0, instance._call_with_failover(breaker, call, '%s'))
+        call.assert_called_once_with(True)
+        self.assertEqual(0, breaker.failures)
+
+        # success flags must be truthy
+        call.reset_mock()
+        self.assertEqual(0, instance._call_with_failover(breaker, call, '%s', flag=True))
+        self.assertEqual([mock.call(True), mock.call(False)], call.call_args_list)
+        self.assertEqual(1, breaker.failures)
+
+    @mock.patch('aws_lambda_fsm.fsm.send_next_event_for_dispatch')
+    def test_send_next_event_for_dispatch_circuit_open(self,
+                                                       mock_send_next_event_for_dispatch):
+        def send(*args, **kwargs):
+            if kwargs['primary']:
+                raise ClientError({'Error': {'Code': 404}}, 'test')
+            return 'sent'
+        mock_send_next_event_for_dispatch.side_effect = send
+        instance = self._instance()
+        for i in range(5):
+            self.assertEqual('sent', instance._send_next_event_for_dispatch('a', {}))
+        self.assertEqual(10, mock_send_next_event_for_dispatch.call_count)
+
+        # the primary stream is skipped while the circuit is open
+        mock_send_next_event_for_dispatch.reset_mock()
+        self.assertEqual('sent', instance._send_next_event_for_dispatch('a', {}))
+        mock_send_next_event_for_dispatch.assert_called_once_with(
+            {},
+            'a',
+            'foobar',
+            delay=0,
+            primary=False,
+            recovering=False,
+            lane=None,
+            sources=None
+        )
+
+        # but the retry stream is not affected
+        mock_send_next_event_for_dispatch.reset_mock()
+        self.assertEqual('sent', instance._send_next_event_for_dispatch('a', {}, recovering=True))
+        self.assertEqual(2, mock_send_next_event_for_dispatch.call_count)
+
 
 class TestRetry(TestFsmBase):
     def _dispatch_client_error(self,
@@ -737,7 +1315,9 @@ class TestRetry(TestFsmBase):
             '{"system_context": {"correlation_id": "b", "current_event": "e", "current_state": '
             '"s", "machine_name": "m", "retries": 1, "steps": 999}, "user_context": {}}',
             primary=True,
-            recovering=False
+            recovering=False,
+            lane='s',
+            sources=None
         )
         mock_queue_error.assert_called_with(
             'retry',
@@ -765,7 +1345,9 @@ class TestRetry(TestFsmBase):
             101.0,
             payload,
             primary=False,
-            recovering=True
+            recovering=True,
+            lane='s',
+            sources=None
         )
         mock_queue_error.assert_called_with(
             'error',
@@ -785,7 +1367,8 @@ class TestRetry(TestFsmBase):
         instance = self._dispatch_client_error(mock_time, mock_uuid, retries=999)
         mock_stop_retries.assert_called_with(
             instance,
-            primary=True
+            primary=True,
+            sources=None
         )
         mock_queue_error(
             'fatal'
@@ -804,7 +1387,8 @@ class TestRetry(TestFsmBase):
         instance = self._dispatch_client_error(mock_time, mock_uuid, retries=999)
         mock_stop_retries.assert_called_with(
             instance,
-            primary=False
+            primary=False,
+            sources=None
         )
         mock_queue_error.assert_called_with(
             'error',
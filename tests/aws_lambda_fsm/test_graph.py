@@ -0,0 +1,84 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# system imports
+import unittest
+
+# library imports
+import mock
+
+# application imports
+from aws_lambda_fsm.graph import MachineGraph
+from aws_lambda_fsm.graph import get_machine_graphs
+
+MACHINE_DICT = {
+    'name': 'm',
+    'max_retries': 3,
+    'states': [
+        {'name': 'a', 'initial': True, 'entry_action': 'x.Entry', 'do_action': 'x.Do', 'exit_action': 'x.Exit',
+         'retry_interval': 2, 'retry_backoff': 1.5,
+         'transitions': [{'event': 'e1', 'target': 'b', 'action': 'x.Transition'}]},
+        {'name': 'b', 'max_retries': 7, 'map': {'machine': 'child', 'items': 'things', 'max_concurrency': 4},
+         'transitions': [{'event': 'e2', 'target': 'c'}, {'event': 'e3', 'target': 'a'}]},
+        {'name': 'c', 'final': True, 'parallel': ['p1', 'p2']}
+    ]
+}
+
+
+class TestMachineGraph(unittest.TestCase):
+
+    def test_states(self):
+        graph = MachineGraph(MACHINE_DICT)
+        self.assertEqual('m', graph.name)
+        self.assertEqual(['a', 'b', 'c'], graph.states.keys())
+        self.assertEqual('a', graph.initial_state.name)
+        self.assertEqual(['child', 'p1', 'p2'], graph.children)
+
+    def test_state(self):
+        state = MachineGraph(MACHINE_DICT).states['a']
+        self.assertEqual((True, False), (state.initial, state.final))
+        self.assertEqual(('x.Entry', 'x.Do', 'x.Exit'), (state.entry_action, state.do_action, state.exit_action))
+        self.assertEqual((3, 2, 1.5), (state.max_retries, state.retry_interval, state.retry_backoff))
+        self.assertEqual([], state.children)
+        transition = state.next_transition
+        self.assertEqual(('e1', 'b', 'x.Transition'), (transition.event, transition.target, transition.action))
+
+    def test_map_state(self):
+        state = MachineGraph(MACHINE_DICT).states['b']
+        self.assertEqual((7, 1, 2.0), (state.max_retries, state.retry_interval, state.retry_backoff))
+        self.assertEqual(('child', 'things', 4), (state.map_machine, state.map_items, state.map_concurrency))
+        self.assertEqual(['child'], state.children)
+        self.assertEqual(None, state.next_transition)
+
+    def test_parallel_state(self):
+        state = MachineGraph(MACHINE_DICT).states['c']
+        self.assertEqual((None, 'items', 0), (state.map_machine, state.map_items, state.map_concurrency))
+        self.assertEqual(['p1', 'p2'], state.children)
+        self.assertEqual(None, state.next_transition)
+
+
+class TestGetMachineGraphs(unittest.TestCase):
+
+    @mock.patch('aws_lambda_fsm.graph.get_current_configuration')
+    def test_imports(self,
+                     mock_get_current_configuration):
+        configs = {
+            'fsm.yaml': {'machines': [{'name': 'm', 'states': []}, {'import': 'other.yaml'}]},
+            'other.yaml': {'machines': [{'name': 'm', 'states': [{'name': 'x'}]}, {'name': 'n'}]}
+        }
+        mock_get_current_configuration.side_effect = lambda filename='fsm.yaml': configs[filename]
+        graphs = get_machine_graphs()
+        self.assertEqual(['m', 'n'], graphs.keys())
+        self.assertEqual([], graphs['m'].states.keys())
+        self.assertEqual(None, graphs['n'].initial_state)
@@ -22,7 +22,9 @@ import mock
 
 # application imports
 from aws_lambda_fsm.handler import _process_payload
+from aws_lambda_fsm.handler import _parse_payload
 from aws_lambda_fsm.handler import _process_payload_step
+from aws_lambda_fsm.handler import _dispatch_step
 from aws_lambda_fsm.handler import lambda_dynamodb_handler
 from aws_lambda_fsm.handler import lambda_kinesis_handler
 from aws_lambda_fsm.handler import lambda_timer_handler
@@ -30,6 +32,7 @@ from aws_lambda_fsm.handler import lambda_sns_handler
 from aws_lambda_fsm.handler import lambda_handler
 from aws_lambda_fsm.handler import lambda_api_handler
 from aws_lambda_fsm.handler import lambda_step_handler
+from aws_lambda_fsm.snapshot import SnapshotNotFound
 
 
 class TestHandler(unittest.TestCase):
@@ -70,13 +73,13 @@ class TestHandler(unittest.TestCase):
     @mock.patch('aws_lambda_fsm.fsm.FSM')
     def test_process_payload_step(self,
                                   mock_FSM):
-        payload = json.dumps({'system_context': {'machine_name': 'barfoo',
-                                                 'current_state': 'foobar',
-                                                 'stream': 's',
-                                                 'table': 't',
-                                                 'topic': 'z',
-                                                 'metrics': 'm'},
-                              'user_context': {}}, sort_keys=True)
+        payload = {'system_context': {'machine_name': 'barfoo',
+                                      'current_state': 'foobar',
+                                      'stream': 's',
+                                      'table': 't',
+                                      'topic': 'z',
+                                      'metrics': 'm'},
+                   'user_context': {}}
         obj = {}
         mock_FSM.return_value.create_FSM_instance.return_value\
             .system_context.return_value.get.return_value = 'pseudo-init'
@@ -95,11 +98,127 @@ class TestHandler(unittest.TestCase):
         mock_FSM.return_value.create_FSM_instance.return_value.current_state.dispatch.assert_called_with(
             mock_FSM.return_value.create_FSM_instance.return_value,
             'pseudo-init',
-            {'payload': '{"system_context": {"current_state": "foobar", "machine_name": '
-                        '"barfoo", "metrics": "m", "stream": "s", "table": "t", '
-                        '"topic": "z"}, "user_context": {}}'}
+            {'payload': json.dumps(payload)}
         )
-        self.assertEqual({'payload': payload}, obj)
+        self.assertEqual({'payload': json.dumps(payload)}, obj)
+
+    @mock.patch('aws_lambda_fsm.handler._dispatch_step')
+    @mock.patch('aws_lambda_fsm.handler.Context')
+    def test_process_payload_step_full(self,
+                                       mock_Context,
+                                       mock_dispatch_step):
+        mock_dispatch_step.return_value = 'e'
+        mock_Context.from_payload_dict.return_value.to_payload_dict.return_value = \
+            {'system_context': {'current_event': 'e'}, 'user_context': {'a': 1}}
+        payload = {'system_context': {}, 'user_context': {'a': 1}}
+        self.assertEqual({'system_context': {'current_event': 'e'}, 'user_context': {'a': 1}, 'step_function': True},
+                         _process_payload_step(payload, {}))
+        mock_dispatch_step.assert_called_with(mock_Context.from_payload_dict.return_value,
+                                              {'payload': json.dumps(payload)}, inline=False, stop_states=())
+
+    @mock.patch('aws_lambda_fsm.handler._dispatch_step')
+    @mock.patch('aws_lambda_fsm.handler.Context')
+    def test_process_payload_step_finished(self,
+                                           mock_Context,
+                                           mock_dispatch_step):
+        mock_dispatch_step.return_value = None
+        payload = {'system_context': {}, 'user_context': {'a': 1}}
+        self.assertEqual(None, _process_payload_step(payload, {}, delta=True))
+
+    @mock.patch('aws_lambda_fsm.handler._dispatch_step')
+    @mock.patch('aws_lambda_fsm.handler.Context')
+    def test_process_payload_step_delta(self,
+                                        mock_Context,
+                                        mock_dispatch_step):
+        def from_payload_dict(payload):
+            self.assertEqual({'system_context': {'current_state': 's2'},
+                              'user_context': {'a': 1, 'b': {'x': [1]}, 'c': 3, 'n': None}}, payload)
+            payload['user_context']['b']['x'].append(2)  # nested changes are found
+            payload['user_context']['d'] = 4
+            payload['user_context']['m'] = None
+            del payload['user_context']['a']
+            return mock.Mock(to_payload_dict=mock.Mock(
+                return_value={'system_context': {'current_state': 's3'}, 'user_context': payload['user_context']}))
+        mock_Context.from_payload_dict.side_effect = from_payload_dict
+        mock_dispatch_step.return_value = 'e'
+        payload = {
+            'system_context': {'current_state': 's1'},
+            'user_context': {'a': 1, 'b': {'x': [1]}, 'c': 2, 'z': 0},
+            'delta': {'system_context': {'current_state': 's2'}, 'user_context': {'c': 3, 'n': None},
+                      'deleted': ['z']}
+        }
+        self.assertEqual({
+            'system_context': {'current_state': 's3'},
+            'user_context': {'b': {'x': [1, 2]}, 'c': 3, 'd': 4, 'm': None, 'n': None},
+            'deleted': ['a', 'z']
+        }, _process_payload_step(payload, {}, delta=True, inline=True, stop_states=['s4']))
+        mock_dispatch_step.assert_called_with(mock.ANY, mock.ANY, inline=True, stop_states=['s4'])
+
+    @mock.patch('aws_lambda_fsm.handler._dispatch_step')
+    @mock.patch('aws_lambda_fsm.handler.Context')
+    def test_process_payload_step_delta_stop_state(self,
+                                                   mock_Context,
+                                                   mock_dispatch_step):
+        mock_dispatch_step.return_value = 'e'
+        fsm = mock_Context.from_payload_dict.return_value
+        fsm.current_state.get_transition.return_value.target.name = 's4'
+        fsm.to_payload_dict.return_value = {'system_context': {'current_state': 's3'}, 'user_context': {'a': 1}}
+        payload = {'system_context': {}, 'user_context': {'a': 1, 'b': 2}}
+
+        # map/parallel states read the whole user context
+        self.assertEqual({
+            'system_context': {'current_state': 's3'},
+            'user_context': {'a': 1},
+            'deleted': ['b']
+        }, _process_payload_step(payload, {}, delta=True, stop_states=['s4']))
+        fsm.current_state.get_transition.assert_called_with('e')
+
+    def _get_fsm(self, events, inline_steps=5, inline_seconds=10.):
+        states = {}
+
+        def dispatch(context, event, obj):
+            context.dispatched.append(event)
+            return events.pop(0)
+        fsm = mock.Mock(inline_steps=inline_steps, inline_seconds=inline_seconds, dispatched=[])
+        fsm.system_context.return_value = {'current_event': 'e0'}
+        fsm.current_state.dispatch.side_effect = dispatch
+        fsm.current_state.get_transition.side_effect = \
+            lambda event: states.setdefault(event, mock.Mock(target=mock.Mock())) if event != 'bad' else {}[event]
+        states['stop'] = mock.Mock()
+        states['stop'].target.name = 'map'
+        return fsm
+
+    def test_dispatch_step(self):
+        fsm = self._get_fsm(['e1', 'e2'])
+        self.assertEqual('e1', _dispatch_step(fsm, {}))
+        self.assertEqual(['e0'], fsm.dispatched)
+
+    def test_dispatch_step_inline(self):
+        fsm = self._get_fsm(['e1', 'e2', None])
+        self.assertEqual(None, _dispatch_step(fsm, {}, inline=True))
+        self.assertEqual(['e0', 'e1', 'e2'], fsm.dispatched)
+
+    def test_dispatch_step_inline_budget(self):
+        fsm = self._get_fsm(['e1', 'e2', 'e3'], inline_steps=1)
+        self.assertEqual('e2', _dispatch_step(fsm, {}, inline=True))
+        self.assertEqual(['e0', 'e1'], fsm.dispatched)
+        self.assertEqual('e1', fsm.current_event)
+
+    def test_dispatch_step_inline_stop_states(self):
+        fsm = self._get_fsm(['e1', 'stop', 'e3'])
+        self.assertEqual('stop', _dispatch_step(fsm, {}, inline=True, stop_states=['map']))
+        self.assertEqual(['e0', 'e1'], fsm.dispatched)
+
+    def test_dispatch_step_inline_unknown_event(self):
+        fsm = self._get_fsm(['bad', 'e2'])
+        self.assertEqual('bad', _dispatch_step(fsm, {}, inline=True))
+        self.assertEqual(['e0'], fsm.dispatched)
+
+    def test_parse_payload(self):
+        self.assertEqual({'a': 1}, _parse_payload('{"a": 1}'))
+        self.assertIsNone(_parse_payload('[1]'))
+        self.assertIsNone(_parse_payload('not json'))
+        self.assertIsNone(_parse_payload(None))
 
 ################################################################################
 # START: gateway tests
@@ -125,7 +244,30 @@ class TestHandler(unittest.TestCase):
             'foo': 'bar'
         }
         lambda_step_handler(event)
-        mock_process_payload_step.assert_called_with('{"foo": "bar"}', {'source': 'step_function'})
+        mock_process_payload_step.assert_called_with({'foo': 'bar'}, {'source': 'step_function'})
+
+    @mock.patch('aws_lambda_fsm.handler._flush_telemetry')
+    @mock.patch('aws_lambda_fsm.handler._process_payload_step')
+    def test_step_function_handler_error(self,
+                                         mock_process_payload_step,
+                                         mock_flush_telemetry):
+        mock_process_payload_step.side_effect = ValueError
+        self.assertRaises(ValueError, lambda_step_handler, {'foo': 'bar'})
+        self.assertTrue(mock_flush_telemetry.called)
+
+    @mock.patch('aws_lambda_fsm.handler._process_payload_step')
+    def test_step_function_handler_options(self,
+                                           mock_process_payload_step):
+        event = {
+            'step_function': True,
+            'payload': {'foo': 'bar'},
+            'delta': True,
+            'inline': True,
+            'stop_states': ['s']
+        }
+        lambda_step_handler(event)
+        mock_process_payload_step.assert_called_with({'foo': 'bar'}, {'source': 'step_function'},
+                                                     delta=True, inline=True, stop_states=['s'])
 
 ################################################################################
 # START: kinesis tests
@@ -144,7 +286,8 @@ class TestHandler(unittest.TestCase):
             ]
         }
         lambda_kinesis_handler(event)
-        mock_process_payload.assert_called_with('{"machine_name": "barfoo"}', {'source': 'kinesis'})
+        mock_process_payload.assert_called_with('{"machine_name": "barfoo"}', {'source': 'kinesis'},
+                                                payload={'machine_name': 'barfoo'})
 
     @mock.patch('aws_lambda_fsm.handler.FSM')
     @mock.patch('aws_lambda_fsm.handler.logger')
@@ -166,6 +309,25 @@ class TestHandler(unittest.TestCase):
             'Critical error handling record: %s', {'kinesis': {'data': 'eyJtYWNoaW5lX25hbWUiOiAiYmFyZm9vIn0='}}
         )
 
+    @mock.patch('aws_lambda_fsm.handler.logger')
+    def test_lambda_kinesis_handler_bad_record(self,
+                                               mock_logging):
+        lambda_kinesis_handler({'Records': [{'foo': 'bar'}]})
+        mock_logging.exception.assert_called_with(
+            'Critical error handling record: %s', {'foo': 'bar'}
+        )
+
+    @mock.patch('aws_lambda_fsm.handler._process_payload')
+    @mock.patch('aws_lambda_fsm.handler.logger')
+    def test_lambda_kinesis_handler_snapshot_unavailable(self,
+                                                         mock_logging,
+                                                         mock_process_payload):
+        records = [{'kinesis': {'data': base64.b64encode(json.dumps({'n': i}))}} for i in range(2)]
+        mock_process_payload.side_effect = [SnapshotNotFound('s'), None]
+        self.assertRaises(Exception, lambda_kinesis_handler, {'Records': records})
+        self.assertEqual(2, mock_process_payload.call_count)
+        mock_logging.exception.assert_called_with('Snapshot unavailable handling record: %s', records[0])
+
 ################################################################################
 # START: dynamodb tests
 ################################################################################
@@ -187,7 +349,8 @@ class TestHandler(unittest.TestCase):
             ]
         }
         lambda_dynamodb_handler(event)
-        mock_process_payload.assert_called_with('{"pay":"load"}', {'source': 'dynamodb_stream'})
+        mock_process_payload.assert_called_with('{"pay":"load"}', {'source': 'dynamodb_stream'},
+                                                payload={'pay': 'load'})
 
     @mock.patch('aws_lambda_fsm.handler.FSM')
     @mock.patch('aws_lambda_fsm.handler.logger')
@@ -220,7 +383,21 @@ class TestHandler(unittest.TestCase):
                                   mock_retriable_entities):
         mock_retriable_entities.return_value = [{'payload': 'payloadZ', 'correlation_id': 'abc123'}]
         lambda_timer_handler()
-        mock_process_payload.assert_called_with('payloadZ', {'source': 'dynamodb_retry'})
+        mock_process_payload.assert_called_with('payloadZ', {'source': 'dynamodb_retry'}, payload=None)
+
+    @mock.patch('aws_lambda_fsm.handler.retriable_entities')
+    @mock.patch('aws_lambda_fsm.handler.FSM')
+    @mock.patch('aws_lambda_fsm.handler._process_payload')
+    def test_lambda_timer_handler_machine_retry_sources(self,
+                                                        mock_process_payload,
+                                                        mock_FSM,
+                                                        mock_retriable_entities):
+        mock_FSM.return_value.get_primary_sources.return_value = ['arn1', 'arn2']
+        mock_retriable_entities.return_value = []
+        lambda_timer_handler()
+        mock_FSM.return_value.get_primary_sources.assert_called_with('retry')
+        self.assertEqual(['arn1', 'arn2'], [c[0][0] for c in mock_retriable_entities.call_args_list])
+        self.assertFalse(mock_process_payload.called)
 
     @mock.patch('aws_lambda_fsm.handler.retriable_entities')
     @mock.patch('aws_lambda_fsm.handler.FSM')
@@ -230,12 +407,131 @@ class TestHandler(unittest.TestCase):
                                         mock_FSM,
                                         mock_retriable_entities):
         mock_retriable_entities.return_value = [{'payload': 'payloadZ'}]
+        mock_FSM.return_value.get_primary_sources.return_value = ['arn']
         mock_FSM.return_value.create_FSM_instance.side_effect = Exception()
         lambda_timer_handler()
         mock_logging.exception.assert_called_with(
             'Critical error handling entity: %s', {'payload': 'payloadZ'}
         )
 
+    @mock.patch('aws_lambda_fsm.handler.retriable_entities')
+    @mock.patch('aws_lambda_fsm.handler.logger')
+    def test_lambda_timer_handler_bad_entity(self,
+                                             mock_logging,
+                                             mock_retriable_entities):
+        mock_retriable_entities.return_value = [{'correlation_id': 'abc123'}]
+        lambda_timer_handler()
+        mock_logging.exception.assert_called_with(
+            'Critical error handling entity: %s', {'correlation_id': 'abc123'}
+        )
+
+    @mock.patch('aws_lambda_fsm.handler.get_primary_schedule_source')
+    @mock.patch('aws_lambda_fsm.handler.finish_scheduled_events')
+    @mock.patch('aws_lambda_fsm.handler.scheduled_events')
+    @mock.patch('aws_lambda_fsm.handler.retriable_entities')
+    @mock.patch('aws_lambda_fsm.handler._process_payload')
+    def test_lambda_timer_handler_scheduled_events(self,
+                                                   mock_process_payload,
+                                                   mock_retriable_entities,
+                                                   mock_scheduled_events,
+                                                   mock_finish_scheduled_events,
+                                                   mock_get_primary_schedule_source):
+        mock_get_primary_schedule_source.return_value = 'arn'
+        mock_retriable_entities.return_value = []
+        entities = [{'bucket': 60, 'ckey': 'a-1-0', 'payload': 'payloadZ'}]
+        mock_scheduled_events.return_value = (entities, 120)
+        lambda_timer_handler()
+        mock_process_payload.assert_called_with('payloadZ', {'source': 'dynamodb_schedule'}, payload=None)
+        mock_finish_scheduled_events.assert_called_with('arn', entities, 120)
+
+    @mock.patch('aws_lambda_fsm.handler.retriable_entities')
+    @mock.patch('aws_lambda_fsm.handler.FSM')
+    @mock.patch('aws_lambda_fsm.handler._process_payload')
+    def test_lambda_timer_handler_snapshot_unavailable(self,
+                                                       mock_process_payload,
+                                                       mock_FSM,
+                                                       mock_retriable_entities):
+        mock_FSM.return_value.get_primary_sources.return_value = ['arn']
+        mock_retriable_entities.return_value = [{'payload': 'payloadZ'}]
+        mock_process_payload.side_effect = SnapshotNotFound('s')
+        lambda_timer_handler()  # the retry entity is left for the next timer
+        mock_process_payload.assert_called_with('payloadZ', {'source': 'dynamodb_retry'}, payload=None)
+
+    @mock.patch('aws_lambda_fsm.handler.get_primary_schedule_source')
+    @mock.patch('aws_lambda_fsm.handler.finish_scheduled_events')
+    @mock.patch('aws_lambda_fsm.handler.scheduled_events')
+    @mock.patch('aws_lambda_fsm.handler.retriable_entities')
+    @mock.patch('aws_lambda_fsm.handler._process_payload')
+    def test_lambda_timer_handler_scheduled_events_snapshot_unavailable(self,
+                                                                        mock_process_payload,
+                                                                        mock_retriable_entities,
+                                                                        mock_scheduled_events,
+                                                                        mock_finish_scheduled_events,
+                                                                        mock_get_primary_schedule_source):
+        mock_get_primary_schedule_source.return_value = 'arn'
+        mock_retriable_entities.return_value = []
+        mock_scheduled_events.return_value = ([{'bucket': 60, 'ckey': 'a-1-0', 'payload': 'payloadZ'}], 120)
+        mock_process_payload.side_effect = SnapshotNotFound('s')
+        lambda_timer_handler()
+        self.assertFalse(mock_finish_scheduled_events.called)
+
+    @mock.patch('aws_lambda_fsm.handler.get_secondary_schedule_source')
+    @mock.patch('aws_lambda_fsm.handler.get_primary_schedule_source')
+    @mock.patch('aws_lambda_fsm.handler.retriable_entities')
+    @mock.patch('aws_lambda_fsm.handler._process_scheduled_events')
+    def test_lambda_timer_handler_secondary_schedule_source(self,
+                                                            mock_process_scheduled_events,
+                                                            mock_retriable_entities,
+                                                            mock_get_primary_schedule_source,
+                                                            mock_get_secondary_schedule_source):
+        mock_retriable_entities.return_value = []
+        mock_get_primary_schedule_source.return_value = 'arn1'
+        mock_get_secondary_schedule_source.return_value = 'arn2'
+        lambda_timer_handler()
+        self.assertEqual(['arn1', 'arn2'], [c[0][0] for c in mock_process_scheduled_events.call_args_list])
+
+        # the same table is only read once
+        mock_process_scheduled_events.reset_mock()
+        mock_get_secondary_schedule_source.return_value = 'arn1'
+        lambda_timer_handler()
+        mock_process_scheduled_events.assert_called_once_with('arn1')
+
+    @mock.patch('aws_lambda_fsm.handler.get_primary_schedule_source')
+    @mock.patch('aws_lambda_fsm.handler.finish_scheduled_events')
+    @mock.patch('aws_lambda_fsm.handler.scheduled_events')
+    @mock.patch('aws_lambda_fsm.handler.retriable_entities')
+    @mock.patch('aws_lambda_fsm.handler.logger')
+    def test_lambda_timer_handler_scheduled_events_error(self,
+                                                         mock_logging,
+                                                         mock_retriable_entities,
+                                                         mock_scheduled_events,
+                                                         mock_finish_scheduled_events,
+                                                         mock_get_primary_schedule_source):
+        mock_get_primary_schedule_source.return_value = 'arn'
+        mock_retriable_entities.return_value = []
+        mock_scheduled_events.side_effect = Exception()
+        lambda_timer_handler()
+        mock_logging.exception.assert_called_with('Error querying scheduled events.')
+        self.assertFalse(mock_finish_scheduled_events.called)
+
+        mock_scheduled_events.side_effect = None
+        mock_scheduled_events.return_value = ([], 120)
+        mock_finish_scheduled_events.side_effect = Exception()
+        lambda_timer_handler()
+        mock_logging.exception.assert_called_with('Error finishing scheduled events.')
+
+    @mock.patch('aws_lambda_fsm.engine.settings')
+    @mock.patch('aws_lambda_fsm.handler._process_payload')
+    def test_lambda_kinesis_handler_concurrent(self,
+                                               mock_process_payload,
+                                               mock_engine_settings):
+        mock_engine_settings.DISPATCH_CONCURRENCY = 4
+        payloads = [json.dumps({'system_context': {'correlation_id': str(i % 2), 'steps': i}}, sort_keys=True)
+                    for i in range(6)]
+        event = {'Records': [{'kinesis': {'data': base64.b64encode(p)}} for p in payloads]}
+        lambda_kinesis_handler(event)
+        self.assertEqual(sorted(payloads), sorted(c[0][0] for c in mock_process_payload.call_args_list))
+
 ################################################################################
 # START: sns tests
 ################################################################################
@@ -253,7 +549,7 @@ class TestHandler(unittest.TestCase):
             ]
         }
         lambda_sns_handler(event)
-        mock_process_payload.assert_called_with('{"mess": "age"}', {'source': 'sns'})
+        mock_process_payload.assert_called_with('{"mess": "age"}', {'source': 'sns'}, payload={'mess': 'age'})
 
     @mock.patch('aws_lambda_fsm.handler.FSM')
     @mock.patch('aws_lambda_fsm.handler.logger')
@@ -275,6 +571,14 @@ class TestHandler(unittest.TestCase):
             'Critical error handling record: %s', {'Sns': {'Message': '{"default": "{\\"mess\\": \\"age\\"}"}'}}
         )
 
+    @mock.patch('aws_lambda_fsm.handler.logger')
+    def test_lambda_sns_handler_bad_record(self,
+                                           mock_logging):
+        lambda_sns_handler({'Records': [{'Sns': {'Message': 'not json'}}]})
+        mock_logging.exception.assert_called_with(
+            'Critical error handling record: %s', {'Sns': {'Message': 'not json'}}
+        )
+
     @mock.patch('aws_lambda_fsm.handler.FSM')
     @mock.patch('aws_lambda_fsm.handler.logger')
     def test_lambda_api_handler_error(self,
@@ -289,6 +593,17 @@ class TestHandler(unittest.TestCase):
             'Critical error handling lambda: %s', {'foo': 'bar'}
         )
 
+    @mock.patch('aws_lambda_fsm.handler._process_payload')
+    @mock.patch('aws_lambda_fsm.handler.logger')
+    def test_lambda_api_handler_snapshot_unavailable(self,
+                                                     mock_logging,
+                                                     mock_process_payload):
+        mock_process_payload.side_effect = SnapshotNotFound('s')
+        self.assertRaises(SnapshotNotFound, lambda_api_handler, {'foo': 'bar'})
+        mock_logging.exception.assert_called_with(
+            'Snapshot unavailable handling lambda: %s', {'foo': 'bar'}
+        )
+
 ################################################################################
 # START: general tests
 ################################################################################
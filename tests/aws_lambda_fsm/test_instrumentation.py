@@ -0,0 +1,134 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# system imports
+import unittest
+
+# library imports
+import mock
+
+# application imports
+from aws_lambda_fsm import instrumentation
+from aws_lambda_fsm.instrumentation import Histogram
+from aws_lambda_fsm.instrumentation import HistogramInstrumentation
+from aws_lambda_fsm.instrumentation import Instrumentation
+from aws_lambda_fsm.instrumentation import get_instrumentation
+from aws_lambda_fsm.instrumentation import flush_instrumentation
+from aws_lambda_fsm.instrumentation import timed
+from aws_lambda_fsm.instrumentation import _NULL_TIMER
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_add(self):
+        histogram = Histogram()
+        histogram.add(0.5)
+        histogram.add(3.0)
+        histogram.add(10000.0)
+        self.assertEqual({'SampleCount': 3, 'Sum': 10003.5, 'Minimum': 0.5, 'Maximum': 10000.0},
+                         histogram.statistics())
+        self.assertEqual([1, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1], histogram.buckets)
+        self.assertEqual('Histogram(count=3, avg=3334.5ms, min=0.5ms, max=10000.0ms, '
+                         '{<=1: 1, <=5: 1, >5000: 1})', repr(histogram))
+
+
+class TestHistogramInstrumentation(unittest.TestCase):
+
+    def test_record(self):
+        histograms = HistogramInstrumentation()
+        histograms.record('m', 's', 'lease', 0.001)
+        histograms.record('m', 's', 'lease', 0.003)
+        self.assertEqual(2, histograms.histograms[('m', 's', 'lease')].count)
+        self.assertEqual(4.0, histograms.histograms[('m', 's', 'lease')].total)
+
+    @mock.patch('aws_lambda_fsm.instrumentation.buffer_metric_statistics')
+    def test_flush(self,
+                   mock_buffer_metric_statistics):
+        histograms = HistogramInstrumentation()
+        histograms.record('m', 's', 'send', 0.002)
+        histograms.record('m', 's', 'lease', 0.001)
+        histograms.flush()
+        mock_buffer_metric_statistics.assert_called_with([
+            ('PhaseDuration', {'machine_name': 'm', 'current_state': 's', 'phase': 'lease'},
+             {'SampleCount': 1, 'Sum': 1.0, 'Minimum': 1.0, 'Maximum': 1.0}),
+            ('PhaseDuration', {'machine_name': 'm', 'current_state': 's', 'phase': 'send'},
+             {'SampleCount': 1, 'Sum': 2.0, 'Minimum': 2.0, 'Maximum': 2.0})
+        ])
+        self.assertEqual({}, histograms.histograms)
+
+    @mock.patch('aws_lambda_fsm.instrumentation.buffer_metric_statistics')
+    def test_flush_empty(self,
+                         mock_buffer_metric_statistics):
+        HistogramInstrumentation().flush()
+        self.assertFalse(mock_buffer_metric_statistics.called)
+
+
+class TestGetInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        instrumentation._local.instrumentation = None
+
+    def tearDown(self):
+        instrumentation._local.instrumentation = None
+
+    @mock.patch('aws_lambda_fsm.instrumentation.settings')
+    def test_default(self,
+                     mock_settings):
+        mock_settings.INSTRUMENTATION = None
+        instance = get_instrumentation()
+        self.assertEqual(Instrumentation, type(instance))
+        self.assertTrue(instance is get_instrumentation())
+        self.assertTrue(timed(mock.Mock(), 'lease') is _NULL_TIMER)
+        with timed(mock.Mock(), 'lease'):
+            pass
+        flush_instrumentation()
+
+    @mock.patch('aws_lambda_fsm.instrumentation.settings')
+    def test_setting(self,
+                     mock_settings):
+        mock_settings.INSTRUMENTATION = 'aws_lambda_fsm.instrumentation.HistogramInstrumentation'
+        self.assertTrue(isinstance(get_instrumentation(), HistogramInstrumentation))
+
+    def test_timed(self):
+        instrumentation._local.instrumentation = mock.Mock(enabled=True)
+        context = mock.Mock()
+        context.name = 'm'
+        context.system_context.return_value = {}
+        context.current_state.name = 's1'
+        with timed(context, 'action'):
+            context.current_state.name = 's2'
+        args = instrumentation._local.instrumentation.record.call_args[0]
+        self.assertEqual(('m', 's1', 'action'), args[0:3])
+        self.assertTrue(args[3] >= 0)
+        context.system_context.return_value = {'current_state': 's0'}
+        with timed(context, 'action'):
+            pass
+        self.assertEqual(('m', 's0', 'action'), instrumentation._local.instrumentation.record.call_args[0][0:3])
+
+    @mock.patch('aws_lambda_fsm.instrumentation.logger')
+    def test_timed_error(self,
+                         mock_logger):
+        instrumentation._local.instrumentation = mock.Mock(enabled=True)
+        instrumentation._local.instrumentation.record.side_effect = Exception()
+        with timed(mock.Mock(), 'action'):
+            pass
+        mock_logger.exception.assert_called_with('Error recording %s timing.', 'action')
+
+    @mock.patch('aws_lambda_fsm.instrumentation.logger')
+    def test_flush_error(self,
+                         mock_logger):
+        instrumentation._local.instrumentation = mock.Mock()
+        instrumentation._local.instrumentation.flush.side_effect = Exception()
+        flush_instrumentation()
+        mock_logger.exception.assert_called_with('Error flushing instrumentation.')
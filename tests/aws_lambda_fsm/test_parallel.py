@@ -0,0 +1,308 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# system imports
+import json
+import unittest
+
+# library imports
+import mock
+
+# application imports
+from aws_lambda_fsm import circuit
+from aws_lambda_fsm.fsm import Context
+from aws_lambda_fsm.parallel import ForkAction
+from aws_lambda_fsm.parallel import JoinAction
+from aws_lambda_fsm.parallel import MapAction
+from aws_lambda_fsm.parallel import MapChunkAction
+
+
+class ForkItems(ForkAction):
+    batch_size = 2
+
+    def get_children(self, context, obj):
+        return 'child', [{'item': item} for item in context['items']]
+
+
+class JoinItems(JoinAction):
+
+    def get_result(self, context, obj):
+        return context['item'] * 2
+
+
+class DoubleItems(MapAction):
+    chunk_size = 2
+
+    def process_item(self, context, item):
+        return item * 2
+
+
+class DoubleItemsInChildren(DoubleItems):
+    child_machine = 'child'
+
+
+class DoubleChunk(MapChunkAction):
+
+    def process_item(self, context, item):
+        return item * 2
+
+
+def _context(items):
+    context = mock.MagicMock()
+    context.__getitem__.side_effect = {'items': items}.__getitem__
+    context.correlation_id = 'abc'
+    context.steps = 3
+    context.name = 'parent'
+    context.current_action = context.current_state.do_action
+    context.sources = None
+    context._call_with_failover.side_effect = \
+        lambda *args, **kwargs: Context._call_with_failover.__func__(context, *args, **kwargs)
+    return context
+
+
+def _machine(mock_FSM):
+    mock_FSM.return_value.get_machine.return_value = {'sources': {'x': 'y'}, 'stream': 'lane'}
+
+
+class TestForkAction(unittest.TestCase):
+
+    def setUp(self):
+        circuit._local.breakers.clear()
+
+    def test_event(self):
+        self.assertEqual('joined', ForkItems('fork').event)
+        self.assertEqual('done', ForkItems('fork', event='done').event)
+
+    def test_no_children(self):
+        context = _context([])
+        self.assertEqual('joined', ForkItems('fork').execute(context, {}))
+        context.__setitem__.assert_called_with('join_results', [])
+
+    @mock.patch('aws_lambda_fsm.parallel.start_state_machines')
+    @mock.patch('aws_lambda_fsm.parallel.start_join')
+    def test_fork_not_do_action(self,
+                                mock_start_join,
+                                mock_start_state_machines):
+        context = _context([1])
+        context.current_action = context.current_state.entry_action
+        self.assertRaises(Exception, ForkItems('fork').execute, context, {})
+        self.assertFalse(mock_start_join.called)
+        self.assertFalse(mock_start_state_machines.called)
+
+    @mock.patch('aws_lambda_fsm.parallel.get_stream_source')
+    @mock.patch('aws_lambda_fsm.parallel.FSM')
+    @mock.patch('aws_lambda_fsm.parallel.start_state_machines')
+    @mock.patch('aws_lambda_fsm.parallel.start_join')
+    @mock.patch('aws_lambda_fsm.parallel.Context')
+    def test_fork(self,
+                  mock_Context,
+                  mock_start_join,
+                  mock_start_state_machines,
+                  mock_FSM,
+                  mock_get_stream_source):
+        _machine(mock_FSM)
+        mock_start_state_machines.return_value = []
+        mock_Context.from_payload_dict.return_value.steps = 3
+        mock_Context.from_payload_dict.return_value.to_payload_dict.return_value = {'p': 1}
+        context = _context([1, 2, 3])
+        self.assertIsNone(ForkItems('fork').execute(context, {}))
+
+        # the resumed machine gets the next step and the join event
+        resumed = mock_Context.from_payload_dict.return_value
+        self.assertEqual((4, 0, 'joined'), (resumed.steps, resumed.retries, resumed.current_event))
+        mock_start_join.assert_called_once_with('abc-3', 3, '{"p": 1}', primary=True, sources=context.sources)
+
+        def join(i):
+            return {'join': {'id': 'abc-3', 'index': i, 'primary': True, 'machine_name': 'parent'}}
+        self.assertEqual([
+            mock.call('child', [{'item': 1}, {'item': 2}], correlation_ids=['abc-3-0', 'abc-3-1'],
+                      system_contexts=[join(0), join(1)], lane='lane', primary=True, sources={'x': 'y'}),
+            mock.call('child', [{'item': 3}], correlation_ids=['abc-3-2'], system_contexts=[join(2)],
+                      lane='lane', primary=True, sources={'x': 'y'})
+        ], mock_start_state_machines.call_args_list)
+
+        # the children are sent to the child machine's own stream
+        mock_FSM.return_value.get_machine.assert_called_with('child')
+        mock_get_stream_source.assert_called_with(sources={'x': 'y'}, lane='lane')
+
+    @mock.patch('aws_lambda_fsm.parallel.FSM')
+    @mock.patch('aws_lambda_fsm.parallel.start_state_machines')
+    @mock.patch('aws_lambda_fsm.parallel.start_join')
+    @mock.patch('aws_lambda_fsm.parallel.Context')
+    def test_fork_children_secondary(self,
+                                     mock_Context,
+                                     mock_start_join,
+                                     mock_start_state_machines,
+                                     mock_FSM):
+        _machine(mock_FSM)
+        mock_Context.from_payload_dict.return_value.to_payload_dict.return_value = {}
+        mock_start_state_machines.side_effect = [['abc-3-1'], [], []]
+        context = _context([1, 2, 3])
+        self.assertIsNone(ForkItems('fork').execute(context, {}))
+
+        # only the unsent child is re-sent, to the secondary stream
+        self.assertEqual((['abc-3-1'], False),
+                         (mock_start_state_machines.call_args[1]['correlation_ids'],
+                          mock_start_state_machines.call_args[1]['primary']))
+
+        # unless it still cannot be sent
+        mock_start_state_machines.side_effect = [['abc-3-1'], [], ['abc-3-1']]
+        self.assertRaises(Exception, ForkItems('fork').execute, context, {})
+
+    @mock.patch('aws_lambda_fsm.parallel.FSM')
+    @mock.patch('aws_lambda_fsm.parallel.start_state_machines')
+    @mock.patch('aws_lambda_fsm.parallel.start_join')
+    @mock.patch('aws_lambda_fsm.parallel.Context')
+    def test_fork_secondary(self,
+                            mock_Context,
+                            mock_start_join,
+                            mock_start_state_machines,
+                            mock_FSM):
+        _machine(mock_FSM)
+        mock_start_state_machines.return_value = []
+        mock_Context.from_payload_dict.return_value.steps = 3
+        mock_Context.from_payload_dict.return_value.to_payload_dict.return_value = {}
+        mock_start_join.side_effect = [0, True]
+        ForkItems('fork').execute(_context([1]), {})
+        self.assertFalse(mock_start_join.call_args[1]['primary'])
+        self.assertFalse(mock_start_state_machines.call_args[1]['system_contexts'][0]['join']['primary'])
+
+    @mock.patch('aws_lambda_fsm.parallel.start_state_machines')
+    @mock.patch('aws_lambda_fsm.parallel.start_join')
+    @mock.patch('aws_lambda_fsm.parallel.Context')
+    def test_fork_error(self,
+                        mock_Context,
+                        mock_start_join,
+                        mock_start_state_machines):
+        mock_Context.from_payload_dict.return_value.steps = 3
+        mock_Context.from_payload_dict.return_value.to_payload_dict.return_value = {}
+        mock_start_join.return_value = 0
+        self.assertRaises(Exception, ForkItems('fork').execute, _context([1]), {})
+        self.assertFalse(mock_start_state_machines.called)
+
+
+class TestJoinAction(unittest.TestCase):
+
+    def _context(self):
+        context = mock.MagicMock()
+        context.__getitem__.side_effect = {'item': 5}.__getitem__
+        context.system_context.return_value = \
+            {'join': {'id': 'abc-3', 'index': 1, 'primary': False, 'machine_name': 'parent'}}
+        return context
+
+    def test_not_forked(self):
+        context = mock.Mock()
+        context.system_context.return_value = {}
+        self.assertEqual('done', JoinItems('join', event='done').execute(context, {}))
+
+    @mock.patch('aws_lambda_fsm.parallel.report_join')
+    @mock.patch('aws_lambda_fsm.parallel.FSM')
+    def test_join_waiting(self,
+                          mock_FSM,
+                          mock_report_join):
+        mock_report_join.return_value = None
+        self.assertEqual('done', JoinItems('join', event='done').execute(self._context(), {}))
+        mock_FSM.return_value.get_machine.assert_called_with('parent')
+        mock_report_join.assert_called_with('abc-3', 1, '10', primary=False,
+                                            sources=mock_FSM.return_value.get_machine.return_value['sources'])
+
+    @mock.patch('aws_lambda_fsm.parallel.report_join')
+    @mock.patch('aws_lambda_fsm.parallel.FSM')
+    def test_join_error(self,
+                        mock_FSM,
+                        mock_report_join):
+        mock_report_join.return_value = 0
+        self.assertRaises(Exception, JoinItems('join').execute, self._context(), {})
+
+    @mock.patch('aws_lambda_fsm.parallel.Context')
+    @mock.patch('aws_lambda_fsm.parallel.report_join')
+    @mock.patch('aws_lambda_fsm.parallel.FSM')
+    def test_join_complete(self,
+                           mock_FSM,
+                           mock_report_join,
+                           mock_Context):
+        mock_report_join.return_value = ('{"user_context": {"a": 1}}', ['4', '10'])
+        self.assertEqual('done', JoinItems('join', event='done').execute(self._context(), {}))
+        payload_dict = {'user_context': {'a': 1, 'join_results': [4, 10]}}
+        mock_Context.from_payload_dict.assert_called_with(payload_dict)
+        parent = mock_Context.from_payload_dict.return_value
+        parent.send_next_event.assert_called_once_with(json.dumps(payload_dict, sort_keys=True), {}, lane=parent.lane)
+
+    @mock.patch('aws_lambda_fsm.parallel.Context')
+    @mock.patch('aws_lambda_fsm.parallel.report_join')
+    @mock.patch('aws_lambda_fsm.parallel.FSM')
+    def test_join_complete_send_fails(self,
+                                      mock_FSM,
+                                      mock_report_join,
+                                      mock_Context):
+        mock_report_join.return_value = ('{"user_context": {}}', ['null'])
+        parent = mock_Context.from_payload_dict.return_value
+        parent.send_next_event.return_value = None
+        self.assertRaises(Exception, JoinAction('join').execute, self._context(), {})
+        parent.send_next_event.assert_called_with('{"user_context": {"join_results": [null]}}', {},
+                                                  lane=parent.lane)
+
+
+class TestMapAction(unittest.TestCase):
+
+    def test_event(self):
+        self.assertEqual('mapped', DoubleItems('map').event)
+
+    @mock.patch('aws_lambda_fsm.parallel.map_concurrently')
+    def test_map(self,
+                 mock_map_concurrently):
+        mock_map_concurrently.side_effect = lambda items, process, concurrency: [process(item) for item in items]
+        context = {'items': [1, 2, 3, 4, 5]}
+        self.assertEqual('mapped', DoubleItems('map').execute(context, {}))
+        self.assertEqual([2, 4, 6, 8, 10], context['map_results'])
+        self.assertEqual([[1, 2], [3, 4], [5]], mock_map_concurrently.call_args[0][0])
+        self.assertEqual(None, mock_map_concurrently.call_args[1]['concurrency'])
+
+    def test_map_no_items(self):
+        context = {}
+        self.assertEqual('mapped', DoubleItemsInChildren('map').execute(context, {}))
+        self.assertEqual([], context['map_results'])
+
+    @mock.patch('aws_lambda_fsm.parallel.FSM')
+    @mock.patch('aws_lambda_fsm.parallel.start_state_machines')
+    @mock.patch('aws_lambda_fsm.parallel.start_join')
+    @mock.patch('aws_lambda_fsm.parallel.Context')
+    def test_map_in_children(self,
+                             mock_Context,
+                             mock_start_join,
+                             mock_start_state_machines,
+                             mock_FSM):
+        _machine(mock_FSM)
+        mock_start_state_machines.return_value = []
+        mock_Context.from_payload_dict.return_value.steps = 3
+        mock_Context.from_payload_dict.return_value.to_payload_dict.return_value = {}
+        context = _context([])
+        context.get.return_value = [1, 2, 3]
+        self.assertIsNone(DoubleItemsInChildren('map').execute(context, {}))
+        self.assertEqual('mapped', mock_Context.from_payload_dict.return_value.current_event)
+        self.assertEqual(2, mock_start_join.call_args[0][1])
+        self.assertEqual(('child', [{'items': [1, 2]}, {'items': [3]}]), mock_start_state_machines.call_args[0])
+
+
+class TestMapChunkAction(unittest.TestCase):
+
+    def test_get_result(self):
+        self.assertEqual([2, 4], DoubleChunk('chunk').get_result({'items': [1, 2]}, {}))
+        self.assertEqual([], DoubleChunk('chunk').get_result({}, {}))
+
+    def test_set_results(self):
+        user_context = {}
+        DoubleChunk('chunk').set_results(user_context, [[2, 4], [6]])
+        self.assertEqual({'map_results': [2, 4, 6]}, user_context)
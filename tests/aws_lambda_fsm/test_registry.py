@@ -0,0 +1,42 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# system imports
+import unittest
+
+# library imports
+import mock
+
+# application imports
+from aws_lambda_fsm.registry import Registry
+
+
+class TestRegistry(unittest.TestCase):
+
+    def test_get(self):
+        factory = mock.Mock(side_effect=lambda key: [key])
+        registry = Registry(factory)
+        obj = registry.get('a')
+        self.assertEqual(['a'], obj)
+        self.assertTrue(obj is registry.get('a'))
+        self.assertEqual(['b'], registry.get('b'))
+        self.assertEqual(2, factory.call_count)
+
+    def test_items_and_clear(self):
+        registry = Registry(lambda key: key.upper())
+        registry.get('b')
+        registry.get('a')
+        self.assertEqual([('a', 'A'), ('b', 'B')], registry.items())
+        registry.clear()
+        self.assertEqual([], registry.items())
@@ -0,0 +1,148 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# system imports
+import unittest
+
+# library imports
+import mock
+
+# application imports
+from aws_lambda_fsm import shards
+from aws_lambda_fsm.shards import ShardMonitor
+from aws_lambda_fsm.shards import get_hash_ranges
+from aws_lambda_fsm.shards import get_explicit_hash_key
+from aws_lambda_fsm.shards import get_shard_monitor
+from aws_lambda_fsm.shards import drain_shard_monitors
+
+
+def _shard(shard_id, start, end, closed=False):
+    shard = {
+        'ShardId': shard_id,
+        'HashKeyRange': {'StartingHashKey': str(start), 'EndingHashKey': str(end)},
+        'SequenceNumberRange': {'StartingSequenceNumber': '1'}
+    }
+    if closed:
+        shard['SequenceNumberRange']['EndingSequenceNumber'] = '2'
+    return shard
+
+
+class TestHashKeys(unittest.TestCase):
+
+    def test_get_hash_ranges(self):
+        self.assertEqual(
+            [(0, 9), (10, 99)],
+            get_hash_ranges([_shard('s2', 10, 99), _shard('s0', 0, 99, closed=True), _shard('s1', 0, 9)])
+        )
+
+    def test_get_explicit_hash_key_is_stable(self):
+        hash_ranges = [(0, 9), (10, 99)]
+        self.assertEqual(get_explicit_hash_key('abc', hash_ranges), get_explicit_hash_key('abc', hash_ranges))
+
+    def test_get_explicit_hash_key_is_uniform_over_shards(self):
+        # the second shard has 9x the hash key range, but receives the same share
+        hash_ranges = [(0, 9), (10, 99)]
+        counts = [0, 0]
+        for i in range(1000):
+            key = int(get_explicit_hash_key('correlation-%d' % i, hash_ranges))
+            self.assertTrue(0 <= key <= 99)
+            counts[0 if key <= 9 else 1] += 1
+        self.assertTrue(400 < counts[0] < 600, counts)
+
+
+class TestShardMonitor(unittest.TestCase):
+
+    def test_drain(self):
+        monitor = ShardMonitor('arn')
+        monitor.record('s0')
+        monitor.record('s0', count=2)
+        monitor.record('s1')
+        self.assertEqual({'s0': 3, 's1': 1}, monitor.drain())
+        self.assertEqual({}, monitor.drain())
+
+    @mock.patch('aws_lambda_fsm.shards.logger')
+    def test_hot_shard(self,
+                       mock_logger):
+        monitor = ShardMonitor('arn', hot_ratio=2., window=10)
+        monitor.record('s0', count=8)
+        self.assertEqual([], monitor.hot_shard_ids)
+        monitor.record('s1')
+        monitor.record('s2')
+        self.assertEqual(['s0'], monitor.hot_shard_ids)
+        mock_logger.warning.assert_called_with(
+            'Hot shard %s on %s received %d of the last %d puts.', 's0', 'arn', 8, 10)
+        self.assertEqual(0, monitor.window_total)
+
+    @mock.patch('aws_lambda_fsm.shards.logger')
+    def test_hot_shard_uses_open_shard_count(self,
+                                             mock_logger):
+        monitor = ShardMonitor('arn', hot_ratio=2., window=10)
+        monitor.hash_ranges = [(0, 1), (2, 3), (4, 5), (6, 7)]
+        monitor.record('s0', count=6)
+        monitor.record('s1', count=4)
+        self.assertEqual(['s0'], monitor.hot_shard_ids)
+
+    @mock.patch('aws_lambda_fsm.shards.time')
+    def test_get_hash_ranges(self,
+                             mock_time):
+        mock_time.time.return_value = 100.
+        monitor = ShardMonitor('arn')
+        describe_shards = mock.Mock(return_value=[_shard('s0', 0, 9)])
+        self.assertEqual([(0, 9)], monitor.get_hash_ranges(describe_shards))
+        self.assertEqual([(0, 9)], monitor.get_hash_ranges(describe_shards))
+        self.assertEqual(1, describe_shards.call_count)
+
+        # reloaded after the timeout
+        mock_time.time.return_value = 1000.
+        describe_shards.return_value = [_shard('s1', 0, 4), _shard('s2', 5, 9)]
+        self.assertEqual([(0, 4), (5, 9)], monitor.get_hash_ranges(describe_shards))
+
+    @mock.patch('aws_lambda_fsm.shards.logger')
+    @mock.patch('aws_lambda_fsm.shards.time')
+    def test_get_hash_ranges_error(self,
+                                   mock_time,
+                                   mock_logger):
+        mock_time.time.return_value = 100.
+        monitor = ShardMonitor('arn')
+        describe_shards = mock.Mock(side_effect=Exception())
+        self.assertIsNone(monitor.get_hash_ranges(describe_shards))
+        mock_logger.exception.assert_called_with('Error loading the shards for %s.', 'arn')
+
+        # not retried until the timeout
+        self.assertIsNone(monitor.get_hash_ranges(describe_shards))
+        self.assertEqual(1, describe_shards.call_count)
+
+
+class TestGetShardMonitor(unittest.TestCase):
+
+    def tearDown(self):
+        shards._local.monitors.clear()
+
+    @mock.patch('aws_lambda_fsm.shards.settings')
+    def test_get_shard_monitor(self,
+                               mock_settings):
+        mock_settings.KINESIS_HOT_SHARD_RATIO = 3.
+        mock_settings.KINESIS_HOT_SHARD_WINDOW = 50
+        monitor = get_shard_monitor('arn')
+        self.assertEqual(('arn', 3., 50), (monitor.name, monitor.hot_ratio, monitor.window))
+        self.assertTrue(monitor is get_shard_monitor('arn'))
+        self.assertFalse(monitor is get_shard_monitor('arn2'))
+
+    def test_drain_shard_monitors(self):
+        get_shard_monitor('arn2').record('s0')
+        get_shard_monitor('arn1').record('s1')
+        get_shard_monitor('arn3')
+        self.assertEqual([('arn1', {'s1': 1}), ('arn2', {'s0': 1})], drain_shard_monitors())
+        self.assertEqual([], drain_shard_monitors())
@@ -0,0 +1,116 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# system imports
+from collections import OrderedDict
+import unittest
+
+# library imports
+from botocore.exceptions import ClientError
+import mock
+
+# application imports
+from aws_lambda_fsm import circuit
+from aws_lambda_fsm import snapshot
+from aws_lambda_fsm.snapshot import put_snapshot
+from aws_lambda_fsm.snapshot import SnapshotNotFound
+from aws_lambda_fsm.snapshot import apply_delta
+from aws_lambda_fsm.snapshot import get_delta
+from aws_lambda_fsm.snapshot import get_user_context
+from aws_lambda_fsm.snapshot import get_user_context_delta
+
+ERROR = ClientError({'Error': {'Code': 'x', 'Message': 'y'}}, 'PutItem')
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        snapshot._local.snapshots = OrderedDict()
+        circuit._local.breakers.clear()
+
+    def test_get_delta(self):
+        self.assertEqual(({'b': 3, 'c': 4, 'n': None}, ['d', 'e']),
+                         get_delta({'a': 1, 'b': 2, 'd': 5, 'e': None},
+                                   {'a': 1, 'b': 3, 'c': 4, 'n': None}))
+
+    def test_apply_delta(self):
+        self.assertEqual({'a': 1, 'b': 3, 'c': 4, 'n': None},
+                         apply_delta({'a': 1, 'b': 2, 'd': 5, 'e': None},
+                                     {'b': 3, 'c': 4, 'n': None}, ['d', 'e', 'x']))
+
+    @mock.patch('aws_lambda_fsm.snapshot.store_snapshot')
+    def test_put_snapshot(self,
+                          mock_store_snapshot):
+        self.assertTrue(put_snapshot('c', 's', {'a': 1}, sources={'x': 'y'}))
+        mock_store_snapshot.assert_called_with('c', 's', '{"a": 1}', primary=True, sources={'x': 'y'})
+        self.assertEqual({('c', 's'): ('{"a": 1}', {'a': 1})}, dict(snapshot._local.snapshots))
+
+    @mock.patch('aws_lambda_fsm.snapshot.store_snapshot')
+    def test_put_snapshot_secondary(self,
+                                    mock_store_snapshot):
+        mock_store_snapshot.side_effect = [ERROR, {'ResponseMetadata': {}}]
+        self.assertTrue(put_snapshot('c', 's', {'a': 1}))
+        mock_store_snapshot.assert_called_with('c', 's', '{"a": 1}', primary=False, sources=None)
+
+    @mock.patch('aws_lambda_fsm.snapshot.store_snapshot')
+    def test_put_snapshot_not_stored(self,
+                                     mock_store_snapshot):
+        mock_store_snapshot.return_value = None
+        self.assertFalse(put_snapshot('c', 's', {'a': 1}))
+        self.assertEqual(2, mock_store_snapshot.call_count)
+        self.assertEqual({}, dict(snapshot._local.snapshots))
+
+    @mock.patch('aws_lambda_fsm.snapshot.store_snapshot')
+    def test_put_snapshot_fails(self,
+                                mock_store_snapshot):
+        mock_store_snapshot.side_effect = ERROR
+        self.assertFalse(put_snapshot('c', 's', {'a': 1}))
+        self.assertEqual({}, dict(snapshot._local.snapshots))
+
+    @mock.patch('aws_lambda_fsm.snapshot.CHECKPOINT_DATA')
+    @mock.patch('aws_lambda_fsm.snapshot.store_snapshot')
+    def test_put_snapshot_evicts(self,
+                                 mock_store_snapshot,
+                                 mock_CHECKPOINT_DATA):
+        mock_CHECKPOINT_DATA.SNAPSHOT_CACHE_SIZE = 2
+        for snapshot_id in 'stu':
+            put_snapshot('c', snapshot_id, {})
+        self.assertEqual([('c', 't'), ('c', 'u')], snapshot._local.snapshots.keys())
+
+    @mock.patch('aws_lambda_fsm.snapshot.load_snapshot')
+    @mock.patch('aws_lambda_fsm.snapshot.store_snapshot')
+    def test_get_user_context_cached(self,
+                                     mock_store_snapshot,
+                                     mock_load_snapshot):
+        put_snapshot('c', 's', {'a': {'b': 1}, 'c': 2, 'd': 3})
+        user_context = get_user_context('c', 's', {'c': 4}, ['d'])
+        self.assertEqual({'a': {'b': 1}, 'c': 4}, user_context)
+        user_context['a']['b'] = 5
+        self.assertEqual(({'a': {'b': 5}, 'c': 4}, ['d']), get_user_context_delta('c', 's', user_context))
+        self.assertFalse(mock_load_snapshot.called)
+
+    @mock.patch('aws_lambda_fsm.snapshot.load_snapshot')
+    def test_get_user_context_loaded(self,
+                                     mock_load_snapshot):
+        mock_load_snapshot.side_effect = [ERROR, '{"a": 1}']
+        self.assertEqual({'a': 1, 'b': 2}, get_user_context('c', 's', {'b': 2}, [], sources={'x': 'y'}))
+        mock_load_snapshot.assert_called_with('c', 's', primary=False, sources={'x': 'y'})
+        self.assertEqual([('c', 's')], snapshot._local.snapshots.keys())
+
+    @mock.patch('aws_lambda_fsm.snapshot.load_snapshot')
+    def test_get_user_context_missing(self,
+                                      mock_load_snapshot):
+        mock_load_snapshot.return_value = None
+        self.assertRaises(SnapshotNotFound, get_user_context, 'c', 's', {}, [])
+        self.assertRaises(SnapshotNotFound, get_user_context_delta, 'c', 's', {})
@@ -20,6 +20,7 @@ import mock
 
 # application imports
 from aws_lambda_fsm.state import State
+from aws_lambda_fsm.transition import Transition
 from aws_lambda_fsm.fsm import Context
 
 
@@ -75,3 +76,58 @@ class TestAction(unittest.TestCase):
         context['foo'] = 'bar'
         event = state.dispatch(context, 'event', 'obj')
         self.assertIsNone(event)
+
+    def test_compile(self):
+        source = State('source', exit_action='exit')
+        target = State('target', entry_action='entry', do_action='do', final=True)
+        transition = Transition('source->target:event', target, action='action')
+        source.add_transition(transition, 'event')
+        self.assertEqual(
+            {'event': (transition, 'exit', 'action', 'entry', 'do', target, True)},
+            source.compile()
+        )
+        source.add_transition(transition, 'event')
+        self.assertEqual({}, source._event_2_dispatch)
+
+    def test_dispatch_compiled(self):
+        actions = dict((name, mock.Mock()) for name in ['exit', 'action', 'entry', 'do'])
+        source = State('source', exit_action=actions['exit'])
+        target = State('target', entry_action=actions['entry'], do_action=actions['do'])
+        transition = Transition('source->target:event', target, action=actions['action'])
+        source.add_transition(transition, 'event')
+        source.compile()
+        context = Context('name', initial_state=source)
+        event = source.dispatch(context, 'event', 'obj')
+        for action in actions.values():
+            action.execute.assert_called_with(context, 'obj')
+        self.assertEqual(actions['do'].execute.return_value, event)
+        self.assertTrue(target is context.current_state)
+        self.assertTrue(transition is context.current_transition)
+        self.assertTrue(actions['do'] is context.current_action)
+
+    def test_dispatch_compiled_current_action(self):
+        actions = dict((name, mock.Mock()) for name in ['action', 'do'])
+        target = State('target', do_action=actions['do'])
+        transition = Transition('source->target:event', target, action=actions['action'])
+        source = State('source')
+        source.add_transition(transition, 'event')
+        source.compile()
+        context = Context('name', initial_state=source)
+        current_actions = []
+        for action in actions.values():
+            action.execute.side_effect = lambda *args: current_actions.append(context.current_action)
+        source.dispatch(context, 'event', 'obj')
+        self.assertEqual([actions['action'], actions['do']], current_actions)
+
+    def test_dispatch_compiled_to_final_no_event(self):
+        do_action = mock.Mock()
+        source = State('source')
+        target = State('target', do_action=do_action, final=True)
+        source.add_transition(Transition('source->target:event', target), 'event')
+        source.compile()
+        context = Context('name', initial_state=source)
+        self.assertIsNone(source.dispatch(context, 'event', 'obj'))
+        do_action.execute.assert_called_with(context, 'obj')
+
+    def test_slots(self):
+        self.assertRaises(AttributeError, setattr, State('name'), 'foo', 'bar')
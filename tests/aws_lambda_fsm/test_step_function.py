@@ -0,0 +1,220 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# system imports
+import unittest
+
+# library imports
+
+# application imports
+from aws_lambda_fsm.graph import MachineGraph
+from aws_lambda_fsm.step_function import get_definition
+from aws_lambda_fsm.step_function import _quote
+
+ARN = 'arn:aws:lambda:us-east-1:999999999999:function:fsm'
+
+
+def _graphs(*machine_dicts):
+    return dict((machine_dict['name'], MachineGraph(machine_dict)) for machine_dict in machine_dicts)
+
+
+def _task(retries=5, interval=1, backoff=2.0, **kwargs):
+    kwargs.update({
+        'Type': 'Task',
+        'Resource': ARN,
+        'Retry': [{'ErrorEquals': ['States.ALL'], 'IntervalSeconds': interval,
+                   'MaxAttempts': retries, 'BackoffRate': backoff}]
+    })
+    return kwargs
+
+
+CHILD = {'name': 'child', 'states': [{'name': 'x', 'initial': True, 'final': True}]}
+
+
+class TestGetDefinition(unittest.TestCase):
+
+    def test_linear_machine_has_no_choices(self):
+        graphs = _graphs({'name': 'm', 'max_retries': 3, 'states': [
+            {'name': 'a', 'initial': True, 'retry_interval': 5, 'retry_backoff': 1.0,
+             'transitions': [{'event': 'e', 'target': 'b'}]},
+            {'name': 'b', 'final': True, 'max_retries': 0}
+        ]})
+        self.assertEqual({
+            'Comment': 'c',
+            'StartAt': 'a',
+            'States': {
+                'a': _task(retries=3, interval=5, backoff=1.0, Next='b'),
+                'b': _task(retries=0, End=True)
+            }
+        }, get_definition(graphs['m'], graphs, ARN, comment='c'))
+
+    def test_choices(self):
+        graphs = _graphs({'name': 'm', 'states': [
+            {'name': 'a', 'initial': True,
+             'transitions': [{'event': 'e1', 'target': 'a'}, {'event': 'e2', 'target': 'b'}]},
+            {'name': 'b', 'final': True, 'transitions': [{'event': 'e3', 'target': 'a'}]},
+            {'name': 'c'}
+        ]})
+        self.assertEqual({
+            'StartAt': 'a',
+            'States': {
+                'a': _task(Next='a-choices'),
+                'a-choices': {
+                    'Type': 'Choice',
+                    'Choices': [
+                        {'Variable': '$.system_context.current_event', 'StringEquals': 'e1', 'Next': 'a'},
+                        {'Variable': '$.system_context.current_event', 'StringEquals': 'e2', 'Next': 'b'}
+                    ]
+                },
+                'b': _task(End=True),
+                'c': _task(End=True)
+            }
+        }, get_definition(graphs['m'], graphs, ARN))
+
+    def test_map(self):
+        graphs = _graphs(CHILD, {'name': 'm', 'states': [
+            {'name': 'a', 'initial': True, 'map': {'machine': 'child', 'max_concurrency': 2},
+             'transitions': [{'event': 'mapped', 'target': 'b'}]},
+            {'name': 'b', 'final': True, 'map': {'machine': 'child', 'items': 'things'}}
+        ]})
+        iterator = {'StartAt': 'x', 'States': {'x': _task(End=True)}}
+        start = {
+            'version': '0.1',
+            'system_context': {'machine_name': 'child', 'current_state': 'pseudo_init',
+                               'current_event': 'pseudo_init', 'steps': 0, 'retries': 0},
+            'user_context': {'item.$': '$$.Map.Item.Value'},
+            'step_function': True
+        }
+        self.assertEqual({
+            'StartAt': 'a',
+            'States': {
+                'a': {'Type': 'Map', 'ItemsPath': '$.user_context.items', 'MaxConcurrency': 2,
+                      'Parameters': start, 'Iterator': iterator,
+                      'ResultPath': '$.user_context.map_results', 'Next': 'a-resume'},
+                'a-resume': {
+                    'Type': 'Pass',
+                    'Parameters': {
+                        'version.$': '$.version',
+                        'system_context.$': "States.JsonMerge($.system_context, States.StringToJson("
+                                            "'\\{\"current_event\":\"mapped\",\"current_state\":\"a\"\\}'), false)",
+                        'user_context.$': '$.user_context',
+                        'step_function': True
+                    },
+                    'Next': 'b'
+                },
+                'b': {'Type': 'Map', 'ItemsPath': '$.user_context.things',
+                      'Parameters': start, 'Iterator': iterator,
+                      'ResultPath': '$.user_context.map_results', 'End': True}
+            }
+        }, get_definition(graphs['m'], graphs, ARN))
+
+    def test_parallel(self):
+        graphs = _graphs(CHILD, {'name': 'm', 'states': [
+            {'name': 'a', 'initial': True, 'final': True, 'parallel': ['child']}
+        ]})
+        self.assertEqual({
+            'StartAt': 'a',
+            'States': {
+                'a': {
+                    'Type': 'Parallel',
+                    'Branches': [{
+                        'StartAt': 'child-start',
+                        'States': {
+                            'child-start': {
+                                'Type': 'Pass',
+                                'Parameters': {
+                                    'version': '0.1',
+                                    'system_context': {'machine_name': 'child', 'current_state': 'pseudo_init',
+                                                       'current_event': 'pseudo_init', 'steps': 0, 'retries': 0},
+                                    'user_context.$': '$.user_context',
+                                    'step_function': True
+                                },
+                                'Next': 'x'
+                            },
+                            'x': _task(End=True)
+                        }
+                    }],
+                    'ResultPath': '$.user_context.join_results',
+                    'End': True
+                }
+            }
+        }, get_definition(graphs['m'], graphs, ARN))
+
+    def test_delta(self):
+        graphs = _graphs(CHILD, {'name': 'm', 'states': [
+            {'name': 'a', 'initial': True,
+             'transitions': [{'event': 'e1', 'target': 'b'}, {'event': 'e2', 'target': 'c'}]},
+            {'name': 'b', 'parallel': ['child'], 'transitions': [{'event': 'joined', 'target': 'c'}]},
+            {'name': 'c', 'final': True}
+        ]})
+        states = get_definition(graphs['m'], graphs, ARN, delta=True)['States']
+        self.assertEqual(_task(Next='a-choices', ResultPath='$.delta',
+                               Parameters={'step_function': True, 'payload.$': '$', 'delta': True,
+                                           'stop_states': ['b']}), states['a'])
+        self.assertEqual([
+            {'Variable': '$.delta.system_context.current_event', 'StringEquals': 'e1', 'Next': 'b-merge'},
+            {'Variable': '$.delta.system_context.current_event', 'StringEquals': 'e2', 'Next': 'c'}
+        ], states['a-choices']['Choices'])
+        self.assertEqual({
+            'Type': 'Pass',
+            'Parameters': {
+                'version.$': '$.version',
+                'system_context.$': '$.delta.system_context',
+                'user_context.$': '$.delta.user_context',
+                'step_function': True
+            },
+            'Next': 'b'
+        }, states['b-merge'])
+        self.assertEqual({'system_context.$', 'user_context'},
+                         set(states['b-resume']['Parameters']['delta'].keys()))
+        self.assertEqual('c', states['b-resume']['Next'])
+        self.assertEqual('$.delta', states['b']['Branches'][0]['States']['x']['ResultPath'])
+
+    def test_inline(self):
+        graphs = _graphs(CHILD, {'name': 'm', 'inline_steps': 2, 'states': [
+            {'name': 'a', 'initial': True, 'transitions': [{'event': 'e1', 'target': 'b'}]},
+            {'name': 'b', 'map': {'machine': 'child'}, 'transitions': [{'event': 'mapped', 'target': 'c'}]},
+            {'name': 'c', 'final': True}
+        ]})
+        states = get_definition(graphs['m'], graphs, ARN)['States']
+        parameters = {'step_function': True, 'payload.$': '$', 'inline': True, 'stop_states': ['b']}
+        self.assertEqual(_task(Next='m-dispatch', Parameters=parameters), states['a'])
+        self.assertEqual(_task(Next='m-dispatch', Parameters=parameters), states['c'])
+        self.assertEqual({
+            'Type': 'Choice',
+            'Choices': [
+                {'Variable': '$', 'IsNull': True, 'Next': 'm-done'},
+                {
+                    'And': [
+                        {'Variable': '$.system_context.current_state', 'StringEquals': 'a'},
+                        {'Variable': '$.system_context.current_event', 'StringEquals': 'e1'}
+                    ],
+                    'Next': 'b'
+                }
+            ]
+        }, states['m-dispatch'])
+        self.assertEqual({'Type': 'Succeed'}, states['m-done'])
+        self.assertEqual('c', states['b-resume']['Next'])
+
+    def test_recursive(self):
+        graphs = _graphs({'name': 'm', 'states': [
+            {'name': 'a', 'initial': True, 'final': True, 'map': {'machine': 'm'}}
+        ]})
+        self.assertRaises(ValueError, get_definition, graphs['m'], graphs, ARN)
+
+
+class TestQuote(unittest.TestCase):
+
+    def test_quote(self):
+        self.assertEqual("'a\\'b\\\\c\\{\\}'", _quote("a'b\\c{}"))
@@ -0,0 +1,103 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# system imports
+import unittest
+
+# library imports
+import mock
+
+# application imports
+from aws_lambda_fsm import throttle
+from aws_lambda_fsm.throttle import TokenBucket
+from aws_lambda_fsm.throttle import get_token_bucket
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    @mock.patch('aws_lambda_fsm.throttle.time')
+    def test_unlimited(self,
+                       mock_time):
+        mock_time.time.return_value = 100.
+        bucket = TokenBucket('arn')
+        for i in range(1000):
+            self.assertEqual(0., bucket.acquire())
+            bucket.succeeded()
+        self.assertIsNone(bucket.rate)
+        self.assertFalse(mock_time.sleep.called)
+
+    @mock.patch('aws_lambda_fsm.throttle.time')
+    def test_max_rate(self,
+                      mock_time):
+        mock_time.time.return_value = 100.
+        bucket = TokenBucket('arn', max_rate=10., max_wait=1.)
+        mock_time.time.return_value = 101.
+        waits = [bucket.acquire() for i in range(12)]
+        self.assertEqual([0.] * 10 + [0.1, 0.2], waits)
+        mock_time.sleep.assert_called_with(0.2)
+        bucket.succeeded()
+        self.assertEqual(10., bucket.rate)
+
+    @mock.patch('aws_lambda_fsm.throttle.time')
+    def test_max_wait(self,
+                      mock_time):
+        mock_time.time.return_value = 100.
+        bucket = TokenBucket('arn', max_rate=1., max_wait=0.5)
+        self.assertEqual([0.5, 0.5], [bucket.acquire(), bucket.acquire()])
+        self.assertEqual(-0.5, bucket.tokens)
+
+    @mock.patch('aws_lambda_fsm.throttle.time')
+    def test_learns_rate(self,
+                         mock_time):
+        mock_time.time.return_value = 100.
+        bucket = TokenBucket('arn')
+        for i in range(200):
+            bucket.succeeded()
+        mock_time.time.return_value = 102.
+        for i in range(50):
+            bucket.succeeded()
+        self.assertEqual(100., bucket.last_window_rate)
+
+        # the first throttle halves the observed rate
+        bucket.throttled()
+        self.assertEqual(50., bucket.rate)
+        self.assertEqual(0.02, bucket.acquire())
+
+        # subsequent throttles halve the rate, down to the minimum
+        bucket.throttled()
+        self.assertEqual(25., bucket.rate)
+        for i in range(10):
+            bucket.throttled()
+        self.assertEqual(1., bucket.rate)
+
+        # and successful puts slowly raise it again
+        for i in range(10):
+            bucket.succeeded()
+        self.assertAlmostEqual(2., bucket.rate)
+
+
+class TestGetTokenBucket(unittest.TestCase):
+
+    def tearDown(self):
+        throttle._local.buckets.clear()
+
+    @mock.patch('aws_lambda_fsm.throttle.settings')
+    def test_get_token_bucket(self,
+                              mock_settings):
+        mock_settings.KINESIS_MAX_RATE = 100.
+        mock_settings.KINESIS_THROTTLE_MAX_WAIT = 0.1
+        bucket = get_token_bucket('arn')
+        self.assertEqual(('arn', 100., 0.1), (bucket.name, bucket.rate, bucket.max_wait))
+        self.assertTrue(bucket is get_token_bucket('arn'))
+        self.assertFalse(bucket is get_token_bucket('arn2'))
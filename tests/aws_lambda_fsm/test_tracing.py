@@ -0,0 +1,241 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# system imports
+import json
+import os
+import tempfile
+import unittest
+
+# library imports
+import mock
+
+# application imports
+from aws_lambda_fsm import tracing
+from aws_lambda_fsm.tracing import Span
+from aws_lambda_fsm.tracing import SpanSink
+from aws_lambda_fsm.tracing import LoggingSpanSink
+from aws_lambda_fsm.tracing import BufferingSpanSink
+from aws_lambda_fsm.tracing import FileSpanSink
+from aws_lambda_fsm.tracing import OtlpHttpSpanSink
+from aws_lambda_fsm.tracing import get_span_sink
+from aws_lambda_fsm.tracing import get_trace_context
+from aws_lambda_fsm.tracing import get_payload_size
+from aws_lambda_fsm.tracing import record_span
+from aws_lambda_fsm.tracing import start_span
+from aws_lambda_fsm.tracing import finish_span
+from aws_lambda_fsm.tracing import traced
+from aws_lambda_fsm.tracing import flush_spans
+from aws_lambda_fsm.tracing import new_trace_id
+from aws_lambda_fsm.tracing import new_span_id
+from aws_lambda_fsm.tracing import _NULL_SPAN
+
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        tracing._local.sink = None
+        tracing._local.sink_loaded = False
+
+    def tearDown(self):
+        tracing._local.sink = None
+        tracing._local.sink_loaded = False
+
+    def _enable(self):
+        tracing._local.sink = mock.Mock()
+        tracing._local.sink_loaded = True
+        return tracing._local.sink
+
+    @mock.patch('aws_lambda_fsm.tracing.settings')
+    def test_get_span_sink_disabled(self,
+                                    mock_settings):
+        mock_settings.TRACE_SINK = None
+        self.assertIsNone(get_span_sink())
+        self.assertTrue(tracing._local.sink_loaded)
+        self.assertIsNone(start_span('fsm', 'step'))
+        self.assertTrue(traced('fsm', 'action') is _NULL_SPAN)
+        with traced('fsm', 'action'):
+            pass
+        flush_spans()
+
+    @mock.patch('aws_lambda_fsm.tracing.settings')
+    def test_get_span_sink(self,
+                           mock_settings):
+        mock_settings.TRACE_SINK = 'aws_lambda_fsm.tracing.LoggingSpanSink'
+        sink = get_span_sink()
+        self.assertTrue(isinstance(sink, LoggingSpanSink))
+        self.assertTrue(sink is get_span_sink())
+
+    def test_ids(self):
+        self.assertEqual(32, len(new_trace_id()))
+        self.assertEqual(16, len(new_span_id()))
+
+    def test_get_payload_size(self):
+        self.assertEqual(7, get_payload_size(((), {'a': 'bc', 'd': [u'ef', ('g', 1)], 'h': {'i': 'jk'}})))
+
+    def test_span_to_dict(self):
+        span = Span('kinesis', 'put_record', 1.0, 0.5, 10, 'ok', {'correlation_id': 'abc'},
+                    trace_id='t', span_id='s', parent_span_id='p')
+        self.assertEqual(
+            {'service': 'kinesis', 'operation': 'put_record', 'started_at': 1.0, 'duration': 0.5,
+             'payload_size': 10, 'outcome': 'ok', 'correlation_id': 'abc',
+             'trace_id': 't', 'span_id': 's', 'parent_span_id': 'p'},
+            span.to_dict()
+        )
+
+    def test_span_to_otlp(self):
+        span = Span('fsm', 'step', 1.0, 0.5, 10, 'retry', {'steps': 2},
+                    trace_id='t', span_id='s', parent_span_id='p')
+        self.assertEqual(
+            {
+                'traceId': 't',
+                'spanId': 's',
+                'parentSpanId': 'p',
+                'name': 'fsm.step',
+                'kind': 1,
+                'startTimeUnixNano': '1000000000',
+                'endTimeUnixNano': '1500000000',
+                'attributes': [
+                    {'key': 'outcome', 'value': {'stringValue': 'retry'}},
+                    {'key': 'payload_size', 'value': {'stringValue': '10'}},
+                    {'key': 'service', 'value': {'stringValue': 'fsm'}},
+                    {'key': 'steps', 'value': {'stringValue': '2'}}
+                ],
+                'status': {'code': 2}
+            },
+            span.to_otlp()
+        )
+        span = Span('kinesis', 'put_record', 1.0, 0.5, 10, 'ok', {}, trace_id='t', span_id='s')
+        self.assertEqual((3, {'code': 1}, False),
+                         (span.to_otlp()['kind'], span.to_otlp()['status'], 'parentSpanId' in span.to_otlp()))
+
+    @mock.patch('aws_lambda_fsm.tracing.logger')
+    def test_logging_span_sink(self,
+                               mock_logger):
+        sink = LoggingSpanSink()
+        sink.record(Span('kinesis', 'put_record', 1.0, 0.5, 10, 'ok', {}, trace_id='t', span_id='s'))
+        sink.flush()
+        mock_logger.info.assert_called_with(
+            'span=%s',
+            '{"duration": 0.5, "operation": "put_record", "outcome": "ok", "parent_span_id": null, '
+            '"payload_size": 10, "service": "kinesis", "span_id": "s", "started_at": 1.0, "trace_id": "t"}'
+        )
+
+    def test_buffering_span_sink(self):
+        sink = BufferingSpanSink()
+        sink.export = mock.Mock()
+        sink.flush()
+        self.assertFalse(sink.export.called)
+        sink.record(Span('kinesis', 'put_record', 1.0, 0.5, 10, 'ok', {}, trace_id='t', span_id='s'))
+        sink.flush()
+        request = json.loads(sink.export.call_args[0][0])
+        self.assertEqual('aws_lambda_fsm', request['resourceSpans'][0]['scopeSpans'][0]['scope']['name'])
+        self.assertEqual('s', request['resourceSpans'][0]['scopeSpans'][0]['spans'][0]['spanId'])
+        self.assertEqual([], sink.spans)
+        self.assertRaises(NotImplementedError, BufferingSpanSink().export, '{}')
+
+    @mock.patch('aws_lambda_fsm.tracing.settings')
+    def test_file_span_sink(self,
+                            mock_settings):
+        fd, mock_settings.TRACE_FILE = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            FileSpanSink().export('{"a": 1}')
+            FileSpanSink().export('{"b": 2}')
+            with open(mock_settings.TRACE_FILE) as f:
+                self.assertEqual('{"a": 1}\n{"b": 2}\n', f.read())
+        finally:
+            os.remove(mock_settings.TRACE_FILE)
+
+    @mock.patch('aws_lambda_fsm.tracing.urllib2')
+    @mock.patch('aws_lambda_fsm.tracing.settings')
+    def test_otlp_http_span_sink(self,
+                                 mock_settings,
+                                 mock_urllib2):
+        mock_settings.TRACE_OTLP_ENDPOINT = 'http://collector:4318/v1/traces'
+        OtlpHttpSpanSink().export('{"a": 1}')
+        mock_urllib2.Request.assert_called_with('http://collector:4318/v1/traces', '{"a": 1}',
+                                                {'Content-Type': 'application/json'})
+        mock_urllib2.urlopen.assert_called_with(mock_urllib2.Request.return_value, timeout=5)
+
+    def test_start_finish_span(self):
+        sink = self._enable()
+        step = start_span('fsm', 'step', attributes={'steps': 1}, trace_id='t', parent_span_id='p')
+        self.assertEqual({'steps': 1}, get_trace_context())
+        with traced('fsm', 'action', {'current_event': 'e'}):
+            self.assertEqual({'steps': 1, 'current_event': 'e'}, get_trace_context())
+            record_span(sink, 'kinesis', 'put_record', 1.0, 0.5, {'Data': 'abc'}, 'ok')
+        finish_span(step, outcome='retry', payload_size=3)
+        self.assertEqual({}, get_trace_context())
+
+        backend, action, step = [c[0][0] for c in sink.record.call_args_list]
+        self.assertEqual(('fsm', 'step', 't', 'p', 'retry', 3, {'steps': 1}),
+                         (step.service, step.operation, step.trace_id, step.parent_span_id,
+                          step.outcome, step.payload_size, step.attributes))
+        self.assertEqual(('fsm', 'action', 't', step.span_id, 'ok'),
+                         (action.service, action.operation, action.trace_id, action.parent_span_id, action.outcome))
+        self.assertEqual(('kinesis', 't', action.span_id, 3, {'steps': 1, 'current_event': 'e'}),
+                         (backend.service, backend.trace_id, backend.parent_span_id, backend.payload_size,
+                          backend.attributes))
+
+    def test_traced_exception(self):
+        sink = self._enable()
+
+        def run():
+            with traced('fsm', 'action'):
+                raise ValueError()
+        self.assertRaises(ValueError, run)
+        span = sink.record.call_args[0][0]
+        self.assertEqual(('ValueError', None), (span.outcome, span.parent_span_id))
+        self.assertEqual(32, len(span.trace_id))
+
+    def test_record_span_without_trace(self):
+        sink = self._enable()
+        record_span(sink, 'dynamodb', 'query', 1.0, 0.5, {}, 'ok')
+        span = sink.record.call_args[0][0]
+        self.assertEqual((32, 16, None), (len(span.trace_id), len(span.span_id), span.parent_span_id))
+
+    @mock.patch('aws_lambda_fsm.tracing.logger')
+    def test_record_span_error(self,
+                               mock_logger):
+        sink = mock.Mock()
+        sink.record.side_effect = Exception()
+        record_span(sink, 'dynamodb', 'get_item', 1.0, 0.5, {}, 'ok')
+        mock_logger.exception.assert_called_with('Error recording span.')
+
+    @mock.patch('aws_lambda_fsm.tracing.logger')
+    def test_finish_span_error(self,
+                               mock_logger):
+        sink = self._enable()
+        sink.record.side_effect = Exception()
+        finish_span(start_span('fsm', 'step'))
+        mock_logger.exception.assert_called_with('Error recording span.')
+
+    def test_flush_spans(self):
+        sink = self._enable()
+        flush_spans()
+        self.assertTrue(sink.flush.called)
+
+    @mock.patch('aws_lambda_fsm.tracing.logger')
+    def test_flush_spans_error(self,
+                               mock_logger):
+        sink = self._enable()
+        sink.flush.side_effect = Exception()
+        flush_spans()
+        mock_logger.exception.assert_called_with('Error flushing spans.')
+
+    def test_span_sink(self):
+        sink = SpanSink()
+        sink.record(None)
+        sink.flush()
@@ -0,0 +1,408 @@
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# system imports
+import threading
+import time
+import unittest
+
+# library imports
+import mock
+from botocore.exceptions import ClientError
+
+# application imports
+from aws_lambda_fsm.worker import ShardConsumer
+from aws_lambda_fsm.worker import WeightedSemaphore
+from aws_lambda_fsm.worker import Worker
+
+STREAM_ARN = 'arn:partition:kinesis:testing:account:stream/s'
+
+
+class TestWorkerBase(unittest.TestCase):
+
+    def setUp(self):
+        self.patcher = mock.patch('aws_lambda_fsm.worker.get_connection')
+        self.mock_get_connection = self.patcher.start()
+        self.handler = mock.Mock()
+        self.worker = Worker(STREAM_ARN, handler=self.handler, sleep_time=0.01)
+        self.conn = self.worker.kinesis_conn
+
+    def tearDown(self):
+        self.patcher.stop()
+
+
+class TestWeightedSemaphore(unittest.TestCase):
+
+    def _wait_for(self, condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.001)
+        self.assertTrue(condition())
+
+    def test_permits_granted_by_weight(self):
+        semaphore = WeightedSemaphore(0, {'a': 3, 'b': 1})
+        granted = []
+
+        def acquire(lane):
+            semaphore.acquire(lane)
+            granted.append(lane)
+
+        threads = [threading.Thread(target=acquire, args=(lane,)) for lane in 'aaaabbbb']
+        for thread in threads:
+            thread.start()
+        self._wait_for(lambda: semaphore.waiting == {'a': 4, 'b': 4})
+
+        for i in range(8):
+            semaphore.release()
+            self._wait_for(lambda: len(granted) == i + 1)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(['a', 'b', 'a', 'a', 'a', 'b', 'b', 'b'], granted)
+
+    def test_idle_lane_does_not_catch_up(self):
+        semaphore = WeightedSemaphore(1, {'a': 1, 'b': 2})
+        semaphore.current_pass = 5.
+        semaphore.acquire('b')
+        self.assertEqual(5.5, semaphore.passes['b'])
+        self.assertEqual(0, semaphore.value)
+
+    def test_lane(self):
+        semaphore = WeightedSemaphore(1, {'a': 1})
+        with semaphore.lane('a'):
+            self.assertEqual(0, semaphore.value)
+        self.assertEqual(1, semaphore.value)
+
+
+class TestShardConsumer(TestWorkerBase):
+
+    def _consumer(self):
+        return ShardConsumer(self.worker, 'shardId-000000000000')
+
+    @mock.patch('aws_lambda_fsm.worker.acquire_lease')
+    def test_acquire(self,
+                     mock_acquire_lease):
+        mock_acquire_lease.return_value = 3
+        consumer = self._consumer()
+        self.assertTrue(consumer.acquire())
+        self.assertEqual(3, consumer.fence_token)
+        mock_acquire_lease.assert_called_with('shard-s-shardId-000000000000', 0, 0, timeout=60)
+
+    @mock.patch('aws_lambda_fsm.worker.acquire_lease')
+    def test_acquire_fails(self,
+                           mock_acquire_lease):
+        mock_acquire_lease.return_value = False
+        consumer = self._consumer()
+        self.assertFalse(consumer.acquire())
+        self.assertIsNone(consumer.fence_token)
+
+    @mock.patch('aws_lambda_fsm.worker.release_lease')
+    def test_release(self,
+                     mock_release_lease):
+        consumer = self._consumer()
+        consumer.release()
+        self.assertFalse(mock_release_lease.called)
+        consumer.fence_token = 3
+        consumer.release()
+        mock_release_lease.assert_called_with('shard-s-shardId-000000000000', 0, 0, 3)
+        self.assertIsNone(consumer.fence_token)
+
+    @mock.patch('aws_lambda_fsm.worker.time')
+    @mock.patch('aws_lambda_fsm.worker.renew_lease')
+    @mock.patch('aws_lambda_fsm.worker.release_lease')
+    @mock.patch('aws_lambda_fsm.worker.acquire_lease')
+    def test_renew(self,
+                   mock_acquire_lease,
+                   mock_release_lease,
+                   mock_renew_lease,
+                   mock_time):
+        consumer = self._consumer()
+        self.assertFalse(consumer.renew())
+        consumer.fence_token = 3
+        consumer.lease_acquired_at = 100
+        mock_time.time.return_value = 110
+        self.assertTrue(consumer.renew())
+        self.assertFalse(mock_renew_lease.called)
+        mock_time.time.return_value = 130
+        mock_renew_lease.return_value = True
+        self.assertTrue(consumer.renew())
+        mock_renew_lease.assert_called_with('shard-s-shardId-000000000000', 0, 0, 3, timeout=60)
+        self.assertEqual(3, consumer.fence_token)
+        self.assertEqual(130, consumer.lease_acquired_at)
+        mock_time.time.return_value = 200
+        mock_renew_lease.return_value = False
+        self.assertFalse(consumer.renew())
+        self.assertIsNone(consumer.fence_token)
+        self.assertFalse(mock_acquire_lease.called)
+        self.assertFalse(mock_release_lease.called)
+
+    @mock.patch('aws_lambda_fsm.worker.load_shard_checkpoint')
+    def test_get_shard_iterator_checkpointed(self,
+                                             mock_load_shard_checkpoint):
+        mock_load_shard_checkpoint.return_value = '123'
+        self.conn.get_shard_iterator.return_value = {'ShardIterator': 'it'}
+        self.assertEqual('it', self._consumer().get_shard_iterator())
+        self.conn.get_shard_iterator.assert_called_with(
+            StreamName='s',
+            ShardId='shardId-000000000000',
+            ShardIteratorType='AFTER_SEQUENCE_NUMBER',
+            StartingSequenceNumber='123'
+        )
+
+    @mock.patch('aws_lambda_fsm.worker.load_shard_checkpoint')
+    def test_get_shard_iterator_initial(self,
+                                        mock_load_shard_checkpoint):
+        mock_load_shard_checkpoint.return_value = None
+        self.conn.get_shard_iterator.return_value = {'ShardIterator': 'it'}
+        self.assertEqual('it', self._consumer().get_shard_iterator())
+        self.conn.get_shard_iterator.assert_called_with(
+            StreamName='s',
+            ShardId='shardId-000000000000',
+            ShardIteratorType='TRIM_HORIZON'
+        )
+
+    @mock.patch('aws_lambda_fsm.worker.load_shard_checkpoint')
+    def test_get_shard_iterator_shard_end(self,
+                                          mock_load_shard_checkpoint):
+        mock_load_shard_checkpoint.return_value = 'SHARD_END'
+        consumer = self._consumer()
+        self.assertIsNone(consumer.get_shard_iterator())
+        self.assertTrue(consumer.finished)
+
+    def test_process_batch(self):
+        self.conn.get_records.return_value = {
+            'Records': [{'Data': 'a', 'SequenceNumber': '1'}, {'Data': 'b', 'SequenceNumber': '2'}],
+            'NextShardIterator': 'next',
+            'MillisBehindLatest': 1000
+        }
+        consumer = self._consumer()
+        consumer.shard_iterator = 'it'
+        self.assertEqual(2, consumer.process_batch())
+        self.handler.assert_called_with({'Records': [{'kinesis': {'data': 'YQ=='}}, {'kinesis': {'data': 'Yg=='}}]})
+        self.conn.get_records.assert_called_with(ShardIterator='it', Limit=100)
+        self.assertEqual(('next', '2', 1000), (consumer.shard_iterator,
+                                               consumer.sequence_number,
+                                               consumer.millis_behind_latest))
+        self.assertEqual((2, 1), (self.worker.records, self.worker.batches))
+
+    def test_process_batch_shared_semaphore(self):
+        self.worker = Worker(STREAM_ARN, handler=self.handler, semaphore=mock.MagicMock())
+        self.conn = self.worker.kinesis_conn
+        self.conn.get_records.return_value = {
+            'Records': [{'Data': 'a', 'SequenceNumber': '1'}],
+            'NextShardIterator': 'next'
+        }
+        self._consumer().process_batch()
+        self.assertTrue(self.worker.semaphore.__enter__.called)
+        self.assertTrue(self.worker.semaphore.__exit__.called)
+
+    def test_process_batch_shard_closed(self):
+        self.conn.get_records.return_value = {'Records': [], 'NextShardIterator': None}
+        consumer = self._consumer()
+        self.assertEqual(0, consumer.process_batch())
+        self.assertFalse(self.handler.called)
+        self.assertTrue(consumer.finished)
+        self.assertEqual('SHARD_END', consumer.sequence_number)
+
+    def test_process_batch_throttled(self):
+        self.conn.get_records.side_effect = \
+            ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'test')
+        consumer = self._consumer()
+        self.assertEqual(0, consumer.process_batch())
+        self.assertEqual(0.2, consumer.backoff)
+        consumer.process_batch()
+        self.assertEqual(0.4, consumer.backoff)
+
+    def test_process_batch_error(self):
+        self.conn.get_records.side_effect = ClientError({'Error': {'Code': 'Other'}}, 'test')
+        self.assertRaises(ClientError, self._consumer().process_batch)
+
+    @mock.patch('aws_lambda_fsm.worker.time')
+    @mock.patch('aws_lambda_fsm.worker.store_shard_checkpoint')
+    def test_checkpoint(self,
+                        mock_store_shard_checkpoint,
+                        mock_time):
+        mock_time.time.return_value = 100
+        consumer = self._consumer()
+        consumer.checkpoint()
+        self.assertFalse(mock_store_shard_checkpoint.called)
+        consumer.sequence_number = '1'
+        consumer.checkpoint()
+        mock_store_shard_checkpoint.assert_called_with(STREAM_ARN, 'shardId-000000000000', '1')
+        consumer.sequence_number = '2'
+        consumer.checkpoint()
+        self.assertEqual(1, mock_store_shard_checkpoint.call_count)
+        consumer.checkpoint(force=True)
+        mock_store_shard_checkpoint.assert_called_with(STREAM_ARN, 'shardId-000000000000', '2')
+
+    @mock.patch('aws_lambda_fsm.worker.store_shard_checkpoint')
+    @mock.patch('aws_lambda_fsm.worker.load_shard_checkpoint')
+    @mock.patch('aws_lambda_fsm.worker.release_lease')
+    @mock.patch('aws_lambda_fsm.worker.acquire_lease')
+    def test_run(self,
+                 mock_acquire_lease,
+                 mock_release_lease,
+                 mock_load_shard_checkpoint,
+                 mock_store_shard_checkpoint):
+        mock_acquire_lease.return_value = 1
+        mock_load_shard_checkpoint.return_value = None
+        self.conn.get_shard_iterator.return_value = {'ShardIterator': 'it'}
+        self.conn.get_records.side_effect = [
+            {'Records': [], 'NextShardIterator': 'it'},
+            {'Records': [{'Data': 'a', 'SequenceNumber': '1'}], 'NextShardIterator': 'it'}
+        ]
+        self.handler.side_effect = lambda event: self.worker.stopped.set()
+        consumer = self._consumer()
+        self.assertTrue(consumer.acquire())
+        consumer.run()
+        self.assertEqual(2, self.conn.get_records.call_count)
+        mock_store_shard_checkpoint.assert_called_with(STREAM_ARN, 'shardId-000000000000', '1')
+        mock_release_lease.assert_called_with('shard-s-shardId-000000000000', 0, 0, 1)
+
+    @mock.patch('aws_lambda_fsm.worker.store_shard_checkpoint')
+    @mock.patch('aws_lambda_fsm.worker.load_shard_checkpoint')
+    @mock.patch('aws_lambda_fsm.worker.release_lease')
+    @mock.patch('aws_lambda_fsm.worker.acquire_lease')
+    def test_run_errors(self,
+                        mock_acquire_lease,
+                        mock_release_lease,
+                        mock_load_shard_checkpoint,
+                        mock_store_shard_checkpoint):
+        mock_acquire_lease.return_value = 1
+
+        def get_shard_iterator(**kwargs):
+            self.worker.stopped.set()
+            raise Exception()
+
+        self.conn.get_shard_iterator.side_effect = get_shard_iterator
+        consumer = self._consumer()
+        consumer.sequence_number = 'x'
+        mock_store_shard_checkpoint.side_effect = Exception()
+        consumer.acquire()
+        consumer.run()
+        self.assertEqual(1, self.worker.errors)
+        self.assertEqual(0.01, consumer.backoff)
+        self.assertFalse(mock_load_shard_checkpoint.called)
+        self.assertIsNone(consumer.fence_token)
+
+    @mock.patch('aws_lambda_fsm.worker.store_shard_checkpoint')
+    @mock.patch('aws_lambda_fsm.worker.load_shard_checkpoint')
+    @mock.patch('aws_lambda_fsm.worker.renew_lease')
+    @mock.patch('aws_lambda_fsm.worker.release_lease')
+    @mock.patch('aws_lambda_fsm.worker.acquire_lease')
+    def test_run_lease_lost(self,
+                            mock_acquire_lease,
+                            mock_release_lease,
+                            mock_renew_lease,
+                            mock_load_shard_checkpoint,
+                            mock_store_shard_checkpoint):
+        mock_acquire_lease.return_value = 1
+        mock_renew_lease.return_value = False
+        consumer = self._consumer()
+        consumer.acquire()
+        consumer.sequence_number = 'x'
+        consumer.lease_acquired_at = 0
+        consumer.run()
+        self.assertFalse(self.conn.get_records.called)
+        self.assertFalse(mock_store_shard_checkpoint.called)
+        self.assertFalse(mock_release_lease.called)
+
+
+class TestWorker(TestWorkerBase):
+
+    def test_get_shard_ids(self):
+        self.conn.describe_stream.side_effect = [
+            {'StreamDescription': {'Shards': [{'ShardId': 'a'}], 'HasMoreShards': True}},
+            {'StreamDescription': {'Shards': [{'ShardId': 'b'}], 'HasMoreShards': False}}
+        ]
+        self.assertEqual(['a', 'b'], self.worker.get_shard_ids())
+        self.conn.describe_stream.assert_called_with(StreamName='s', ExclusiveStartShardId='a')
+
+    @mock.patch('aws_lambda_fsm.worker.ShardConsumer.start')
+    @mock.patch('aws_lambda_fsm.worker.ShardConsumer.acquire')
+    def test_rebalance(self,
+                       mock_acquire,
+                       mock_start):
+        self.conn.describe_stream.return_value = \
+            {'StreamDescription': {'Shards': [{'ShardId': 'a'}, {'ShardId': 'b'}, {'ShardId': 'c'}]}}
+        mock_acquire.side_effect = [True, False, True]
+        self.worker.rebalance()
+        self.assertEqual(['a', 'c'], sorted(self.worker.consumers.keys()))
+        self.assertEqual(2, mock_start.call_count)
+
+    @mock.patch('aws_lambda_fsm.worker.ShardConsumer.start')
+    @mock.patch('aws_lambda_fsm.worker.ShardConsumer.acquire')
+    def test_rebalance_reaps_and_limits(self,
+                                        mock_acquire,
+                                        mock_start):
+        self.conn.describe_stream.return_value = \
+            {'StreamDescription': {'Shards': [{'ShardId': 'a'}, {'ShardId': 'b'}, {'ShardId': 'c'}]}}
+        mock_acquire.return_value = True
+        finished = mock.Mock(finished=True)
+        finished.is_alive.return_value = False
+        running = mock.Mock(finished=False)
+        running.is_alive.return_value = True
+        lost = mock.Mock(finished=False)
+        lost.is_alive.return_value = False
+        self.worker.consumers = {'a': finished, 'b': running, 'c': lost}
+        self.worker.max_shards = 2
+        self.worker.rebalance()
+        self.assertEqual(set(['a']), self.worker.finished_shard_ids)
+        self.assertEqual(['b', 'c'], sorted(self.worker.consumers.keys()))
+        self.assertFalse(self.worker.consumers['c'] is lost)
+        self.assertEqual(1, mock_start.call_count)
+        self.worker.max_shards = 1
+        self.worker.consumers = {'b': running}
+        self.worker.rebalance()
+        self.assertEqual(['b'], self.worker.consumers.keys())
+        self.assertEqual(1, mock_start.call_count)
+
+    @mock.patch('aws_lambda_fsm.worker.put_metrics')
+    def test_flush_metrics(self,
+                           mock_put_metrics):
+        self.worker.record_batch(10)
+        self.worker.record_error()
+        self.worker.consumers = {'a': mock.Mock(millis_behind_latest=5)}
+        mock_put_metrics.side_effect = Exception()
+        self.worker.flush_metrics()
+        mock_put_metrics.assert_called_with(
+            {'WorkerRecords': 10, 'WorkerBatches': 1, 'WorkerErrors': 1, 'WorkerShards': 1,
+             'WorkerMillisBehindLatest': 5},
+            {'stream': 's'}
+        )
+        self.assertEqual((0, 0, 0), (self.worker.records, self.worker.batches, self.worker.errors))
+
+    @mock.patch('aws_lambda_fsm.worker.Worker.flush_metrics')
+    @mock.patch('aws_lambda_fsm.worker.Worker.rebalance')
+    def test_tick(self,
+                  mock_rebalance,
+                  mock_flush_metrics):
+        mock_rebalance.side_effect = Exception()
+        self.worker.tick()
+        self.assertTrue(mock_rebalance.called)
+        self.assertFalse(mock_flush_metrics.called)
+        self.worker.metrics_flushed_at = 0
+        self.worker.tick()
+        self.assertTrue(mock_flush_metrics.called)
+
+    @mock.patch('aws_lambda_fsm.worker.Worker.flush_metrics')
+    @mock.patch('aws_lambda_fsm.worker.Worker.tick')
+    def test_run(self,
+                 mock_tick,
+                 mock_flush_metrics):
+        consumer = mock.Mock()
+        self.worker.consumers = {'a': consumer}
+        mock_tick.side_effect = self.worker.stop
+        self.worker.run()
+        consumer.join.assert_called_with(None)
+        self.assertTrue(mock_flush_metrics.called)
@@ -24,6 +24,7 @@ from botocore.exceptions import ClientError
 # application imports
 from aws_lambda_fsm.client import start_state_machine
 from aws_lambda_fsm import handler
+from aws_lambda_fsm import circuit
 
 
 class Messages(object):
@@ -120,7 +121,8 @@ class AWSStub(object):
             self.primary_retry_source.recv() or \
             self.secondary_retry_source.recv()
 
-    def send_next_event_for_dispatch(self, context, data, correlation_id, delay=0, primary=True, recovering=False):
+    def send_next_event_for_dispatch(self, context, data, correlation_id, delay=0, primary=True, recovering=False,
+                                     lane=None, sources=None):
         if recovering:
             self._get_retry_source(primary).send(data)
         else:
@@ -128,7 +130,7 @@ class AWSStub(object):
         self.all_sources.send(data)
         return {'test': 'stub'}
 
-    def start_retries(self, context, run_at, payload, primary=True, recovering=False):
+    def start_retries(self, context, run_at, payload, primary=True, recovering=False, lane=None, sources=None):
         if recovering:
             self._get_stream_source(primary).send(payload)
         else:
@@ -136,7 +138,7 @@ class AWSStub(object):
         self.all_sources.send(payload)
         return {'test': 'stub'}
 
-    def set_message_dispatched(self, correlation_id, steps, retries, primary=True):
+    def set_message_dispatched(self, correlation_id, steps, retries, primary=True, sources=None):
         chaos = {True: self.primary_cache_chaos, False: self.secondary_cache_chaos}[primary]
         if chaos and random.uniform(0.0, 1.0) < chaos:
             return 0
@@ -146,14 +148,14 @@ class AWSStub(object):
             self.all_caches[key] = True
             return True
 
-    def get_message_dispatched(self, correlation_id, steps, primary=True):
+    def get_message_dispatched(self, correlation_id, steps, primary=True, sources=None):
         chaos = {True: self.primary_cache_chaos, False: self.secondary_cache_chaos}[primary]
         if chaos and random.uniform(0.0, 1.0) < chaos:
             return 0
         else:
             return self._get_cache_source(primary).get('%s-%s' % (correlation_id, steps))
 
-    def acquire_lease(self, correlation_id, steps, retries, primary=True):
+    def acquire_lease(self, correlation_id, steps, retries, primary=True, sources=None):
         chaos = {True: self.primary_cache_chaos, False: self.secondary_cache_chaos}[primary]
         if chaos and random.uniform(0.0, 1.0) < chaos:
             return 0
@@ -166,7 +168,7 @@ class AWSStub(object):
                 self.all_caches[key] = True
                 return True
 
-    def release_lease(self, correlation_id, steps, retries, fence_token, primary=True):
+    def release_lease(self, correlation_id, steps, retries, fence_token, primary=True, sources=None):
         chaos = {True: self.primary_cache_chaos, False: self.secondary_cache_chaos}[primary]
         if chaos and random.uniform(0.0, 1.0) < chaos:
             return 0
@@ -182,7 +184,7 @@ class AWSStub(object):
         self.errors.send(json.dumps((data, dimensions)))
         return {'test': 'stub'}
 
-    def store_checkpoint(self, context, sent, primary=True):
+    def store_checkpoint(self, context, sent, primary=True, sources=None):
         return {'test': 'stub'}
 
     def reset(self):
@@ -203,6 +205,7 @@ class AWSStub(object):
         self.secondary_cache_chaos = 0.0
         self.empty_primary_cache = False
         self.empty_secondary_cache = False
+        circuit._local.breakers.clear()
 
 
 def to_kinesis_message(data):
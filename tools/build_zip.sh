@@ -15,7 +15,8 @@
 # limitations under the License.
 
 echo Y | pycleaner
-zip -r aws-lambda-fsm.zip aws_lambda_fsm examples settings.py main.py fsm.yaml settingslocal.py
+python tools/compile_fsm.py --filename=fsm.yaml --output=fsm_compiled.py || exit 1
+zip -r aws-lambda-fsm.zip aws_lambda_fsm examples settings.py main.py fsm.yaml fsm_compiled.py fsm_compiled.pyc settingslocal.py
 a=`pwd`
 s=`echo "import yaml; print yaml.__file__.split('yaml')[0]" | python`
 cd ${s}
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# compile_fsm.py
+#
+# Script that validates an fsm.yaml file (and all the files it imports) and
+# writes a precompiled python module that aws_lambda_fsm.config loads in
+# preference to parsing the yaml on every cold start.
+
+# system imports
+import argparse
+import logging
+import py_compile
+import sys
+
+# library imports
+
+# application imports
+from aws_lambda_fsm.action import LazyAction
+from aws_lambda_fsm.config import compile_config
+from aws_lambda_fsm.config import get_precompiled_source
+from aws_lambda_fsm.constants import CONFIG
+from aws_lambda_fsm.constants import PRECOMPILED
+
+# setup the command line args
+parser = argparse.ArgumentParser(description='Validates and precompiles fsm.yaml.')
+parser.add_argument('--filename', default='fsm.yaml')
+parser.add_argument('--output', default=PRECOMPILED.DEFAULT_MODULE + '.py')
+parser.add_argument('--check_imports', type=int, default=1,
+                    help='also check that all the action classes can be imported')
+parser.add_argument('--strict', type=int, default=0,
+                    help='treat action classes that cannot be imported as errors, rather than warnings')
+parser.add_argument('--log_level', default='INFO')
+args = parser.parse_args()
+
+logging.basicConfig(
+    format='[%(levelname)s] %(asctime)-15s %(message)s',
+    level=int(args.log_level) if args.log_level.isdigit() else args.log_level,
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+
+def get_action_names(config_dict):
+    """
+    Returns all the action class names referenced by a configuration.
+
+    :param config_dict: a dict as returned by aws_lambda_fsm.config.load_config_from_yaml
+    :return: a list of tuples of (str machine name, str action name)
+    """
+    names = []
+    for machine_dict in config_dict[CONFIG.MACHINES]:
+        for state_dict in machine_dict.get(CONFIG.STATES, []):
+            actions = [state_dict.get(key) for key in (CONFIG.ENTRY_ACTION, CONFIG.DO_ACTION, CONFIG.EXIT_ACTION)]
+            actions += [t.get(CONFIG.ACTION) for t in state_dict.get(CONFIG.TRANSITIONS, [])]
+            names += [(machine_dict[CONFIG.NAME], action) for action in actions if action]
+    return names
+
+
+configurations, errors = compile_config(filename=args.filename)
+
+if args.check_imports and not errors:
+    for filename, entry in sorted(configurations.items()):
+        for machine_name, action_name in get_action_names(entry[PRECOMPILED.CONFIG]):
+            try:
+                LazyAction(action_name).load()
+            except (ImportError, AttributeError, ValueError), e:
+                # actions are imported lazily, so at runtime an unimportable action only
+                # fails when it is first executed, and the machine retries until it terminates
+                message = '%s: machine "%s" action "%s" cannot be imported (%s).' % \
+                    (filename, machine_name, action_name, e)
+                if args.strict:
+                    errors.append(message)
+                else:
+                    logging.warning(message)
+
+if errors:
+    for error in errors:
+        logging.error(error)
+    sys.exit(1)
+
+with open(args.output, 'w') as f:
+    f.write(get_precompiled_source(configurations, filename=args.filename))
+
+# byte-compile now, so the deployment package doesn't have to at cold start
+py_compile.compile(args.output, doraise=True)
+logging.info('Wrote %s', args.output)
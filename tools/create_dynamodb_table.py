@@ -32,6 +32,7 @@ from aws_lambda_fsm.aws import get_arn_from_arn_string
 from aws_lambda_fsm.aws import validate_config
 from aws_lambda_fsm.constants import ENVIRONMENT_DATA
 from aws_lambda_fsm.constants import RETRY_DATA
+from aws_lambda_fsm.constants import SCHEDULE_DATA
 from aws_lambda_fsm.constants import CHECKPOINT_DATA
 from aws_lambda_fsm.constants import CACHE_DATA
 from aws_lambda_fsm.constants import STREAM_DATA
@@ -45,6 +46,8 @@ parser = argparse.ArgumentParser(description='Creates AWS DynamoDB tables.')
 parser.add_argument('--dynamodb_table_arn', default='PRIMARY_STREAM_SOURCE')
 parser.add_argument('--dynamodb_read_capacity_units', type=int, default=10)
 parser.add_argument('--dynamodb_write_capacity_units', type=int, default=10)
+parser.add_argument('--dynamodb_stream_view_type', default=AWS_DYNAMODB.NEW_IMAGE,
+                    help='stream view type for the stream table (empty to disable the DynamoDB stream)')
 parser.add_argument('--log_level', default='INFO')
 parser.add_argument('--boto_log_level', default='INFO')
 args = parser.parse_args()
@@ -117,6 +120,18 @@ if 'CHECKPOINT' in args.dynamodb_table_arn:
     )
     logging.info(response)
 
+    # user context snapshots are never deleted (retries may still refer to them), so
+    # they expire via the TTL attribute, which can only be enabled on an active table
+    dynamodb_conn.get_waiter('table_exists').wait(TableName=dynamodb_table)
+    response = dynamodb_conn.update_time_to_live(
+        TableName=dynamodb_table,
+        TimeToLiveSpecification={
+            AWS_DYNAMODB.Enabled: True,
+            AWS_DYNAMODB.AttributeName: CHECKPOINT_DATA.TIMEOUT
+        }
+    )
+    logging.info(response)
+
 if 'STREAM' in args.dynamodb_table_arn:
     # create a dynamodb table for streaming events
     response = dynamodb_conn.create_table(
@@ -136,6 +151,13 @@ if 'STREAM' in args.dynamodb_table_arn:
         ProvisionedThroughput={
             AWS_DYNAMODB.ReadCapacityUnits: args.dynamodb_read_capacity_units,
             AWS_DYNAMODB.WriteCapacityUnites: args.dynamodb_write_capacity_units
+        },
+        # the DynamoDB stream triggers lambda_dynamodb_handler (and dev_lambda.py --dynamodb_streams=1)
+        StreamSpecification={
+            AWS_DYNAMODB.StreamEnabled: True,
+            AWS_DYNAMODB.StreamViewType: args.dynamodb_stream_view_type
+        } if args.dynamodb_stream_view_type else {
+            AWS_DYNAMODB.StreamEnabled: False
         }
     )
     logging.info(response)
@@ -241,3 +263,35 @@ if 'CACHE' in args.dynamodb_table_arn:
         }
     )
     logging.info(response)
+
+if 'SCHEDULE' in args.dynamodb_table_arn:
+    # create a dynamodb table for scheduled events. we use the time bucket as the key
+    # hash, so the timer handler can query exactly the buckets that are due.
+    response = dynamodb_conn.create_table(
+        TableName=dynamodb_table,
+        AttributeDefinitions=[
+            {
+                AWS_DYNAMODB.AttributeName: SCHEDULE_DATA.BUCKET,
+                AWS_DYNAMODB.AttributeType: AWS_DYNAMODB.NUMBER
+            },
+            {
+                AWS_DYNAMODB.AttributeName: SCHEDULE_DATA.KEY,
+                AWS_DYNAMODB.AttributeType: AWS_DYNAMODB.STRING
+            }
+        ],
+        KeySchema=[
+            {
+                AWS_DYNAMODB.AttributeName: SCHEDULE_DATA.BUCKET,
+                AWS_DYNAMODB.KeyType: AWS_DYNAMODB.HASH
+            },
+            {
+                AWS_DYNAMODB.AttributeName: SCHEDULE_DATA.KEY,
+                AWS_DYNAMODB.KeyType: AWS_DYNAMODB.RANGE
+            }
+        ],
+        ProvisionedThroughput={
+            AWS_DYNAMODB.ReadCapacityUnits: args.dynamodb_read_capacity_units,
+            AWS_DYNAMODB.WriteCapacityUnites: args.dynamodb_write_capacity_units
+        }
+    )
+    logging.info(response)
@@ -20,6 +20,8 @@
 # Script that pretends to be AWS Lambda attached to a AWS Kinesis Stream.
 
 # system imports
+import atexit
+import os
 import time
 import base64
 import logging
@@ -29,6 +31,7 @@ import BaseHTTPServer
 import json
 import sys
 import subprocess
+from collections import OrderedDict
 
 # library imports
 
@@ -39,6 +42,7 @@ from aws_lambda_fsm.handler import lambda_timer_handler
 from aws_lambda_fsm.handler import lambda_sns_handler
 from aws_lambda_fsm.aws import get_connection
 from aws_lambda_fsm.aws import get_arn_from_arn_string
+from aws_lambda_fsm.aws import _get_connection_info
 from aws_lambda_fsm.aws import validate_config
 from aws_lambda_fsm.constants import AWS_KINESIS
 from aws_lambda_fsm.constants import AWS_DYNAMODB
@@ -65,13 +69,25 @@ parser.add_argument('--run_sns_lambda', type=int, default=0)
 parser.add_argument('--random_seed', type=int, default=0)
 parser.add_argument('--lambda_command', help='command to run lambda code (eg. docker run -v ' +
                                              '"$PWD":/var/task lambci/lambda:python2.7 main.lambda_handler)')
+parser.add_argument('--lambda_stdin', type=int, default=0,
+                    help='pipe the event to --lambda_command via stdin rather than as an argument (eg. docker run ' +
+                         '-i -e DOCKER_LAMBDA_USE_STDIN=1 ...)')
+parser.add_argument('--kinesis_shard_processes', type=int, default=0,
+                    help='consume each kinesis shard in a separate process')
+parser.add_argument('--kinesis_shard_id', help=argparse.SUPPRESS)
+parser.add_argument('--dynamodb_streams', type=int, default=0,
+                    help='consume the DynamoDB stream of the table, rather than polling the table with scans')
+parser.add_argument('--dynamodb_image_cache_size', type=int, default=10000,
+                    help='max number of items remembered when polling the table with scans')
+parser.add_argument('--report_interval', type=float, default=10.0,
+                    help='seconds between per-shard throughput and lag reports')
 args = parser.parse_args()
 
 random.seed(args.random_seed)
 STARTED_AT = str(int(time.time()))
 
 logging.basicConfig(
-    format='[%(levelname)s] %(asctime)-15s %(message)s',
+    format='[%(levelname)s] %(asctime)-15s %(processName)s %(message)s',
     level=int(args.log_level) if args.log_level.isdigit() else args.log_level,
     datefmt='%Y-%m-%d %H:%M:%S'
 )
@@ -104,6 +120,18 @@ if args.run_dynamodb_lambda:
     dynamodb_table = get_arn_from_arn_string(dynamodb_table_arn).slash_resource()
     logging.info('DynamoDB table: %s', dynamodb_table)
 
+if args.run_dynamodb_lambda and args.dynamodb_streams:
+    import boto3
+    table = dynamodb_conn.describe_table(TableName=dynamodb_table)[AWS_DYNAMODB.Table]
+    dynamodb_stream_arn = table.get(AWS_DYNAMODB.LatestStreamArn)
+    if not dynamodb_stream_arn:
+        logging.fatal("%s does not have a DynamoDB stream", dynamodb_table_arn)
+        sys.exit(1)
+    logging.info('DynamoDB stream ARN: %s', dynamodb_stream_arn)
+    _, region_name, endpoint_url = _get_connection_info(
+        AWS.DYNAMODB_STREAMS, get_arn_from_arn_string(dynamodb_table_arn).region_name, dynamodb_stream_arn)
+    dynamodb_streams_conn = boto3.client(AWS.DYNAMODB_STREAMS, region_name=region_name, endpoint_url=endpoint_url)
+
 if args.run_sns_lambda:
     class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
         def do_POST(self):
@@ -129,24 +157,196 @@ if args.run_sns_lambda:
         Endpoint='http://localhost:8000/'
     )
 
+
+def call_lambda(handler, lambda_event):
+    """
+    Calls the lambda handler in-process, or via --lambda_command.
+    """
+    if args.lambda_command:
+        if args.lambda_stdin:
+            # avoids the argument length limit, and quoting issues, for large batches
+            process = subprocess.Popen(['/bin/bash', '-c', args.lambda_command], stdin=subprocess.PIPE)
+            process.communicate(json.dumps(lambda_event))
+        else:
+            subprocess.call(['/bin/bash', '-c', args.lambda_command + " '" + json.dumps(lambda_event) + "'"])
+    else:
+        handler(lambda_event)
+
+
 # get an iterator to the head of the stream
+shard_ids = []
 shard_its = []
 
 if args.run_kinesis_lambda:
     response = kinesis_conn.describe_stream(
         StreamName=kinesis_stream,
     )
-    num_shards = len(response[AWS_KINESIS.StreamDescription][AWS_KINESIS.STREAM.Shards])
-    for i in range(num_shards):
-        shard_id = 'shardId-%s' % str(i).zfill(12)
-        shard_it = kinesis_conn.get_shard_iterator(
-            StreamName=kinesis_stream,
-            ShardId=shard_id,
-            ShardIteratorType=AWS_KINESIS.LATEST
-        )[AWS_KINESIS.ShardIterator]
-        shard_its.append(shard_it)
-
-dynamodb_old_images = {}
+    shards = response[AWS_KINESIS.StreamDescription][AWS_KINESIS.STREAM.Shards]
+    shard_ids = [shard[AWS_KINESIS.SHARD.ShardId] for shard in shards]
+    if args.kinesis_shard_id:
+        shard_ids = [args.kinesis_shard_id]
+
+if args.run_kinesis_lambda and args.kinesis_shard_processes and not args.kinesis_shard_id:
+
+    # fan out to one child process per shard, each running only the kinesis
+    # consumer. this process keeps running the other handlers.
+    children = []
+    for shard_id in shard_ids:
+        command = [sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + [
+            '--kinesis_shard_processes=0',
+            '--kinesis_shard_id=' + shard_id,
+            '--run_timer_lambda=0',
+            '--run_dynamodb_lambda=0',
+            '--run_sns_lambda=0'
+        ]
+        logging.info('Starting process for shard %s...', shard_id)
+        children.append(subprocess.Popen(command))
+
+    def terminate_children():
+        for child in children:
+            if child.poll() is None:
+                child.terminate()
+    atexit.register(terminate_children)
+
+    args.run_kinesis_lambda = 0
+    shard_ids = []
+
+for shard_id in shard_ids:
+    shard_it = kinesis_conn.get_shard_iterator(
+        StreamName=kinesis_stream,
+        ShardId=shard_id,
+        ShardIteratorType=AWS_KINESIS.LATEST
+    )[AWS_KINESIS.ShardIterator]
+    shard_its.append(shard_it)
+
+# per-shard [records, batches, millis behind latest] since the last report
+shard_stats = dict((shard_id, [0, 0, 0]) for shard_id in shard_ids)
+reported_at = time.time()
+
+
+def report_shard_stats():
+    """
+    Logs the per-shard throughput and lag since the last report.
+    """
+    global reported_at
+    elapsed = max(time.time() - reported_at, 0.001)
+    for shard_id in shard_ids:
+        records, batches, millis_behind_latest = shard_stats[shard_id]
+        logging.info('%s: %d records in %d batches (%.1f records/sec), MillisBehindLatest=%d',
+                     shard_id, records, batches, records / elapsed, millis_behind_latest)
+        shard_stats[shard_id][:2] = [0, 0]
+    reported_at = time.time()
+
+# the scan poller only looks at items written at, or after, the latest timestamp
+# seen so far, and remembers a bounded number of recent payloads to detect updates.
+dynamodb_old_images = OrderedDict()
+dynamodb_watermark = int(STARTED_AT) + 1
+
+# the stream consumer keeps an iterator per stream shard. shards that appear after
+# start-up (dynamodb rolls shards over every few hours) are read from the beginning.
+dynamodb_shard_its = {}
+dynamodb_shards_refreshed_at = 0
+
+
+def refresh_dynamodb_shards():
+    """
+    Adds iterators for any new shards in the DynamoDB stream.
+    """
+    global dynamodb_shards_refreshed_at
+    initial = not dynamodb_shard_its
+    kwargs = {'StreamArn': dynamodb_stream_arn}
+    while True:
+        description = dynamodb_streams_conn.describe_stream(**kwargs)[AWS_KINESIS.StreamDescription]
+        for shard in description[AWS_KINESIS.STREAM.Shards]:
+            shard_id = shard[AWS_KINESIS.SHARD.ShardId]
+            if shard_id not in dynamodb_shard_its:
+                dynamodb_shard_its[shard_id] = dynamodb_streams_conn.get_shard_iterator(
+                    StreamArn=dynamodb_stream_arn,
+                    ShardId=shard_id,
+                    ShardIteratorType=AWS_KINESIS.LATEST if initial else AWS_KINESIS.TRIM_HORIZON
+                )[AWS_KINESIS.ShardIterator]
+        last_shard_id = description.get(AWS_DYNAMODB.LastEvaluatedShardId)
+        if not last_shard_id:
+            break
+        kwargs['ExclusiveStartShardId'] = last_shard_id
+    dynamodb_shards_refreshed_at = time.time()
+
+
+def get_dynamodb_stream_records():
+    """
+    Returns the new images from all the shards of the DynamoDB stream.
+    """
+    if time.time() - dynamodb_shards_refreshed_at >= 60:
+        refresh_dynamodb_shards()
+
+    records = []
+    for shard_id, shard_it in dynamodb_shard_its.items():
+        # closed shards are remembered, so they are not re-read
+        if not shard_it:
+            continue
+        out = dynamodb_streams_conn.get_records(
+            ShardIterator=shard_it,
+            Limit=args.lambda_batch_size
+        )
+        dynamodb_shard_its[shard_id] = out.get(AWS_KINESIS.NextShardIterator)
+        for record in out[AWS_KINESIS.Records]:
+            if AWS_LAMBDA.DYNAMODB_RECORD.NewImage in record[AWS_LAMBDA.DYNAMODB_RECORD.DYNAMODB]:
+                records.append({AWS_LAMBDA.DYNAMODB_RECORD.DYNAMODB: record[AWS_LAMBDA.DYNAMODB_RECORD.DYNAMODB]})
+    return records
+
+
+def get_dynamodb_scan_records():
+    """
+    Returns the new images of the created or updated items in the DynamoDB table
+    since the last call, using a paginated scan.
+    """
+    global dynamodb_watermark
+    kwargs = {
+        'TableName': dynamodb_table,
+        'ConsistentRead': True,
+        'ScanFilter': {
+            STREAM_DATA.TIMESTAMP: {
+                AWS_DYNAMODB.ComparisonOperator: AWS_DYNAMODB.GREATER_THAN_OR_EQUAL,
+                AWS_DYNAMODB.AttributeValueList: [{AWS_DYNAMODB.NUMBER: str(dynamodb_watermark)}]
+            },
+        }
+    }
+
+    records = []
+    watermark = dynamodb_watermark
+    while True:
+        scanned = dynamodb_conn.scan(**kwargs)
+
+        for item in scanned[AWS_DYNAMODB.Items]:
+            correlation_id = item[STREAM_DATA.CORRELATION_ID][AWS_DYNAMODB.STRING]
+            payload = item[STREAM_DATA.PAYLOAD][AWS_DYNAMODB.STRING]
+            timestamp = int(item[STREAM_DATA.TIMESTAMP][AWS_DYNAMODB.NUMBER])
+            watermark = max(watermark, timestamp)
+
+            # this is a CREATE or UPDATE
+            if dynamodb_old_images.pop(correlation_id, None) != payload:
+                records.append({
+                    AWS_LAMBDA.DYNAMODB_RECORD.DYNAMODB: {
+                        AWS_LAMBDA.DYNAMODB_RECORD.NewImage: {
+                            STREAM_DATA.PAYLOAD: {
+                                AWS_DYNAMODB.STRING: payload
+                            }
+                        }
+                    }
+                })
+
+            # (re-)insert as the most recently seen item, evicting the oldest
+            dynamodb_old_images[correlation_id] = payload
+            while len(dynamodb_old_images) > args.dynamodb_image_cache_size:
+                dynamodb_old_images.popitem(last=False)
+
+        last_key = scanned.get(AWS_DYNAMODB.LastEvaluatedKey)
+        if not last_key:
+            break
+        kwargs['ExclusiveStartKey'] = last_key
+
+    dynamodb_watermark = watermark
+    return records
 seen_seq_num = set()
 
 # now loop on the stream, pulling records and calling
@@ -168,6 +368,8 @@ while True:
                 Limit=args.lambda_batch_size
             )
             shard_its[i] = out[AWS_KINESIS.NextShardIterator]
+            stats = shard_stats[shard_ids[i]]
+            stats[2] = out.get(AWS_KINESIS.MillisBehindLatest, 0)
 
             # process any results that are available
             if out[AWS_KINESIS.Records]:
@@ -192,10 +394,12 @@ while True:
                     lambda_event[AWS_LAMBDA.Records].append(tmp)
 
                 # and call the handler with the records
-                if args.lambda_command:
-                    subprocess.call(['/bin/bash', '-c', args.lambda_command + " '" + json.dumps(lambda_event) + "'"])
-                else:
-                    lambda_kinesis_handler(lambda_event)
+                call_lambda(lambda_kinesis_handler, lambda_event)
+                stats[0] += len(lambda_event[AWS_LAMBDA.Records])
+                stats[1] += 1
+
+        if args.report_interval and time.time() - reported_at >= args.report_interval:
+            report_shard_stats()
 
     if args.run_sns_lambda and sns_server:
 
@@ -212,59 +416,21 @@ while True:
                 ]
             }
 
-            if args.lambda_command:
-                subprocess.call(['/bin/bash', '-c', args.lambda_command + " '" + json.dumps(lambda_event) + "'"])
-            else:
-                lambda_sns_handler(lambda_event)
+            call_lambda(lambda_sns_handler, lambda_event)
 
     if args.run_dynamodb_lambda and dynamodb_conn:
 
         # run the dynamodb update handler
-        scanned = dynamodb_conn.scan(
-            TableName=dynamodb_table,
-            ConsistentRead=True,
-            ScanFilter={
-                STREAM_DATA.TIMESTAMP: {
-                    AWS_DYNAMODB.ComparisonOperator: AWS_DYNAMODB.GREATER_THAN,
-                    AWS_DYNAMODB.AttributeValueList: [{AWS_DYNAMODB.NUMBER: STARTED_AT}]
-                },
-            }
-        )
-
-        if scanned[AWS_DYNAMODB.Items]:
+        if args.dynamodb_streams:
+            records = get_dynamodb_stream_records()
+        else:
+            records = get_dynamodb_scan_records()
 
-            # create the lambda event
+        # and call the handler with the records
+        for i in range(0, len(records), args.lambda_batch_size):
             lambda_event = {
-                AWS_LAMBDA.Records: []
+                AWS_LAMBDA.Records: records[i:i + args.lambda_batch_size]
             }
-
-            # populate the lambda event
-            for record in scanned[AWS_DYNAMODB.Items]:
-                correlation_id = record[STREAM_DATA.CORRELATION_ID][AWS_DYNAMODB.STRING]
-                payload = record[STREAM_DATA.PAYLOAD][AWS_DYNAMODB.STRING]
-                timestamp = record[STREAM_DATA.TIMESTAMP][AWS_DYNAMODB.NUMBER]
-                create = correlation_id not in dynamodb_old_images
-                update = correlation_id in dynamodb_old_images and payload != dynamodb_old_images[correlation_id]
-                if create or update:
-                    # this is a CREATE or UPDATE
-                    tmp = {
-                        AWS_LAMBDA.DYNAMODB_RECORD.DYNAMODB: {
-                            AWS_LAMBDA.DYNAMODB_RECORD.NewImage: {
-                                STREAM_DATA.PAYLOAD: {
-                                    AWS_DYNAMODB.STRING: payload
-                                }
-                            }
-                        }
-                    }
-                    lambda_event[AWS_LAMBDA.Records].append(tmp)
-                    dynamodb_old_images[correlation_id] = payload
-
-            # and call the handler with the records
-            if lambda_event[AWS_LAMBDA.Records]:
-
-                if args.lambda_command:
-                    subprocess.call(['/bin/bash', '-c', args.lambda_command + " '" + json.dumps(lambda_event) + "'"])
-                else:
-                    lambda_dynamodb_handler(lambda_event)
+            call_lambda(lambda_dynamodb_handler, lambda_event)
 
     time.sleep(args.sleep_time)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# fsm_worker.py
+#
+# Script that runs a long-lived worker (eg. in an ECS service) consuming a
+# Kinesis stream directly, rather than via AWS Lambda. Run several copies to
+# share the shards of a stream between processes/containers. With --lanes, a
+# single worker consumes the streams for several lanes (see settings.STREAM_LANES),
+# sharing --max_concurrent_batches between them in proportion to their weights.
+
+# system imports
+import argparse
+import logging
+import signal
+import sys
+import threading
+
+# library imports
+
+# application imports
+from aws_lambda_fsm.aws import get_arn_from_arn_string
+from aws_lambda_fsm.aws import get_primary_stream_source
+from aws_lambda_fsm.aws import get_stream_lanes
+from aws_lambda_fsm.aws import validate_config
+from aws_lambda_fsm.constants import AWS
+from aws_lambda_fsm.constants import AWS_KINESIS
+from aws_lambda_fsm.constants import STREAM_LANE
+from aws_lambda_fsm.constants import WORKER_DATA
+from aws_lambda_fsm.worker import WeightedSemaphore
+from aws_lambda_fsm.worker import Worker
+
+import settings
+
+# setup the command line args
+parser = argparse.ArgumentParser(description='Long-running Kinesis stream worker.')
+parser.add_argument('--kinesis_stream_arn', default='PRIMARY_STREAM_SOURCE')
+parser.add_argument('--log_level', default='INFO')
+parser.add_argument('--boto_log_level', default='INFO')
+parser.add_argument('--batch_size', type=int, default=100)
+parser.add_argument('--sleep_time', type=float, default=1.0)
+parser.add_argument('--max_shards', type=int, default=0,
+                    help='max number of shards owned by this worker (0 is unlimited)')
+parser.add_argument('--max_concurrent_batches', type=int, default=0,
+                    help='max number of batches processed concurrently across all shards (0 is unlimited)')
+parser.add_argument('--initial_position', default=AWS_KINESIS.TRIM_HORIZON,
+                    choices=[AWS_KINESIS.TRIM_HORIZON, AWS_KINESIS.LATEST])
+parser.add_argument('--lease_timeout', type=int, default=WORKER_DATA.LEASE_TIMEOUT)
+parser.add_argument('--checkpoint_interval', type=int, default=WORKER_DATA.CHECKPOINT_INTERVAL)
+parser.add_argument('--rebalance_interval', type=int, default=WORKER_DATA.REBALANCE_INTERVAL)
+parser.add_argument('--metrics_interval', type=int, default=WORKER_DATA.METRICS_INTERVAL)
+parser.add_argument('--lanes',
+                    help='comma separated lane=weight pairs like "realtime=4,default=1" (see settings.STREAM_LANES)')
+args = parser.parse_args()
+
+logging.basicConfig(
+    format='[%(levelname)s] %(asctime)-15s %(threadName)s %(message)s',
+    level=int(args.log_level) if args.log_level.isdigit() else args.log_level,
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+logging.getLogger('boto3').setLevel(args.boto_log_level)
+logging.getLogger('botocore').setLevel(args.boto_log_level)
+
+validate_config()
+
+# {lane: (kinesis stream arn, weight)}
+lanes = {}
+if args.lanes:
+    if not args.max_concurrent_batches:
+        logging.fatal("--lanes requires --max_concurrent_batches")
+        sys.exit(1)
+    for pair in args.lanes.split(','):
+        lane, separator, weight = pair.partition('=')
+        if lane != STREAM_LANE.DEFAULT and lane not in get_stream_lanes():
+            logging.fatal("%s is not in STREAM_LANES", lane)
+            sys.exit(1)
+        lanes[lane] = (get_primary_stream_source(lane), int(weight or STREAM_LANE.DEFAULT_WEIGHT))
+else:
+    lanes[STREAM_LANE.DEFAULT] = (getattr(settings, args.kinesis_stream_arn), STREAM_LANE.DEFAULT_WEIGHT)
+
+for lane, (kinesis_stream_arn, weight) in sorted(lanes.items()):
+    logging.info('Kinesis stream ARN for lane %s (weight %d): %s', lane, weight, kinesis_stream_arn)
+    if get_arn_from_arn_string(kinesis_stream_arn).service != AWS.KINESIS:
+        logging.fatal("%s is not a Kinesis ARN", kinesis_stream_arn)
+        sys.exit(1)
+
+semaphore = None
+if args.lanes:
+    semaphore = WeightedSemaphore(args.max_concurrent_batches,
+                                  dict((lane, weight) for lane, (kinesis_stream_arn, weight) in lanes.items()))
+
+workers = [
+    Worker(
+        kinesis_stream_arn,
+        batch_size=args.batch_size,
+        sleep_time=args.sleep_time,
+        max_shards=args.max_shards,
+        max_concurrent_batches=args.max_concurrent_batches,
+        semaphore=semaphore.lane(lane) if semaphore else None,
+        initial_position=args.initial_position,
+        lease_timeout=args.lease_timeout,
+        checkpoint_interval=args.checkpoint_interval,
+        rebalance_interval=args.rebalance_interval,
+        metrics_interval=args.metrics_interval
+    )
+    for lane, (kinesis_stream_arn, weight) in sorted(lanes.items())
+]
+
+
+def stop(*args):
+    for worker in workers:
+        worker.stop(*args)
+
+# ECS sends SIGTERM (then SIGKILL after a grace period) when stopping a task
+signal.signal(signal.SIGTERM, stop)
+signal.signal(signal.SIGINT, stop)
+
+# signals are only delivered to the main thread, so it runs the last worker
+threads = [threading.Thread(target=worker.run, name=worker.stream_name) for worker in workers[:-1]]
+for thread in threads:
+    thread.start()
+workers[-1].run()
+for thread in threads:
+    thread.join()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+# Copyright 2016-2017 Workiva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#
+# import_time.py
+#
+# Script that measures the import (cold-start) cost of the framework, in the
+# style of "python -X importtime" (which is unavailable on python 2.7).
+#
+# Each run happens in a fresh interpreter, so modules cached by a previous
+# import do not skew the numbers. The report shows the median self and
+# cumulative import time (in microseconds) for every module imported.
+#
+#   $ python tools/import_time.py --module=aws_lambda_fsm.handler --runs=5
+#   $ python tools/import_time.py --module=main --factory=1
+
+# system imports
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+# library imports
+
+# application imports
+
+# setup the command line args
+parser = argparse.ArgumentParser(description='Reports module import times for AWS Lambda cold-starts.')
+parser.add_argument('--module', default='aws_lambda_fsm.handler')
+parser.add_argument('--runs', type=int, default=5)
+parser.add_argument('--limit', type=int, default=30)
+parser.add_argument('--sort', choices=['self', 'cumulative'], default='cumulative')
+parser.add_argument('--factory', type=int, default=0,
+                    help='also time construction of the FSM factory (fsm.yaml loading and machine building)')
+parser.add_argument('--child', type=int, default=0, help=argparse.SUPPRESS)
+args = parser.parse_args()
+
+
+def measure():
+    """
+    Imports args.module with a hooked __import__ and returns the timings.
+
+    :return: a dict of {'modules': {name: [self_us, cumulative_us]}, 'total': us, 'factory': us}
+    """
+    original_import = builtins.__import__
+    timings = {}
+    stack = []
+
+    def timed_import(name, *import_args, **import_kwargs):
+        # only the first (uncached) import of a module has any real cost
+        if name in sys.modules:
+            return original_import(name, *import_args, **import_kwargs)
+        stack.append(0.0)
+        started = time.time()
+        try:
+            return original_import(name, *import_args, **import_kwargs)
+        finally:
+            cumulative = time.time() - started
+            children = stack.pop()
+            if stack:
+                stack[-1] += cumulative
+            if name in sys.modules and name not in timings:
+                timings[name] = [int((cumulative - children) * 1e6), int(cumulative * 1e6)]
+
+    builtins.__import__ = timed_import
+    started = time.time()
+    try:
+        module = __import__(args.module, fromlist=['*'])
+    finally:
+        builtins.__import__ = original_import
+    total = int((time.time() - started) * 1e6)
+
+    factory = None
+    if args.factory:
+        from aws_lambda_fsm.fsm import FSM
+        started = time.time()
+        FSM()
+        factory = int((time.time() - started) * 1e6)
+
+    del module
+    return {'modules': timings, 'total': total, 'factory': factory}
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2] if values else 0
+
+
+def report(results):
+    """
+    Prints an aggregated report of several child runs.
+
+    :param results: a list of dicts as returned by measure()
+    """
+    names = set()
+    for result in results:
+        names.update(result['modules'].keys())
+
+    rows = []
+    for name in names:
+        entries = [r['modules'][name] for r in results if name in r['modules']]
+        rows.append((median([e[0] for e in entries]), median([e[1] for e in entries]), name))
+    rows.sort(key=lambda row: row[0 if args.sort == 'self' else 1], reverse=True)
+
+    print('import time: %10s | %10s | %s' % ('self [us]', 'cumulative', 'imported module'))
+    for self_us, cumulative_us, name in rows[:args.limit]:
+        print('import time: %10d | %10d | %s' % (self_us, cumulative_us, name))
+    print('')
+    print('%s: median total import time %d us over %d runs (%d modules)' %
+          (args.module, median([r['total'] for r in results]), len(results), len(names)))
+    if args.factory:
+        print('FSM(): median factory construction time %d us' % median([r['factory'] for r in results]))
+
+
+if args.child:
+    logging.basicConfig(level=logging.ERROR)
+    sys.stdout.write(json.dumps(measure()))
+
+else:
+    command = [sys.executable, os.path.abspath(__file__), '--child=1', '--module=' + args.module,
+               '--factory=%d' % args.factory]
+    # the children import from the current directory (for settings.py, main.py etc.)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.getcwd(), env.get('PYTHONPATH')]))
+    results = []
+    for _ in range(args.runs):
+        output = subprocess.check_output(command, env=env)
+        results.append(json.loads(output))
+    report(results)
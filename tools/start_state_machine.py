@@ -53,6 +53,7 @@ parser.add_argument('--num_machines', type=int, default=1)
 parser.add_argument('--log_level', default='INFO')
 parser.add_argument('--boto_log_level', default='INFO')
 parser.add_argument('--correlation_id')
+parser.add_argument('--lane', help='lane name (see settings.STREAM_LANES) to send the first event to')
 args = parser.parse_args()
 
 logging.basicConfig(
@@ -70,10 +71,14 @@ if args.num_machines > 1:
     # start things off
     context = json.loads(args.initial_context or "{}")
     current_state = current_event = STATE.PSEUDO_INIT
-    start_state_machines(args.machine_name,
-                         [context] * args.num_machines,
-                         current_state=current_state,
-                         current_event=current_event)
+    unsent = start_state_machines(args.machine_name,
+                                  [context] * args.num_machines,
+                                  current_state=current_state,
+                                  current_event=current_event,
+                                  lane=args.lane)
+    if unsent:
+        logging.error('Unable to start %d machines.', len(unsent))
+        exit(1)
     exit(0)
 
 # checkpoint specified, so start with a context saved to the kinesis stream
@@ -120,4 +125,5 @@ start_state_machine(args.machine_name,
                     context,
                     correlation_id=args.correlation_id,
                     current_state=current_state,
-                    current_event=current_event)
+                    current_event=current_event,
+                    lane=args.lane)
@@ -22,8 +22,7 @@ import urllib
 # library imports
 
 # application imports
-from aws_lambda_fsm.config import get_current_configuration
-from aws_lambda_fsm.constants import CONFIG
+from aws_lambda_fsm.graph import get_machine_graphs
 
 # setup the command line args
 parser = argparse.ArgumentParser(description='Turns a fsm.yaml file into a GraphViz URL.')
@@ -49,93 +48,83 @@ def prepend_lambda_to_label(label):
     return label
 
 
-def output_transition_dict(state_dict, transition_dict):
+def output_transition(state, transition):
     """
     Outputs a GraphViz directed edge representing an FSM transition.
 
-    :param state_dict: a dict with state info.
-    :param transition_dict: a dict with transition info.
+    :param state: an aws_lambda_fsm.graph.StateNode instance.
+    :param transition: an aws_lambda_fsm.graph.TransitionNode instance.
     :return: a str.
     """
-    label = prepend_lambda_to_label(transition_dict[CONFIG.EVENT])
-    if transition_dict.get(CONFIG.ACTION):
-        label += '/ ' + transition_dict[CONFIG.ACTION]
+    label = prepend_lambda_to_label(transition.event)
+    if transition.action:
+        label += '/ ' + transition.action
     return '"%(source)s" -> "%(target)s" [label="%(label)s"];' % \
-           {'source': state_dict[CONFIG.NAME],
-            'target': transition_dict[CONFIG.TARGET],
+           {'source': state.name,
+            'target': transition.target,
             'label': label}
 
 
-def output_state_dict(state_dict):
+def output_state(state):
     """
     Outputs a GraphViz node representing an FSM state.
 
-    :param state_dict: a dict with state info.
+    :param state: an aws_lambda_fsm.graph.StateNode instance.
     :return: a str.
     """
     actions = list()
-    if state_dict.get(CONFIG.ENTRY_ACTION):
-        actions.append('entry/ %(entry)s' % {'entry': state_dict[CONFIG.ENTRY_ACTION]})
-    if state_dict.get(CONFIG.DO_ACTION):
-        actions.append('do/ %(do)s' % {'do': state_dict[CONFIG.DO_ACTION]})
-    if state_dict.get(CONFIG.EXIT_ACTION):
-        actions.append('exit/ %(exit)s' % {'exit': state_dict[CONFIG.EXIT_ACTION]})
-    label = '%(state_name)s|%(actions)s' % {'state_name': state_dict[CONFIG.NAME], 'actions': '\\l'.join(actions)}
+    if state.entry_action:
+        actions.append('entry/ %(entry)s' % {'entry': state.entry_action})
+    if state.do_action:
+        actions.append('do/ %(do)s' % {'do': state.do_action})
+    if state.exit_action:
+        actions.append('exit/ %(exit)s' % {'exit': state.exit_action})
+    for machine_name in state.children:
+        actions.append('run/ %(machine)s' % {'machine': machine_name})
+    label = '%(state_name)s|%(actions)s' % {'state_name': state.name, 'actions': '\\l'.join(actions)}
     shape = 'Mrecord'
     return '"%(state_name)s" [shape=%(shape)s,label="{%(label)s}"];' % \
-           {'state_name': state_dict[CONFIG.NAME],
+           {'state_name': state.name,
             'shape': shape,
             'label': label}
 
 
-def output_machine_dict(machine_dict):
+def output_machine(graph):
     """
     Outputs a GraphViz .dot file representing an FSM.
 
-    :param machine_dict: a dict with machine info.
+    :param graph: an aws_lambda_fsm.graph.MachineGraph instance.
     :return: a str.
     """
     lines = list()
     lines.append('digraph G {')
-    lines.append('label="%(machine_name)s"' % {'machine_name': machine_dict[CONFIG.NAME]})
+    lines.append('label="%(machine_name)s"' % {'machine_name': graph.name})
     lines.append('labelloc="t"')
     lines.append('"__start__" [label="start",shape=circle,style=filled,fillcolor=black,fontcolor=white,fontsize=9];')
-    for state_dict in machine_dict.get(CONFIG.STATES, []):
-        lines.append(output_state_dict(state_dict))
-        if state_dict.get(CONFIG.INITIAL):
+    for state in graph.states.values():
+        lines.append(output_state(state))
+        if state.initial:
             label = prepend_lambda_to_label('')
             lines.append('"__start__" -> "%(state_name)s" [label="%(label)s"]' %
-                         {'state_name': state_dict[CONFIG.NAME],
+                         {'state_name': state.name,
                           'label': label})
-        if state_dict.get(CONFIG.FINAL):
+        if state.final:
             label = prepend_lambda_to_label('')
             lines.append('"%(state_name)s" -> "__end__" [label="%(label)s"]' %
-                         {'state_name': state_dict[CONFIG.NAME],
+                         {'state_name': state.name,
                           'label': label})
-        for transition_dict in state_dict.get(CONFIG.TRANSITIONS, []):
-            lines.append(output_transition_dict(state_dict, transition_dict))
+        for transition in state.transitions:
+            lines.append(output_transition(state, transition))
     lines.append('"__end__" [label="end",shape=doublecircle,style=filled,fillcolor=black,fontcolor=white,fontsize=9];')
     lines.append('}')
     return '\n'.join(lines)
 
 
-def search_for_machine(filename='fsm.yaml'):
-    """
-    Searches the .yaml hierarchy for the correct machine.
-
-    :param filename: a path to a fsm.yaml file
-    :return:
-    """
-    for machine_dict in get_current_configuration(filename=filename)[CONFIG.MACHINES]:
-        if CONFIG.IMPORT in machine_dict:
-            search_for_machine(filename=machine_dict[CONFIG.IMPORT])
-            continue
-        if machine_dict[CONFIG.NAME] == args.machine_name:
-            chl = output_machine_dict(machine_dict)
-            if args.format == 'dot':
-                print chl
-            else:
-                print 'https://chart.googleapis.com/chart?cht=gv&chl=%(chl)s' % {'chl': urllib.quote_plus(chl)}
-
 # find the machine in the machine list
-search_for_machine()
+graphs = get_machine_graphs()
+if args.machine_name in graphs:
+    chl = output_machine(graphs[args.machine_name])
+    if args.format == 'dot':
+        print chl
+    else:
+        print 'https://chart.googleapis.com/chart?cht=gv&chl=%(chl)s' % {'chl': urllib.quote_plus(chl)}